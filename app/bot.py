@@ -0,0 +1,93 @@
+# app/bot.py
+from app.config import get_settings
+
+# aiogram тяжелый (pydantic-модели всех типов Bot API, aiohttp). Bot и Dispatcher создаются
+# при первом обращении — на старте (установка вебхука) или при первом апдейте в /webhook.
+_bot = None
+_dp = None
+
+
+def get_bot():
+    """Telegram-бот (один на процесс)."""
+    global _bot
+    if _bot is None:
+        from aiogram import Bot
+        from aiogram.client.default import DefaultBotProperties
+        from aiogram.client.session.aiohttp import AiohttpSession
+        from aiogram.client.telegram import TelegramAPIServer
+        from aiogram.enums import ParseMode
+
+        settings = get_settings()
+        _bot = Bot(
+            token=settings.bot_token,
+            session=AiohttpSession(api=TelegramAPIServer.from_base(settings.telegram_api_base)),
+            default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+        )
+    return _bot
+
+
+def get_dispatcher():
+    """Dispatcher со всеми обработчиками бота."""
+    global _dp
+    if _dp is None:
+        from aiogram import Dispatcher
+        from aiogram.filters import Command, CommandObject
+        from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, WebAppInfo
+
+        dp = Dispatcher()
+
+        # === Кнопка Mini App ===
+        webapp_button = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🚀 Запустить Mini App", web_app=WebAppInfo(url=get_settings().webapp_url))]
+        ])
+
+        # === Обработчик /start ===
+        @dp.message(Command("start"))
+        async def start_handler(message: Message, command: CommandObject):
+            from app.referrals import remember_referral
+
+            print(f"Получено сообщение от пользователя: {message.from_user.id} - start {command.args or ''}")
+
+            # Реферальная ссылка (start=ref_<id>): только запоминаем, в БД — при регистрации
+            try:
+                await remember_referral(message.from_user.id, command.args)
+            except Exception as e:
+                print(f"❌ Не удалось запомнить реферера для {message.from_user.id}: {e}")
+
+            await message.answer(
+                "👋 Привет! Нажми кнопку ниже, чтобы открыть Mini App:",
+                reply_markup=webapp_button
+            )
+            await message.delete() # Удаление сообщения может быть нежелательно для пользователя
+
+        _dp = dp
+    return _dp
+
+
+async def feed_webhook_update(payload: dict):
+    """Передает апдейт из вебхука в Dispatcher."""
+    from aiogram import types
+
+    bot = get_bot()
+    update = types.Update.model_validate(payload, context={"bot": bot})
+    await get_dispatcher().feed_update(bot, update)
+
+
+async def set_webhook(url: str):
+    from aiogram.methods import SetWebhook
+
+    await get_bot()(SetWebhook(url=url))
+
+
+async def delete_webhook():
+    from aiogram.methods import DeleteWebhook
+
+    await get_bot()(DeleteWebhook())
+
+
+async def close_bot():
+    """Закрывает HTTP-сессию бота, если бот вообще создавался."""
+    global _bot
+    if _bot is not None:
+        await _bot.session.close()
+        _bot = None
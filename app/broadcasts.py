@@ -0,0 +1,385 @@
+# app/broadcasts.py
+"""
+Рассылки сообщений всем пользователям бота.
+
+Рассылка — строка в broadcasts. Получатели — пользователи не в статусе banned, по возрастанию id:
+страница за страницей по ключу (id > cursor_user_id), без OFFSET и без долгих транзакций.
+После каждой страницы в broadcasts пишется чекпоинт (последний id и счетчики доставки), поэтому
+после рестарта рассылка продолжается с места остановки; повторно может уйти не больше одной страницы.
+
+Скорость держат token bucket'ы в общем состоянии воркеров (app.shared_state): общий на бота
+(BROADCAST_RATE сообщений в секунду, ниже лимита Telegram ~30/с — остается запас для ответов бота)
+и по одному сообщению в секунду на чат. Ответ 429 с retry_after ставит на паузу все отправки.
+
+Рассылки выполняет один процесс на все реплики — тот, кто держит pg_try_advisory_lock(BROADCAST_LOCK_ID),
+как лидер планировщика. Он подхватывает рассылки в статусах pending и running (прерванные).
+
+Управление: POST /api/admin/broadcasts, а также
+    python -m app.broadcasts create "текст" | list | run <id> | pause <id> | resume <id> | cancel <id>
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy import func, select, text, update
+
+from app.config import get_settings
+from app.database import get_engine, get_session_factory
+from app.metrics import broadcast_messages
+from app.models import Broadcast, User, UserAccountStatus
+from app.shared_state import get_shared_state
+
+# Ключ pg_advisory_lock процесса, который выполняет рассылки
+BROADCAST_LOCK_ID = 7_401_041
+# Получателей на страницу: между чекпоинтами
+PAGE_SIZE = 100
+# Одновременных запросов к Bot API (скорость ограничивает token bucket, а не они)
+SENDERS = 8
+# Попыток на одно сообщение (429 и сетевые ошибки)
+MAX_ATTEMPTS = 5
+# Лимит Telegram на один чат
+CHAT_RATE = 1.0
+# Запас токенов общего bucket'а. Telegram считает сообщения за секунду: с запасом в rate токенов
+# в первую секунду уходило бы до 2 * rate сообщений, поэтому отправки идут ровно, по одной
+GLOBAL_BURST = 1
+# Как часто процесс рассылок ищет новые рассылки и пробует стать ведущим
+POLL_SECONDS = 5
+LEADER_RETRY_SECONDS = 30
+
+GLOBAL_BUCKET_KEY = "telegram:global"
+CHAT_BUCKET_KEY = "telegram:chat:"
+
+# Из каких статусов разрешено действие и в какой статус оно переводит
+TRANSITIONS = {
+    "pause": (("pending", "running"), "paused"),
+    "resume": (("paused",), "running"),
+    "cancel": (("pending", "running", "paused"), "cancelled"),
+}
+# Эти рассылки выполняет процесс рассылок (running — прерванная рестартом)
+RUNNABLE_STATUSES = ("pending", "running")
+
+
+class TelegramRateLimiter:
+    """Token bucket'ы Telegram: общий на бота и по чату; после 429 — пауза для всех отправок процесса."""
+
+    def __init__(self, rate: float, chat_rate: float = CHAT_RATE):
+        self.rate = rate
+        self.chat_rate = chat_rate
+        self._paused_until = 0.0
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self, chat_id: int):
+        state = get_shared_state()
+        # Сначала чат (ожидание тут редкость), потом общий токен — чтобы не держать его, пока ждем чат
+        while (wait := await state.take_token(f"{CHAT_BUCKET_KEY}{chat_id}", self.chat_rate, 1)) > 0:
+            await asyncio.sleep(wait)
+        while True:
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            wait = await state.take_token(GLOBAL_BUCKET_KEY, self.rate, GLOBAL_BURST)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+
+async def deliver(bot, limiter: TelegramRateLimiter, chat_id: int, message: str) -> tuple[str, int]:
+    """Отправляет одно сообщение. Возвращает (sent / blocked / failed, число повторов)."""
+    from aiogram.exceptions import (
+        TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter, TelegramServerError,
+    )
+
+    retries = 0
+    for attempt in range(MAX_ATTEMPTS):
+        await limiter.acquire(chat_id)
+        try:
+            await bot.send_message(chat_id, message)
+            return "sent", retries
+        except TelegramRetryAfter as e:
+            print(f"⏳ Telegram просит подождать {e.retry_after} с (чат {chat_id})")
+            limiter.pause(e.retry_after)
+        except TelegramForbiddenError:
+            return "blocked", retries
+        except TelegramBadRequest as e: # chat not found и т.п. — повтор не поможет
+            print(f"❌ Сообщение в чат {chat_id} не отправлено: {e.message}")
+            return "failed", retries
+        except (TelegramNetworkError, TelegramServerError) as e:
+            print(f"⚠️ Ошибка Bot API (чат {chat_id}, попытка {attempt + 1}): {e}")
+            await asyncio.sleep(2 ** attempt)
+        except Exception as e:
+            # Любая другая ошибка не должна выбить страницу из gather: тогда чекпоинт не сдвинется
+            # и страница уйдет повторно
+            print(f"❌ Сообщение в чат {chat_id} не отправлено: {e!r}")
+            return "failed", retries
+        retries += 1
+    return "failed", retries
+
+
+# --- Выполнение рассылки ---
+
+def _recipients_after(cursor: int):
+    return (
+        select(User.id)
+        .where(User.id > cursor, User.status != UserAccountStatus.banned)
+        .order_by(User.id)
+        .limit(PAGE_SIZE)
+    )
+
+
+async def run_broadcast(
+    broadcast_id: int,
+    rate: Optional[float] = None,
+    on_checkpoint: Optional[Callable[[], Awaitable[None]]] = None,
+) -> str:
+    """
+    Выполняет рассылку с ее чекпоинта до конца (или до паузы/отмены). Возвращает итоговый статус.
+    on_checkpoint вызывается после каждой страницы: процесс рассылок проверяет там, что еще держит блокировку.
+    """
+    from app.bot import get_bot
+
+    session_factory = get_session_factory()
+    async with session_factory() as db:
+        broadcast = await db.get(Broadcast, broadcast_id)
+        if broadcast is None:
+            raise ValueError(f"Рассылка {broadcast_id} не найдена")
+        if broadcast.status not in RUNNABLE_STATUSES:
+            return broadcast.status
+        if broadcast.started_at is None:
+            broadcast.total = (await db.execute(
+                select(func.count()).select_from(User).where(User.status != UserAccountStatus.banned)
+            )).scalar_one()
+            broadcast.started_at = datetime.now(timezone.utc)
+        broadcast.status = "running"
+        await db.commit()
+        message, cursor = broadcast.text, broadcast.cursor_user_id
+    print(f"📣 Рассылка {broadcast_id}: старт с пользователя после {cursor}, всего получателей {broadcast.total}")
+
+    bot = get_bot()
+    limiter = TelegramRateLimiter(rate or get_settings().broadcast_rate)
+    senders = asyncio.Semaphore(SENDERS)
+
+    async def send(chat_id: int) -> tuple[str, int]:
+        async with senders:
+            return await deliver(bot, limiter, chat_id, message)
+
+    started = time.monotonic()
+    status = "running"
+    while status == "running":
+        async with session_factory() as db:
+            page = list((await db.execute(_recipients_after(cursor))).scalars())
+        if not page:
+            status = "completed"
+            break
+
+        counts = {"sent": 0, "blocked": 0, "failed": 0, "retries": 0}
+        for result, retries in await asyncio.gather(*(send(chat_id) for chat_id in page)):
+            counts[result] += 1
+            counts["retries"] += retries
+            broadcast_messages.inc(result)
+        cursor = page[-1]
+
+        # Чекпоинт; заодно узнаем, не поставили ли рассылку на паузу или не отменили ли ее
+        async with session_factory() as db:
+            status = (await db.execute(
+                update(Broadcast).where(Broadcast.id == broadcast_id).values(
+                    cursor_user_id=cursor,
+                    sent=Broadcast.sent + counts["sent"],
+                    blocked=Broadcast.blocked + counts["blocked"],
+                    failed=Broadcast.failed + counts["failed"],
+                    retries=Broadcast.retries + counts["retries"],
+                    updated_at=func.now(),
+                ).returning(Broadcast.status)
+            )).scalar_one()
+            await db.commit()
+        if on_checkpoint is not None:
+            await on_checkpoint()
+
+    async with session_factory() as db:
+        if status == "completed":
+            await db.execute(
+                update(Broadcast).where(Broadcast.id == broadcast_id, Broadcast.status == "running")
+                .values(status="completed", finished_at=func.now())
+            )
+            await db.commit()
+        broadcast = await db.get(Broadcast, broadcast_id)
+    print(f"📣 Рассылка {broadcast_id}: {status} за {time.monotonic() - started:.1f} с — отправлено {broadcast.sent}, "
+          f"заблокировали бота {broadcast.blocked}, ошибок {broadcast.failed}, повторов {broadcast.retries}")
+    return status
+
+
+async def next_runnable() -> Optional[int]:
+    async with get_session_factory()() as db:
+        return (await db.execute(
+            select(Broadcast.id).where(Broadcast.status.in_(RUNNABLE_STATUSES)).order_by(Broadcast.id).limit(1)
+        )).scalar()
+
+
+# --- Управление ---
+
+async def create_broadcast(db, message: str, created_by: Optional[int] = None) -> Broadcast:
+    broadcast = Broadcast(text=message, status="pending", created_by=created_by)
+    db.add(broadcast)
+    await db.commit()
+    return broadcast
+
+
+async def change_status(db, broadcast_id: int, action: str) -> Optional[Broadcast]:
+    """Пауза, продолжение или отмена. None — рассылки нет или действие недопустимо в ее статусе."""
+    allowed, new_status = TRANSITIONS[action]
+    values = {"status": new_status}
+    if new_status == "cancelled":
+        values["finished_at"] = func.now()
+    changed = (await db.execute(
+        update(Broadcast).where(Broadcast.id == broadcast_id, Broadcast.status.in_(allowed))
+        .values(**values).returning(Broadcast.id)
+    )).scalar()
+    await db.commit()
+    return await db.get(Broadcast, broadcast_id, populate_existing=True) if changed else None
+
+
+def broadcast_stats(broadcast: Broadcast) -> dict:
+    return {
+        "id": broadcast.id,
+        "status": broadcast.status,
+        "text": broadcast.text,
+        "created_at": broadcast.created_at,
+        "started_at": broadcast.started_at,
+        "finished_at": broadcast.finished_at,
+        "updated_at": broadcast.updated_at,
+        "total": broadcast.total,
+        "sent": broadcast.sent,
+        "blocked": broadcast.blocked,
+        "failed": broadcast.failed,
+        "retries": broadcast.retries,
+        "cursor_user_id": broadcast.cursor_user_id,
+    }
+
+
+# --- Процесс рассылок ---
+
+class BroadcastRunner:
+    """Выполняет рассылки по одной, пока держит advisory lock (один процесс на все реплики)."""
+
+    def __init__(self, lock_id: int = BROADCAST_LOCK_ID):
+        self.lock_id = lock_id
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="broadcasts")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                async with get_engine().connect() as conn:
+                    acquired = (await conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": self.lock_id})).scalar()
+                    await conn.commit()
+                    if acquired:
+                        await self._lead(conn)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Ошибка процесса рассылок: {e}")
+            await asyncio.sleep(LEADER_RETRY_SECONDS)
+
+    async def _lead(self, conn):
+        async def heartbeat():
+            # Соединение с блокировкой живо — значит, рассылку не подхватил кто-то еще
+            await conn.execute(text("SELECT 1"))
+            await conn.commit()
+
+        while True:
+            broadcast_id = await next_runnable()
+            if broadcast_id is None:
+                await asyncio.sleep(POLL_SECONDS)
+                await heartbeat()
+                continue
+            await run_broadcast(broadcast_id, on_checkpoint=heartbeat)
+
+
+_runner: Optional[BroadcastRunner] = None
+
+
+def start_broadcasts():
+    global _runner
+    settings = get_settings()
+    if not settings.broadcasts_enabled or not settings.bot_token:
+        print("Рассылки выключены (BROADCASTS_ENABLED=False или не задан BOT_TOKEN).")
+        return
+    if _runner is None:
+        _runner = BroadcastRunner()
+    _runner.start()
+
+
+async def stop_broadcasts():
+    if _runner is not None:
+        await _runner.stop()
+
+
+async def _main(args) -> int:
+    session_factory = get_session_factory()
+    try:
+        if args.command == "create":
+            async with session_factory() as db:
+                broadcast = await create_broadcast(db, args.text)
+            print(f"Рассылка {broadcast.id} создана; ее выполнит процесс рассылок (или: python -m app.broadcasts run {broadcast.id}).")
+        elif args.command == "list":
+            async with session_factory() as db:
+                for b in (await db.execute(select(Broadcast).order_by(Broadcast.id.desc()).limit(args.limit))).scalars():
+                    print(f"{b.id:>5} {b.status:<10} отправлено {b.sent}/{b.total or '?'}, заблокировали {b.blocked}, "
+                          f"ошибок {b.failed}, повторов {b.retries}  {b.text[:40]!r}")
+        elif args.command == "run":
+            # Вручную — под той же блокировкой, чтобы не слать параллельно с процессом рассылок
+            async with get_engine().connect() as conn:
+                acquired = (await conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": BROADCAST_LOCK_ID})).scalar()
+                # Блокировка сессионная: транзакцию закрываем, чтобы соединение не висело idle in transaction
+                await conn.commit()
+                if not acquired:
+                    print("Рассылки сейчас выполняет другой процесс.")
+                    return 1
+                try:
+                    status = await run_broadcast(args.id, rate=args.rate)
+                finally:
+                    await conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": BROADCAST_LOCK_ID})
+                    await conn.commit()
+            return 0 if status in ("completed", "paused", "cancelled") else 1
+        else:
+            async with session_factory() as db:
+                broadcast = await change_status(db, args.id, args.command)
+            if broadcast is None:
+                print(f"Рассылку {args.id} нельзя {args.command}: ее нет или статус не подходит.")
+                return 1
+            print(f"Рассылка {broadcast.id}: {broadcast.status}")
+        return 0
+    finally:
+        from app.bot import close_bot
+
+        await close_bot()
+        await get_engine().dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Рассылки сообщений пользователям бота")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("create", help="Создать рассылку").add_argument("text")
+    sub.add_parser("list", help="Последние рассылки").add_argument("--limit", type=int, default=20)
+    run_parser = sub.add_parser("run", help="Выполнить рассылку сейчас, в этом процессе")
+    run_parser.add_argument("id", type=int)
+    run_parser.add_argument("--rate", type=float, default=None, help="сообщений в секунду (по умолчанию BROADCAST_RATE)")
+    for action in TRANSITIONS:
+        sub.add_parser(action).add_argument("id", type=int)
+    raise SystemExit(asyncio.run(_main(parser.parse_args())))
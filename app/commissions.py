@@ -0,0 +1,188 @@
+# app/commissions.py
+"""
+Реферальные комиссии с покупок инвестиционных пакетов.
+
+С каждой покупки (строка investments) предки покупателя по цепочке referrals получают на bonus_balance
+процент от суммы по COMMISSION_RATES (app/referrals.py): 1-й уровень — тот, кто пригласил покупателя,
+2-й — тот, кто пригласил его, и так до 5-го. Один SQL на пачку покупок делает все в одной транзакции:
+    покупки -> предки (рекурсивный CTE, до MAX_LEVEL) -> bonus_balance предков ->
+    referrals.bonus_earned -> транзакции 'referral_commission' -> user_stats -> investments.commissions_paid_at
+
+bonus_earned растет у связи предка с его прямым рефералом на пути к покупателю: в /api/referral_data
+у каждого прямого реферала видно, сколько предок заработал на нем и на всей его сети.
+
+Покупка выплачивается один раз: выбираются только строки с commissions_paid_at IS NULL, и они
+блокируются (FOR UPDATE SKIP LOCKED) — вебхук и задача pay_referral_commissions одну покупку не удвоят.
+Вебхук платежа выплачивает комиссии сразу после покупки; если это не удалось, а также для покупок,
+сделанных до появления комиссий, выплату делает задача пачками по BATCH_SIZE.
+
+Заблокированные (banned) предки комиссию не получают, но цепочка идет через них дальше. Пользователь,
+уже встретившийся в цепочке (цикл в referrals), повторно не учитывается.
+
+Ручной запуск: python -m app.commissions pay [--batch-size 1000]
+"""
+import argparse
+import asyncio
+from decimal import Decimal
+
+from sqlalchemy import text
+
+from app.database import get_session_factory
+from app.events import balances_from_rows, publish_balances
+from app.referrals import COMMISSION_RATES, REFERRAL_COMMISSION_TX_TYPE
+
+# Глубже этого уровня комиссии не платятся, даже если в COMMISSION_RATES есть ставки
+MAX_LEVEL = 5
+BATCH_SIZE = 1000
+
+# Покупки пачки: явный список id (вебхук) или следующие невыплаченные по порядку (задача)
+_PURCHASES_BY_ID = """
+    SELECT id, user_id, amount_invested FROM investments
+    WHERE id = ANY(CAST(:ids AS INTEGER[])) AND commissions_paid_at IS NULL
+    ORDER BY id
+    FOR UPDATE SKIP LOCKED
+"""
+_PENDING_PURCHASES = """
+    SELECT id, user_id, amount_invested FROM investments
+    WHERE commissions_paid_at IS NULL
+    ORDER BY id
+    LIMIT :batch_size
+    FOR UPDATE SKIP LOCKED
+"""
+
+# Предки блокируются по возрастанию id до любых изменений: параллельные выплаты с общими предками
+# ждут друг друга, а не попадают во взаимную блокировку. Игры и ежедневный бонус (app/routers/games.py)
+# тоже читают пользователя с FOR UPDATE, поэтому их запись bonus_balance не затирает комиссию.
+# Новые балансы возвращаются массивом и после коммита публикуются подписчикам (app/events.py).
+_PAY_COMMISSIONS_SQL = """
+WITH RECURSIVE purchases AS ({purchases}),
+chain AS (
+    SELECT p.id AS investment_id, p.amount_invested, r.id AS referral_id, r.referrer_id AS ancestor_id,
+           1 AS level, ARRAY[p.user_id, r.referrer_id] AS path
+    FROM purchases p
+    JOIN referrals r ON r.referred_id = p.user_id
+    WHERE r.referrer_id <> p.user_id
+    UNION ALL
+    SELECT c.investment_id, c.amount_invested, r.id, r.referrer_id, c.level + 1, c.path || r.referrer_id
+    FROM chain c
+    JOIN referrals r ON r.referred_id = c.ancestor_id
+    WHERE c.level < :max_level AND r.referrer_id <> ALL(c.path)
+),
+payouts AS (
+    SELECT c.investment_id, c.referral_id, c.ancestor_id, c.level,
+           round(c.amount_invested * rates.rate / 100, 2) AS amount
+    FROM chain c
+    JOIN unnest(CAST(:levels AS INTEGER[]), CAST(:rates AS NUMERIC[])) AS rates(level, rate) ON rates.level = c.level
+    WHERE round(c.amount_invested * rates.rate / 100, 2) > 0
+),
+ancestors AS (
+    SELECT u.id FROM users u
+    WHERE u.id IN (SELECT ancestor_id FROM payouts) AND u.status <> 'banned'
+    ORDER BY u.id
+    FOR UPDATE
+),
+paid_out AS (
+    SELECT payouts.* FROM payouts JOIN ancestors ON ancestors.id = payouts.ancestor_id
+),
+balances AS (
+    UPDATE users u
+    SET bonus_balance = COALESCE(u.bonus_balance, 0) + per_user.amount
+    FROM (SELECT ancestor_id, sum(amount) AS amount FROM paid_out GROUP BY ancestor_id) AS per_user
+    WHERE u.id = per_user.ancestor_id
+    RETURNING u.id, u.main_balance, u.bonus_balance, u.lucrum_balance
+),
+earned AS (
+    UPDATE referrals r
+    SET bonus_earned = COALESCE(r.bonus_earned, 0) + per_referral.amount
+    FROM (SELECT referral_id, sum(amount) AS amount FROM paid_out GROUP BY referral_id) AS per_referral
+    WHERE r.id = per_referral.referral_id
+),
+ledger AS (
+    INSERT INTO transactions (user_id, type, amount, currency, status, description, txid)
+    SELECT ancestor_id, :tx_type, amount, '₤s', 'completed',
+           'Реферальная комиссия ' || level || '-го уровня: +' || amount || ' ₤s',
+           'commission:' || investment_id || ':' || level
+    FROM paid_out
+    RETURNING id, user_id, amount, timestamp
+),
+stats AS (
+    INSERT INTO user_stats (user_id, type, tx_count, amount_sum, last_activity_at, last_transaction_id)
+    SELECT user_id, :tx_type, count(*), sum(amount), max(timestamp), max(id)
+    FROM ledger
+    GROUP BY user_id
+    ORDER BY user_id
+    ON CONFLICT (user_id, type) DO UPDATE
+    SET tx_count = user_stats.tx_count + EXCLUDED.tx_count,
+        amount_sum = user_stats.amount_sum + EXCLUDED.amount_sum,
+        last_activity_at = GREATEST(user_stats.last_activity_at, EXCLUDED.last_activity_at),
+        last_transaction_id = GREATEST(user_stats.last_transaction_id, EXCLUDED.last_transaction_id)
+),
+marked AS (
+    UPDATE investments i SET commissions_paid_at = now()
+    FROM purchases
+    WHERE i.id = purchases.id
+    RETURNING i.id
+)
+SELECT (SELECT count(*) FROM marked) AS investments, (SELECT count(*) FROM paid_out) AS payouts,
+       (SELECT COALESCE(sum(amount), 0) FROM paid_out) AS total,
+       (SELECT array_agg(ARRAY[id, main_balance, bonus_balance, lucrum_balance]) FROM balances) AS balances
+"""
+_PAY_BY_ID_SQL = text(_PAY_COMMISSIONS_SQL.format(purchases=_PURCHASES_BY_ID))
+_PAY_PENDING_SQL = text(_PAY_COMMISSIONS_SQL.format(purchases=_PENDING_PURCHASES))
+
+
+def _rate_params() -> dict:
+    levels = sorted(level for level in COMMISSION_RATES if 1 <= level <= MAX_LEVEL)
+    return {
+        "levels": levels,
+        "rates": [Decimal(COMMISSION_RATES[level]) for level in levels],
+        "max_level": MAX_LEVEL,
+        "tx_type": REFERRAL_COMMISSION_TX_TYPE,
+    }
+
+
+async def pay_commissions(db, investment_ids: list[int]):
+    """
+    Выплачивает комиссии по указанным покупкам и коммитит. Уже выплаченные и занятые другой
+    выплатой покупки пропускаются. Возвращает строку (investments, payouts, total, balances).
+    """
+    row = (await db.execute(_PAY_BY_ID_SQL, {**_rate_params(), "ids": investment_ids})).one()
+    await db.commit()
+    await publish_balances(balances_from_rows(row.balances))
+    return row
+
+
+async def pay_pending_commissions(batch_size: int = BATCH_SIZE) -> str:
+    """Выплачивает комиссии по всем невыплаченным покупкам пачками, каждая пачка — своя транзакция."""
+    investments, payouts, total = 0, 0, Decimal("0")
+    params = {**_rate_params(), "batch_size": batch_size}
+    session_factory = get_session_factory()
+    while True:
+        async with session_factory() as db:
+            row = (await db.execute(_PAY_PENDING_SQL, params)).one()
+            await db.commit()
+        await publish_balances(balances_from_rows(row.balances))
+        investments += row.investments
+        payouts += row.payouts
+        total += row.total
+        if row.investments < batch_size:
+            break
+    return f"покупок: {investments}, выплат: {payouts}, начислено: {total} ₤s"
+
+
+async def _main(args) -> int:
+    from app.database import dispose_engine
+
+    try:
+        print(f"✅ Комиссии выплачены: {await pay_pending_commissions(args.batch_size)}")
+        return 0
+    finally:
+        await dispose_engine()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m app.commissions", description="Реферальные комиссии с покупок")
+    sub = parser.add_subparsers(dest="command", required=True)
+    pay_parser = sub.add_parser("pay", help="Выплатить комиссии по всем невыплаченным покупкам")
+    pay_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="покупок в транзакции")
+    raise SystemExit(asyncio.run(_main(parser.parse_args())))
@@ -0,0 +1,82 @@
+# app/compression.py
+"""
+Сжатие ответов по Accept-Encoding: brotli, если установлен пакет brotli и клиент его принимает, иначе gzip.
+
+Ответы короче минимального размера и потоки text/event-stream (GET /api/events) не сжимаются;
+ответ, у которого уже есть Content-Encoding, проходит как есть. Разбор тела и заголовки
+(Vary: Accept-Encoding, Content-Length) — из GZipMiddleware Starlette, здесь только выбор кодировки
+и brotli. ETag приложения слабые (app/http_cache.py), поэтому сжатие их не ломает.
+"""
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipResponder, IdentityResponder
+
+# Уровни для динамических ответов: дальше размер почти не падает, а время на сжатие растет в разы
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def accepted_encodings(header: str) -> dict[str, float]:
+    """Accept-Encoding -> {кодировка: q}. "gzip;q=0" означает отказ."""
+    encodings = {}
+    for item in header.split(","):
+        name, _, params = item.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        encodings[name] = q
+    return encodings
+
+
+class BrotliResponder(IdentityResponder):
+    content_encoding = "br"
+
+    def __init__(self, app, minimum_size: int, brotli_module, quality: int = BROTLI_QUALITY):
+        super().__init__(app, minimum_size)
+        self.compressor = brotli_module.Compressor(quality=quality)
+
+    def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        body = self.compressor.process(body)
+        return body + (self.compressor.flush() if more_body else self.compressor.finish())
+
+
+class CompressionMiddleware:
+    """ASGI-middleware сжатия: кодировку выбирает по Accept-Encoding для каждого запроса."""
+
+    def __init__(self, app, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+        try:
+            import brotli
+        except ImportError: # Необязательная зависимость: без нее — только gzip
+            brotli = None
+        self.brotli = brotli
+        self.preferred = ("br", "gzip") if brotli is not None else ("gzip",)
+
+    def choose_encoding(self, accept_encoding: str):
+        accepted = accepted_encodings(accept_encoding)
+        for encoding in self.preferred:
+            if accepted.get(encoding, accepted.get("*", 0)) > 0:
+                return encoding
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = self.choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding == "br":
+            responder = BrotliResponder(self.app, self.minimum_size, self.brotli)
+        elif encoding == "gzip":
+            responder = GZipResponder(self.app, self.minimum_size, compresslevel=GZIP_LEVEL)
+        else:
+            # Без сжатия, но с Vary: Accept-Encoding — иначе CDN мог бы отдать этот вариант вместо сжатого
+            responder = IdentityResponder(self.app, self.minimum_size)
+        await responder(scope, receive, send)
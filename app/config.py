@@ -0,0 +1,133 @@
+# app/config.py
+import os
+import tempfile
+from dataclasses import dataclass
+from functools import lru_cache
+
+
+def _bool(name: str, default: str) -> bool:
+    return os.getenv(name, default).lower() == "true"
+
+
+@dataclass(frozen=True)
+class Settings:
+    """Все настройки приложения из переменных окружения. Читаются один раз — см. get_settings()."""
+
+    # --- Telegram ---
+    bot_token: str | None
+    webapp_url: str | None # URL Mini App
+    base_webhook_url: str | None
+    telegram_api_base: str # Адрес Bot API; переопределяется для локальной заглушки (бенчмарки, тесты)
+    telegram_payment_provider_token: str | None
+
+    # --- База данных ---
+    database_url: str | None
+    sql_echo: bool
+    # Пул соединений (app/database.py). DB_POOL_SIZE=0 — без пула (NullPool), соединение на каждую сессию
+    db_pool_size: int
+    db_max_overflow: int
+    db_pool_recycle: int # Пересоздавать соединения старше стольких секунд
+    db_statement_cache_size: int # Подготовленных операторов на соединение; 0 — не кешировать
+    db_pgbouncer: bool # Соединения идут через PgBouncer (transaction/statement pooling)
+    # Реплика для чтения (app/database.py, get_read_session). Пусто — все идет в основную БД
+    database_replica_url: str | None
+    replica_max_lag_seconds: float # Реплика, отстающая сильнее, не используется
+    replica_sticky_seconds: float # Столько секунд после записи чтения пользователя идут в основную БД
+    replica_check_interval: float # Как часто проверять доступность и отставание реплики
+    drop_db_on_startup: bool
+    # Что делать со схемой БД на старте:
+    #   check   — только сверить версию в schema_version (по умолчанию; миграции — отдельным шагом деплоя)
+    #   migrate — применить миграции прямо на старте (один инстанс без release-шага, локальная разработка)
+    #   skip    — ничего не проверять
+    schema_mode: str
+
+    # --- JWT ---
+    jwt_secret_key: str | None
+    refresh_token_secret_key: str | None
+
+    # --- Ограничение частоты запросов и сброс нагрузки ---
+    rate_limit_enabled: bool
+    load_shed_lag_seconds: float
+    fraud_detection_enabled: bool # Детектор мошенничества по событиям игр и бонусов (app/fraud.py)
+    fraud_device_rules: str # off / flag / block — правила multi_account и shared_ip (нужен настоящий IP клиента)
+
+    # --- Сжатие ответов (app/compression.py) ---
+    compression_enabled: bool
+    compression_min_size: int # Ответы короче стольких байт не сжимаются
+
+    # --- Метрики (/metrics) ---
+    # Если задан, /metrics отдается только с заголовком Authorization: Bearer <токен>
+    metrics_token: str | None
+
+    # --- Несколько воркеров ---
+    # Общее состояние воркеров (кеши, лимитеры): redis://... Без него — память процесса,
+    # что корректно только для одного воркера.
+    shared_state_url: str | None
+    shared_state_max_keys: int # Размер LRU для бэкенда в памяти
+    web_concurrency: int # Число воркеров (gunicorn.conf.py, uvicorn --workers)
+    worker_lock_dir: str # Где лежат lock-файлы выбора главного воркера
+
+    # --- Фоновые задачи ---
+    scheduler_enabled: bool
+    # Архив старых месячных партиций transactions (app/partitions.py): 0 — хранить все в БД
+    transactions_archive_after_months: int
+    transactions_archive_dir: str
+    transactions_archive_format: str # csv.gz или parquet (нужен pyarrow)
+    # Рассылки (app/broadcasts.py)
+    broadcasts_enabled: bool
+    broadcast_rate: float # Сообщений в секунду на весь бот; лимит Telegram — около 30
+    # Выплаты заявок на вывод (app/payouts.py): stub или "package.module:ClassName"
+    payout_provider: str
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        return cls(
+            bot_token=os.getenv("BOT_TOKEN"),
+            webapp_url=os.getenv("WEBAPP_URL"),
+            base_webhook_url=os.getenv("BASE_WEBHOOK_URL"),
+            telegram_api_base=os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org"),
+            telegram_payment_provider_token=os.getenv("TELEGRAM_PAYMENT_PROVIDER_TOKEN"),
+            database_url=os.getenv("DATABASE_URL"),
+            sql_echo=_bool("SQL_ECHO", "True"),
+            db_pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+            db_max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "5")),
+            db_pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+            db_statement_cache_size=int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100")),
+            db_pgbouncer=_bool("DB_PGBOUNCER", "False"),
+            database_replica_url=os.getenv("DATABASE_REPLICA_URL") or None,
+            replica_max_lag_seconds=float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5")),
+            replica_sticky_seconds=float(os.getenv("REPLICA_STICKY_SECONDS", "10")),
+            replica_check_interval=float(os.getenv("REPLICA_CHECK_INTERVAL", "2")),
+            drop_db_on_startup=_bool("DROP_DB_ON_STARTUP", "False"),
+            schema_mode=os.getenv("SCHEMA_MODE", "check").lower(),
+            jwt_secret_key=os.getenv("JWT_SECRET_KEY"),
+            refresh_token_secret_key=os.getenv("REFRESH_TOKEN_SECRET_KEY"),
+            rate_limit_enabled=_bool("RATE_LIMIT_ENABLED", "True"),
+            load_shed_lag_seconds=float(os.getenv("LOAD_SHED_LAG_SECONDS", "0.5")),
+            fraud_detection_enabled=_bool("FRAUD_DETECTION_ENABLED", "True"),
+            fraud_device_rules=os.getenv("FRAUD_DEVICE_RULES", "off").lower(),
+            compression_enabled=_bool("COMPRESSION_ENABLED", "True"),
+            compression_min_size=int(os.getenv("COMPRESSION_MIN_SIZE", "1024")),
+            metrics_token=os.getenv("METRICS_TOKEN") or None,
+            # RATE_LIMIT_* — старые имена, пока лимитер был единственным пользователем общего состояния
+            shared_state_url=os.getenv("SHARED_STATE_URL") or os.getenv("RATE_LIMIT_REDIS_URL"),
+            shared_state_max_keys=int(os.getenv("SHARED_STATE_MAX_KEYS") or os.getenv("RATE_LIMIT_MAX_BUCKETS") or "100000"),
+            web_concurrency=int(os.getenv("WEB_CONCURRENCY", "1")),
+            worker_lock_dir=os.getenv("WORKER_LOCK_DIR") or tempfile.gettempdir(),
+            scheduler_enabled=_bool("SCHEDULER_ENABLED", "True"),
+            transactions_archive_after_months=int(os.getenv("TRANSACTIONS_ARCHIVE_AFTER_MONTHS", "0")),
+            transactions_archive_dir=os.getenv("TRANSACTIONS_ARCHIVE_DIR", "archive/transactions"),
+            transactions_archive_format=os.getenv("TRANSACTIONS_ARCHIVE_FORMAT", "csv.gz").lower(),
+            broadcasts_enabled=_bool("BROADCASTS_ENABLED", "True"),
+            broadcast_rate=float(os.getenv("BROADCAST_RATE", "25")),
+            payout_provider=os.getenv("PAYOUT_PROVIDER", "stub"),
+        )
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Настройки процесса. .env читается один раз при первом обращении."""
+    return Settings.from_env()
@@ -1,12 +1,16 @@
 # app/database.py
+import asyncio
+import time
+from uuid import uuid4
 
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.orm import Session, declarative_base, sessionmaker
 from sqlalchemy.pool import NullPool # Для Render.com или других облачных провайдеров, использующих connection pool на своей стороне
-from sqlalchemy import select # Импортируем select для проверки существования пакетов
+from sqlalchemy import event, text
 
-import os
-from dotenv import load_dotenv
+from app.config import get_settings
+from app.metrics import db_read_sessions, db_replica_lag, instrument_engine
+from app.shared_state import get_shared_state
 
 # Импортируем модели здесь, чтобы они были доступны для Base.metadata.create_all
 # и для инициализации пакетов. Важно: models.py должен импортировать Base из database.py
@@ -14,93 +18,290 @@ from dotenv import load_dotenv
 # Лучше импортировать Base из .database
 # from app.models import InvestmentPackage, User # Закомментировано, так как Base.metadata.create_all сам найдет все модели, унаследованные от Base
 
-load_dotenv() # Загружаем переменные окружения
+# Создаем базовый класс для декларативных моделей SQLAlchemy
+Base = declarative_base()
 
-DATABASE_URL = os.getenv("DATABASE_URL")
+# Движок и фабрика сессий создаются лениво, при первом обращении: импорт модуля
+# не требует DATABASE_URL и ничего не подключает (быстрый старт, легкие тесты).
+_engine = None
+_session_factory = None
+_replica_engine = None
 
-# Проверяем, что DATABASE_URL установлен
-if not DATABASE_URL:
-    raise ValueError("DATABASE_URL environment variable is not set.")
+# Ключ общего состояния: пользователь недавно писал, его чтения идут в основную БД
+RECENT_WRITE_KEY = "recent_write:"
+# Дольше проверка реплики не ждет: зависшая реплика считается недоступной
+REPLICA_CHECK_TIMEOUT = 1.0
+# Отставание реплики в секундах. Если все полученное WAL уже применено, отставания нет,
+# даже когда основная БД давно ничего не писала (pg_last_xact_replay_timestamp тогда старый).
+# На основной БД (pg_is_in_recovery() = false) — 0: так локально можно указать ту же базу.
+REPLICA_LAG_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
 
-# Создаем асинхронный движок SQLAlchemy
-# poolclass=NullPool может быть полезен, если провайдер БД (например, Render.com)
-# имеет свой собственный пул подключений, и вы не хотите, чтобы SQLAlchemy
-# создавал дополнительный пул, который может конфликтовать.
-# Если вы используете локальную БД или другой провайдер, который не управляет пулом,
-# можно убрать poolclass=NullPool или использовать QueuePool (по умолчанию).
-engine = create_async_engine(DATABASE_URL, echo=True, poolclass=NullPool)
 
-# Создаем базовый класс для декларативных моделей SQLAlchemy
-Base = declarative_base()
+def _prepared_statement_name() -> str:
+    return f"__asyncpg_{uuid4()}__"
+
+
+def build_engine(settings, url: str | None = None):
+    """
+    Движок по настройкам пула и кеша подготовленных операторов.
+
+    Подготовленные операторы asyncpg живут на соединении: с пулом (DB_POOL_SIZE > 0) разбор и план
+    горячих запросов переживают запрос, а с NullPool выбрасываются вместе с соединением.
+    Через PgBouncer (DB_PGBOUNCER=True) соседние клиенты делят серверные соединения, поэтому имена
+    операторов делаем уникальными — иначе «prepared statement already exists». Кеш операторов через
+    PgBouncer работает только с версии 1.21 и max_prepared_statements > 0; для более старых
+    выставьте DB_STATEMENT_CACHE_SIZE=0.
+    """
+    connect_args = {
+        # Кеш SQLAlchemy-адаптера (подготовленные операторы ORM) и собственный кеш asyncpg (сырые запросы)
+        "prepared_statement_cache_size": settings.db_statement_cache_size,
+        "statement_cache_size": settings.db_statement_cache_size,
+    }
+    if settings.db_pgbouncer:
+        connect_args["prepared_statement_name_func"] = _prepared_statement_name
+
+    pool_options = {"poolclass": NullPool}
+    if settings.db_pool_size > 0:
+        pool_options = {
+            "pool_size": settings.db_pool_size,
+            "max_overflow": settings.db_max_overflow,
+            "pool_recycle": settings.db_pool_recycle,
+        }
+    return create_async_engine(
+        url or settings.database_url, echo=settings.sql_echo, connect_args=connect_args, **pool_options,
+    )
+
+
+def get_engine():
+    """Асинхронный движок SQLAlchemy (создается один раз на процесс)."""
+    global _engine
+    if _engine is None:
+        settings = get_settings()
+        # Проверяем, что DATABASE_URL установлен
+        if not settings.database_url:
+            raise ValueError("DATABASE_URL environment variable is not set.")
+
+        # Пул — на каждый воркер: всего соединений до WEB_CONCURRENCY * (DB_POOL_SIZE + DB_MAX_OVERFLOW).
+        # DB_POOL_SIZE=0 — прежний режим без пула (NullPool), если пулом управляет провайдер БД.
+        _engine = build_engine(settings)
+
+        # Время каждого SQL-запроса попадает в метрики (span="db")
+        instrument_engine(_engine)
+    return _engine
+
+
+async def dispose_engine():
+    """Закрывает соединения пулов основной БД и реплики (при остановке процесса)."""
+    global _engine, _session_factory, _replica_engine
+    if _replica_engine is not None:
+        await _replica_engine.dispose()
+        _replica_engine = None
+        _replica_state.update(available=False, checked_at=float("-inf"), task=None)
+    if _engine is not None:
+        await _engine.dispose()
+        _engine, _session_factory = None, None
+
+
+# --- Реплика для чтения ---
+# Маршруты только для чтения берут сессию из get_read_session(): ее запросы уходят на реплику
+# (DATABASE_REPLICA_URL), а flush и все остальные сессии — в основную БД. В основную БД чтения
+# возвращаются, если реплики нет, она недоступна или отстает больше REPLICA_MAX_LAG_SECONDS,
+# а также для пользователя, который писал последние REPLICA_STICKY_SECONDS (read-your-writes).
+
+class RoutingSession(Session):
+    """Сессия, которая отправляет чтения на реплику, если get_read_session() ее выбрал."""
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        read_bind = self.info.get("read_bind")
+        if read_bind is not None and not self._flushing:
+            return read_bind
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _collect_written_users(session, flush_context):
+    """Запоминает пользователей, чьи данные изменил flush (до коммита — только в сессии)."""
+    from app.models import User
+
+    pending = session.info.setdefault("pending_user_ids", set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, User):
+            pending.add(obj.id)
+        for attr in ("user_id", "referrer_id", "referred_id"):
+            user_id = getattr(obj, attr, None)
+            if user_id is not None:
+                pending.add(user_id)
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _commit_written_users(session):
+    pending = session.info.pop("pending_user_ids", None)
+    if pending:
+        session.info.setdefault("written_user_ids", set()).update(pending)
+
+
+@event.listens_for(RoutingSession, "after_soft_rollback")
+def _forget_written_users(session, previous_transaction):
+    session.info.pop("pending_user_ids", None)
+
+
+async def remember_writes(session):
+    """
+    Отмечает в общем состоянии пользователей, чьи записи закоммитила сессия: следующие
+    REPLICA_STICKY_SECONDS их чтения пойдут в основную БД. Вызывается из get_async_session()
+    после обработчика — FastAPI выполняет это до отправки ответа.
+    """
+    user_ids = session.info.pop("written_user_ids", None)
+    if not user_ids or get_replica_engine() is None:
+        return
+    ttl = get_settings().replica_sticky_seconds
+    state = get_shared_state()
+    for user_id in user_ids:
+        await state.set(f"{RECENT_WRITE_KEY}{user_id}", "1", ttl=ttl)
+
+
+def get_replica_engine():
+    """Движок реплики или None, если DATABASE_REPLICA_URL не задан."""
+    global _replica_engine
+    settings = get_settings()
+    if _replica_engine is None and settings.database_replica_url:
+        # Отдельный пул на каждый воркер, того же размера, что и у основной БД
+        _replica_engine = build_engine(settings, settings.database_replica_url)
+        instrument_engine(_replica_engine)
+
+        @event.listens_for(_replica_engine.sync_engine, "handle_error")
+        def _replica_error(exception_context):
+            # Оборванное соединение — реплика упала: до следующей проверки читаем из основной БД
+            if exception_context.is_disconnect:
+                _replica_state["available"] = False
+    return _replica_engine
+
+
+# Состояние реплики в процессе: результат последней проверки и фоновая задача проверки
+_replica_state = {"available": False, "checked_at": float("-inf"), "task": None}
+
+
+async def _check_replica(engine):
+    settings = get_settings()
+    try:
+        async with asyncio.timeout(REPLICA_CHECK_TIMEOUT):
+            async with engine.connect() as conn:
+                lag = float((await conn.execute(text(REPLICA_LAG_SQL))).scalar())
+    except Exception as e:
+        if _replica_state["available"]:
+            print(f"⚠️ Реплика недоступна, чтения идут в основную БД: {e!r}")
+        _replica_state["available"] = False
+        db_replica_lag.set(-1)
+        return
+    available = lag <= settings.replica_max_lag_seconds
+    if available != _replica_state["available"]:
+        print(f"{'✅' if available else '⚠️'} Реплика {'доступна' if available else 'отстает'}: отставание {lag:.1f} с")
+    _replica_state["available"] = available
+    db_replica_lag.set(lag)
+
+
+def replica_available() -> bool:
+    """
+    Можно ли читать с реплики. Запрос не ждет проверку: раз в REPLICA_CHECK_INTERVAL
+    проверка запускается в фоне, а до ее результата действует предыдущий (сначала — основная БД).
+    """
+    engine = get_replica_engine()
+    if engine is None:
+        return False
+    now = time.monotonic()
+    if now - _replica_state["checked_at"] >= get_settings().replica_check_interval:
+        _replica_state["checked_at"] = now
+        _replica_state["task"] = asyncio.get_running_loop().create_task(_check_replica(engine))
+    return _replica_state["available"]
+
+
+async def read_your_writes(session, user_id: int):
+    """Пользователь недавно писал — чтения этой сессии идут в основную БД. Вызывать до первого запроса."""
+    if "read_bind" in session.info and await get_shared_state().get(f"{RECENT_WRITE_KEY}{user_id}"):
+        del session.info["read_bind"]
+
+
+def get_session_factory():
+    """
+    Фабрика асинхронных сессий.
+    autoflush=False отключает автоматическую отправку изменений в БД после каждой операции,
+    что может быть полезно для оптимизации, но требует явного flush() перед commit() если нужно.
+    """
+    global _session_factory
+    if _session_factory is None:
+        # Регистрирует обработчики: user_stats вместе с записями в transactions, события об изменении балансов,
+        # версия каталога пакетов для HTTP-кеша, приращения досок лидеров, детектор мошенничества
+        import app.user_stats # noqa: F401
+        import app.events # noqa: F401
+        import app.http_cache # noqa: F401
+        import app.leaderboards # noqa: F401
+        import app.fraud # noqa: F401
+
+        _session_factory = sessionmaker(
+            autocommit=False,
+            autoflush=False,
+            bind=get_engine(),
+            class_=AsyncSession,
+            sync_session_class=RoutingSession, # Чтения на реплику — только в сессиях get_read_session()
+            expire_on_commit=False # Объекты не истекают после коммита, можно использовать их дальше
+        )
+    return _session_factory
+
+
+def __getattr__(name):
+    # Совместимость со старым кодом: app.database.engine / AsyncSessionLocal по-прежнему доступны,
+    # но создаются только при первом обращении.
+    if name == "engine":
+        return get_engine()
+    if name == "AsyncSessionLocal":
+        return get_session_factory()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# Создаем фабрику асинхронных сессий
-# autoflush=False отключает автоматическую отправку изменений в БД после каждой операции,
-# что может быть полезно для оптимизации, но требует явного flush() перед commit() если нужно.
-# bind=engine привязывает сессии к нашему движку.
-AsyncSessionLocal = sessionmaker(
-    autocommit=False,
-    autoflush=False,
-    bind=engine,
-    class_=AsyncSession,
-    expire_on_commit=False # Объекты не истекают после коммита, можно использовать их дальше
-)
 
 # Функция для получения асинхронной сессии (для зависимостей FastAPI)
 async def get_async_session():
-    async with AsyncSessionLocal() as session:
+    async with get_session_factory()() as session:
         yield session
+        await remember_writes(session)
+
 
-# --- Данные для начальной инициализации инвестиционных пакетов ---
-def _initial_investment_packages_data():
-    """Возвращает список словарей с данными для начальных инвестиционных пакетов."""
-    return [
-        {'name': 'Bronze Plan', 'min_amount': 100.00, 'max_amount': 500.00, 'daily_roi_percentage': 0.50, 'duration_days': 30, 'description': 'Наш начальный план. Идеально подходит для новичков.', 'is_active': True},
-        {'name': 'Silver Plan', 'min_amount': 501.00, 'max_amount': 2000.00, 'daily_roi_percentage': 0.75, 'duration_days': 45, 'description': 'Популярный план со сбалансированным доходом.', 'is_active': True},
-        {'name': 'Gold Plan', 'min_amount': 2001.00, 'max_amount': 10000.00, 'daily_roi_percentage': 1.00, 'duration_days': 60, 'description': 'Премиальный план для более значительных инвестиций.', 'is_active': True},
-        {'name': 'Diamond Plan', 'min_amount': 10001.00, 'max_amount': None, 'daily_roi_percentage': 1.25, 'duration_days': 90, 'description': 'Эксклюзивный план с максимальной прибылью.', 'is_active': True},
-    ]
-
-async def initialize_investment_packages(session: AsyncSession):
+async def get_read_session():
     """
-    Инициализирует базовые инвестиционные пакеты в базе данных,
-    если их еще нет.
+    Сессия для маршрутов только для чтения: запросы идут на реплику, если она доступна.
+    Маршрут, который знает пользователя, вызывает read_your_writes(db, user_id) до первого запроса.
     """
-    # Импортируем InvestmentPackage здесь, чтобы избежать циклического импорта
-    # если models.py импортирует что-то из database.py
-    from app.models import InvestmentPackage 
-
-    print("Проверяю и инициализирую инвестиционные пакеты...")
-    for pkg_data in _initial_investment_packages_data():
-        # Проверяем, существует ли пакет с таким именем
-        stmt = select(InvestmentPackage).where(InvestmentPackage.name == pkg_data['name'])
-        existing_package = (await session.execute(stmt)).scalar_one_or_none()
-        
-        if not existing_package:
-            # Если не существует, создаем и добавляем
-            new_package = InvestmentPackage(**pkg_data)
-            session.add(new_package)
-            print(f"Добавлен инвестиционный пакет: {pkg_data['name']}")
-        else:
-            print(f"Инвестиционный пакет '{pkg_data['name']}' уже существует.")
-    
-    await session.commit() # Фиксируем изменения после добавления всех пакетов
-    print("Инициализация инвестиционных пакетов завершена.")
-
-
-# Функции для создания и удаления всех таблиц
-async def create_db_tables():
-    """Создает все таблицы в базе данных на основе ORM-моделей и инициализирует базовые данные."""
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-    print("Все таблицы базы данных успешно созданы.")
-    
-    # После создания таблиц, инициализируем инвестиционные пакеты
-    async with AsyncSessionLocal() as session:
-        await initialize_investment_packages(session)
+    async with get_session_factory()() as session:
+        if replica_available():
+            session.info["read_bind"] = get_replica_engine().sync_engine
+        yield session
+        db_read_sessions.inc("replica" if "read_bind" in session.info else "primary")
+
+# --- Схема БД ---
+# Таблицы создаются и обновляются версионированными миграциями (app/migrations),
+# а начальные инвестиционные пакеты заводит миграция 0002. На старте приложение
+# только сверяет версию схемы, см. check_schema_version().
+
+async def run_migrations():
+    """Применяет непримененные миграции (python -m app.migrations upgrade делает то же самое)."""
+    from app import migrations
+    return await migrations.upgrade(get_engine())
+
+
+async def check_schema_version() -> int:
+    """Один SELECT по schema_version: бросает SchemaVersionError, если миграции не применены."""
+    from app import migrations
+    return await migrations.check(get_engine())
 
 
 async def drop_db_tables():
     """Удаляет все таблицы из базы данных."""
-    async with engine.begin() as conn:
+    async with get_engine().begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
+        await conn.execute(text("DROP TABLE IF EXISTS schema_version"))
     print("Все таблицы базы данных успешно удалены.")
\ No newline at end of file
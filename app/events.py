@@ -0,0 +1,255 @@
+# app/events.py
+"""
+События для Mini App в реальном времени (GET /api/events, Server-Sent Events).
+
+Издатели ничего не знают о подключениях: они публикуют событие пользователя в шину
+(publish / publish_balances), а шина доставляет его во все воркеры, где у этого пользователя
+открыт поток. Бэкенд шины выбирается так же, как у app.shared_state:
+  - InMemoryEventBus — один процесс: событие сразу раздается локальным подписчикам;
+  - RedisEventBus    — несколько воркеров/инстансов (SHARED_STATE_URL=redis://...): PUBLISH в один
+    канал, каждый воркер слушает его одной подпиской и раздает своим подписчикам.
+
+Изменения балансов через ORM (игры, бонус, оплата) публикуются сами: обработчики after_flush /
+after_commit ниже запоминают новые балансы пользователей и отправляют их после коммита
+(откат — ничего не отправляется). Массовые SQL-записи (начисление ROI, админка) вызывают
+publish_balances() сами.
+
+Подписка хранит только последнее событие каждого типа (баланс — это состояние, промежуточные
+значения клиенту не нужны), поэтому память на подключение не растет, даже если клиент медленный.
+"""
+import asyncio
+from decimal import Decimal
+from typing import Optional
+
+import orjson
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from app.config import get_settings
+from app.metrics import events_published
+from app.responses import dumps
+
+BALANCE_EVENT = "balance"
+# Поля User, изменение которых — событие balance
+BALANCE_FIELDS = ("main_balance", "bonus_balance", "lucrum_balance")
+# Канал Redis, через который воркеры обмениваются событиями
+REDIS_CHANNEL = "lucrora:events"
+# Пауза перед переподключением слушателя Redis
+REDIS_RECONNECT_SECONDS = 1.0
+
+
+class Subscription:
+    """Поток одного подключения: последнее событие каждого типа и future, которую ждет поток."""
+
+    __slots__ = ("user_id", "pending", "waiter")
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.pending: dict[str, dict] = {}
+        self.waiter: Optional[asyncio.Future] = None
+
+    def push(self, event_type: str, data: dict):
+        self.pending[event_type] = data
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    def wake_future(self) -> asyncio.Future:
+        """Future, которая завершится при следующем push (или уже завершена, если события ждут)."""
+        self.waiter = asyncio.get_running_loop().create_future()
+        if self.pending:
+            self.waiter.set_result(None)
+        return self.waiter
+
+    def drain(self) -> dict[str, dict]:
+        pending, self.pending = self.pending, {}
+        return pending
+
+
+class EventHub:
+    """Подписчики этого процесса: user_id -> подписки (у пользователя может быть несколько вкладок)."""
+
+    def __init__(self):
+        self._subscribers: dict[int, set[Subscription]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(subs) for subs in self._subscribers.values())
+
+    def count(self, user_id: int) -> int:
+        return len(self._subscribers.get(user_id, ()))
+
+    def subscribe(self, user_id: int) -> Subscription:
+        subscription = Subscription(user_id)
+        self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subs = self._subscribers.get(subscription.user_id)
+        if subs is not None:
+            subs.discard(subscription)
+            if not subs:
+                del self._subscribers[subscription.user_id]
+
+    def dispatch(self, user_id: int, event_type: str, data: dict):
+        for subscription in self._subscribers.get(user_id, ()):
+            subscription.push(event_type, data)
+
+
+class InMemoryEventBus:
+    """Шина одного процесса."""
+
+    def __init__(self):
+        self.hub = EventHub()
+
+    def subscribe(self, user_id: int) -> Subscription:
+        return self.hub.subscribe(user_id)
+
+    def unsubscribe(self, subscription: Subscription):
+        self.hub.unsubscribe(subscription)
+
+    async def publish(self, user_id: int, event_type: str, data: dict):
+        self.hub.dispatch(user_id, event_type, data)
+
+    async def close(self):
+        pass
+
+
+class RedisEventBus:
+    """
+    Шина через Redis Pub/Sub. client — redis.asyncio.Redis. Подписка на канал одна на процесс и
+    создается при первом подписчике; события пользователей без подписчиков в этом воркере отбрасываются.
+    """
+
+    def __init__(self, client, channel: str = REDIS_CHANNEL):
+        self.client = client
+        self.channel = channel
+        self.hub = EventHub()
+        self._listener: Optional[asyncio.Task] = None
+
+    def subscribe(self, user_id: int) -> Subscription:
+        if self._listener is None:
+            self._listener = asyncio.get_running_loop().create_task(self._listen(), name="events-listener")
+        return self.hub.subscribe(user_id)
+
+    def unsubscribe(self, subscription: Subscription):
+        self.hub.unsubscribe(subscription)
+
+    async def publish(self, user_id: int, event_type: str, data: dict):
+        await self.client.publish(self.channel, dumps({"u": user_id, "t": event_type, "d": data}))
+
+    async def _listen(self):
+        while True:
+            pubsub = self.client.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    payload = orjson.loads(message["data"])
+                    self.hub.dispatch(payload["u"], payload["t"], payload["d"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Слушатель событий Redis: {e}; переподключаюсь...")
+                await asyncio.sleep(REDIS_RECONNECT_SECONDS)
+            finally:
+                await pubsub.aclose()
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+
+_bus = None
+
+
+def get_event_bus():
+    """Шина событий процесса. Бэкенд выбирается по SHARED_STATE_URL при первом обращении."""
+    global _bus
+    if _bus is None:
+        settings = get_settings()
+        if settings.shared_state_url:
+            import redis.asyncio as redis # Импортируем только если общий бэкенд действительно нужен
+            _bus = RedisEventBus(redis.from_url(settings.shared_state_url))
+        else:
+            _bus = InMemoryEventBus()
+    return _bus
+
+
+def set_event_bus(bus):
+    """Подменяет бэкенд (тесты, локальная заглушка)."""
+    global _bus
+    _bus = bus
+
+
+async def close_event_bus():
+    global _bus
+    if _bus is not None:
+        await _bus.close()
+        _bus = None
+
+
+# --- Публикация ---
+
+async def publish(user_id: int, event_type: str, data: dict):
+    events_published.inc(event_type)
+    await get_event_bus().publish(user_id, event_type, data)
+
+
+async def publish_balances(balances: dict[int, dict]):
+    """balances: user_id -> {main_balance, bonus_balance, lucrum_balance}. Ошибки шины не роняют вызывающего."""
+    try:
+        for user_id, data in balances.items():
+            await publish(user_id, BALANCE_EVENT, data)
+    except Exception as e:
+        print(f"❌ Не удалось опубликовать изменения балансов ({len(balances)} польз.): {e}")
+
+
+def balance_snapshot(user) -> dict:
+    return {field: getattr(user, field) or Decimal("0") for field in BALANCE_FIELDS}
+
+
+def balances_from_rows(rows) -> dict[int, dict]:
+    """Строки [id, main_balance, bonus_balance, lucrum_balance] (array_agg из массового UPDATE ... RETURNING)."""
+    return {
+        int(row[0]): {field: value or Decimal("0") for field, value in zip(BALANCE_FIELDS, row[1:])}
+        for row in rows or ()
+    }
+
+
+# Фоновые задачи публикации: держим ссылки, иначе незавершенную задачу может собрать GC
+_publish_tasks: set = set()
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_balance_changes(session, flush_context):
+    from app.models import User
+
+    for obj in session.dirty:
+        if isinstance(obj, User):
+            state = inspect(obj)
+            if any(state.attrs[field].history.has_changes() for field in BALANCE_FIELDS):
+                session.info.setdefault("balance_events", {})[obj.id] = balance_snapshot(obj)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_balance_changes(session):
+    balances = session.info.pop("balance_events", None)
+    if not balances:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError: # Синхронная сессия вне event loop — подписчиков в этом процессе нет
+        return
+    task = loop.create_task(publish_balances(balances))
+    _publish_tasks.add(task)
+    task.add_done_callback(_publish_tasks.discard)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_balance_changes(session, previous_transaction):
+    session.info.pop("balance_events", None)
@@ -0,0 +1,183 @@
+# app/factory.py
+import hmac
+import os
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
+from fastapi.middleware.cors import CORSMiddleware
+
+from app.compression import CompressionMiddleware
+from app.config import get_settings
+from app.database import run_migrations, check_schema_version, drop_db_tables, dispose_engine
+from app.events import close_event_bus
+from app.loop_lag import loop_lag_monitor
+from app.metrics import MetricsMiddleware, render_metrics
+from app.ratelimit import LoadSheddingMiddleware
+from app.responses import FastJSONResponse
+from app.scheduler import start_scheduler, stop_scheduler
+from app.broadcasts import start_broadcasts, stop_broadcasts
+from app.workers import start_worker, stop_worker, is_first_worker, mark_primary_ready, wait_for_primary
+
+
+def create_app() -> FastAPI:
+    """
+    Собирает FastAPI-приложение: middleware, роутеры, старт/остановка.
+    Движок БД и Telegram-бот здесь не создаются — только при первом обращении (см. app.database, app.bot).
+    """
+    settings = get_settings()
+
+    # Роутеры импортируются здесь, а не на уровне модуля: импорт app.factory остается легким
+    from app.routers import admin, auth, bootstrap, events, games, investments
+    from app import leaderboards, referrals, withdrawals
+    from app.transactions import router as transactions_router
+
+    # === Инициализация FastAPI ===
+    app = FastAPI(default_response_class=FastJSONResponse)
+
+    # Сжатие gzip/brotli — самым внутренним слоем: сжимаются только ответы приложения
+    if settings.compression_enabled:
+        app.add_middleware(CompressionMiddleware, minimum_size=settings.compression_min_size)
+
+    # Сброс нагрузки при большой задержке event loop.
+    # Добавляем до CORS, чтобы ответы 429 тоже получали CORS-заголовки.
+    app.add_middleware(LoadSheddingMiddleware)
+
+    # CORS для Mini App
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["https://lucrora.vercel.app", "https://lucrora-bot.onrender.com", "http://localhost:8000"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    # Метрики — самым внешним слоем, чтобы в латентность попадали и 429 от сброса нагрузки
+    app.add_middleware(MetricsMiddleware, fastapi_app=app)
+
+    # === Метрики в формате Prometheus ===
+    # Трафик по маршрутам, результаты задач и расхождения журнала — не для всех: с METRICS_TOKEN
+    # нужен заголовок Authorization: Bearer <токен> (bearer_token в scrape_config Prometheus)
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics(request: Request):
+        if settings.metrics_token and not hmac.compare_digest(
+            request.headers.get("authorization", "").encode(), f"Bearer {settings.metrics_token}".encode()
+        ):
+            return PlainTextResponse("Unauthorized", status_code=401, headers={"WWW-Authenticate": "Bearer"})
+        return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+    # === Эндпоинт для обработки вебхуков от Telegram ===
+    # Этот эндпоинт будет получать все обновления от Telegram
+    @app.post("/webhook")
+    async def telegram_webhook(request: Request):
+        from app.bot import feed_webhook_update
+
+        await feed_webhook_update(await request.json())
+        return {"ok": True}
+
+    # === Запуск бота и подключение к БД на старте FastAPI ===
+    @app.on_event("startup")
+    async def on_startup():
+        print("🚀 FastAPI стартовал.")
+        loop_lag_monitor.start()
+
+        # При нескольких воркерах одноразовые действия (схема БД, вебхук) выполняет только главный
+        if not start_worker():
+            print(f"Воркер {os.getpid()} запущен (не главный): схема БД и вебхук — на главном воркере.")
+            # Не принимаем запросы, пока главный воркер не подготовил БД
+            if not await wait_for_primary():
+                print("❗ Главный воркер не отметил готовность вовремя, начинаю принимать запросы.")
+            return
+        print(f"Воркер {os.getpid()} — главный.")
+        if settings.web_concurrency > 1 and not settings.shared_state_url:
+            print("❗ WEB_CONCURRENCY > 1, но SHARED_STATE_URL не задан: лимиты и кеши будут у каждого воркера свои.")
+
+        # Пересоздание и миграции — только первым воркером поколения, а не главным,
+        # перезапущенным посреди работы (иначе DROP_DB_ON_STARTUP снесет живую базу)
+        first = is_first_worker()
+        try:
+            started = time.monotonic()
+            if settings.drop_db_on_startup and first:
+                print("❗ Переменная DROP_DB_ON_STARTUP=True. Удаляю все таблицы...")
+                await drop_db_tables()
+                print("✅ Все таблицы успешно удалены.")
+
+            if (settings.schema_mode == "migrate" or settings.drop_db_on_startup) and first:
+                print("Применяю миграции базы данных...")
+                await run_migrations()
+                print("✅ Структура базы данных готова.")
+            elif settings.schema_mode != "skip":
+                version = await check_schema_version()
+                print(f"✅ Схема базы данных актуальна (версия {version}), проверка заняла {(time.monotonic() - started) * 1000:.0f} мс.")
+            else:
+                print("Проверка схемы базы данных пропущена (SCHEMA_MODE=skip).")
+        except Exception as e:
+            print(f"❌ Ошибка при инициализации базы данных: {e}")
+            raise
+
+        mark_primary_ready()
+
+        # Фоновые задачи: планировщик есть в главном воркере каждой реплики, выполняет их только лидер (advisory lock)
+        start_scheduler()
+        # Рассылки — так же: процесс есть в главном воркере каждой реплики, выполняет один (advisory lock)
+        start_broadcasts()
+
+        # --- Настройка вебхуков ---
+        if not settings.bot_token or not settings.base_webhook_url:
+            print("❌ Не указан BOT_TOKEN или BASE_WEBHOOK_URL. Вебхуки не будут настроены.")
+            # Возможно, здесь стоит выйти из приложения или выбросить исключение
+            return
+
+        from app.bot import set_webhook
+
+        webhook_url = f"{settings.base_webhook_url}/webhook"
+        print(f"Устанавливаю вебхук на: {webhook_url}")
+        try:
+            await set_webhook(webhook_url)
+            print("✅ Вебхук успешно установлен.")
+        except Exception as e:
+            print(f"❌ Ошибка при установке вебхука: {e}")
+            # Если вебхук не удалось установить, это критическая ошибка для бота
+            # Вы можете решить, стоит ли здесь остановить запуск приложения
+            raise
+
+        print("Aiogram вебхуки настроены и ожидают обновлений.")
+
+    # === Закрытие пула подключений к БД при завершении работы FastAPI ===
+    @app.on_event("shutdown")
+    async def on_shutdown():
+        print("FastAPI завершил работу.")
+        await loop_lag_monitor.stop()
+        await stop_scheduler()
+        await stop_broadcasts()
+        # Вебхук снимает только последний остановившийся воркер: перезапуск одного воркера его не трогает
+        is_last_worker = stop_worker()
+        if is_last_worker and settings.bot_token and settings.base_webhook_url:
+            from app.bot import delete_webhook
+
+            # При завершении работы рекомендуется удалить вебхук, чтобы избежать проблем.
+            print("Удаляю вебхук...")
+            try:
+                await delete_webhook()
+            except Exception as e:
+                print(f"❌ Ошибка при удалении вебхука: {e}")
+
+        from app.bot import close_bot
+
+        await close_bot() # Закрываем сессию бота при завершении работы (если он создавался)
+        await close_event_bus() # Подписка на события других воркеров (Redis)
+        await dispose_engine() # Соединения пула БД
+
+    # === Регистрация роутеров  ===
+    app.include_router(auth.router)
+    app.include_router(investments.router)
+    app.include_router(referrals.router)
+    app.include_router(leaderboards.router)
+    app.include_router(withdrawals.router)
+    app.include_router(transactions_router)
+    app.include_router(games.router)
+    app.include_router(admin.router)
+    app.include_router(events.router)
+    app.include_router(bootstrap.router)
+
+    return app
@@ -0,0 +1,380 @@
+# app/fraud.py
+"""
+Потоковый детектор мошенничества по событиям журнала: игры (/api/games/play) и ежедневный бонус.
+
+Детектор живет в памяти процесса и получает записи transactions сразу после коммита — обработчики
+after_flush / after_commit ниже, как у app.user_stats и app.leaderboards (откат — событий нет).
+На каждого активного пользователя и устройство — несколько скользящих окон фиксированного размера,
+поэтому память — O(1) на активный ключ, а ключи, по которым давно не было событий, вытесняются.
+
+Правила:
+  - spin_rate     — больше SPINS_PER_MINUTE_LIMIT ставок за минуту: игры ограничены на SPIN_THROTTLE_SECONDS;
+  - win_ratio     — доля выигрышей к ставкам за час заметно выше ожидаемой (EXPECTED_RTP): флаг;
+  - multi_account — больше MAX_ACCOUNTS_PER_DEVICE аккаунтов с одного устройства (IP + User-Agent)
+                    за сутки: флаг всем; при FRAUD_DEVICE_RULES=block ежедневный бонус с такого
+                    устройства больше не выдается;
+  - shared_ip     — больше MAX_ACCOUNTS_PER_IP аккаунтов с одного IP за сутки (лимит выше — NAT): флаг.
+
+Правила устройств опираются на request.client.host. За прокси это IP балансировщика, пока gunicorn/uvicorn
+не доверяет его X-Forwarded-For (FORWARDED_ALLOW_IPS), и тогда все пользователи — «одно устройство».
+Поэтому по умолчанию они выключены (FRAUD_DEVICE_RULES=off): flag — только флаги, block — флаги и отказ в бонусе.
+
+Флаги и ограничения пишутся в общее состояние (app.shared_state) с TTL, поэтому их видят все воркеры:
+зависимость fraud_guard() отвечает 429, пока ограничение действует, а флаг смотрит модератор
+(GET /api/admin/fraud/{user_id}) и при необходимости банит. Каждый воркер считает окна по тем
+запросам, которые обслуживает сам: Mini App держит keep-alive соединение, так что события одного
+пользователя обычно приходят в один воркер.
+"""
+import asyncio
+import hashlib
+import math
+import time
+from collections import OrderedDict, namedtuple
+from typing import Optional
+
+from fastapi import Depends, HTTPException, Request, status
+from sqlalchemy import event, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.config import get_settings
+from app.database import get_async_session
+from app.metrics import fraud_actions
+from app.ratelimit import telegram_user_id
+from app.shared_state import get_shared_state
+
+FRAUD_DETECTION_ENABLED = get_settings().fraud_detection_enabled
+# off / flag / block; любое другое значение — off
+DEVICE_RULES = get_settings().fraud_device_rules
+DEVICE_RULES_ENABLED = DEVICE_RULES in ("flag", "block")
+
+GAME_BET_TX_TYPE = "game_bet"
+GAME_WIN_TX_TYPE = "game_win"
+DAILY_BONUS_TX_TYPE = "daily_bonus"
+WATCHED_TX_TYPES = (GAME_BET_TX_TYPE, GAME_WIN_TX_TYPE, DAILY_BONUS_TX_TYPE)
+# Не запись журнала, а отказ fraud_guard: аккаунт все равно учитывается на устройстве и получает флаг
+BONUS_REFUSED_EVENT = "daily_bonus_refused"
+
+# Частота игр: rate_limit("games") режет всплески, а это — устойчивый темп, которого не держит человек
+SPINS_WINDOW_SECONDS = 60
+SPINS_PER_MINUTE_LIMIT = 40
+SPIN_THROTTLE_SECONDS = 120
+
+# Выигрыши к ставкам за час. Колесо фортуны: выигрыш с вероятностью 0.4, сумма — ставка x U(1.5, 5),
+# отсюда ожидаемая отдача 1.30 и стандартное отклонение отдачи одной игры ~1.72.
+# Флаг — если отдача выше ожидаемой больше чем на RTP_SIGMAS стандартных ошибок при RTP_MIN_SPINS+ играх.
+RTP_WINDOW_SECONDS = 3600
+EXPECTED_RTP = 1.30
+RTP_STDDEV = 1.72
+RTP_SIGMAS = 5
+RTP_MIN_SPINS = 100
+
+# Аккаунты на устройство и на IP
+DEVICE_WINDOW_SECONDS = 24 * 3600
+MAX_ACCOUNTS_PER_DEVICE = 3
+MAX_ACCOUNTS_PER_IP = 20
+BONUS_THROTTLE_SECONDS = 24 * 3600
+
+# Сколько хранится флаг для модератора
+FLAG_TTL_SECONDS = 7 * 24 * 3600
+# Предел ключей в памяти: самые давние вытесняются первыми
+MAX_TRACKED_USERS = 200_000
+MAX_TRACKED_DEVICES = 200_000
+
+# Ограничения по классам маршрутов fraud_guard()
+GAMES_SCOPE = "games"
+BONUS_SCOPE = "bonus"
+
+FLAG_KEY = "fraud:flag:"
+THROTTLE_KEY = "fraud:throttle:"
+
+# Решение детектора: action — flag или throttle; scope и ttl — для throttle (для flag scope = None)
+FraudAction = namedtuple("FraudAction", "user_id action reason scope ttl")
+
+
+class SlidingWindow:
+    """
+    Сумма за последние window секунд за O(1) памяти: текущее окно целиком плюс предыдущее
+    с весом той его доли, что еще попадает в скользящее окно.
+    """
+
+    __slots__ = ("window", "started", "current", "previous")
+
+    def __init__(self, window: float, now: float):
+        self.window = window
+        self.started = now
+        self.current = 0.0
+        self.previous = 0.0
+
+    def _roll(self, now: float):
+        periods = int((now - self.started) // self.window)
+        if periods > 0:
+            self.previous = self.current if periods == 1 else 0.0
+            self.current = 0.0
+            self.started += periods * self.window
+
+    def add(self, now: float, amount: float = 1.0):
+        self._roll(now)
+        self.current += amount
+
+    def total(self, now: float) -> float:
+        self._roll(now)
+        return self.current + self.previous * (1 - (now - self.started) / self.window)
+
+
+class UserWindows:
+    __slots__ = ("spins_minute", "spins", "bets", "wins", "last_seen", "throttled_until", "raised")
+
+    def __init__(self, now: float):
+        self.spins_minute = SlidingWindow(SPINS_WINDOW_SECONDS, now)
+        self.spins = SlidingWindow(RTP_WINDOW_SECONDS, now)
+        self.bets = SlidingWindow(RTP_WINDOW_SECONDS, now)
+        self.wins = SlidingWindow(RTP_WINDOW_SECONDS, now)
+        self.last_seen = now
+        self.throttled_until = 0.0
+        self.raised: tuple = () # Причины, о которых уже сообщили: флаг не повторяется на каждом событии
+
+
+class DeviceAccounts:
+    """Аккаунты устройства (или IP) за окно: не больше limit + 1 записей — для решения больше не нужно."""
+
+    __slots__ = ("accounts", "last_seen")
+
+    def __init__(self, now: float):
+        self.accounts: dict[int, float] = {} # user_id -> последнее событие, от давних к свежим
+        self.last_seen = now
+
+    def add(self, user_id: int, now: float, limit: int) -> int:
+        self.last_seen = now
+        self.accounts.pop(user_id, None)
+        self.accounts[user_id] = now
+        # Самый свежий — этот аккаунт, поэтому цикл не опустошит словарь
+        while len(self.accounts) > limit + 1 or next(iter(self.accounts.values())) <= now - DEVICE_WINDOW_SECONDS:
+            del self.accounts[next(iter(self.accounts))]
+        return len(self.accounts)
+
+
+def _touch(table: OrderedDict, key, factory, now: float, idle: float, max_keys: int):
+    """Запись ключа (создает при первом событии) и вытеснение давно молчащих ключей с начала очереди."""
+    entry = table.get(key)
+    if entry is None:
+        entry = table[key] = factory(now)
+    else:
+        table.move_to_end(key)
+    entry.last_seen = now
+    while table:
+        oldest = next(iter(table.values()))
+        if len(table) <= max_keys and oldest.last_seen > now - idle:
+            break
+        table.popitem(last=False)
+    return entry
+
+
+def device_key(ip: str, user_agent: str) -> str:
+    return hashlib.sha1(f"{ip}|{user_agent}".encode()).hexdigest()[:16]
+
+
+class FraudDetector:
+    """Скользящие окна по пользователям, устройствам и IP. observe() — O(1) на событие."""
+
+    def __init__(self, max_users: int = MAX_TRACKED_USERS, max_devices: int = MAX_TRACKED_DEVICES,
+                 block_shared_devices: bool = False):
+        self.max_users = max_users
+        self.max_devices = max_devices
+        self.block_shared_devices = block_shared_devices # multi_account ограничивает бонус, а не только флагует
+        self.users: "OrderedDict[int, UserWindows]" = OrderedDict()
+        self.devices: "OrderedDict[str, DeviceAccounts]" = OrderedDict()
+
+    def observe(self, user_id: int, tx_type: str, amount: float, device: Optional[tuple] = None,
+                now: Optional[float] = None) -> list:
+        """Учитывает запись журнала; device — (ip, user_agent) запроса. Возвращает новые FraudAction."""
+        now = time.monotonic() if now is None else now
+        actions = []
+        user = _touch(self.users, user_id, UserWindows, now, RTP_WINDOW_SECONDS, self.max_users)
+
+        if tx_type == GAME_BET_TX_TYPE:
+            user.spins_minute.add(now)
+            user.spins.add(now)
+            user.bets.add(now, abs(amount))
+            if user.spins_minute.total(now) > SPINS_PER_MINUTE_LIMIT and now >= user.throttled_until:
+                user.throttled_until = now + SPIN_THROTTLE_SECONDS
+                actions.append(FraudAction(user_id, "throttle", "spin_rate", GAMES_SCOPE, SPIN_THROTTLE_SECONDS))
+                self._flag(user, user_id, "spin_rate", actions)
+        elif tx_type == GAME_WIN_TX_TYPE:
+            user.wins.add(now, amount)
+            spins, bets = user.spins.total(now), user.bets.total(now)
+            if spins >= RTP_MIN_SPINS and bets > 0:
+                if user.wins.total(now) / bets > EXPECTED_RTP + RTP_SIGMAS * RTP_STDDEV / math.sqrt(spins):
+                    self._flag(user, user_id, "win_ratio", actions)
+
+        if device is not None:
+            ip, user_agent = device
+            shared_device = self._accounts(f"dev:{device_key(ip, user_agent)}", user_id, now, MAX_ACCOUNTS_PER_DEVICE)
+            if shared_device:
+                for other_id in shared_device:
+                    other = _touch(self.users, other_id, UserWindows, now, RTP_WINDOW_SECONDS, self.max_users)
+                    self._flag(other, other_id, "multi_account", actions)
+                if self.block_shared_devices and tx_type == DAILY_BONUS_TX_TYPE and "bonus_throttled" not in user.raised:
+                    user.raised += ("bonus_throttled",)
+                    actions.append(FraudAction(user_id, "throttle", "multi_account", BONUS_SCOPE, BONUS_THROTTLE_SECONDS))
+            shared_ip = self._accounts(f"ip:{ip}", user_id, now, MAX_ACCOUNTS_PER_IP)
+            for other_id in shared_ip:
+                other = _touch(self.users, other_id, UserWindows, now, RTP_WINDOW_SECONDS, self.max_users)
+                self._flag(other, other_id, "shared_ip", actions)
+        return actions
+
+    def _accounts(self, key: str, user_id: int, now: float, limit: int) -> list[int]:
+        """Учитывает аккаунт устройства; если аккаунтов больше limit — возвращает их все, иначе []."""
+        accounts = _touch(self.devices, key, DeviceAccounts, now, DEVICE_WINDOW_SECONDS, self.max_devices)
+        if accounts.add(user_id, now, limit) > limit:
+            return list(accounts.accounts)
+        return []
+
+    def crowded_device(self, ip: str, user_agent: str, user_id: int, now: Optional[float] = None) -> bool:
+        """На устройстве за окно уже MAX_ACCOUNTS_PER_DEVICE других аккаунтов — новый сюда не добавляется."""
+        now = time.monotonic() if now is None else now
+        entry = self.devices.get(f"dev:{device_key(ip, user_agent)}")
+        if entry is None:
+            return False
+        others = sum(1 for other_id, seen in entry.accounts.items()
+                     if other_id != user_id and seen > now - DEVICE_WINDOW_SECONDS)
+        return others >= MAX_ACCOUNTS_PER_DEVICE
+
+    @staticmethod
+    def _flag(user: UserWindows, user_id: int, reason: str, actions: list):
+        if reason not in user.raised:
+            user.raised += (reason,)
+            actions.append(FraudAction(user_id, "flag", reason, None, FLAG_TTL_SECONDS))
+
+
+_detector: Optional[FraudDetector] = None
+
+
+def get_detector() -> FraudDetector:
+    global _detector
+    if _detector is None:
+        _detector = FraudDetector(block_shared_devices=DEVICE_RULES == "block")
+    return _detector
+
+
+# --- Флаги и ограничения (общее состояние воркеров) ---
+
+async def apply_actions(actions: list):
+    """Записывает решения детектора в общее состояние. Ошибки не роняют вызывающего."""
+    state = get_shared_state()
+    for action in actions:
+        fraud_actions.inc(action.action, action.reason)
+        try:
+            if action.action == "throttle":
+                until = time.time() + action.ttl
+                await state.set(f"{THROTTLE_KEY}{action.scope}:{action.user_id}", f"{action.reason}:{until:.0f}", ttl=action.ttl)
+                print(f"⛔ Пользователь {action.user_id} ограничен ({action.scope}) на {action.ttl} с: {action.reason}")
+            else:
+                # Во флаге — все причины через запятую: новая не затирает прежние
+                reasons = (await state.get(f"{FLAG_KEY}{action.user_id}") or "").split(",")
+                if action.reason not in reasons:
+                    reasons = [reason for reason in reasons if reason] + [action.reason]
+                await state.set(f"{FLAG_KEY}{action.user_id}", ",".join(reasons), ttl=action.ttl)
+                print(f"🚩 Подозрительный пользователь {action.user_id}: {action.reason}")
+        except Exception as e:
+            print(f"❌ Не удалось сохранить решение детектора мошенничества {action}: {e}")
+
+
+async def user_status(user_id: int) -> dict:
+    """Флаг и действующие ограничения пользователя (для модератора)."""
+    state = get_shared_state()
+    throttles = {}
+    for scope in (GAMES_SCOPE, BONUS_SCOPE):
+        value = await state.get(f"{THROTTLE_KEY}{scope}:{user_id}")
+        if value:
+            reason, _, until = value.rpartition(":")
+            throttles[scope] = {"reason": reason, "retry_after": max(0, math.ceil(float(until) - time.time()))}
+    return {"user_id": user_id, "flag": await state.get(f"{FLAG_KEY}{user_id}"), "throttles": throttles}
+
+
+def fraud_guard(scope: str):
+    """
+    Зависимость FastAPI: 429, пока пользователь ограничен в scope; при включенных правилах устройств
+    запоминает устройство запроса (IP + User-Agent) в сессии — его получат события журнала этого запроса.
+    Использование: @router.post(..., dependencies=[Depends(fraud_guard("games"))])
+    """
+
+    async def dependency(request: Request, db: AsyncSession = Depends(get_async_session)):
+        if not FRAUD_DETECTION_ENABLED:
+            return
+        device = None
+        if DEVICE_RULES_ENABLED:
+            device = (request.client.host if request.client else "unknown", request.headers.get("user-agent", ""))
+            db.info["fraud_device"] = device
+        user_id = await telegram_user_id(request)
+        if user_id is None:
+            return # Без проверенного initData до обработчика дело не дойдет — он ответит 403
+        # Бонус с устройства, где уже хватает аккаунтов, не выдаем и первому разу нового аккаунта
+        if scope == BONUS_SCOPE and get_detector().block_shared_devices and get_detector().crowded_device(*device, user_id):
+            await apply_actions(get_detector().observe(user_id, BONUS_REFUSED_EVENT, 0.0, device))
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Действие временно ограничено из-за подозрительной активности. Попробуйте позже.",
+                headers={"Retry-After": str(BONUS_THROTTLE_SECONDS)},
+            )
+        try:
+            value = await get_shared_state().get(f"{THROTTLE_KEY}{scope}:{user_id}")
+        except Exception as e:
+            print(f"ВНИМАНИЕ: детектор мошенничества недоступен, запрос пропущен без проверки: {e}")
+            return
+        if value:
+            retry_after = max(1, math.ceil(float(value.rpartition(":")[2]) - time.time()))
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Действие временно ограничено из-за подозрительной активности. Попробуйте позже.",
+                headers={"Retry-After": str(retry_after)},
+            )
+
+    return dependency
+
+
+# --- События журнала ---
+
+# Фоновые задачи записи решений: держим ссылки, иначе незавершенную задачу может собрать GC
+_apply_tasks: set = set()
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_fraud_events(session, flush_context):
+    if not FRAUD_DETECTION_ENABLED:
+        return
+    from app.models import Transaction
+
+    for obj in session.new:
+        if isinstance(obj, Transaction):
+            # Читаем уже загруженные значения, не трогая атрибуты: ленивая загрузка в after_flush недоступна
+            values = inspect(obj).dict
+            if values.get("type") in WATCHED_TX_TYPES and (values.get("status") or "completed") == "completed":
+                session.info.setdefault("fraud_events", []).append(
+                    (values["user_id"], values["type"], float(values["amount"] or 0))
+                )
+
+
+@event.listens_for(Session, "after_commit")
+def _observe_fraud_events(session):
+    events = session.info.pop("fraud_events", None)
+    if not events:
+        return
+    detector, device = get_detector(), session.info.get("fraud_device")
+    actions = [action for user_id, tx_type, amount in events for action in detector.observe(user_id, tx_type, amount, device)]
+    if not actions:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError: # Синхронная сессия вне event loop — решения только в метриках и логе
+        for action in actions:
+            fraud_actions.inc(action.action, action.reason)
+        return
+    task = loop.create_task(apply_actions(actions))
+    _apply_tasks.add(task)
+    task.add_done_callback(_apply_tasks.discard)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_fraud_events(session, previous_transaction):
+    session.info.pop("fraud_events", None)
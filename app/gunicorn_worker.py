@@ -0,0 +1,20 @@
+# app/gunicorn_worker.py
+"""
+Класс воркера gunicorn (worker_class в gunicorn.conf.py): UvicornWorker с ограниченной мягкой остановкой.
+
+При остановке uvicorn ждет, пока договорят открытые ответы, и по умолчанию — без ограничения.
+Потоки GET /api/events сами не заканчиваются, поэтому gunicorn убивал бы воркер по graceful_timeout
+(SIGKILL), и shutdown приложения (DeleteWebhook, advisory lock планировщика, пул БД) не выполнялся бы.
+Здесь uvicorn ждет на SHUTDOWN_MARGIN_SECONDS меньше, затем отменяет оставшиеся запросы (потоки событий
+закрываются, клиенты переподключаются к другим воркерам) и успевает выполнить shutdown.
+"""
+from uvicorn_worker import UvicornWorker
+
+# Запас до graceful_timeout gunicorn на shutdown приложения
+SHUTDOWN_MARGIN_SECONDS = 5
+
+
+class Worker(UvicornWorker):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.config.timeout_graceful_shutdown = max(1, self.cfg.graceful_timeout - SHUTDOWN_MARGIN_SECONDS)
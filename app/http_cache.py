@@ -0,0 +1,135 @@
+# app/http_cache.py
+"""
+HTTP-кеширование GET-ответов: ETag, Cache-Control и условные запросы (If-None-Match -> 304).
+
+Каталог пакетов (/api/investment_packages) одинаков для всех пользователей. Воркер держит готовый
+ответ: строки, тело и ETag от содержимого. Копия сбрасывается, когда меняется версия каталога
+в app.shared_state. Версию увеличивает запись InvestmentPackage через ORM (обработчик after_commit
+ниже). На случай правок мимо ORM копия живет не дольше CATALOG_CACHE_SECONDS. Ответ публичный:
+его может держать CDN/edge (s-maxage).
+
+История пользователя (/api/transactions) меняется только вместе с журналом. ETag строится из
+отметки журнала — max(last_transaction_id) и числа транзакций в user_stats, одна строка по ключу —
+и параметров запроса. Совпал ETag — 304 без запроса истории и без сериализации.
+
+ETag слабые (W/"..."): тело может уйти сжатым, а сравнение If-None-Match по ним все равно работает.
+"""
+import asyncio
+import hashlib
+import time
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from starlette.responses import Response
+
+from app import queries
+from app.responses import dumps
+from app.shared_state import get_shared_state
+
+# Ключ версии каталога в app.shared_state
+CATALOG_VERSION_KEY = "catalog_version:investment_packages"
+# Сколько воркер держит каталог, не заглядывая в БД, даже если версия не менялась
+CATALOG_CACHE_SECONDS = 60
+# Браузер переспрашивает каталог раз в минуту, CDN — раз в 5 минут; устаревший ответ CDN может
+# отдавать еще 10 минут, пока в фоне проверяет новый
+CATALOG_CACHE_CONTROL = "public, max-age=60, s-maxage=300, stale-while-revalidate=600"
+# Личные данные: только в браузере и только после проверки ETag
+PRIVATE_CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts) -> str:
+    return 'W/"' + "-".join(str(part) for part in parts) + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Совпадает ли ETag с заголовком If-None-Match (список ETag через запятую или *; сравнение слабое)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in if_none_match.split(","))
+
+
+def not_modified(headers: dict) -> Response:
+    return Response(status_code=304, headers=headers)
+
+
+# --- Каталог инвестиционных пакетов ---
+
+class CatalogEntry:
+    __slots__ = ("version", "expires_at", "rows", "body", "etag")
+
+    def __init__(self, version: str, rows: list[dict]):
+        self.version = version
+        self.expires_at = time.monotonic() + CATALOG_CACHE_SECONDS
+        self.rows = rows
+        self.body = dumps(rows)
+        self.etag = make_etag("pk", hashlib.sha1(self.body).hexdigest()[:16])
+
+
+_catalog: Optional[CatalogEntry] = None
+
+
+async def catalog_version() -> str:
+    return await get_shared_state().get(CATALOG_VERSION_KEY) or "0"
+
+
+async def bump_catalog_version():
+    try:
+        await get_shared_state().incr(CATALOG_VERSION_KEY)
+    except Exception as e:
+        print(f"❌ Не удалось обновить версию каталога пакетов: {e}")
+
+
+async def active_packages_catalog(db) -> CatalogEntry:
+    """Каталог активных пакетов: копия воркера, если версия та же и срок не вышел, иначе запрос в БД."""
+    global _catalog
+    version = await catalog_version()
+    entry = _catalog
+    if entry is None or entry.version != version or entry.expires_at <= time.monotonic():
+        result = await db.execute(queries.active_packages())
+        entry = _catalog = CatalogEntry(version, [row._asdict() for row in result])
+    return entry
+
+
+# --- Журнал пользователя ---
+
+async def ledger_etag(db, user_id: int, *params) -> str:
+    """ETag истории пользователя: отметка журнала + параметры запроса (фильтры меняют тело)."""
+    last_transaction_id, tx_count = (await db.execute(queries.ledger_mark(user_id))).one()
+    params_hash = hashlib.sha1(repr(params).encode()).hexdigest()[:8]
+    return make_etag("tx", user_id, last_transaction_id or 0, tx_count or 0, params_hash)
+
+
+# --- Версия каталога: запись InvestmentPackage через ORM ---
+
+# Фоновые задачи обновления версии: держим ссылки, иначе незавершенную задачу может собрать GC
+_version_tasks: set = set()
+
+
+@event.listens_for(Session, "after_flush")
+def _detect_catalog_changes(session, flush_context):
+    from app.models import InvestmentPackage
+
+    if any(isinstance(obj, InvestmentPackage) for obj in (*session.new, *session.dirty, *session.deleted)):
+        session.info["catalog_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_catalog_version(session):
+    if not session.info.pop("catalog_changed", False):
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError: # Синхронная сессия вне event loop — копии каталога устареют по CATALOG_CACHE_SECONDS
+        return
+    task = loop.create_task(bump_catalog_version())
+    _version_tasks.add(task)
+    task.add_done_callback(_version_tasks.discard)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_catalog_changes(session, previous_transaction):
+    session.info.pop("catalog_changed", None)
@@ -0,0 +1,228 @@
+# app/jobs.py
+"""
+Периодические задачи планировщика (app/scheduler.py).
+
+Каждая задача идемпотентна и работает пачками по BATCH_SIZE строк, каждая пачка — своя транзакция:
+повторный или прерванный запуск (таймаут, смена лидера, деплой) ничего не удвоит и продолжит с места остановки.
+"""
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, update, delete, text
+
+from app.commissions import pay_pending_commissions
+from app.config import get_settings
+from app.database import get_engine, get_session_factory
+from app.events import balances_from_rows, publish_balances
+from app.leaderboards import rebuild_leaderboards
+from app.ledger import reconcile_ledger
+from app.models import User, UserAccountStatus, JobRun
+from app.partitions import ensure_partitions, archive_old_partitions
+from app.referrals import expire_pending_referrals
+from app.scheduler import Job
+from app.withdrawals import process_pending_withdrawals
+
+BATCH_SIZE = 1000
+# Пользователь без входа дольше этого срока помечается как inactive (при входе снова становится active)
+INACTIVE_AFTER_DAYS = 30
+# Сколько хранить историю запусков задач
+JOB_RUNS_RETENTION_DAYS = 90
+
+# Дата окончания инвестиции: end_date, а если не заполнена — start_date + срок пакета
+_INVESTMENT_END = (
+    "COALESCE(i.end_date, i.start_date + make_interval(days => p.duration_days))"
+)
+
+# Начисление ROI одним запросом на пачку: инвестиции -> балансы -> журнал транзакций -> user_stats.
+# Новые балансы возвращаются массивом и после коммита публикуются подписчикам (app/events.py).
+# last_accrual_date — до какой даты (UTC) ROI уже начислен; условие на старое значение в UPDATE
+# защищает от двойного начисления, если строку параллельно обработал кто-то еще.
+_ACCRUE_ROI_SQL = text(f"""
+WITH due AS (
+    SELECT i.id, i.user_id, i.last_accrual_date,
+           i.amount_invested * p.daily_roi_percentage / 100 AS daily_amount,
+           COALESCE(i.last_accrual_date, CAST(timezone('UTC', i.start_date) AS date)) AS accrued_until,
+           LEAST(CAST(:today AS date), CAST(timezone('UTC', {_INVESTMENT_END}) AS date)) AS accrue_until
+    FROM investments i
+    JOIN investment_packages p ON p.id = i.package_id
+    WHERE i.is_active
+      AND COALESCE(i.last_accrual_date, CAST(timezone('UTC', i.start_date) AS date))
+          < LEAST(CAST(:today AS date), CAST(timezone('UTC', {_INVESTMENT_END}) AS date))
+    ORDER BY i.id
+    LIMIT :batch_size
+),
+credited AS (
+    UPDATE investments i
+    SET current_earned = COALESCE(i.current_earned, 0) + round(due.daily_amount * (due.accrue_until - due.accrued_until), 2),
+        last_accrual_date = due.accrue_until
+    FROM due
+    WHERE i.id = due.id AND i.last_accrual_date IS NOT DISTINCT FROM due.last_accrual_date
+    RETURNING i.id, i.user_id, due.accrue_until,
+              round(due.daily_amount * (due.accrue_until - due.accrued_until), 2) AS amount
+),
+per_user AS (
+    SELECT user_id, sum(amount) AS amount FROM credited GROUP BY user_id
+),
+balances AS (
+    UPDATE users u
+    SET main_balance = COALESCE(u.main_balance, 0) + per_user.amount
+    FROM per_user
+    WHERE u.id = per_user.user_id
+    RETURNING u.id, u.main_balance, u.bonus_balance, u.lucrum_balance
+),
+ledger AS (
+    INSERT INTO transactions (user_id, type, amount, currency, status, description)
+    SELECT user_id, 'roi_accrual', amount, '₤s', 'completed',
+           'Начисление ROI по инвестиции #' || id || ' по ' || to_char(accrue_until, 'DD.MM.YYYY') || ': +' || amount || ' ₤s'
+    FROM credited
+    RETURNING id, user_id, amount, timestamp
+),
+stats AS (
+    INSERT INTO user_stats (user_id, type, tx_count, amount_sum, last_activity_at, last_transaction_id)
+    SELECT user_id, 'roi_accrual', count(*), sum(amount), max(timestamp), max(id)
+    FROM ledger
+    GROUP BY user_id
+    ORDER BY user_id
+    ON CONFLICT (user_id, type) DO UPDATE
+    SET tx_count = user_stats.tx_count + EXCLUDED.tx_count,
+        amount_sum = user_stats.amount_sum + EXCLUDED.amount_sum,
+        last_activity_at = GREATEST(user_stats.last_activity_at, EXCLUDED.last_activity_at),
+        last_transaction_id = GREATEST(user_stats.last_transaction_id, EXCLUDED.last_transaction_id)
+)
+SELECT count(*) AS investments, COALESCE(sum(amount), 0) AS total,
+       (SELECT array_agg(ARRAY[id, main_balance, bonus_balance, lucrum_balance]) FROM balances) AS balances
+FROM credited
+""")
+
+# Завершаем инвестиции, срок которых вышел и по которым ROI уже начислен полностью
+_EXPIRE_INVESTMENTS_SQL = text(f"""
+UPDATE investments
+SET is_active = false, end_date = expired.end_at
+FROM (
+    SELECT i.id, {_INVESTMENT_END} AS end_at
+    FROM investments i
+    JOIN investment_packages p ON p.id = i.package_id
+    WHERE i.is_active
+      AND {_INVESTMENT_END} <= :now
+      AND i.last_accrual_date >= CAST(timezone('UTC', {_INVESTMENT_END}) AS date)
+    ORDER BY i.id
+    LIMIT :batch_size
+) AS expired
+WHERE investments.id = expired.id
+""")
+
+
+async def accrue_roi() -> str:
+    """Ежедневное начисление ROI по активным инвестициям на основной баланс (транзакции 'roi_accrual')."""
+    today = datetime.now(timezone.utc).date()
+    investments, total = 0, 0
+    session_factory = get_session_factory()
+    while True:
+        async with session_factory() as db:
+            row = (await db.execute(_ACCRUE_ROI_SQL, {"today": today, "batch_size": BATCH_SIZE})).one()
+            await db.commit()
+        await publish_balances(balances_from_rows(row.balances))
+        investments += row.investments
+        total += row.total
+        if row.investments == 0:
+            break
+    return f"инвестиций: {investments}, начислено: {total} ₤s"
+
+
+async def expire_investments() -> str:
+    """Снимает флаг is_active с завершившихся инвестиций."""
+    expired = 0
+    session_factory = get_session_factory()
+    while True:
+        async with session_factory() as db:
+            result = await db.execute(_EXPIRE_INVESTMENTS_SQL, {"now": datetime.now(timezone.utc), "batch_size": BATCH_SIZE})
+            await db.commit()
+        expired += result.rowcount
+        if result.rowcount < BATCH_SIZE:
+            break
+    return f"завершено инвестиций: {expired}"
+
+
+async def mark_inactive_users() -> str:
+    """Помечает UserAccountStatus.inactive пользователей, которые давно не входили."""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=INACTIVE_AFTER_DAYS)
+    marked = 0
+    session_factory = get_session_factory()
+    while True:
+        async with session_factory() as db:
+            batch = (
+                select(User.id)
+                .where(User.status == UserAccountStatus.active, User.last_login_date < cutoff)
+                .order_by(User.id)
+                .limit(BATCH_SIZE)
+            )
+            result = await db.execute(
+                update(User).where(User.id.in_(batch)).values(status=UserAccountStatus.inactive)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+        marked += result.rowcount
+        if result.rowcount < BATCH_SIZE:
+            break
+    return f"помечено неактивными: {marked}"
+
+
+async def pay_referral_commissions() -> str:
+    """Реферальные комиссии по покупкам, которые не выплатил вебхук платежа (см. app/commissions.py)."""
+    return await pay_pending_commissions()
+
+
+async def reconcile_leaderboards() -> str:
+    """Пересобирает доски лидеров из БД: подбирает то, что прошло мимо приращений (см. app/leaderboards.py)."""
+    sizes = await rebuild_leaderboards()
+    return ", ".join(f"{board}: {size}" for board, size in sizes.items())
+
+
+async def process_withdrawals() -> str:
+    """Выплачивает заявки на вывод пачками через провайдера выплат (см. app/withdrawals.py)."""
+    return await process_pending_withdrawals()
+
+
+async def cleanup_job_runs() -> str:
+    """Удаляет старую историю запусков задач."""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=JOB_RUNS_RETENTION_DAYS)
+    async with get_session_factory()() as db:
+        result = await db.execute(delete(JobRun).where(JobRun.started_at < cutoff))
+        await db.commit()
+    return f"удалено запусков: {result.rowcount}"
+
+
+async def cleanup_pending_referrals() -> str:
+    """Удаляет просроченные ожидающие рефереры из pending_referrals (без SHARED_STATE_URL)."""
+    return f"удалено записей: {await expire_pending_referrals()}"
+
+
+async def maintain_transaction_partitions() -> str:
+    """Создает месячные секции transactions наперед и архивирует старые (если включено)."""
+    settings = get_settings()
+    engine = get_engine()
+    created = await ensure_partitions(engine)
+    archived = await archive_old_partitions(
+        engine, settings.transactions_archive_after_months,
+        settings.transactions_archive_dir, settings.transactions_archive_format,
+    )
+    return f"создано секций: {len(created)}, архивировано: {len(archived)}"
+
+
+# Время — UTC. Тяжелые задачи стоят на 00:00–04:00 UTC (03:00–07:00 МСК), когда трафик минимальный.
+JOBS = [
+    Job("accrue_roi", "5 0 * * *", accrue_roi, timeout=1800, jitter=300),
+    # Через 40 минут после начисления: завершаем только то, по чему ROI уже начислен полностью
+    Job("expire_investments", "45 0 * * *", expire_investments, timeout=600, jitter=120),
+    # Вебхук платит комиссии сразу; задача подбирает сбои и покупки, сделанные до появления комиссий
+    Job("pay_referral_commissions", "*/15 * * * *", pay_referral_commissions, timeout=1800, jitter=60),
+    # Доски обновляются приращениями; сверка исправляет массовые SQL-записи и расхождения
+    Job("reconcile_leaderboards", "*/10 * * * *", reconcile_leaderboards, timeout=600, jitter=60),
+    Job("process_withdrawals", "*/5 * * * *", process_withdrawals, timeout=1200, jitter=30),
+    Job("mark_inactive_users", "30 2 * * *", mark_inactive_users, timeout=600, jitter=600),
+    Job("cleanup_job_runs", "0 4 * * 0", cleanup_job_runs, timeout=300, jitter=600),
+    Job("cleanup_pending_referrals", "20 4 * * *", cleanup_pending_referrals, timeout=300, jitter=600),
+    # Секции создаются на 3 месяца вперед, так что ежедневный запуск с большим запасом
+    Job("maintain_transaction_partitions", "15 3 * * *", maintain_transaction_partitions, timeout=3600, jitter=300),
+    # Только чтение, порциями; расхождения видны в отчете запуска и в метрике ledger_mismatched_users
+    Job("reconcile_ledger", "45 3 * * *", reconcile_ledger, timeout=3600, jitter=300),
+]
@@ -0,0 +1,423 @@
+# app/leaderboards.py
+"""
+Доски лидеров (GET /api/leaderboards/{board}):
+  - referrers — больше всего приглашенных напрямую (строки referrals);
+  - winners   — больше всего выиграно в играх (сумма транзакций 'game_win', user_stats);
+  - investors — больше всего вложено (users.total_invested).
+
+Чтение не ходит в БД: доски — отсортированные структуры, топ и «мое место» — O(log n).
+Бэкенд выбирается так же, как у app.shared_state:
+  - InMemoryLeaderboards — один процесс: SortedList пар (-очки, user_id) на доску;
+  - RedisLeaderboards    — несколько воркеров/инстансов (SHARED_STATE_URL=redis://...): ZSET на доску.
+
+Доски обновляются по приращениям из тех же путей записи, что и журнал: обработчики after_flush /
+after_commit ниже собирают новые выигрыши, рефералов и total_invested и применяют их после коммита
+(откат — ничего не применяется). Массовые SQL-записи (бан из админки и т.п.) досок не трогают — их
+подбирает сверка: задача reconcile_leaderboards пересобирает доски из SQL, а доска, которую давно
+не сверяли (свежий процесс, воркер без общего бэкенда), пересобирается при первом чтении.
+
+Ручная сверка: python -m app.leaderboards reconcile
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import defaultdict
+from decimal import Decimal
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query, status
+from sortedcontainers import SortedList
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import Session
+
+from app.config import get_settings
+from app.responses import fast_json
+from app.utils import check_webapp_signature, parse_qsl
+
+BOT_TOKEN = get_settings().bot_token
+
+# Сколько мест доски отдает API (и для скольких заранее загружаются имена)
+LEADERBOARD_TOP = 100
+LEADERBOARD_DEFAULT_LIMIT = 10
+# Доску, которую не сверяли дольше этого, пересобирает первое чтение (задача сверяет чаще)
+LEADERBOARD_MAX_AGE_SECONDS = 30 * 60
+# Сколько помнить отображаемое имя пользователя из топа
+NAME_CACHE_SECONDS = 10 * 60
+NAME_CACHE_SIZE = 10_000
+# Ключи Redis
+REDIS_PREFIX = "lucrora:leaderboard:"
+# Сколько элементов в одном ZADD при пересборке доски в Redis
+REDIS_CHUNK_SIZE = 5000
+
+WINS_TX_TYPE = "game_win"
+
+# Очки каждой доски целиком из SQL. Заблокированные пользователи на доски не попадают.
+_RECONCILE_SQL = {
+    "referrers": text("""
+        SELECT r.referrer_id, count(*) FROM referrals r
+        JOIN users u ON u.id = r.referrer_id
+        WHERE u.status <> 'banned'
+        GROUP BY r.referrer_id
+    """),
+    "winners": text("""
+        SELECT s.user_id, s.amount_sum FROM user_stats s
+        JOIN users u ON u.id = s.user_id
+        WHERE s.type = :wins_tx_type AND s.amount_sum > 0 AND u.status <> 'banned'
+    """),
+    "investors": text("""
+        SELECT id, total_invested FROM users
+        WHERE total_invested > 0 AND status <> 'banned'
+    """),
+}
+BOARDS = tuple(_RECONCILE_SQL)
+
+_NAMES_SQL = text("SELECT id, COALESCE(NULLIF(first_name, ''), username) FROM users WHERE id = ANY(CAST(:ids AS BIGINT[]))")
+
+router = APIRouter(prefix="/api", tags=["leaderboards"])
+
+
+class Leaderboard:
+    """
+    Одна доска в памяти: user_id -> очки и SortedList пар (-очки, user_id) — по убыванию очков.
+    Место — как в спортивных таблицах: равные очки делят место, следующее пропускается (1, 2, 2, 4).
+    """
+
+    def __init__(self, rows=()):
+        self.scores: dict[int, Decimal] = dict(rows)
+        self.ranking = SortedList((-score, user_id) for user_id, score in self.scores.items())
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    def set(self, user_id: int, score):
+        self.remove(user_id)
+        if score > 0:
+            self.scores[user_id] = score
+            self.ranking.add((-score, user_id))
+
+    def incr(self, user_id: int, amount):
+        self.set(user_id, self.scores.get(user_id, 0) + amount)
+
+    def remove(self, user_id: int):
+        score = self.scores.pop(user_id, None)
+        if score is not None:
+            self.ranking.remove((-score, user_id))
+
+    def top(self, limit: int) -> list[tuple[int, Decimal]]:
+        return [(user_id, -negated) for negated, user_id in self.ranking.islice(0, limit)]
+
+    def rank(self, user_id: int) -> Optional[tuple[int, Decimal]]:
+        """(место с 1, очки) или None, если пользователя на доске нет."""
+        score = self.scores.get(user_id)
+        if score is None:
+            return None
+        # (-score,) меньше любой пары (-score, user_id): слева от нее — только те, у кого очков больше
+        return self.ranking.bisect_left((-score,)) + 1, score
+
+
+class InMemoryLeaderboards:
+    """Доски процесса."""
+
+    def __init__(self):
+        self.boards = {name: Leaderboard() for name in BOARDS}
+        self.fresh_until: dict[str, float] = {}
+
+    async def incr(self, board: str, user_id: int, amount):
+        self.boards[board].incr(user_id, amount)
+
+    async def set(self, board: str, user_id: int, score):
+        self.boards[board].set(user_id, score)
+
+    async def remove(self, user_id: int):
+        for leaderboard in self.boards.values():
+            leaderboard.remove(user_id)
+
+    async def top(self, board: str, limit: int) -> list[tuple[int, Decimal]]:
+        return self.boards[board].top(limit)
+
+    async def rank(self, board: str, user_id: int) -> Optional[tuple[int, Decimal]]:
+        return self.boards[board].rank(user_id)
+
+    async def size(self, board: str) -> int:
+        return len(self.boards[board])
+
+    async def replace(self, board: str, rows: list, max_age: float):
+        self.boards[board] = Leaderboard(rows)
+        self.fresh_until[board] = time.monotonic() + max_age
+
+    async def is_fresh(self, board: str) -> bool:
+        return self.fresh_until.get(board, 0) > time.monotonic()
+
+
+class RedisLeaderboards:
+    """
+    Доски в Redis: ZSET user_id -> очки. client — redis.asyncio.Redis. Очки в ZSET — float, поэтому
+    суммы округляются до копеек при чтении. Пересборка пишет во временный ключ и заменяет доску RENAME.
+    """
+
+    def __init__(self, client, prefix: str = REDIS_PREFIX):
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, board: str) -> str:
+        return self.prefix + board
+
+    @staticmethod
+    def _score(value) -> Decimal:
+        return Decimal(str(round(float(value), 2)))
+
+    async def incr(self, board: str, user_id: int, amount):
+        await self.client.zincrby(self._key(board), float(amount), user_id)
+
+    async def set(self, board: str, user_id: int, score):
+        if score > 0:
+            await self.client.zadd(self._key(board), {user_id: float(score)})
+        else:
+            await self.client.zrem(self._key(board), user_id)
+
+    async def remove(self, user_id: int):
+        async with self.client.pipeline(transaction=False) as pipe:
+            for board in BOARDS:
+                pipe.zrem(self._key(board), user_id)
+            await pipe.execute()
+
+    async def top(self, board: str, limit: int) -> list[tuple[int, Decimal]]:
+        rows = await self.client.zrevrange(self._key(board), 0, limit - 1, withscores=True)
+        return [(int(member), self._score(score)) for member, score in rows]
+
+    async def rank(self, board: str, user_id: int) -> Optional[tuple[int, Decimal]]:
+        score = await self.client.zscore(self._key(board), user_id)
+        if score is None:
+            return None
+        # Место — как у InMemoryLeaderboards: 1 + сколько участников с очками строго больше
+        return await self.client.zcount(self._key(board), f"({score!r}", "+inf") + 1, self._score(score)
+
+    async def size(self, board: str) -> int:
+        return await self.client.zcard(self._key(board))
+
+    async def replace(self, board: str, rows: list, max_age: float):
+        key, tmp_key = self._key(board), self._key(board) + ":rebuild"
+        await self.client.delete(tmp_key)
+        for start in range(0, len(rows), REDIS_CHUNK_SIZE):
+            chunk = rows[start:start + REDIS_CHUNK_SIZE]
+            await self.client.zadd(tmp_key, {user_id: float(score) for user_id, score in chunk})
+        async with self.client.pipeline(transaction=True) as pipe:
+            if rows:
+                pipe.rename(tmp_key, key)
+            else:
+                pipe.delete(key)
+            pipe.set(key + ":fresh", "1", px=int(max_age * 1000))
+            await pipe.execute()
+
+    async def is_fresh(self, board: str) -> bool:
+        return bool(await self.client.exists(self._key(board) + ":fresh"))
+
+
+_leaderboards = None
+_reconcile_lock: Optional[asyncio.Lock] = None
+
+
+def get_leaderboards():
+    """Доски процесса. Бэкенд выбирается по SHARED_STATE_URL при первом обращении."""
+    global _leaderboards
+    if _leaderboards is None:
+        settings = get_settings()
+        if settings.shared_state_url:
+            import redis.asyncio as redis # Импортируем только если общий бэкенд действительно нужен
+            _leaderboards = RedisLeaderboards(redis.from_url(settings.shared_state_url))
+        else:
+            _leaderboards = InMemoryLeaderboards()
+    return _leaderboards
+
+
+def set_leaderboards(leaderboards):
+    """Подменяет бэкенд (тесты, локальная заглушка)."""
+    global _leaderboards
+    _leaderboards = leaderboards
+
+
+# --- Сверка с БД ---
+
+async def rebuild_leaderboards(boards=BOARDS, max_age: float = LEADERBOARD_MAX_AGE_SECONDS) -> dict[str, int]:
+    """Пересобирает доски из SQL и обновляет имена их топа. Возвращает {доска: участников}."""
+    from app.database import get_session_factory
+
+    leaderboards = get_leaderboards()
+    sizes = {}
+    async with get_session_factory()() as db:
+        for board in boards:
+            rows = (await db.execute(_RECONCILE_SQL[board], {"wins_tx_type": WINS_TX_TYPE})).all()
+            await leaderboards.replace(board, [tuple(row) for row in rows], max_age)
+            sizes[board] = len(rows)
+            top_ids = [user_id for user_id, _ in await leaderboards.top(board, LEADERBOARD_TOP)]
+            await _load_names(db, top_ids)
+    return sizes
+
+
+async def ensure_fresh(board: str):
+    """Пересобирает доску, если ее давно не сверяли. Параллельные чтения процесса ждут одну пересборку."""
+    global _reconcile_lock
+    leaderboards = get_leaderboards()
+    if await leaderboards.is_fresh(board):
+        return
+    if _reconcile_lock is None:
+        _reconcile_lock = asyncio.Lock()
+    async with _reconcile_lock:
+        if not await leaderboards.is_fresh(board):
+            await rebuild_leaderboards((board,))
+
+
+# --- Имена для топа ---
+# Имена меняются редко, а нужны только для первых мест: держим их в памяти процесса с TTL.
+
+_names: dict[int, tuple[str, float]] = {}
+
+
+async def _load_names(db, user_ids: list[int]):
+    if not user_ids:
+        return
+    if len(_names) + len(user_ids) > NAME_CACHE_SIZE:
+        _names.clear()
+    expires_at = time.monotonic() + NAME_CACHE_SECONDS
+    for user_id, name in (await db.execute(_NAMES_SQL, {"ids": user_ids})).all():
+        _names[user_id] = (name, expires_at)
+
+
+async def display_names(user_ids: list[int]) -> dict[int, Optional[str]]:
+    """Имена пользователей топа. В БД идем только за теми, кого нет в кеше (или чье имя устарело)."""
+    now = time.monotonic()
+    missing = [user_id for user_id in user_ids if _names.get(user_id, (None, 0))[1] <= now]
+    if missing:
+        from app.database import get_session_factory
+
+        async with get_session_factory()() as db:
+            await _load_names(db, missing)
+    return {user_id: _names.get(user_id, (None, 0))[0] for user_id in user_ids}
+
+
+# --- Приращения из путей записи ---
+
+async def apply_changes(changes: dict):
+    """changes — из обработчика after_flush: incr/set по доскам и removed. Ошибки не роняют вызывающего."""
+    try:
+        leaderboards = get_leaderboards()
+        for board, deltas in changes.get("incr", {}).items():
+            for user_id, amount in deltas.items():
+                await leaderboards.incr(board, user_id, amount)
+        for board, scores in changes.get("set", {}).items():
+            for user_id, score in scores.items():
+                await leaderboards.set(board, user_id, score)
+        for user_id in changes.get("removed", ()):
+            await leaderboards.remove(user_id)
+    except Exception as e:
+        print(f"❌ Не удалось обновить доски лидеров: {e}")
+
+
+# Фоновые задачи обновления: держим ссылки, иначе незавершенную задачу может собрать GC
+_apply_tasks: set = set()
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_leaderboard_changes(session, flush_context):
+    from app.models import Referral, Transaction, User, UserAccountStatus
+
+    def changes() -> dict:
+        return session.info.setdefault("leaderboard_changes", {})
+
+    for obj in session.new:
+        if isinstance(obj, Transaction):
+            # Читаем уже загруженные значения, не трогая атрибуты: ленивая загрузка в after_flush недоступна
+            values = inspect(obj).dict
+            if values.get("type") == WINS_TX_TYPE and (values.get("status") or "completed") == "completed":
+                wins = changes().setdefault("incr", {}).setdefault("winners", defaultdict(Decimal))
+                wins[values["user_id"]] += Decimal(str(values["amount"]))
+        elif isinstance(obj, Referral):
+            changes().setdefault("incr", {}).setdefault("referrers", defaultdict(int))[obj.referrer_id] += 1
+    for obj in session.dirty:
+        if not isinstance(obj, User):
+            continue
+        state = inspect(obj)
+        if state.attrs.total_invested.history.has_changes():
+            changes().setdefault("set", {}).setdefault("investors", {})[obj.id] = obj.total_invested or Decimal("0")
+        if state.attrs.status.history.has_changes() and obj.status == UserAccountStatus.banned:
+            changes().setdefault("removed", set()).add(obj.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_leaderboard_changes(session):
+    changes = session.info.pop("leaderboard_changes", None)
+    if not changes:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError: # Синхронная сессия вне event loop — досок этого процесса не трогаем, их догонит сверка
+        return
+    task = loop.create_task(apply_changes(changes))
+    _apply_tasks.add(task)
+    task.add_done_callback(_apply_tasks.discard)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_leaderboard_changes(session, previous_transaction):
+    session.info.pop("leaderboard_changes", None)
+
+
+# --- API ---
+
+@router.get("/leaderboards/{board}")
+async def get_leaderboard(
+    board: str,
+    telegram_init_data: str = Query(..., alias="initData"),
+    limit: int = Query(LEADERBOARD_DEFAULT_LIMIT, ge=1, le=LEADERBOARD_TOP),
+):
+    """Топ доски и место текущего пользователя (me = null, если его на доске нет)."""
+    if board not in BOARDS:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Неизвестная доска: {board}")
+    if not check_webapp_signature(telegram_init_data, BOT_TOKEN):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Неверная подпись Telegram initData.")
+    user_data_str = dict(parse_qsl(telegram_init_data)).get('user')
+    try:
+        user_id = int(json.loads(user_data_str)["id"])
+    except (TypeError, ValueError, KeyError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Неверные данные пользователя в initData.")
+
+    await ensure_fresh(board)
+    leaderboards = get_leaderboards()
+    top = await leaderboards.top(board, limit)
+    names = await display_names([entry_id for entry_id, _ in top])
+    me = await leaderboards.rank(board, user_id)
+    # Места топа с тем же правилом, что и rank(): равные очки — одно место
+    places, place = [], 0
+    for index, (_, score) in enumerate(top):
+        if index == 0 or score != top[index - 1][1]:
+            place = index + 1
+        places.append(place)
+    return fast_json({
+        "board": board,
+        "total": await leaderboards.size(board),
+        "top": [
+            {"rank": place, "name": names[entry_id], "score": score, "is_me": entry_id == user_id}
+            for place, (entry_id, score) in zip(places, top)
+        ],
+        "me": None if me is None else {"rank": me[0], "score": me[1]},
+    })
+
+
+async def _main(args) -> int:
+    from app.database import dispose_engine
+
+    try:
+        sizes = await rebuild_leaderboards(args.board or BOARDS)
+        print("✅ Доски лидеров сверены: " + ", ".join(f"{board}: {size}" for board, size in sizes.items()))
+        return 0
+    finally:
+        await dispose_engine()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m app.leaderboards", description="Доски лидеров")
+    sub = parser.add_subparsers(dest="command", required=True)
+    reconcile_parser = sub.add_parser("reconcile", help="Пересобрать доски из БД (нужен общий бэкенд SHARED_STATE_URL)")
+    reconcile_parser.add_argument("--board", action="append", choices=BOARDS, help="какую доску (по умолчанию все)")
+    raise SystemExit(asyncio.run(_main(parser.parse_args())))
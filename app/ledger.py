@@ -0,0 +1,191 @@
+# app/ledger.py
+"""
+Сверка балансов с журналом транзакций.
+
+Баланс пользователя должен равняться сумме его завершенных (status = 'completed') транзакций
+тех типов, что меняют этот баланс:
+    main_balance  — MAIN_BALANCE_TX_TYPES;
+    bonus_balance — BONUS_BALANCE_TX_TYPES.
+Покупка пакета за Stars ('investment_purchase_stars') балансы не меняет и в сверку не входит.
+Транзакции архивированных секций (app/partitions.py) из БД удалены: их суммы по пользователю
+archive_partition переносит в ledger_opening_sums, и сверка прибавляет их к сумме журнала.
+
+Пользователи проверяются порциями по CHUNK_SIZE (по возрастанию id, keyset): одна порция — один SQL,
+который суммирует транзакции порции по индексу (user_id, timestamp) и возвращает только расхождения.
+Порции не держат блокировок и не мешают рабочим запросам. Запись, попавшая в журнал между чтением
+баланса и чтением транзакций, может дать ложное расхождение — такие пользователи перепроверяются
+в конце отдельными запросами теми же порциями.
+
+Расхождения печатаются, их число уходит в метрику ledger_mismatched_users. Ничего не исправляется:
+причину расхождения разбирает человек.
+
+Ручной запуск: python -m app.ledger reconcile [--chunk-size 5000] [--show 20]
+"""
+import argparse
+import asyncio
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal
+
+from sqlalchemy import text
+
+from app.database import get_session_factory
+from app.metrics import ledger_mismatched_users
+
+MAIN_BALANCE_TX_TYPES = ("roi_accrual", "withdrawal", "withdrawal_refund")
+BONUS_BALANCE_TX_TYPES = ("game_bet", "game_win", "game_loss", "daily_bonus", "referral_commission", "admin_bonus")
+
+CHUNK_SIZE = 5000
+# Сколько расхождений показывать в отчете задачи
+REPORT_LIMIT = 20
+
+# {transactions} — условие на t.user_id: по нему транзакции порции читаются по индексу (user_id, timestamp)
+# каждой секции. Соединение с chunk вместо него планировщик превращает в полный просмотр журнала.
+_SUMS = """
+sums AS (
+    SELECT t.user_id,
+           sum(t.amount) FILTER (WHERE t.type = ANY(CAST(:main_types AS TEXT[]))) AS main_sum,
+           sum(t.amount) FILTER (WHERE t.type = ANY(CAST(:bonus_types AS TEXT[]))) AS bonus_sum
+    FROM transactions t
+    WHERE {transactions} AND t.status = 'completed'
+    GROUP BY t.user_id
+),
+totals AS (
+    SELECT chunk.id, chunk.main_balance,
+           COALESCE(sums.main_sum, 0) + COALESCE(opening.main_sum, 0) AS main_sum,
+           chunk.bonus_balance,
+           COALESCE(sums.bonus_sum, 0) + COALESCE(opening.bonus_sum, 0) AS bonus_sum
+    FROM chunk
+    LEFT JOIN sums ON sums.user_id = chunk.id
+    LEFT JOIN ledger_opening_sums opening ON opening.user_id = chunk.id
+),
+mismatched AS (
+    SELECT * FROM totals WHERE main_balance <> main_sum OR bonus_balance <> bonus_sum
+)
+"""
+
+# Суммы секции перед ее удалением: вызывается в транзакции, которая отсоединяет секцию, поэтому
+# повтор архивации после сбоя не учтет секцию дважды
+_RECORD_OPENING_SQL = """
+INSERT INTO ledger_opening_sums (user_id, main_sum, bonus_sum, archived_through)
+SELECT user_id,
+       COALESCE(sum(amount) FILTER (WHERE type = ANY(CAST(:main_types AS TEXT[]))), 0),
+       COALESCE(sum(amount) FILTER (WHERE type = ANY(CAST(:bonus_types AS TEXT[]))), 0),
+       :month
+FROM "{table}"
+WHERE status = 'completed'
+GROUP BY user_id
+ON CONFLICT (user_id) DO UPDATE
+SET main_sum = ledger_opening_sums.main_sum + EXCLUDED.main_sum,
+    bonus_sum = ledger_opening_sums.bonus_sum + EXCLUDED.bonus_sum,
+    archived_through = GREATEST(ledger_opening_sums.archived_through, EXCLUDED.archived_through)
+"""
+
+_RECONCILE_CHUNK_SQL = text("""
+WITH chunk AS (
+    SELECT id, COALESCE(main_balance, 0) AS main_balance, COALESCE(bonus_balance, 0) AS bonus_balance
+    FROM users
+    WHERE id > :after_id
+    ORDER BY id
+    LIMIT :chunk_size
+),
+{sums}
+SELECT (SELECT count(*) FROM chunk) AS users, (SELECT max(id) FROM chunk) AS last_id,
+       (SELECT array_agg(ARRAY[id, main_balance, main_sum, bonus_balance, bonus_sum] ORDER BY id) FROM mismatched) AS mismatched
+""".format(sums=_SUMS.format(transactions="t.user_id > :after_id AND t.user_id <= (SELECT max(id) FROM chunk)")))
+
+_RECHECK_SQL = text("""
+WITH chunk AS (
+    SELECT id, COALESCE(main_balance, 0) AS main_balance, COALESCE(bonus_balance, 0) AS bonus_balance
+    FROM users
+    WHERE id = ANY(CAST(:ids AS BIGINT[]))
+),
+{sums}
+SELECT (SELECT array_agg(ARRAY[id, main_balance, main_sum, bonus_balance, bonus_sum] ORDER BY id) FROM mismatched) AS mismatched
+""".format(sums=_SUMS.format(transactions="t.user_id = ANY(CAST(:ids AS BIGINT[]))")))
+
+
+@dataclass(frozen=True)
+class Mismatch:
+    user_id: int
+    main_balance: Decimal
+    main_sum: Decimal
+    bonus_balance: Decimal
+    bonus_sum: Decimal
+
+    def __str__(self):
+        parts = []
+        if self.main_balance != self.main_sum:
+            parts.append(f"main_balance {self.main_balance} ≠ {self.main_sum}")
+        if self.bonus_balance != self.bonus_sum:
+            parts.append(f"bonus_balance {self.bonus_balance} ≠ {self.bonus_sum}")
+        return f"пользователь {self.user_id}: " + ", ".join(parts)
+
+
+def _mismatches(rows) -> list[Mismatch]:
+    return [Mismatch(int(row[0]), *row[1:]) for row in rows or ()]
+
+
+def _type_params() -> dict:
+    return {"main_types": list(MAIN_BALANCE_TX_TYPES), "bonus_types": list(BONUS_BALANCE_TX_TYPES)}
+
+
+async def record_opening_sums(conn, table: str, month: date) -> int:
+    """Прибавляет суммы секции table к ledger_opening_sums (в транзакции conn). Возвращает число пользователей."""
+    result = await conn.execute(text(_RECORD_OPENING_SQL.format(table=table)), {**_type_params(), "month": month})
+    return result.rowcount
+
+
+async def reconcile_balances(chunk_size: int = CHUNK_SIZE) -> tuple[int, list[Mismatch]]:
+    """Сверяет балансы всех пользователей с журналом. Возвращает (проверено пользователей, расхождения)."""
+    checked, suspects, after_id = 0, [], 0
+    session_factory = get_session_factory()
+    while True:
+        async with session_factory() as db:
+            row = (await db.execute(_RECONCILE_CHUNK_SQL, {**_type_params(), "after_id": after_id, "chunk_size": chunk_size})).one()
+        checked += row.users
+        suspects.extend(_mismatches(row.mismatched))
+        if row.users < chunk_size:
+            break
+        after_id = row.last_id
+
+    mismatches = []
+    for start in range(0, len(suspects), chunk_size):
+        ids = [m.user_id for m in suspects[start:start + chunk_size]]
+        async with session_factory() as db:
+            row = (await db.execute(_RECHECK_SQL, {**_type_params(), "ids": ids})).one()
+        mismatches.extend(_mismatches(row.mismatched))
+    ledger_mismatched_users.set(len(mismatches))
+    return checked, mismatches
+
+
+async def reconcile_ledger(report_limit: int = REPORT_LIMIT) -> str:
+    """Задача планировщика: сверка и отчет с первыми report_limit расхождениями."""
+    checked, mismatches = await reconcile_balances()
+    for mismatch in mismatches[:report_limit]:
+        print(f"🚩 Расхождение с журналом: {mismatch}")
+    return f"проверено пользователей: {checked}, расхождений: {len(mismatches)}"
+
+
+async def _main(args) -> int:
+    from app.database import dispose_engine
+
+    try:
+        checked, mismatches = await reconcile_balances(args.chunk_size)
+        for mismatch in mismatches[:args.show]:
+            print(f"🚩 {mismatch}")
+        if len(mismatches) > args.show:
+            print(f"... и еще {len(mismatches) - args.show}")
+        print(f"{'❌' if mismatches else '✅'} Проверено пользователей: {checked}, расхождений: {len(mismatches)}")
+        return 1 if mismatches else 0
+    finally:
+        await dispose_engine()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m app.ledger", description="Сверка балансов с журналом транзакций")
+    sub = parser.add_subparsers(dest="command", required=True)
+    reconcile_parser = sub.add_parser("reconcile", help="Сверить main_balance/bonus_balance с суммой транзакций")
+    reconcile_parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="пользователей в одном запросе")
+    reconcile_parser.add_argument("--show", type=int, default=REPORT_LIMIT, help="сколько расхождений напечатать")
+    raise SystemExit(asyncio.run(_main(parser.parse_args())))
@@ -0,0 +1,44 @@
+# app/loop_lag.py
+import asyncio
+from typing import Optional
+
+
+class LoopLagMonitor:
+    """
+    Измеряет задержку event loop: задача засыпает на interval секунд и смотрит,
+    насколько позже она проснулась. Если loop занят (bcrypt, тяжелая сериализация,
+    синхронный код), опоздание растет — по нему и сбрасываем нагрузку.
+    """
+
+    def __init__(self, interval: float = 0.25):
+        self.interval = interval
+        self.lag = 0.0 # Последнее измеренное опоздание, секунды
+        self.listeners = [] # Функции, получающие каждое измерение (например, гистограмма метрик)
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, loop.time() - started - self.interval)
+            for listener in self.listeners:
+                listener(self.lag)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.lag = 0.0
+
+
+# Один монитор на процесс (на воркер)
+loop_lag_monitor = LoopLagMonitor()
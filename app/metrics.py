@@ -0,0 +1,264 @@
+# app/metrics.py
+import threading
+import time
+from contextlib import contextmanager
+
+from starlette.routing import Match
+
+from app.loop_lag import loop_lag_monitor
+
+# Небольшой самописный реестр метрик в текстовом формате Prometheus (exposition format 0.0.4).
+# Метрики живут в памяти воркера; при нескольких воркерах Prometheus опрашивает каждый.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry: list = []
+_lock = threading.Lock() # Наблюдения приходят и из потоков (синхронные SQLAlchemy-события в greenlet/потоках)
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name, self.documentation, self.labelnames = name, documentation, labelnames
+        self._values: dict = {}
+        _registry.append(self)
+
+    def inc(self, *labels, amount: float = 1.0):
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name, self.documentation, self.labelnames = name, documentation, labelnames
+        self._values: dict = {}
+        _registry.append(self)
+
+    def set(self, value: float, *labels):
+        with _lock:
+            self._values[labels] = value
+
+    def inc(self, *labels, amount: float = 1.0):
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name, self.documentation, self.labelnames = name, documentation, labelnames
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values: dict = {} # labels -> [counts по бакетам (не накопительные), sum, count]
+        _registry.append(self)
+
+    def observe(self, value: float, *labels):
+        with _lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+# === Метрики приложения ===
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Время обработки HTTP-запроса", ("method", "route", "status"),
+)
+http_requests_in_flight = Gauge(
+    "http_requests_in_flight", "Запросы, которые обрабатываются прямо сейчас", ("method", "route"),
+)
+span_duration = Histogram(
+    "app_span_duration_seconds",
+    "Время отдельных этапов запроса: auth_verify, db, bcrypt, bot_api",
+    ("span",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+db_queries = Counter("db_queries_total", "Количество SQL-запросов к БД")
+db_read_sessions = Counter(
+    "db_read_sessions_total", "Сессии маршрутов только для чтения: куда ушли чтения (replica/primary)", ("target",),
+)
+db_replica_lag = Gauge("db_replica_lag_seconds", "Отставание реплики по последней проверке; -1 — недоступна")
+event_loop_lag = Histogram(
+    "event_loop_lag_seconds", "Опоздание event loop относительно ожидаемого пробуждения",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+event_loop_lag_current = Gauge("event_loop_lag_current_seconds", "Последнее измеренное опоздание event loop")
+
+# --- Фоновые задачи (app/scheduler.py) ---
+job_duration = Histogram(
+    "scheduler_job_duration_seconds", "Время выполнения фоновой задачи", ("job", "status"),
+    buckets=(0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0),
+)
+job_lag = Histogram(
+    "scheduler_job_lag_seconds", "Опоздание запуска задачи относительно расписания (включая jitter)", ("job",),
+    buckets=(0.01, 0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0),
+)
+job_last_success = Gauge(
+    "scheduler_job_last_success_timestamp_seconds", "Unix-время последнего успешного запуска задачи", ("job",),
+)
+scheduler_leader = Gauge("scheduler_leader", "1, если этот процесс — лидер планировщика")
+
+# --- Рассылки (app/broadcasts.py) ---
+broadcast_messages = Counter(
+    "broadcast_messages_total", "Сообщения рассылок по результату: sent / blocked / failed", ("result",),
+)
+
+# --- События в реальном времени (app/events.py, GET /api/events) ---
+events_published = Counter("events_published_total", "Опубликованные события пользователей по типу", ("type",))
+sse_connections = Gauge("sse_connections", "Открытые потоки GET /api/events в этом воркере")
+
+# --- Детектор мошенничества (app/fraud.py) ---
+fraud_actions = Counter("fraud_actions_total", "Решения детектора мошенничества: flag / throttle по причине", ("action", "reason"))
+
+# --- Сверка балансов с журналом (app/ledger.py) ---
+ledger_mismatched_users = Gauge("ledger_mismatched_users", "Пользователи, чей баланс расходится с журналом транзакций, по последней сверке")
+
+
+def span(name: str):
+    """Контекстный менеджер для замера этапа: with span("bcrypt"): ..."""
+    return span_duration.time(name)
+
+
+def render_metrics() -> str:
+    event_loop_lag_current.set(loop_lag_monitor.lag)
+    lines: list[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Каждое измерение задержки loop попадает в гистограмму
+loop_lag_monitor.listeners.append(event_loop_lag.observe)
+
+
+# === SQLAlchemy: время каждого SQL-запроса ===
+def instrument_engine(engine):
+    """Вешает обработчики before/after_cursor_execute на движок (AsyncEngine или обычный)."""
+    from sqlalchemy import event
+
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started_at"].pop()
+        span_duration.observe(time.perf_counter() - started, "db")
+        db_queries.inc()
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _handle_error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_started_at"):
+            conn.info["query_started_at"].pop()
+
+
+# === HTTP middleware ===
+# Метки маршрутов по (метод, путь): перебор всех маршрутов — на первый запрос пути, а не на каждый.
+# Пути с параметрами (/api/admin/fraud/123) и мусор сканеров уникальны, поэтому кеш ограничен.
+ROUTE_LABEL_CACHE_SIZE = 10_000
+_route_labels: dict[tuple[str, str], str] = {}
+
+
+def _route_label(app, scope) -> str:
+    """Шаблон пути маршрута (а не сырой путь), чтобы не плодить метки на каждый URL."""
+    key = (scope["method"], scope["path"])
+    label = _route_labels.get(key)
+    if label is not None:
+        return label
+    label = "unmatched"
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            label = getattr(route, "path", "unknown")
+            break
+    if len(_route_labels) < ROUTE_LABEL_CACHE_SIZE:
+        _route_labels[key] = label
+    return label
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: гистограмма времени ответа и число запросов в работе по маршрутам."""
+
+    def __init__(self, app, fastapi_app=None):
+        self.app = app
+        self.fastapi_app = fastapi_app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route = _route_label(self.fastapi_app, scope) if self.fastapi_app is not None else scope["path"]
+        method = scope["method"]
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc(method, route)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_flight.dec(method, route)
+            http_request_duration.observe(time.perf_counter() - started, method, route, str(status_code))
@@ -0,0 +1,114 @@
+# app/migrations/__init__.py
+"""
+Версионированные миграции схемы БД.
+
+Каждая миграция — модуль app/migrations/versions/NNNN_<name>.py с функцией
+`async def upgrade(conn)`. Примененные версии записываются в таблицу schema_version.
+Миграции запускаются отдельным шагом деплоя (`python -m app.migrations upgrade`),
+а приложение на старте только сверяет номер версии — это один быстрый SELECT.
+
+Модуль может объявить TRANSACTIONAL = False (например, для CREATE INDEX CONCURRENTLY):
+тогда он выполняется в режиме AUTOCOMMIT, а не в одной транзакции.
+"""
+import importlib
+import pkgutil
+import re
+import time
+
+from sqlalchemy import text
+
+SCHEMA_VERSION_TABLE = "schema_version"
+# Ключ pg_advisory_lock: два одновременных запуска миграций не пойдут параллельно
+MIGRATIONS_LOCK_ID = 7_401_031
+
+_MODULE_NAME_RE = re.compile(r"^(\d{4})_(\w+)$")
+
+
+class SchemaVersionError(RuntimeError):
+    """Схема БД отстает от кода (не применены миграции)."""
+
+
+def load_migrations() -> list[tuple[int, str, object]]:
+    """Возвращает [(version, name, module)], отсортированные по версии."""
+    from app.migrations import versions
+
+    found = []
+    for info in pkgutil.iter_modules(versions.__path__):
+        match = _MODULE_NAME_RE.match(info.name)
+        if match:
+            module = importlib.import_module(f"{versions.__name__}.{info.name}")
+            found.append((int(match.group(1)), match.group(2), module))
+    found.sort(key=lambda item: item[0])
+    return found
+
+
+def latest_version() -> int:
+    migrations = load_migrations()
+    return migrations[-1][0] if migrations else 0
+
+
+async def current_version(conn) -> int | None:
+    """Текущая версия схемы или None, если таблицы schema_version еще нет."""
+    exists = (await conn.execute(text("SELECT to_regclass(:name)"), {"name": SCHEMA_VERSION_TABLE})).scalar()
+    if exists is None:
+        return None
+    return (await conn.execute(text(f"SELECT coalesce(max(version), 0) FROM {SCHEMA_VERSION_TABLE}"))).scalar_one()
+
+
+async def upgrade(engine, target: int | None = None) -> list[int]:
+    """Применяет все непримененные миграции (до target включительно). Возвращает список примененных версий."""
+    applied = []
+    async with engine.connect() as lock_conn:
+        await lock_conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATIONS_LOCK_ID})
+        await lock_conn.commit()
+        try:
+            await lock_conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {SCHEMA_VERSION_TABLE} ("
+                "version INTEGER PRIMARY KEY, "
+                "name VARCHAR(255) NOT NULL, "
+                "applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now())"
+            ))
+            await lock_conn.commit()
+            current = await current_version(lock_conn) or 0
+            await lock_conn.commit()
+
+            for version, name, module in load_migrations():
+                if version <= current or (target is not None and version > target):
+                    continue
+                print(f"Применяю миграцию {version:04d}_{name}...")
+                started = time.monotonic()
+                stamp = text(f"INSERT INTO {SCHEMA_VERSION_TABLE} (version, name) VALUES (:version, :name)")
+                if getattr(module, "TRANSACTIONAL", True):
+                    async with engine.begin() as conn:
+                        await module.upgrade(conn)
+                        await conn.execute(stamp, {"version": version, "name": name})
+                else:
+                    async with engine.connect() as conn:
+                        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+                        await module.upgrade(conn)
+                        await conn.execute(stamp, {"version": version, "name": name})
+                applied.append(version)
+                print(f"✅ Миграция {version:04d}_{name} применена за {time.monotonic() - started:.2f} с.")
+        finally:
+            await lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATIONS_LOCK_ID})
+            await lock_conn.commit()
+    return applied
+
+
+async def check(engine) -> int:
+    """
+    Быстрая проверка на старте: версия схемы не ниже последней миграции в коде.
+    Бросает SchemaVersionError, если миграции не применены.
+    """
+    async with engine.connect() as conn:
+        current = await current_version(conn)
+    latest = latest_version()
+    if current is None:
+        raise SchemaVersionError("Схема БД не инициализирована. Выполните: python -m app.migrations upgrade")
+    if current < latest:
+        raise SchemaVersionError(
+            f"Схема БД устарела (версия {current}, нужна {latest}). Выполните: python -m app.migrations upgrade"
+        )
+    if current > latest:
+        print(f"ВНИМАНИЕ: версия схемы БД ({current}) новее кода ({latest}). Вероятно, идет выкладка новой версии.")
+    return current
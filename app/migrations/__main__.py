@@ -0,0 +1,45 @@
+# app/migrations/__main__.py
+"""
+python -m app.migrations upgrade [--to N]  — применить миграции
+python -m app.migrations current           — показать текущую версию схемы
+python -m app.migrations check             — код возврата 1, если схема отстает от кода
+"""
+import argparse
+import asyncio
+import sys
+
+from app import migrations
+from app.database import get_engine
+
+
+async def _main(args) -> int:
+    engine = get_engine()
+    try:
+        if args.command == "upgrade":
+            applied = await migrations.upgrade(engine, target=args.to)
+            print(f"Применено миграций: {len(applied)}." if applied else "Схема уже актуальна.")
+        elif args.command == "current":
+            async with engine.connect() as conn:
+                version = await migrations.current_version(conn)
+            print(f"Текущая версия: {version}, последняя в коде: {migrations.latest_version()}")
+        elif args.command == "check":
+            try:
+                print(f"Схема актуальна (версия {await migrations.check(engine)}).")
+            except migrations.SchemaVersionError as e:
+                print(f"❌ {e}")
+                return 1
+        return 0
+    finally:
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m app.migrations", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["upgrade", "current", "check"])
+    parser.add_argument("--to", type=int, help="применить миграции только до этой версии включительно")
+    sys.exit(asyncio.run(_main(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
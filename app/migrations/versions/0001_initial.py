@@ -0,0 +1,120 @@
+# app/migrations/versions/0001_initial.py
+"""
+Исходная схема: users, investment_packages, investments, transactions, referrals.
+
+DDL совпадает с тем, что создавал Base.metadata.create_all, и написан с IF NOT EXISTS:
+на базах, созданных старым кодом, миграция ничего не меняет и только ставит версию.
+"""
+from sqlalchemy import text
+
+STATEMENTS = [
+    """
+    DO $$ BEGIN
+        CREATE TYPE useraccountstatus AS ENUM ('active', 'logged_out', 'banned', 'inactive');
+    EXCEPTION WHEN duplicate_object THEN NULL;
+    END $$
+    """,
+    """
+    DO $$ BEGIN
+        CREATE TYPE userrole AS ENUM ('user', 'premium', 'vip', 'moderator', 'admin');
+    EXCEPTION WHEN duplicate_object THEN NULL;
+    END $$
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS investment_packages (
+        id SERIAL NOT NULL,
+        name VARCHAR(255) NOT NULL,
+        min_amount NUMERIC(18, 2) NOT NULL,
+        max_amount NUMERIC(18, 2),
+        daily_roi_percentage NUMERIC(5, 2) NOT NULL,
+        duration_days INTEGER NOT NULL,
+        description TEXT,
+        is_active BOOLEAN,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+        updated_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+        PRIMARY KEY (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_investment_packages_id ON investment_packages (id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_investment_packages_name ON investment_packages (name)",
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id BIGSERIAL NOT NULL,
+        username VARCHAR(255) NOT NULL,
+        first_name VARCHAR(255),
+        last_name VARCHAR(255),
+        registration_date TIMESTAMP WITH TIME ZONE DEFAULT now(),
+        main_balance NUMERIC(18, 2),
+        bonus_balance NUMERIC(18, 2),
+        lucrum_balance NUMERIC(18, 2),
+        total_invested NUMERIC(18, 2),
+        total_withdrawn NUMERIC(18, 2),
+        password_hash VARCHAR(255),
+        last_daily_bonus_claim TIMESTAMP WITH TIME ZONE,
+        last_login_date TIMESTAMP WITH TIME ZONE,
+        phone_number VARCHAR(20),
+        email VARCHAR(255),
+        status useraccountstatus NOT NULL,
+        role userrole NOT NULL,
+        PRIMARY KEY (id)
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_phone_number ON users (phone_number)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_email ON users (email)",
+    "CREATE INDEX IF NOT EXISTS ix_users_id ON users (id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_username ON users (username)",
+    """
+    CREATE TABLE IF NOT EXISTS investments (
+        id SERIAL NOT NULL,
+        user_id BIGINT NOT NULL,
+        package_id INTEGER NOT NULL,
+        amount_invested NUMERIC(18, 2) NOT NULL,
+        start_date TIMESTAMP WITH TIME ZONE DEFAULT now(),
+        end_date TIMESTAMP WITH TIME ZONE,
+        current_earned NUMERIC(18, 2),
+        is_active BOOLEAN,
+        stars_payment_charge_id VARCHAR(255),
+        PRIMARY KEY (id),
+        FOREIGN KEY(user_id) REFERENCES users (id),
+        FOREIGN KEY(package_id) REFERENCES investment_packages (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_investments_id ON investments (id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_investments_stars_payment_charge_id ON investments (stars_payment_charge_id)",
+    """
+    CREATE TABLE IF NOT EXISTS referrals (
+        id SERIAL NOT NULL,
+        referrer_id BIGINT NOT NULL,
+        referred_id BIGINT NOT NULL,
+        referral_level INTEGER,
+        bonus_earned NUMERIC(18, 2),
+        join_date TIMESTAMP WITH TIME ZONE DEFAULT now(),
+        PRIMARY KEY (id),
+        FOREIGN KEY(referrer_id) REFERENCES users (id),
+        UNIQUE (referred_id),
+        FOREIGN KEY(referred_id) REFERENCES users (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_referrals_id ON referrals (id)",
+    """
+    CREATE TABLE IF NOT EXISTS transactions (
+        id SERIAL NOT NULL,
+        user_id BIGINT NOT NULL,
+        type VARCHAR(50) NOT NULL,
+        amount NUMERIC(18, 2) NOT NULL,
+        currency VARCHAR(10) NOT NULL,
+        timestamp TIMESTAMP WITH TIME ZONE DEFAULT now(),
+        status VARCHAR(50),
+        description TEXT,
+        txid VARCHAR(255),
+        PRIMARY KEY (id),
+        FOREIGN KEY(user_id) REFERENCES users (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_transactions_id ON transactions (id)",
+]
+
+
+async def upgrade(conn):
+    for statement in STATEMENTS:
+        await conn.execute(text(statement))
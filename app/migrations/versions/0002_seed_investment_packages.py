@@ -0,0 +1,28 @@
+# app/migrations/versions/0002_seed_investment_packages.py
+"""
+Начальные инвестиционные пакеты — одним INSERT ... ON CONFLICT DO NOTHING.
+Раньше это делалось на каждом старте приложения (SELECT на каждый пакет + commit).
+"""
+from decimal import Decimal
+
+from sqlalchemy import text
+
+PACKAGES = [
+    {'name': 'Bronze Plan', 'min_amount': Decimal('100.00'), 'max_amount': Decimal('500.00'), 'daily_roi_percentage': Decimal('0.50'), 'duration_days': 30, 'description': 'Наш начальный план. Идеально подходит для новичков.', 'is_active': True},
+    {'name': 'Silver Plan', 'min_amount': Decimal('501.00'), 'max_amount': Decimal('2000.00'), 'daily_roi_percentage': Decimal('0.75'), 'duration_days': 45, 'description': 'Популярный план со сбалансированным доходом.', 'is_active': True},
+    {'name': 'Gold Plan', 'min_amount': Decimal('2001.00'), 'max_amount': Decimal('10000.00'), 'daily_roi_percentage': Decimal('1.00'), 'duration_days': 60, 'description': 'Премиальный план для более значительных инвестиций.', 'is_active': True},
+    {'name': 'Diamond Plan', 'min_amount': Decimal('10001.00'), 'max_amount': None, 'daily_roi_percentage': Decimal('1.25'), 'duration_days': 90, 'description': 'Эксклюзивный план с максимальной прибылью.', 'is_active': True},
+]
+
+COLUMNS = ("name", "min_amount", "max_amount", "daily_roi_percentage", "duration_days", "description", "is_active")
+
+
+async def upgrade(conn):
+    values = ", ".join(
+        "(" + ", ".join(f":{column}_{i}" for column in COLUMNS) + ")" for i in range(len(PACKAGES))
+    )
+    params = {f"{column}_{i}": package[column] for i, package in enumerate(PACKAGES) for column in COLUMNS}
+    await conn.execute(
+        text(f"INSERT INTO investment_packages ({', '.join(COLUMNS)}) VALUES {values} ON CONFLICT (name) DO NOTHING"),
+        params,
+    )
@@ -0,0 +1,31 @@
+# app/migrations/versions/0003_scheduler.py
+"""
+Фоновый планировщик (app/scheduler.py):
+- job_runs — история запусков задач;
+- investments.last_accrual_date — до какой даты уже начислен ROI (начисление идемпотентно).
+"""
+from sqlalchemy import text
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS job_runs (
+        id BIGSERIAL NOT NULL,
+        job_name VARCHAR(100) NOT NULL,
+        scheduled_at TIMESTAMP WITH TIME ZONE NOT NULL,
+        started_at TIMESTAMP WITH TIME ZONE NOT NULL,
+        finished_at TIMESTAMP WITH TIME ZONE,
+        status VARCHAR(20) NOT NULL,
+        result TEXT,
+        error TEXT,
+        worker VARCHAR(255),
+        PRIMARY KEY (id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_job_runs_job_name_started_at ON job_runs (job_name, started_at)",
+    "ALTER TABLE investments ADD COLUMN IF NOT EXISTS last_accrual_date DATE",
+]
+
+
+async def upgrade(conn):
+    for statement in STATEMENTS:
+        await conn.execute(text(statement))
@@ -0,0 +1,35 @@
+# app/migrations/versions/0004_user_stats.py
+"""
+user_stats — агрегаты transactions по (пользователь, тип): количество, сумма, последняя активность.
+Заполняется из существующей истории одним INSERT ... SELECT. Пересчитать позже (параллельно, по чанкам)
+можно командой `python -m app.user_stats rebuild`.
+"""
+from sqlalchemy import text
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS user_stats (
+        user_id BIGINT NOT NULL,
+        type VARCHAR(50) NOT NULL,
+        tx_count BIGINT NOT NULL,
+        amount_sum NUMERIC(18, 2) NOT NULL,
+        last_activity_at TIMESTAMP WITH TIME ZONE,
+        last_transaction_id BIGINT,
+        PRIMARY KEY (user_id, type),
+        FOREIGN KEY(user_id) REFERENCES users (id)
+    )
+    """,
+    """
+    INSERT INTO user_stats (user_id, type, tx_count, amount_sum, last_activity_at, last_transaction_id)
+    SELECT user_id, type, count(*), COALESCE(sum(amount), 0), max(timestamp), max(id)
+    FROM transactions
+    WHERE COALESCE(status, 'completed') = 'completed'
+    GROUP BY user_id, type
+    ON CONFLICT (user_id, type) DO NOTHING
+    """,
+]
+
+
+async def upgrade(conn):
+    for statement in STATEMENTS:
+        await conn.execute(text(statement))
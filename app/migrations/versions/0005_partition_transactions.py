@@ -0,0 +1,73 @@
+# app/migrations/versions/0005_partition_transactions.py
+"""
+transactions -> таблица, секционированная по месяцам (RANGE по timestamp, границы — начало месяца UTC).
+
+- Первичный ключ секционированной таблицы обязан включать ключ секционирования: PK (id, timestamp).
+  id по-прежнему из последовательности transactions_id_seq; она переводится на BIGINT
+  (две строки на каждый спин — до предела INTEGER недалеко).
+- timestamp становится NOT NULL: без него строку некуда положить.
+- Секции: с месяца самой старой транзакции по текущий + 3 вперед, и секция DEFAULT
+  на случай, если задача обслуживания (app/partitions.py) не успела создать нужную.
+
+Данные переносятся одним INSERT ... SELECT внутри транзакции миграции: на время переноса
+запись в transactions заблокирована.
+"""
+from sqlalchemy import text
+
+STATEMENTS = [
+    "ALTER TABLE transactions RENAME TO transactions_unpartitioned",
+    "ALTER TABLE transactions_unpartitioned RENAME CONSTRAINT transactions_pkey TO transactions_unpartitioned_pkey",
+    "ALTER TABLE transactions_unpartitioned RENAME CONSTRAINT transactions_user_id_fkey TO transactions_unpartitioned_user_id_fkey",
+    "ALTER INDEX IF EXISTS ix_transactions_id RENAME TO ix_transactions_unpartitioned_id",
+    "ALTER SEQUENCE transactions_id_seq AS BIGINT",
+    """
+    CREATE TABLE transactions (
+        id BIGINT NOT NULL DEFAULT nextval('transactions_id_seq'),
+        user_id BIGINT NOT NULL,
+        type VARCHAR(50) NOT NULL,
+        amount NUMERIC(18, 2) NOT NULL,
+        currency VARCHAR(10) NOT NULL,
+        timestamp TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+        status VARCHAR(50),
+        description TEXT,
+        txid VARCHAR(255),
+        PRIMARY KEY (id, timestamp),
+        FOREIGN KEY(user_id) REFERENCES users (id)
+    ) PARTITION BY RANGE (timestamp)
+    """,
+    "ALTER SEQUENCE transactions_id_seq OWNED BY transactions.id",
+    "CREATE INDEX ix_transactions_id ON transactions (id)",
+    "CREATE TABLE transactions_default PARTITION OF transactions DEFAULT",
+    """
+    DO $$
+    DECLARE
+        month date;
+    BEGIN
+        FOR month IN
+            SELECT generate_series(
+                date_trunc('month', timezone('UTC', LEAST((SELECT min(timestamp) FROM transactions_unpartitioned), now()))),
+                date_trunc('month', timezone('UTC', now())) + interval '3 months',
+                interval '1 month'
+            )::date
+        LOOP
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF transactions FOR VALUES FROM (%L) TO (%L)',
+                'transactions_y' || to_char(month, 'YYYY') || 'm' || to_char(month, 'MM'),
+                timezone('UTC', month::timestamp),
+                timezone('UTC', (month + interval '1 month')::timestamp)
+            );
+        END LOOP;
+    END $$
+    """,
+    """
+    INSERT INTO transactions (id, user_id, type, amount, currency, timestamp, status, description, txid)
+    SELECT id, user_id, type, amount, currency, COALESCE(timestamp, now()), status, description, txid
+    FROM transactions_unpartitioned
+    """,
+    "DROP TABLE transactions_unpartitioned",
+]
+
+
+async def upgrade(conn):
+    for statement in STATEMENTS:
+        await conn.execute(text(statement))
@@ -0,0 +1,52 @@
+# app/migrations/versions/0006_hot_query_indexes.py
+"""
+Индексы под горячие запросы (проверка: python -m benchmarks.explain_queries):
+- transactions (user_id, timestamp) — история пользователя с сортировкой по времени и периодом;
+- investments (user_id), (package_id) — инвестиции пользователя, внешние ключи;
+- investments (id) WHERE is_active — пачки начисления ROI и завершения инвестиций;
+- referrals (referrer_id, referral_level) — рефералы по уровням и их число.
+
+CREATE INDEX CONCURRENTLY не блокирует запись, но не работает в транзакции и на секционированной
+таблице. Поэтому миграция нетранзакционная, а для transactions индекс создается на самой таблице
+(ON ONLY, без построения), затем CONCURRENTLY на каждой секции и подключается к нему.
+Прерванное построение оставляет невалидный индекс — при повторном запуске он удаляется и строится заново.
+"""
+from sqlalchemy import text
+
+TRANSACTIONAL = False
+
+INDEXES = [
+    ("ix_investments_user_id", "investments (user_id)"),
+    ("ix_investments_package_id", "investments (package_id)"),
+    ("ix_investments_active_id", "investments (id) WHERE is_active"),
+    ("ix_referrals_referrer_id_level", "referrals (referrer_id, referral_level)"),
+]
+PARTITIONED_INDEX = ("ix_transactions_user_id_timestamp", "transactions", "(user_id, timestamp)")
+
+
+async def _drop_if_invalid(conn, name: str):
+    invalid = (await conn.execute(text(
+        "SELECT NOT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"
+    ), {"name": name})).scalar()
+    if invalid:
+        await conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"'))
+
+
+async def upgrade(conn):
+    for name, definition in INDEXES:
+        await _drop_if_invalid(conn, name)
+        table, _, columns = definition.partition(" ")
+        await conn.execute(text(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{name}" ON {table} {columns}'))
+
+    name, table, columns = PARTITIONED_INDEX
+    await conn.execute(text(f'CREATE INDEX IF NOT EXISTS "{name}" ON ONLY {table} {columns}'))
+    partitions = (await conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = CAST(:table AS regclass) ORDER BY c.relname"
+    ), {"table": table})).scalars().all()
+    for partition in partitions:
+        # Имя — как у индексов, которые Postgres создает сам при ATTACH PARTITION новых секций
+        partition_index = f"{partition}_user_id_timestamp_idx"
+        await _drop_if_invalid(conn, partition_index)
+        await conn.execute(text(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{partition_index}" ON "{partition}" {columns}'))
+        await conn.execute(text(f'ALTER INDEX "{name}" ATTACH PARTITION "{partition_index}"'))
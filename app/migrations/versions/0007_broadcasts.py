@@ -0,0 +1,35 @@
+# app/migrations/versions/0007_broadcasts.py
+"""
+broadcasts — рассылки сообщений всем пользователям бота (app/broadcasts.py):
+текст, статус, чекпоинт (последний обработанный users.id) и статистика доставки.
+"""
+from sqlalchemy import text
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS broadcasts (
+        id SERIAL NOT NULL,
+        text TEXT NOT NULL,
+        status VARCHAR(20) NOT NULL,
+        created_by BIGINT,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+        started_at TIMESTAMP WITH TIME ZONE,
+        finished_at TIMESTAMP WITH TIME ZONE,
+        updated_at TIMESTAMP WITH TIME ZONE,
+        cursor_user_id BIGINT NOT NULL DEFAULT 0,
+        total INTEGER,
+        sent INTEGER NOT NULL DEFAULT 0,
+        blocked INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        retries INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        PRIMARY KEY (id),
+        FOREIGN KEY(created_by) REFERENCES users (id)
+    )
+    """,
+]
+
+
+async def upgrade(conn):
+    for statement in STATEMENTS:
+        await conn.execute(text(statement))
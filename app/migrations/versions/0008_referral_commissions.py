@@ -0,0 +1,19 @@
+# app/migrations/versions/0008_referral_commissions.py
+"""
+Реферальные комиссии с покупок (app/commissions.py):
+- investments.commissions_paid_at — когда выплачены комиссии по покупке; NULL — еще не выплачены;
+- индекс по id невыплаченных покупок — пачки задачи pay_referral_commissions.
+
+Уже существующие покупки остаются невыплаченными: комиссии по ним выплатит та же задача.
+"""
+from sqlalchemy import text
+
+STATEMENTS = [
+    "ALTER TABLE investments ADD COLUMN IF NOT EXISTS commissions_paid_at TIMESTAMP WITH TIME ZONE",
+    "CREATE INDEX IF NOT EXISTS ix_investments_commissions_pending ON investments (id) WHERE commissions_paid_at IS NULL",
+]
+
+
+async def upgrade(conn):
+    for statement in STATEMENTS:
+        await conn.execute(text(statement))
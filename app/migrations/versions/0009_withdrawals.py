@@ -0,0 +1,41 @@
+# app/migrations/versions/0009_withdrawals.py
+"""
+withdrawals — заявки на вывод средств (app/withdrawals.py):
+- сумма удерживается с main_balance при создании заявки (в журнале — транзакция 'withdrawal');
+- статус: pending -> processing -> completed, либо failed (сумма возвращается транзакцией 'withdrawal_refund');
+- request_key — ключ идемпотентности клиента: повтор того же запроса не создает вторую заявку;
+- индекс по id открытых заявок — пачки обработчика и лимит открытых заявок пользователя.
+"""
+from sqlalchemy import text
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS withdrawals (
+        id SERIAL NOT NULL,
+        user_id BIGINT NOT NULL,
+        amount NUMERIC(18, 2) NOT NULL CHECK (amount > 0),
+        currency VARCHAR(10) NOT NULL,
+        destination VARCHAR(255) NOT NULL,
+        status VARCHAR(20) NOT NULL,
+        request_key VARCHAR(64),
+        attempts INTEGER NOT NULL DEFAULT 0,
+        provider VARCHAR(50),
+        provider_ref VARCHAR(255),
+        error TEXT,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+        processing_started_at TIMESTAMP WITH TIME ZONE,
+        next_attempt_at TIMESTAMP WITH TIME ZONE,
+        processed_at TIMESTAMP WITH TIME ZONE,
+        PRIMARY KEY (id),
+        FOREIGN KEY(user_id) REFERENCES users (id)
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_withdrawals_user_request_key ON withdrawals (user_id, request_key)",
+    "CREATE INDEX IF NOT EXISTS ix_withdrawals_user_id_created_at ON withdrawals (user_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_withdrawals_open ON withdrawals (id) WHERE status IN ('pending', 'processing')",
+]
+
+
+async def upgrade(conn):
+    for statement in STATEMENTS:
+        await conn.execute(text(statement))
@@ -0,0 +1,25 @@
+# app/migrations/versions/0010_pending_referrals.py
+"""
+pending_referrals — реферер из /start ref_<id> до регистрации (app/referrals.py), если нет SHARED_STATE_URL:
+без общего бэкенда кеш в памяти процесса не виден воркеру, который обработает /api/register.
+- user_id — Telegram ID приглашенного; пользователя еще нет, поэтому без внешнего ключа;
+- expires_at — после него запись не учитывается, а задача cleanup_pending_referrals ее удаляет.
+"""
+from sqlalchemy import text
+
+STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS pending_referrals (
+        user_id BIGINT NOT NULL,
+        referrer_id BIGINT NOT NULL,
+        expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+        PRIMARY KEY (user_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_pending_referrals_expires_at ON pending_referrals (expires_at)",
+]
+
+
+async def upgrade(conn):
+    for statement in STATEMENTS:
+        await conn.execute(text(statement))
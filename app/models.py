@@ -1,6 +1,6 @@
 # app/models.py
 import enum
-from sqlalchemy import Column, BigInteger, String, Numeric, DateTime, Boolean, Text, Integer, ForeignKey, Enum
+from sqlalchemy import Column, BigInteger, String, Numeric, DateTime, Date, Boolean, Text, Integer, ForeignKey, Enum, Index, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base # Импортируем Base из нашего database.py
@@ -80,10 +80,16 @@ class InvestmentPackage(Base):
 # --- Таблица: `investments`
 class Investment(Base):
     __tablename__ = "investments"
+    __table_args__ = (
+        # Пачки начисления ROI и завершения: WHERE is_active ORDER BY id — индекс только по активным
+        Index("ix_investments_active_id", "id", postgresql_where=text("is_active")),
+        # Покупки, по которым еще не выплачены реферальные комиссии (app/commissions.py)
+        Index("ix_investments_commissions_pending", "id", postgresql_where=text("commissions_paid_at IS NULL")),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(BigInteger, ForeignKey("users.id"), nullable=False)
-    package_id = Column(Integer, ForeignKey("investment_packages.id"), nullable=False) 
+    user_id = Column(BigInteger, ForeignKey("users.id"), nullable=False, index=True)
+    package_id = Column(Integer, ForeignKey("investment_packages.id"), nullable=False, index=True) 
     amount_invested = Column(Numeric(18, 2), nullable=False)
     start_date = Column(DateTime(timezone=True), server_default=func.now())
     end_date = Column(DateTime(timezone=True), nullable=True) # Будет рассчитываться
@@ -95,6 +101,11 @@ class Investment(Base):
     # Это поле будет содержать 'telegram_payment_charge_id' из успешного платежа
     # Делаем его unique=True, чтобы гарантировать, что один и тот же платеж не будет обработан дважды.
 
+    # До какой даты (включительно, UTC) уже начислен ежедневный ROI — см. app/jobs.py
+    last_accrual_date = Column(Date, nullable=True)
+    # Когда выплачены реферальные комиссии с этой покупки (app/commissions.py); NULL — еще не выплачены
+    commissions_paid_at = Column(DateTime(timezone=True), nullable=True)
+
     owner = relationship("User", back_populates="investments")
     package_details = relationship("InvestmentPackage", back_populates="investments_made") 
 
@@ -103,15 +114,22 @@ class Investment(Base):
 
 
 # --- Таблица: `transactions` 
+# Секционирована по месяцам (RANGE по timestamp), секции ведет app/partitions.py.
+# Поэтому первичный ключ — (id, timestamp); запросы с условием на timestamp читают только нужные секции.
 class Transaction(Base):
     __tablename__ = "transactions"
+    __table_args__ = (
+        # История пользователя: WHERE user_id = ? ORDER BY timestamp DESC (и период since/until)
+        Index("ix_transactions_user_id_timestamp", "user_id", "timestamp"),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(BigInteger, primary_key=True, autoincrement=True, index=True)
     user_id = Column(BigInteger, ForeignKey("users.id"), nullable=False)
     type = Column(String(50), nullable=False) 
     amount = Column(Numeric(18, 2), nullable=False)
     currency = Column(String(10), nullable=False) 
-    timestamp = Column(DateTime(timezone=True), server_default=func.now())
+    timestamp = Column(DateTime(timezone=True), primary_key=True, server_default=func.now())
     status = Column(String(50), default='completed') 
     description = Column(Text, nullable=True)
     txid = Column(String(255), nullable=True) 
@@ -122,9 +140,44 @@ class Transaction(Base):
         return f"<Transaction(id={self.id}, user_id={self.user_id}, type='{self.type}', amount={self.amount})>"
 
 
+# --- Таблица: `user_stats` — агрегаты журнала транзакций по пользователю и типу (app/user_stats.py)
+# Обновляется в той же транзакции, что и запись в transactions, поэтому виджеты «всего выиграно»,
+# «всего бонусов» и т.п. читают одну строку по первичному ключу, а не сканируют историю.
+class UserStat(Base):
+    __tablename__ = "user_stats"
+
+    user_id = Column(BigInteger, ForeignKey("users.id"), primary_key=True)
+    type = Column(String(50), primary_key=True) # Тот же тип, что в Transaction.type
+    tx_count = Column(BigInteger, nullable=False, default=0)
+    amount_sum = Column(Numeric(18, 2), nullable=False, default=0)
+    last_activity_at = Column(DateTime(timezone=True), nullable=True)
+    last_transaction_id = Column(BigInteger, nullable=True)
+
+    def __repr__(self):
+        return f"<UserStat(user_id={self.user_id}, type='{self.type}', count={self.tx_count}, sum={self.amount_sum})>"
+
+
+# --- Таблица: `ledger_opening_sums` — суммы архивированных секций transactions (app/ledger.py)
+# Баланс сверяется с opening + суммой оставшихся в БД транзакций.
+class LedgerOpeningSum(Base):
+    __tablename__ = "ledger_opening_sums"
+
+    user_id = Column(BigInteger, ForeignKey("users.id"), primary_key=True)
+    main_sum = Column(Numeric(18, 2), nullable=False, default=0)
+    bonus_sum = Column(Numeric(18, 2), nullable=False, default=0)
+    archived_through = Column(Date, nullable=True) # Последний архивированный месяц
+
+    def __repr__(self):
+        return f"<LedgerOpeningSum(user_id={self.user_id}, main={self.main_sum}, bonus={self.bonus_sum})>"
+
+
 # --- Таблица: `referrals` 
 class Referral(Base):
     __tablename__ = "referrals"
+    __table_args__ = (
+        # Рефералы по уровням: WHERE referrer_id = ? / IN (...) AND referral_level = 1; подходит и для count по referrer_id
+        Index("ix_referrals_referrer_id_level", "referrer_id", "referral_level"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     referrer_id = Column(BigInteger, ForeignKey("users.id"), nullable=False) # Кто пригласил
@@ -137,4 +190,95 @@ class Referral(Base):
     referred_user = relationship("User", foreign_keys=[referred_id], back_populates="referred_by")
 
     def __repr__(self):
-        return f"<Referral(id={self.id}, referrer={self.referrer_id}, referred={self.referred_id})>"
\ No newline at end of file
+        return f"<Referral(id={self.id}, referrer={self.referrer_id}, referred={self.referred_id})>"
+
+
+# --- Таблица: `pending_referrals` — реферер из /start до регистрации, если нет SHARED_STATE_URL (app/referrals.py)
+class PendingReferral(Base):
+    __tablename__ = "pending_referrals"
+
+    user_id = Column(BigInteger, primary_key=True) # Telegram ID приглашенного; пользователя еще нет
+    referrer_id = Column(BigInteger, nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<PendingReferral(user_id={self.user_id}, referrer={self.referrer_id})>"
+
+
+# --- Таблица: `job_runs` — история запусков фоновых задач (app/scheduler.py)
+class JobRun(Base):
+    __tablename__ = "job_runs"
+
+    id = Column(BigInteger, primary_key=True)
+    job_name = Column(String(100), nullable=False)
+    scheduled_at = Column(DateTime(timezone=True), nullable=False) # Время по расписанию (до jitter)
+    started_at = Column(DateTime(timezone=True), nullable=False)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    status = Column(String(20), nullable=False, default='running') # running / success / failed / timeout
+    result = Column(Text, nullable=True) # Краткий итог: сколько строк обработано и т.п.
+    error = Column(Text, nullable=True)
+    worker = Column(String(255), nullable=True) # host:pid лидера, который выполнял задачу
+
+    __table_args__ = (
+        Index("ix_job_runs_job_name_started_at", "job_name", "started_at"),
+    )
+
+    def __repr__(self):
+        return f"<JobRun(id={self.id}, job='{self.job_name}', status='{self.status}')>"
+
+
+# --- Таблица: `broadcasts` — рассылки сообщений всем пользователям бота (app/broadcasts.py)
+class Broadcast(Base):
+    __tablename__ = "broadcasts"
+
+    id = Column(Integer, primary_key=True)
+    text = Column(Text, nullable=False) # HTML, как и остальные сообщения бота
+    status = Column(String(20), nullable=False, default='pending') # pending / running / paused / completed / cancelled
+    created_by = Column(BigInteger, ForeignKey("users.id"), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    updated_at = Column(DateTime(timezone=True), nullable=True) # Время последнего чекпоинта
+    # Чекпоинт: пользователи с id <= cursor_user_id уже обработаны (рассылка идет по возрастанию id)
+    cursor_user_id = Column(BigInteger, nullable=False, default=0)
+    total = Column(Integer, nullable=True) # Получателей на момент старта
+    sent = Column(Integer, nullable=False, default=0)
+    blocked = Column(Integer, nullable=False, default=0) # Пользователь заблокировал бота или удалил аккаунт
+    failed = Column(Integer, nullable=False, default=0)
+    retries = Column(Integer, nullable=False, default=0) # Повторы после 429 (retry_after) и сетевых ошибок
+    error = Column(Text, nullable=True)
+
+    def __repr__(self):
+        return f"<Broadcast(id={self.id}, status='{self.status}', sent={self.sent})>"
+
+
+# --- Таблица: `withdrawals` — заявки на вывод средств (app/withdrawals.py)
+# Сумма удерживается с main_balance при создании заявки; при отказе провайдера возвращается.
+class Withdrawal(Base):
+    __tablename__ = "withdrawals"
+    __table_args__ = (
+        Index("ux_withdrawals_user_request_key", "user_id", "request_key", unique=True),
+        # Заявки пользователя: WHERE user_id = ? ORDER BY created_at DESC
+        Index("ix_withdrawals_user_id_created_at", "user_id", "created_at"),
+        # Пачки обработчика и лимит открытых заявок
+        Index("ix_withdrawals_open", "id", postgresql_where=text("status IN ('pending', 'processing')")),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(BigInteger, ForeignKey("users.id"), nullable=False)
+    amount = Column(Numeric(18, 2), nullable=False)
+    currency = Column(String(10), nullable=False)
+    destination = Column(String(255), nullable=False) # Кошелек/реквизиты получателя
+    status = Column(String(20), nullable=False, default='pending') # pending / processing / completed / failed
+    request_key = Column(String(64), nullable=True) # Ключ идемпотентности клиента
+    attempts = Column(Integer, nullable=False, default=0)
+    provider = Column(String(50), nullable=True)
+    provider_ref = Column(String(255), nullable=True) # Идентификатор выплаты у провайдера
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    processing_started_at = Column(DateTime(timezone=True), nullable=True)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=True) # Повтор после временной ошибки провайдера
+    processed_at = Column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return f"<Withdrawal(id={self.id}, user_id={self.user_id}, amount={self.amount}, status='{self.status}')>"
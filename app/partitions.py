@@ -0,0 +1,230 @@
+# app/partitions.py
+"""
+Месячные секции таблицы transactions (RANGE по timestamp, границы — начало месяца UTC).
+
+- Секция месяца называется transactions_yYYYYmMM. Задача планировщика заранее создает секции
+  на PARTITIONS_AHEAD месяцев вперед. Строки, попавшие в секцию DEFAULT (если секции
+  не оказалось вовремя), переносятся в созданную секцию.
+- Старые секции (TRANSACTIONS_ARCHIVE_AFTER_MONTHS > 0) выгружаются в файл
+  (csv.gz или parquet) в TRANSACTIONS_ARCHIVE_DIR, после проверки числа строк отсоединяются
+  и удаляются. Каталог архива должен быть постоянным диском или синхронизироваться во внешнее хранилище.
+
+Агрегаты user_stats архивом не затрагиваются, но `python -m app.user_stats rebuild`
+считает только то, что осталось в БД. Суммы секции по пользователю перед удалением переносятся
+в ledger_opening_sums — по ним сверка журнала (app/ledger.py) учитывает архивированную историю.
+
+Ручной запуск: python -m app.partitions list | ensure | archive
+"""
+import argparse
+import asyncio
+import gzip
+import os
+import re
+from datetime import date, datetime, timezone
+from typing import Optional
+
+from sqlalchemy import text
+
+from app.config import get_settings
+from app.ledger import record_opening_sums
+
+PARENT_TABLE = "transactions"
+DEFAULT_PARTITION = "transactions_default"
+# На сколько месяцев вперед держать готовые секции
+PARTITIONS_AHEAD = 3
+# Строк в одной пачке при выгрузке в parquet
+ARCHIVE_BATCH_ROWS = 50_000
+
+_PARTITION_NAME_RE = re.compile(r"^transactions_y(\d{4})m(\d{2})$")
+
+_LIST_PARTITIONS_SQL = text("""
+SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = CAST(:parent AS regclass)
+""")
+
+
+def month_start(day: date) -> date:
+    return date(day.year, day.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"transactions_y{month.year:04d}m{month.month:02d}"
+
+
+def _bound(month: date) -> datetime:
+    return datetime(month.year, month.month, 1, tzinfo=timezone.utc)
+
+
+async def list_partitions(conn) -> list[date]:
+    """Месяцы, для которых есть секции (без DEFAULT), по возрастанию."""
+    names = (await conn.execute(_LIST_PARTITIONS_SQL, {"parent": PARENT_TABLE})).scalars()
+    months = []
+    for name in names:
+        match = _PARTITION_NAME_RE.match(name)
+        if match:
+            months.append(date(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+
+async def create_partition(conn, month: date) -> int:
+    """
+    Создает секцию месяца в транзакции conn. Возвращает число строк, перенесенных в нее из DEFAULT.
+    CREATE TABLE ... PARTITION OF падает, если в DEFAULT уже есть строки этого месяца,
+    поэтому таблица создается отдельно, строки переносятся, и только потом она подключается.
+    """
+    name = partition_name(month)
+    params = {"lower": _bound(month), "upper": _bound(add_months(month, 1))}
+    await conn.execute(text(f'CREATE TABLE "{name}" (LIKE {PARENT_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'))
+    # Блокируем DEFAULT до конца транзакции: новые строки месяца не должны попасть туда между переносом и ATTACH
+    await conn.execute(text(f"LOCK TABLE {DEFAULT_PARTITION} IN ACCESS EXCLUSIVE MODE"))
+    moved = await conn.execute(text(f"""
+        WITH moved AS (
+            DELETE FROM {DEFAULT_PARTITION} WHERE timestamp >= :lower AND timestamp < :upper RETURNING *
+        )
+        INSERT INTO "{name}" SELECT * FROM moved
+    """), params)
+    # Границы секции — литералы DDL, параметры здесь не поддерживаются
+    await conn.execute(text(
+        f"""ALTER TABLE {PARENT_TABLE} ATTACH PARTITION "{name}" """
+        f"""FOR VALUES FROM ('{params["lower"].isoformat()}') TO ('{params["upper"].isoformat()}')"""
+    ))
+    return moved.rowcount
+
+
+async def ensure_partitions(engine, months_ahead: int = PARTITIONS_AHEAD, today: Optional[date] = None,
+                            since: Optional[date] = None) -> list[str]:
+    """
+    Создает недостающие секции с текущего месяца (или с месяца since — для загрузки истории)
+    на months_ahead вперед. Каждая секция — своя транзакция.
+    """
+    current = month_start(today or datetime.now(timezone.utc).date())
+    first = month_start(since) if since and since < current else current
+    months_back = (current.year - first.year) * 12 + current.month - first.month
+    async with engine.connect() as conn:
+        existing = set(await list_partitions(conn))
+    created = []
+    for offset in range(-months_back, months_ahead + 1):
+        month = add_months(current, offset)
+        if month in existing:
+            continue
+        async with engine.begin() as conn:
+            moved = await create_partition(conn, month)
+        created.append(partition_name(month))
+        print(f"✅ Создана секция {partition_name(month)}" + (f", перенесено из DEFAULT: {moved}" if moved else ""))
+    return created
+
+
+async def _export_csv_gz(raw_conn, name: str, path: str) -> int:
+    with gzip.open(path, "wb") as out:
+        async def write(chunk: bytes):
+            out.write(chunk)
+
+        status = await raw_conn.copy_from_query(f'SELECT * FROM "{name}" ORDER BY id', output=write, format="csv", header=True)
+    return int(status.split()[-1]) # "COPY <n>"
+
+
+async def _export_parquet(raw_conn, name: str, path: str) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Для TRANSACTIONS_ARCHIVE_FORMAT=parquet нужен пакет pyarrow")
+
+    schema = pa.schema([
+        ("id", pa.int64()), ("user_id", pa.int64()), ("type", pa.string()),
+        ("amount", pa.decimal128(18, 2)), ("currency", pa.string()),
+        ("timestamp", pa.timestamp("us", tz="UTC")), ("status", pa.string()),
+        ("description", pa.string()), ("txid", pa.string()),
+    ])
+    rows = 0
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        async with raw_conn.transaction():
+            cursor = await raw_conn.cursor(f'SELECT {", ".join(schema.names)} FROM "{name}" ORDER BY id')
+            while batch := await cursor.fetch(ARCHIVE_BATCH_ROWS):
+                writer.write_table(pa.Table.from_pylist([dict(record) for record in batch], schema=schema))
+                rows += len(batch)
+    return rows
+
+
+async def archive_partition(engine, month: date, directory: str, fmt: str = "csv.gz") -> str:
+    """
+    Выгружает секцию месяца в файл, сверяет число строк, затем отсоединяет и удаляет секцию.
+    Файл сначала пишется во временный и переименовывается: при сбое остается либо старый архив, либо никакого,
+    а секция удаляется только после успешной выгрузки — повторный запуск начнет заново.
+    """
+    if fmt not in ("csv.gz", "parquet"):
+        raise ValueError(f"Неизвестный формат архива: {fmt!r} (csv.gz или parquet)")
+    name = partition_name(month)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}.{fmt}")
+    tmp_path = f"{path}.tmp"
+
+    async with engine.connect() as conn:
+        expected = (await conn.execute(text(f'SELECT count(*) FROM "{name}"'))).scalar_one()
+        raw_conn = (await conn.get_raw_connection()).driver_connection
+        export = _export_parquet if fmt == "parquet" else _export_csv_gz
+        written = await export(raw_conn, name, tmp_path)
+    if written != expected:
+        os.remove(tmp_path)
+        raise RuntimeError(f"Секция {name}: выгружено {written} строк из {expected}, секция не удалена")
+    os.replace(tmp_path, path)
+
+    async with engine.begin() as conn:
+        await record_opening_sums(conn, name, month)
+        await conn.execute(text(f'ALTER TABLE {PARENT_TABLE} DETACH PARTITION "{name}"'))
+        await conn.execute(text(f'DROP TABLE "{name}"'))
+    print(f"📦 Секция {name} ({written} строк) выгружена в {path} и удалена из БД.")
+    return path
+
+
+async def archive_old_partitions(engine, after_months: int, directory: str, fmt: str,
+                                 today: Optional[date] = None) -> list[str]:
+    """Архивирует секции месяцев, закончившихся больше after_months месяцев назад."""
+    if after_months <= 0:
+        return []
+    cutoff = add_months(month_start(today or datetime.now(timezone.utc).date()), -after_months)
+    async with engine.connect() as conn:
+        old = [month for month in await list_partitions(conn) if month < cutoff]
+    return [await archive_partition(engine, month, directory, fmt) for month in old]
+
+
+async def _main(args) -> int:
+    from app.database import get_engine
+
+    settings = get_settings()
+    engine = get_engine()
+    try:
+        if args.command == "list":
+            async with engine.connect() as conn:
+                for month in await list_partitions(conn):
+                    print(partition_name(month))
+                in_default = (await conn.execute(text(f"SELECT count(*) FROM {DEFAULT_PARTITION}"))).scalar_one()
+            print(f"{DEFAULT_PARTITION}: {in_default} строк")
+        elif args.command == "ensure":
+            created = await ensure_partitions(engine, args.months_ahead)
+            print(f"Создано секций: {len(created)}.")
+        elif args.command == "archive":
+            archived = await archive_old_partitions(
+                engine, args.after_months, settings.transactions_archive_dir, settings.transactions_archive_format,
+            )
+            print(f"Архивировано секций: {len(archived)}.")
+        return 0
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m app.partitions", description="Секции таблицы transactions")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="Список секций")
+    ensure_parser = sub.add_parser("ensure", help="Создать секции наперед")
+    ensure_parser.add_argument("--months-ahead", type=int, default=PARTITIONS_AHEAD)
+    archive_parser = sub.add_parser("archive", help="Выгрузить и удалить старые секции")
+    archive_parser.add_argument("--after-months", type=int, default=get_settings().transactions_archive_after_months,
+                                help="старше скольких месяцев (по умолчанию TRANSACTIONS_ARCHIVE_AFTER_MONTHS)")
+    raise SystemExit(asyncio.run(_main(parser.parse_args())))
@@ -0,0 +1,101 @@
+# app/payouts.py
+"""
+Провайдеры выплат для обработчика заявок на вывод (app/withdrawals.py).
+
+Провайдер получает пачку выплат и возвращает результат по каждой:
+  - completed — деньги отправлены (provider_ref — идентификатор выплаты у провайдера);
+  - failed    — провайдер окончательно отказал: заявка отклоняется, сумма возвращается пользователю;
+  - retry     — временная ошибка: заявка вернется в очередь и будет отправлена позже.
+Исключение из send_batch означает retry для всей пачки.
+
+Ключ идемпотентности выплаты — "withdrawal:<id>": после сбоя обработчика заявку могут отправить
+повторно, и провайдер обязан не платить дважды по одному ключу.
+
+Провайдер выбирается по PAYOUT_PROVIDER: "stub" (по умолчанию — локальная заглушка для разработки
+и тестов) или путь к классу "package.module:ClassName" с конструктором без аргументов.
+"""
+import importlib
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Optional, Protocol
+
+from app.config import get_settings
+
+COMPLETED = "completed"
+FAILED = "failed"
+RETRY = "retry"
+
+
+@dataclass(frozen=True)
+class Payout:
+    withdrawal_id: int
+    user_id: int
+    amount: Decimal
+    currency: str
+    destination: str
+
+    @property
+    def idempotency_key(self) -> str:
+        return f"withdrawal:{self.withdrawal_id}"
+
+
+@dataclass(frozen=True)
+class PayoutResult:
+    withdrawal_id: int
+    outcome: str # COMPLETED / FAILED / RETRY
+    provider_ref: Optional[str] = None
+    error: Optional[str] = None
+
+
+class PayoutProvider(Protocol):
+    name: str
+
+    async def send_batch(self, payouts: list[Payout]) -> list[PayoutResult]:
+        """Отправляет пачку выплат. Выплаты, которых нет в ответе, считаются RETRY."""
+        ...
+
+
+class StubPayoutProvider:
+    """
+    Локальная заглушка: выплаты «проходят» сразу, без внешних вызовов. Для проверки отказов
+    назначения с префиксом "fail:" отклоняются, а с префиксом "retry:" — временно недоступны.
+    """
+
+    name = "stub"
+
+    def __init__(self):
+        self.sent: dict[str, Payout] = {} # idempotency_key -> выплата: повтор ключа не «платит» второй раз
+
+    async def send_batch(self, payouts: list[Payout]) -> list[PayoutResult]:
+        results = []
+        for payout in payouts:
+            if payout.destination.startswith("fail:"):
+                results.append(PayoutResult(payout.withdrawal_id, FAILED, error="Получатель отклонен провайдером"))
+            elif payout.destination.startswith("retry:"):
+                results.append(PayoutResult(payout.withdrawal_id, RETRY, error="Провайдер временно недоступен"))
+            else:
+                self.sent.setdefault(payout.idempotency_key, payout)
+                results.append(PayoutResult(payout.withdrawal_id, COMPLETED, provider_ref=f"stub-{payout.withdrawal_id}"))
+        return results
+
+
+_provider = None
+
+
+def get_payout_provider() -> PayoutProvider:
+    """Провайдер процесса по PAYOUT_PROVIDER; создается при первом обращении."""
+    global _provider
+    if _provider is None:
+        spec = get_settings().payout_provider
+        if spec == "stub":
+            _provider = StubPayoutProvider()
+        else:
+            module_name, _, class_name = spec.partition(":")
+            _provider = getattr(importlib.import_module(module_name), class_name)()
+    return _provider
+
+
+def set_payout_provider(provider):
+    """Подменяет провайдера (тесты, локальная заглушка)."""
+    global _provider
+    _provider = provider
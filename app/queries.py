@@ -0,0 +1,99 @@
+# app/queries.py
+"""
+Горячие запросы роутеров, собранные через lambda_stmt.
+
+select(...) на каждый запрос — это построение дерева выражений и вычисление ключа кеша компиляции.
+lambda_stmt строит запрос один раз на место в коде: при следующих вызовах SQLAlchemy берет готовый
+скомпилированный SQL из кеша, а из замыкания достает только значения переменных — они становятся
+bind-параметрами. Поэтому внутри лямбд — только параметры запроса, без условной логики;
+условные части добавляются через `stmt += lambda s: ...`.
+
+Неизменный текст запроса к тому же дает одинаковый SQL, и asyncpg переиспользует подготовленный
+оператор на пуловом соединении (см. app/database.py).
+"""
+from sqlalchemy import func, lambda_stmt, or_, select
+
+from app.models import Investment, InvestmentPackage, Referral, Transaction, User, UserStat
+
+# Колонки, которые отдаются в истории транзакций (в этом порядке они и попадут в JSON)
+TRANSACTION_COLUMNS = (
+    Transaction.id, Transaction.user_id, Transaction.type, Transaction.amount,
+    Transaction.currency, Transaction.timestamp, Transaction.status,
+    Transaction.description, Transaction.txid,
+)
+
+# Колонки совпадают с InvestmentPackageResponse
+PACKAGE_COLUMNS = (
+    InvestmentPackage.id, InvestmentPackage.name, InvestmentPackage.min_amount,
+    InvestmentPackage.max_amount, InvestmentPackage.daily_roi_percentage,
+    InvestmentPackage.duration_days, InvestmentPackage.description, InvestmentPackage.is_active,
+)
+
+
+# --- Пользователи ---
+
+def user_by_id(user_id: int):
+    return lambda_stmt(lambda: select(User).where(User.id == user_id))
+
+
+def user_by_email(email: str):
+    return lambda_stmt(lambda: select(User).where(User.email == email))
+
+
+def registration_conflicts(telegram_id: int, username: str, email: str, phone_number: str):
+    """Все пользователи, с которыми конфликтует регистрация, — один запрос вместо четырех."""
+    return lambda_stmt(lambda: select(User.id, User.username, User.email, User.phone_number).where(or_(
+        User.id == telegram_id, User.username == username,
+        User.email == email, User.phone_number == phone_number,
+    )))
+
+
+# --- Инвестиции ---
+
+def active_packages():
+    return lambda_stmt(
+        lambda: select(*PACKAGE_COLUMNS).where(InvestmentPackage.is_active == True).order_by(InvestmentPackage.min_amount)
+    )
+
+
+def investment_by_charge_id(charge_id: str):
+    return lambda_stmt(lambda: select(Investment).where(Investment.stars_payment_charge_id == charge_id))
+
+
+# --- Рефералы ---
+
+def user_stat_sum(user_id: int, tx_type: str):
+    return lambda_stmt(lambda: select(UserStat.amount_sum).where(UserStat.user_id == user_id, UserStat.type == tx_type))
+
+
+def referrals_count(referrer_id: int):
+    return lambda_stmt(lambda: select(func.count(Referral.id)).where(Referral.referrer_id == referrer_id))
+
+
+def direct_referrals(referrer_ids: list[int]):
+    """Прямые приглашенные (referral_level = 1) указанных рефереров вместе с их пользователями."""
+    return lambda_stmt(lambda: select(Referral, User).join(User, Referral.referred_id == User.id).where(
+        Referral.referrer_id.in_(referrer_ids), Referral.referral_level == 1,
+    ))
+
+
+# --- Транзакции ---
+
+def transaction_history(user_id: int, types=None, since=None, until=None):
+    """История пользователя, новые сверху. Фильтры необязательные; каждый вариант кешируется отдельно."""
+    stmt = lambda_stmt(lambda: select(*TRANSACTION_COLUMNS).where(Transaction.user_id == user_id))
+    if types:
+        stmt += lambda s: s.where(Transaction.type.in_(types))
+    if since is not None:
+        stmt += lambda s: s.where(Transaction.timestamp >= since)
+    if until is not None:
+        stmt += lambda s: s.where(Transaction.timestamp < until)
+    stmt += lambda s: s.order_by(Transaction.timestamp.desc())
+    return stmt
+
+
+def ledger_mark(user_id: int):
+    """Отметка журнала пользователя для ETag: последняя транзакция и их число (строки user_stats по ключу)."""
+    return lambda_stmt(lambda: select(func.max(UserStat.last_transaction_id), func.sum(UserStat.tx_count)).where(
+        UserStat.user_id == user_id,
+    ))
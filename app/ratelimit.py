@@ -0,0 +1,124 @@
+# app/ratelimit.py
+import json
+import math
+from typing import Optional
+from urllib.parse import parse_qsl
+
+from fastapi import HTTPException, Request, status
+from fastapi.responses import JSONResponse
+
+from app.config import get_settings
+from app.loop_lag import loop_lag_monitor
+from app.shared_state import get_shared_state
+from app.utils import check_webapp_signature
+
+settings = get_settings()
+BOT_TOKEN = settings.bot_token
+
+# Лимиты можно выключить целиком (например, для нагрузочных бенчмарков)
+RATE_LIMIT_ENABLED = settings.rate_limit_enabled
+
+# Классы маршрутов: (скорость пополнения, токенов/сек; емкость ведра)
+RATE_LIMITS = {
+    "games": (2.0, 10),   # /api/games/* — до 10 спинов подряд, дальше 2 в секунду
+    "auth": (0.2, 5),     # /api/login, /api/register — bcrypt дорогой: 5 попыток, потом 1 раз в 5 сек
+    "invoice": (0.5, 3),  # /api/create_stars_invoice — каждый вызов идет в Telegram Bot API
+    "withdrawals": (0.1, 3), # POST /api/withdrawals — заявок на вывод немного, частые попытки подозрительны
+}
+
+# Ведра лежат в общем состоянии воркеров (app.shared_state): в памяти процесса или в Redis,
+# поэтому лимит один и тот же при любом числе воркеров, если задан SHARED_STATE_URL.
+
+# Если event loop опаздывает сильнее порога — отвечаем 429 сразу, не принимая запрос в работу
+LOAD_SHED_LAG_SECONDS = settings.load_shed_lag_seconds
+# Вебхуки Telegram не сбрасываем: платеж уже списан, а повторы бота только добавят нагрузки
+# /metrics тоже: мониторинг должен работать именно тогда, когда сервер перегружен
+LOAD_SHED_EXEMPT_PATHS = ("/webhook", "/telegram_payment_webhook", "/metrics")
+
+
+async def telegram_user_id(request: Request) -> Optional[int]:
+    """
+    Проверенный Telegram ID из initData (параметр запроса или поле JSON-тела), иначе None.
+    Результат запоминается в request.state: лимитер и детектор мошенничества проверяют подпись один раз.
+    """
+    if hasattr(request.state, "telegram_user_id"):
+        return request.state.telegram_user_id
+    init_data = request.query_params.get("initData")
+    if not init_data and request.method == "POST":
+        try:
+            body = await request.json() # Starlette кеширует тело — обработчик прочитает его повторно без проблем
+        except Exception:
+            body = None
+        if isinstance(body, dict):
+            init_data = body.get("initData") or body.get("telegramInitData")
+
+    user_id = None
+    if init_data and BOT_TOKEN and check_webapp_signature(init_data, BOT_TOKEN):
+        try:
+            user_id = int(json.loads(dict(parse_qsl(init_data))['user'])['id'])
+        except (KeyError, TypeError, ValueError):
+            pass
+    request.state.telegram_user_id = user_id
+    return user_id
+
+
+async def _client_key(request: Request) -> str:
+    """Ключ клиента: проверенный Telegram ID из initData, иначе IP-адрес."""
+    user_id = await telegram_user_id(request)
+    if user_id is not None:
+        return f"tg:{user_id}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+def rate_limit(route_class: str):
+    """
+    Зависимость FastAPI: ограничивает частоту запросов для класса маршрутов.
+    Использование: @router.post(..., dependencies=[Depends(rate_limit("games"))])
+    """
+    rate, burst = RATE_LIMITS[route_class]
+
+    async def dependency(request: Request):
+        if not RATE_LIMIT_ENABLED:
+            return
+        key = f"{route_class}:{await _client_key(request)}"
+        try:
+            retry_after = await get_shared_state().take_token(f"ratelimit:{key}", rate, burst)
+        except Exception as e:
+            # Общий бэкенд недоступен — пропускаем запрос, а не роняем API
+            print(f"ВНИМАНИЕ: rate limiter недоступен, запрос пропущен без проверки: {e}")
+            return
+        if retry_after > 0:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Слишком много запросов. Попробуйте позже.",
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+            )
+
+    return dependency
+
+
+class LoadSheddingMiddleware:
+    """
+    ASGI-middleware: пока задержка event loop выше порога, новые запросы сразу получают
+    429 + Retry-After. Так перегруженный воркер не копит очередь из запросов, которые все равно не успеет.
+    """
+
+    def __init__(self, app, max_lag: float = LOAD_SHED_LAG_SECONDS, exempt_paths: tuple = LOAD_SHED_EXEMPT_PATHS):
+        self.app = app
+        self.max_lag = max_lag
+        self.exempt_paths = exempt_paths
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] == "http"
+            and loop_lag_monitor.lag > self.max_lag
+            and not scope["path"].startswith(self.exempt_paths)
+        ):
+            response = JSONResponse(
+                {"detail": "Сервер перегружен. Попробуйте позже."},
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={"Retry-After": str(max(1, math.ceil(loop_lag_monitor.lag)))},
+            )
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
@@ -4,18 +4,28 @@ from decimal import Decimal
 from typing import List, Optional, Dict
 
 from fastapi import APIRouter, Depends, HTTPException, status, Request
-from sqlalchemy import select, func
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 
-from app.database import get_async_session
-from app.models import User, Referral # Make sure Referral is imported from app.models
+from app import queries
+from app.database import get_read_session, get_session_factory, read_your_writes
+from app.models import Referral
+from app.responses import fast_json
+from app.shared_state import InMemorySharedState, get_shared_state
 from app.utils import check_webapp_signature, parse_qsl # Assuming parse_qsl is also in app.utils
+from app.config import get_settings
 
-import os
-from dotenv import load_dotenv
-load_dotenv()
-BOT_TOKEN = os.getenv("BOT_TOKEN")
+BOT_TOKEN = get_settings().bot_token
+# Тип транзакции реферального вознаграждения: сумма по нему в user_stats — «всего заработано с рефералов»
+REFERRAL_COMMISSION_TX_TYPE = "referral_commission"
+# Реферальная ссылка: https://t.me/lucrora_bot?start=ref_<id> — параметр /start (или start_param Mini App)
+REFERRAL_CODE_PREFIX = "ref_"
+# Сколько помним, по чьей ссылке пользователь пришел в бота, пока он не зарегистрировался
+PENDING_REFERRAL_TTL_SECONDS = 7 * 24 * 3600
+# users.id — BIGINT: большее число из кода ссылки сломало бы запрос при регистрации
+MAX_USER_ID = 2**63 - 1
 
 router = APIRouter(prefix="/api", tags=["referrals"])
 
@@ -52,8 +62,10 @@ COMMISSION_RATES = {
     # Add more levels if needed
 }
 
-@router.post("/referral_data")
-async def get_referral_data(request: Request, db: AsyncSession = Depends(get_async_session)):
+# Pydantic-схемы выше описывают ответ для OpenAPI, но сам ответ собирается из обычных dict
+# и отдается через fast_json — без построения моделей и повторной валидации на выходе.
+@router.post("/referral_data", response_model=ReferralSystemResponse)
+async def get_referral_data(request: Request, db: AsyncSession = Depends(get_read_session)):
     try:
         body = await request.json()
     except Exception:
@@ -77,57 +89,56 @@ async def get_referral_data(request: Request, db: AsyncSession = Depends(get_asy
     except (json.JSONDecodeError, ValueError):
         raise HTTPException(status_code=400, detail="Invalid user data JSON or Telegram ID in initData.")
 
+    await read_your_writes(db, telegram_id)
+
     # Fetch the current user
-    stmt_user = select(User).where(User.id == telegram_id)
-    current_user = (await db.execute(stmt_user)).scalar_one_or_none()
+    current_user = (await db.execute(queries.user_by_id(telegram_id))).scalar_one_or_none()
 
     if not current_user:
         raise HTTPException(status_code=404, detail="User not found.")
 
+    return fast_json(await build_referral_data(db, current_user))
+
+
+async def build_referral_data(db: AsyncSession, current_user) -> dict:
+    """Ответ /api/referral_data для пользователя: ссылка, заработок, число рефералов и два уровня сети."""
     # 1. Generate Referral Link
     # Replace 'YourBot' with your actual bot username
-    referral_link = f"https://t.me/lucrora_bot?start=ref_{current_user.id}"
+    referral_link = f"https://t.me/lucrora_bot?start={REFERRAL_CODE_PREFIX}{current_user.id}"
 
     # 2. Calculate Total Referral Earnings
-    # Sum of bonus_earned for all referrals made by this user
-    total_earnings_stmt = select(func.sum(Referral.bonus_earned)).where(
-        Referral.referrer_id == current_user.id
-    )
+    # Одна строка user_stats по первичному ключу вместо суммы по всем рефералам
+    total_earnings_stmt = queries.user_stat_sum(current_user.id, REFERRAL_COMMISSION_TX_TYPE)
     total_referral_earnings = (await db.execute(total_earnings_stmt)).scalar_one_or_none() or Decimal('0.00')
 
     # 3. Calculate Active Referrals Count
     # For simplicity, let's define "active" as someone who has at least one investment.
     # This requires joining with the Investment table if you have one.
     # For now, let's just count all direct referrals who have registered.
-    active_referrals_count_stmt = select(func.count(Referral.id)).where(
-        Referral.referrer_id == current_user.id
-    )
+    active_referrals_count_stmt = queries.referrals_count(current_user.id)
     active_referrals_count = (await db.execute(active_referrals_count_stmt)).scalar_one()
 
     # 4. Build Referral Network Levels
-    referral_network_levels: List[ReferralLevelData] = []
+    referral_network_levels: List[dict] = []
 
     # Level 1 Referrals (Direct referrals)
-    level1_referrals_stmt = select(Referral, User).join(User, Referral.referred_id == User.id).where(
-        Referral.referrer_id == current_user.id,
-        Referral.referral_level == 1
-    )
+    level1_referrals_stmt = queries.direct_referrals([current_user.id])
     level1_results = (await db.execute(level1_referrals_stmt)).all()
 
     level1_details = []
     level1_earned_total = Decimal('0.00')
     for referral, referred_user in level1_results:
-        level1_details.append(ReferralDetails(
-            username=referred_user.username,
-            bonus_earned=float(referral.bonus_earned)
-        ))
+        level1_details.append({
+            "username": referred_user.username,
+            "bonus_earned": referral.bonus_earned,
+        })
         level1_earned_total += referral.bonus_earned
 
-    referral_network_levels.append(ReferralLevelData(
-        level=1,
-        referrals=level1_details,
-        earned_from_level=float(level1_earned_total)
-    ))
+    referral_network_levels.append({
+        "level": 1,
+        "referrals": level1_details,
+        "earned_from_level": level1_earned_total,
+    })
 
     # Level 2 Referrals (Referrals of Level 1 referrals)
     # This requires a more complex query, potentially recursive or multiple joins.
@@ -138,33 +149,152 @@ async def get_referral_data(request: Request, db: AsyncSession = Depends(get_asy
     level1_referred_ids = [ref.referred_id for ref, _ in level1_results]
     
     if level1_referred_ids:
-        level2_referrals_stmt = select(Referral, User).join(User, Referral.referred_id == User.id).where(
-            Referral.referrer_id.in_(level1_referred_ids),
-            Referral.referral_level == 1 # This level in the Referral table is relative to *their* referrer
-        )
+        # referral_level в таблице — уровень относительно *их* реферера, поэтому снова прямые приглашенные
+        level2_referrals_stmt = queries.direct_referrals(level1_referred_ids)
         level2_results = (await db.execute(level2_referrals_stmt)).all()
 
         level2_details = []
         level2_earned_total = Decimal('0.00')
         for referral, referred_user in level2_results:
-            level2_details.append(ReferralDetails(
-                username=referred_user.username,
-                bonus_earned=float(referral.bonus_earned)
-            ))
+            level2_details.append({
+                "username": referred_user.username,
+                "bonus_earned": referral.bonus_earned,
+            })
             level2_earned_total += referral.bonus_earned
 
-        referral_network_levels.append(ReferralLevelData(
-            level=2,
-            referrals=level2_details,
-            earned_from_level=float(level2_earned_total)
-        ))
+        referral_network_levels.append({
+            "level": 2,
+            "referrals": level2_details,
+            "earned_from_level": level2_earned_total,
+        })
     
     # Sort levels for consistent display
-    referral_network_levels.sort(key=lambda x: x.level)
-
-    return ReferralSystemResponse(
-        referral_link=referral_link,
-        total_referral_earnings=float(total_referral_earnings),
-        active_referrals_count=active_referrals_count,
-        referral_network_levels=referral_network_levels
-    )
\ No newline at end of file
+    referral_network_levels.sort(key=lambda x: x["level"])
+
+    return {
+        "ok": True,
+        "message": "Referral data fetched successfully",
+        "referral_link": referral_link,
+        "total_referral_earnings": total_referral_earnings,
+        "active_referrals_count": active_referrals_count,
+        "referral_network_levels": referral_network_levels,
+    }
+
+
+# --- Привязка к рефереру по реферальной ссылке ---
+# С SHARED_STATE_URL /start ref_<id> ничего не пишет в БД: реферер запоминается в Redis с TTL, а строка
+# referrals создается только при регистрации, в одной транзакции с пользователем. Волна переходов по ссылке
+# от тех, кто так и не зарегистрируется, стоит только записи в кеш.
+# Без общего бэкенда кеш в памяти процесса не увидит воркер или реплика, которая примет /api/register,
+# поэтому реферер пишется одной строкой в pending_referrals (с тем же сроком жизни).
+# start_param Mini App подписан в initData и от хранилища не зависит.
+
+# Реферер подходит, если он существует и новый пользователь не среди его предков (иначе — цикл).
+# Предки — по уникальному индексу referrals.referred_id; UNION отбрасывает повторы, поэтому
+# уже существующий цикл в referrals не зациклит запрос.
+_REFERRER_CHECK_SQL = text("""
+WITH RECURSIVE ancestors AS (
+    SELECT referrer_id FROM referrals WHERE referred_id = :referrer_id
+    UNION
+    SELECT r.referrer_id FROM ancestors a JOIN referrals r ON r.referred_id = a.referrer_id
+)
+SELECT EXISTS (SELECT 1 FROM users WHERE id = :referrer_id) AS referrer_exists,
+       EXISTS (SELECT 1 FROM ancestors WHERE referrer_id = :user_id) AS creates_cycle
+""")
+
+_REMEMBER_PENDING_SQL = text("""
+INSERT INTO pending_referrals (user_id, referrer_id, expires_at)
+VALUES (:user_id, :referrer_id, now() + make_interval(secs => :ttl))
+ON CONFLICT (user_id) DO UPDATE SET referrer_id = EXCLUDED.referrer_id, expires_at = EXCLUDED.expires_at
+""")
+_PENDING_REFERRER_SQL = text("SELECT referrer_id FROM pending_referrals WHERE user_id = :user_id AND expires_at > now()")
+_FORGET_PENDING_SQL = text("DELETE FROM pending_referrals WHERE user_id = :user_id")
+_EXPIRE_PENDING_SQL = text("DELETE FROM pending_referrals WHERE expires_at <= now()")
+
+
+def _pending_in_shared_state() -> bool:
+    """Ожидающие рефереры — в общем бэкенде (Redis), а не в памяти процесса: иначе они хранятся в БД."""
+    return not isinstance(get_shared_state(), InMemorySharedState)
+
+
+def _pending_referral_key(user_id: int) -> str:
+    return f"pending_referral:{user_id}"
+
+
+def parse_referral_code(code: Optional[str]) -> Optional[int]:
+    """ID реферера из "ref_<id>"; None, если это не реферальный код."""
+    if not code or not code.startswith(REFERRAL_CODE_PREFIX):
+        return None
+    return _parse_user_id(code[len(REFERRAL_CODE_PREFIX):])
+
+
+def _parse_user_id(value: str) -> Optional[int]:
+    """Только ASCII-цифры в пределах BIGINT: isdigit() пропускает и «²», и 20-значные числа."""
+    if not (value.isascii() and value.isdigit()):
+        return None
+    user_id = int(value)
+    return user_id if user_id <= MAX_USER_ID else None
+
+
+async def remember_referral(user_id: int, code: Optional[str]) -> Optional[int]:
+    """Запоминает реферера из параметра /start до регистрации. Возвращает его ID или None."""
+    referrer_id = parse_referral_code(code)
+    if referrer_id is None or referrer_id == user_id:
+        return None
+    if _pending_in_shared_state():
+        await get_shared_state().set(_pending_referral_key(user_id), str(referrer_id), ttl=PENDING_REFERRAL_TTL_SECONDS)
+        return referrer_id
+    async with get_session_factory()() as db:
+        await db.execute(_REMEMBER_PENDING_SQL, {
+            "user_id": user_id, "referrer_id": referrer_id, "ttl": PENDING_REFERRAL_TTL_SECONDS,
+        })
+        await db.commit()
+    return referrer_id
+
+
+async def forget_referral(user_id: int):
+    if _pending_in_shared_state():
+        await get_shared_state().delete(_pending_referral_key(user_id))
+        return
+    async with get_session_factory()() as db:
+        await db.execute(_FORGET_PENDING_SQL, {"user_id": user_id})
+        await db.commit()
+
+
+async def expire_pending_referrals() -> int:
+    """Удаляет из pending_referrals записи с истекшим сроком. Возвращает их число."""
+    async with get_session_factory()() as db:
+        result = await db.execute(_EXPIRE_PENDING_SQL)
+        await db.commit()
+    return result.rowcount
+
+
+async def attach_referrer(db: AsyncSession, user_id: int, start_param: Optional[str] = None) -> Optional[int]:
+    """
+    Добавляет в сессию связь нового пользователя с реферером — коммитит ее вызывающий вместе с пользователем.
+    Реферер берется из start_param Mini App (подписан в initData), иначе — из запомненного /start.
+    Самоприглашение, несуществующий реферер, цикл и ошибка проверки отбрасываются. Возвращает ID реферера или None.
+    """
+    referrer_id = parse_referral_code(start_param)
+    if referrer_id is None:
+        if _pending_in_shared_state():
+            pending = await get_shared_state().get(_pending_referral_key(user_id))
+        else:
+            pending = (await db.execute(_PENDING_REFERRER_SQL, {"user_id": user_id})).scalar()
+        # Запомненное до проверки диапазона значение (Redis хранит его до 7 дней) не должно ломать регистрацию
+        referrer_id = _parse_user_id(str(pending)) if pending else None
+    if referrer_id is None or referrer_id == user_id:
+        return None
+    try:
+        # Точка сохранения: ошибка проверки не прерывает транзакцию, в которой вызывающий создает пользователя
+        async with db.begin_nested():
+            check = (await db.execute(_REFERRER_CHECK_SQL, {"referrer_id": referrer_id, "user_id": user_id})).one()
+    except DBAPIError as e:
+        print(f"Реферер {referrer_id} для пользователя {user_id} отклонен: ошибка проверки: {e}")
+        return None
+    if not check.referrer_exists or check.creates_cycle:
+        print(f"Реферер {referrer_id} для пользователя {user_id} отклонен: "
+              f"{'не найден' if not check.referrer_exists else 'цикл в цепочке рефералов'}")
+        return None
+    db.add(Referral(referrer_id=referrer_id, referred_id=user_id, referral_level=1))
+    return referrer_id
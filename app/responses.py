@@ -0,0 +1,58 @@
+# app/responses.py
+import enum
+from decimal import Decimal
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+
+# orjson сам умеет datetime/date/UUID/dataclass, поэтому ручные .isoformat() больше не нужны.
+# Decimal он не знает — его кодируем через default: по умолчанию во float (так фронтенд получал
+# числа и раньше), либо строкой, если важна точность до копейки.
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def _default_float(obj: Any):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, enum.Enum):
+        return obj.value
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def _default_str(obj: Any):
+    if isinstance(obj, Decimal):
+        return str(obj)
+    if isinstance(obj, enum.Enum):
+        return obj.value
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON-ответ на orjson. Используется как default_response_class всего приложения.
+    Если вернуть его из обработчика напрямую, FastAPI пропускает jsonable_encoder
+    и валидацию response_model — так делают горячие списочные эндпоинты.
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_default_float, option=_ORJSON_OPTIONS)
+
+
+class DecimalStringJSONResponse(FastJSONResponse):
+    """Тот же ответ, но Decimal отдается строкой ("12.50") без потери точности."""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_default_str, option=_ORJSON_OPTIONS)
+
+
+def fast_json(content: Any, status_code: int = 200, headers: dict | None = None) -> FastJSONResponse:
+    """Готовый ответ без повторной сериализации/валидации со стороны FastAPI."""
+    return FastJSONResponse(content=content, status_code=status_code, headers=headers)
+
+
+def dumps(content: Any) -> bytes:
+    """Сериализация в байты с теми же правилами, что и у FastJSONResponse."""
+    return orjson.dumps(content, default=_default_float, option=_ORJSON_OPTIONS)
+
@@ -0,0 +1,277 @@
+# app/routers/admin.py
+"""
+Массовые операции администратора: бан, начисление бонуса, отключение инвестиций; рассылки.
+
+Каждая операция принимает до MAX_USER_IDS id пользователей и применяет их пачками по CHUNK_SIZE:
+один set-based UPDATE (и INSERT в журнал) на пачку, каждая пачка — своя короткая транзакция.
+Строки users блокируются только в пределах пачки и в порядке id (без взаимных блокировок
+с другими пачками и задачами); lock_timeout не дает пачке повиснуть за чужой долгой транзакцией.
+
+Ответ — NDJSON (строка JSON на пачку), прогресс виден сразу:
+    {"chunk": 1, "chunks": 5, "processed": 1000, "updated": 998, "missing": [..]}
+    ...
+    {"done": true, "operation_id": "...", "processed": 5000, "updated": 4990, "missing": 3, "elapsed": 1.2}
+При ошибке последней строкой идет {"error": ..., "chunk": N}: пачки до нее уже применены.
+Начисление бонуса пишет в transactions txid = "admin:<operation_id>"; повтор с тем же operation_id
+пропускает пользователей, которым уже начислено, поэтому прерванную операцию можно просто повторить.
+"""
+import time
+import uuid
+from decimal import Decimal
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from fastapi.security import HTTPAuthorizationCredentials
+from pydantic import BaseModel, Field
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import broadcasts, fraud
+from app.database import get_async_session, get_session_factory
+from app.events import balances_from_rows, publish_balances
+from app.models import Broadcast, User, UserAccountStatus, UserRole
+from app.responses import dumps
+from app.security import security, verify_access_token
+
+router = APIRouter(prefix="/api/admin", tags=["admin"])
+
+# Сколько пользователей обрабатывает одна транзакция
+CHUNK_SIZE = 1000
+# Больше id в одном запросе не принимаем
+MAX_USER_IDS = 100_000
+# Дольше пачка не ждет блокировку строки (например, пользователь прямо сейчас играет)
+LOCK_TIMEOUT = "5s"
+# Тип транзакции ручного начисления бонуса
+ADMIN_BONUS_TX_TYPE = "admin_bonus"
+
+# Роли, которым доступна операция
+BAN_ROLES = (UserRole.admin, UserRole.moderator)
+ADMIN_ROLES = (UserRole.admin,)
+
+_BAN_SQL = text("""
+WITH targets AS (
+    SELECT id, status FROM users WHERE id = ANY(CAST(:ids AS BIGINT[])) ORDER BY id FOR UPDATE
+),
+banned AS (
+    UPDATE users u SET status = 'banned'
+    FROM targets
+    WHERE u.id = targets.id AND targets.status <> 'banned'
+    RETURNING u.id
+)
+SELECT (SELECT array_agg(id) FROM targets) AS found, (SELECT count(*) FROM banned) AS updated
+""")
+
+# Баланс, журнал и user_stats — одним запросом, как начисление ROI в app/jobs.py.
+# Пользователи, у которых уже есть транзакция этой операции (txid), пропускаются.
+# Начисление прибавляется к текущему значению под FOR UPDATE; игры и ежедневный бонус
+# (app/routers/games.py) блокируют ту же строку до записи баланса, так что начисление не затирается.
+_CREDIT_BONUS_SQL = text("""
+WITH targets AS (
+    SELECT u.id FROM users u
+    WHERE u.id = ANY(CAST(:ids AS BIGINT[]))
+    ORDER BY u.id
+    FOR UPDATE
+),
+pending AS (
+    SELECT targets.id FROM targets
+    WHERE NOT EXISTS (
+        SELECT 1 FROM transactions t
+        WHERE t.user_id = targets.id AND t.type = :tx_type AND t.txid = :txid
+    )
+),
+credited AS (
+    UPDATE users u SET bonus_balance = COALESCE(u.bonus_balance, 0) + :amount
+    FROM pending
+    WHERE u.id = pending.id
+    RETURNING u.id, u.main_balance, u.bonus_balance, u.lucrum_balance
+),
+ledger AS (
+    INSERT INTO transactions (user_id, type, amount, currency, status, description, txid)
+    SELECT id, :tx_type, :amount, '₤s', 'completed', :description, :txid
+    FROM credited
+    RETURNING id, user_id, amount, timestamp
+),
+stats AS (
+    INSERT INTO user_stats (user_id, type, tx_count, amount_sum, last_activity_at, last_transaction_id)
+    SELECT user_id, :tx_type, count(*), sum(amount), max(timestamp), max(id)
+    FROM ledger
+    GROUP BY user_id
+    ORDER BY user_id
+    ON CONFLICT (user_id, type) DO UPDATE
+    SET tx_count = user_stats.tx_count + EXCLUDED.tx_count,
+        amount_sum = user_stats.amount_sum + EXCLUDED.amount_sum,
+        last_activity_at = GREATEST(user_stats.last_activity_at, EXCLUDED.last_activity_at),
+        last_transaction_id = GREATEST(user_stats.last_transaction_id, EXCLUDED.last_transaction_id)
+)
+SELECT (SELECT array_agg(id) FROM targets) AS found, (SELECT count(*) FROM credited) AS updated,
+       (SELECT array_agg(ARRAY[id, main_balance, bonus_balance, lucrum_balance]) FROM credited) AS balances
+""")
+
+# users не блокируются вовсе: меняются только строки investments
+_DEACTIVATE_INVESTMENTS_SQL = text("""
+WITH found AS (
+    SELECT id FROM users WHERE id = ANY(CAST(:ids AS BIGINT[]))
+),
+deactivated AS (
+    UPDATE investments SET is_active = false, end_date = now()
+    WHERE user_id = ANY(CAST(:ids AS BIGINT[]))
+      AND is_active
+      AND (CAST(:package_id AS INTEGER) IS NULL OR package_id = :package_id)
+    RETURNING id
+)
+SELECT (SELECT array_agg(id) FROM found) AS found, (SELECT count(*) FROM deactivated) AS updated
+""")
+
+
+# --- Схемы запросов ---
+
+class BulkUsersRequest(BaseModel):
+    user_ids: list[int] = Field(..., min_length=1, max_length=MAX_USER_IDS)
+
+
+class CreditBonusRequest(BulkUsersRequest):
+    amount: Decimal = Field(..., gt=0, max_digits=18, decimal_places=2)
+    description: str = Field("Бонус от администрации", max_length=500)
+    # Повторный запрос с тем же operation_id не начислит бонус дважды
+    operation_id: Optional[str] = Field(None, max_length=64)
+
+
+class DeactivateInvestmentsRequest(BulkUsersRequest):
+    package_id: Optional[int] = None # Только инвестиции в этот пакет; по умолчанию — все активные
+
+
+class BroadcastRequest(BaseModel):
+    text: str = Field(..., min_length=1, max_length=4096) # Лимит Telegram на длину сообщения
+
+
+# --- Доступ ---
+
+def require_role(*roles: UserRole):
+    """Зависимость: Access Token активного пользователя с одной из ролей, иначе 403."""
+    async def dependency(
+        db: AsyncSession = Depends(get_async_session),
+        credentials: HTTPAuthorizationCredentials = Depends(security),
+    ) -> User:
+        user = await db.get(User, verify_access_token(credentials.credentials))
+        if not user or user.status != UserAccountStatus.active or user.role not in roles:
+            raise HTTPException(status_code=403, detail="Insufficient permissions.")
+        return user
+    return dependency
+
+
+# --- Выполнение пачками ---
+
+def _stream_chunks(name: str, admin: User, user_ids: list[int], sql, params: dict, operation_id: str):
+    """NDJSON-ответ: выполняет sql для каждой пачки user_ids в своей транзакции и пишет строку прогресса."""
+    ids = sorted(set(user_ids)) # Один порядок блокировок для всех операций
+    chunks = [ids[i:i + CHUNK_SIZE] for i in range(0, len(ids), CHUNK_SIZE)]
+
+    async def lines():
+        started = time.monotonic()
+        processed = updated = missing = 0
+        print(f"🛡️ {name}: {len(ids)} пользователей, операция {operation_id}, выполняет {admin.username} (ID: {admin.id})")
+        session_factory = get_session_factory()
+        for number, chunk in enumerate(chunks, start=1):
+            try:
+                async with session_factory() as db:
+                    await db.execute(text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'"))
+                    row = (await db.execute(sql, {**params, "ids": chunk})).one()
+                    await db.commit()
+                # Операции, меняющие балансы, возвращают их: подписчики GET /api/events увидят сразу
+                await publish_balances(balances_from_rows(row._mapping.get("balances")))
+            except Exception as e:
+                reason = str(getattr(e, "orig", e)) # Ошибка драйвера, без текста SQL и параметров
+                print(f"❌ {name}, операция {operation_id}: пачка {number}/{len(chunks)} не применена: {reason}")
+                yield dumps({"error": reason, "chunk": number, "operation_id": operation_id}) + b"\n"
+                return
+            chunk_missing = sorted(set(chunk) - set(row.found or ()))
+            processed += len(chunk)
+            updated += row.updated
+            missing += len(chunk_missing)
+            yield dumps({
+                "chunk": number, "chunks": len(chunks), "processed": processed,
+                "updated": row.updated, "missing": chunk_missing,
+            }) + b"\n"
+        elapsed = round(time.monotonic() - started, 3)
+        print(f"✅ {name}, операция {operation_id}: обработано {processed}, изменено {updated}, не найдено {missing} за {elapsed} с")
+        yield dumps({
+            "done": True, "operation_id": operation_id, "processed": processed,
+            "updated": updated, "missing": missing, "elapsed": elapsed,
+        }) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+# --- Эндпоинты ---
+
+@router.post("/users/ban")
+async def ban_users(body: BulkUsersRequest, admin: User = Depends(require_role(*BAN_ROLES))):
+    """Блокирует пользователей (status = banned). Уже заблокированные не считаются измененными."""
+    return _stream_chunks("Бан", admin, body.user_ids, _BAN_SQL, {}, str(uuid.uuid4()))
+
+
+@router.post("/users/credit_bonus")
+async def credit_bonus(body: CreditBonusRequest, admin: User = Depends(require_role(*ADMIN_ROLES))):
+    """Начисляет amount на bonus_balance с транзакцией admin_bonus каждому пользователю."""
+    operation_id = body.operation_id or str(uuid.uuid4())
+    params = {
+        "amount": body.amount, "description": body.description,
+        "tx_type": ADMIN_BONUS_TX_TYPE, "txid": f"admin:{operation_id}",
+    }
+    return _stream_chunks("Начисление бонуса", admin, body.user_ids, _CREDIT_BONUS_SQL, params, operation_id)
+
+
+@router.post("/investments/deactivate")
+async def deactivate_investments(body: DeactivateInvestmentsRequest, admin: User = Depends(require_role(*ADMIN_ROLES))):
+    """Отключает активные инвестиции пользователей (is_active = false, end_date = сейчас): ROI больше не начисляется."""
+    params = {"package_id": body.package_id}
+    return _stream_chunks("Отключение инвестиций", admin, body.user_ids, _DEACTIVATE_INVESTMENTS_SQL, params, str(uuid.uuid4()))
+
+
+@router.get("/fraud/{user_id}")
+async def fraud_status(user_id: int, admin: User = Depends(require_role(*BAN_ROLES))):
+    """Флаг и действующие ограничения детектора мошенничества (app/fraud.py) для пользователя."""
+    return await fraud.user_status(user_id)
+
+
+# --- Рассылки (app/broadcasts.py) ---
+
+@router.post("/broadcasts")
+async def create_broadcast(
+    body: BroadcastRequest,
+    admin: User = Depends(require_role(*ADMIN_ROLES)),
+    db: AsyncSession = Depends(get_async_session),
+):
+    """Создает рассылку всем пользователям; ее выполнит процесс рассылок."""
+    broadcast = await broadcasts.create_broadcast(db, body.text, created_by=admin.id)
+    print(f"📣 Рассылка {broadcast.id} создана, автор {admin.username} (ID: {admin.id})")
+    return broadcasts.broadcast_stats(broadcast)
+
+
+@router.get("/broadcasts/{broadcast_id}")
+async def get_broadcast(
+    broadcast_id: int,
+    admin: User = Depends(require_role(*BAN_ROLES)),
+    db: AsyncSession = Depends(get_async_session),
+):
+    """Статус и статистика доставки рассылки."""
+    broadcast = await db.get(Broadcast, broadcast_id)
+    if broadcast is None:
+        raise HTTPException(status_code=404, detail="Broadcast not found.")
+    return broadcasts.broadcast_stats(broadcast)
+
+
+@router.post("/broadcasts/{broadcast_id}/{action}")
+async def change_broadcast_status(
+    broadcast_id: int,
+    action: Literal["pause", "resume", "cancel"],
+    admin: User = Depends(require_role(*ADMIN_ROLES)),
+    db: AsyncSession = Depends(get_async_session),
+):
+    """Пауза, продолжение или отмена. Идущая рассылка останавливается на ближайшем чекпоинте."""
+    broadcast = await broadcasts.change_status(db, broadcast_id, action)
+    if broadcast is None:
+        raise HTTPException(status_code=409, detail=f"Broadcast {broadcast_id} cannot {action} in its current status.")
+    print(f"📣 Рассылка {broadcast_id}: {action}, выполняет {admin.username} (ID: {admin.id})")
+    return broadcasts.broadcast_stats(broadcast)
@@ -0,0 +1,512 @@
+# app/routers/auth.py
+import json
+from datetime import datetime, timezone
+from urllib.parse import parse_qsl
+
+from fastapi import APIRouter, Request, HTTPException, Depends
+from fastapi.security import HTTPAuthorizationCredentials
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import queries
+from app.config import get_settings
+from app.database import get_async_session, get_read_session, read_your_writes
+from app.models import User, UserAccountStatus, UserRole
+from app.ratelimit import rate_limit
+from app.referrals import attach_referrer, forget_referral
+from app.security import (
+    security,
+    hash_password,
+    verify_password,
+    create_access_token,
+    create_refresh_token,
+    verify_access_token,
+    verify_refresh_token,
+)
+from app.utils import check_webapp_signature
+
+BOT_TOKEN = get_settings().bot_token
+
+router = APIRouter()
+
+
+# === АУТЕНТИФИКАЦИЯ / РЕГИСТРАЦИЯ / СЕССИИ ===
+
+@router.post("/api/register", dependencies=[Depends(rate_limit("auth"))])
+async def api_register(request: Request, db: AsyncSession = Depends(get_async_session)):
+    try:
+        data = await request.json()
+        init_data = data.get("initData")
+        username = data.get("username")
+        password = data.get("password")
+        # remember_me = data.get("rememberMe", False) # Этот флаг не используется в вашем текущем бэкенде, можно удалить
+        phone_number = data.get("phone_number") 
+        email = data.get("email") 
+                                
+        print(f"Получен запрос на регистрацию: init_data={init_data}, username={username}, phone_number={phone_number}, email={email}")
+
+        # Улучшенная проверка на отсутствующие данные. 
+        # Если init_data не пришла, это критично.
+        # Для остальных полей, если они ожидаются, их тоже нужно проверять.
+        if not init_data:
+            raise HTTPException(status_code=400, detail="Missing Telegram InitData.")
+        if not username:
+            raise HTTPException(status_code=400, detail="Username is required.")
+        if not password:
+            raise HTTPException(status_code=400, detail="Password is required.")
+        if not email: # Теперь email обязателен для регистрации
+             raise HTTPException(status_code=400, detail="Email is required.")
+        if not phone_number: # Теперь phone_number обязателен для регистрации
+             raise HTTPException(status_code=400, detail="Phone number is required.")
+
+        if not check_webapp_signature(init_data, BOT_TOKEN):
+            raise HTTPException(status_code=403, detail="Invalid Telegram initData signature.")
+
+        user_data_tg_str = dict(parse_qsl(init_data)).get('user')
+        if not user_data_tg_str:
+            raise HTTPException(status_code=400, detail="Telegram user data not found in initData.")
+
+        user_info_tg = json.loads(user_data_tg_str)
+        telegram_id = int(user_info_tg.get('id'))
+        first_name = user_info_tg.get('first_name')
+        last_name = user_info_tg.get('last_name')
+
+        # === НОВАЯ ЛОГИКА: Явные проверки на уникальность перед созданием пользователя ===
+        # Одним запросом находим всех, с кем есть конфликт; порядок проверок (и текст ошибки) прежний
+        conflicts = (await db.execute(queries.registration_conflicts(telegram_id, username, email, phone_number))).all()
+
+        # 1. Проверка по Telegram ID (пользователь уже зарегистрирован через бота)
+        if any(row.id == telegram_id for row in conflicts):
+            raise HTTPException(status_code=409, detail="User with this Telegram ID is already registered.")
+
+        # 2. Проверка уникальности username
+        if any(row.username == username for row in conflicts):
+            raise HTTPException(status_code=409, detail="Username already taken.")
+
+        # 3. Проверка уникальности email
+        if any(row.email == email for row in conflicts):
+            raise HTTPException(status_code=409, detail="Email already registered.")
+
+        # 4. Проверка уникальности phone_number
+        if any(row.phone_number == phone_number for row in conflicts):
+            raise HTTPException(status_code=409, detail="Phone number already registered.")
+
+        # Хэширование пароля
+        hashed_password = hash_password(password)
+
+        new_user = User(
+            id=telegram_id,
+            username=username,
+            first_name=first_name,
+            last_name=last_name,
+            password_hash=hashed_password,
+            status=UserAccountStatus.active, # Дефолтный статус активный
+            role=UserRole.user, # Дефолтная роль пользователь
+            phone_number=phone_number,
+            email=email
+        )
+        db.add(new_user)
+        # Реферер из ссылки (ref_<id>) сохраняется в той же транзакции, что и пользователь
+        referrer_id = await attach_referrer(db, telegram_id, dict(parse_qsl(init_data)).get('start_param'))
+        await db.commit()
+        await db.refresh(new_user)
+        if referrer_id is not None:
+            await forget_referral(telegram_id)
+
+        # === ГЕНЕРАЦИЯ ОБОИХ ТОКЕНОВ ===
+        access_token = create_access_token(data={"sub": str(new_user.id)})
+        refresh_token = create_refresh_token(data={"sub": str(new_user.id)})
+
+        print(f"Пользователь {username} (ID: {telegram_id}) успешно зарегистрирован"
+              f"{f' по ссылке {referrer_id}' if referrer_id is not None else ''}. Выданы токены.")
+
+        return {
+            "ok": True,
+            "message": "Registration successful!",
+            "user_id": str(telegram_id),
+            "username": username,
+            "access_token": access_token,
+            "refresh_token": refresh_token,
+            "token_type": "bearer",
+            "isRegistered": True,
+            "main_balance": float(new_user.main_balance),
+            "bonus_balance": float(new_user.bonus_balance),
+            "lucrum_balance": float(new_user.lucrum_balance),
+            "total_invested": float(new_user.total_invested),
+            "total_withdrawn": float(new_user.total_withdrawn),
+            "first_name": new_user.first_name,
+            "last_name": new_user.last_name,
+            "status": new_user.status.value,
+            "role": new_user.role.value,
+            "email": new_user.email,
+            "phone_number": new_user.phone_number
+        }
+    except HTTPException as e:
+        # Перехватываем HTTPException, чтобы FastAPI мог ее обработать как HTTP-ответ.
+        # Например, 400 (Missing data), 403 (Invalid signature), 409 (Conflict).
+        raise e
+    except Exception as e:
+        # Логируем любые другие неожиданные ошибки, прежде чем вернуть 500
+        print(f"НЕПРЕДВИДЕННАЯ ОШИБКА во время регистрации: {e}")
+        # Возвращаем 500, только если это действительно внутренняя, непредвиденная ошибка.
+        raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
+# ================================================
+
+@router.post("/api/login", dependencies=[Depends(rate_limit("auth"))])
+async def api_login(request: Request, db: AsyncSession = Depends(get_async_session)):
+    try:
+        data = await request.json()
+        init_data = data.get("initData")
+        email = data.get("email")
+        password = data.get("password")
+        remember_me = data.get("rememberMe", False) # НОВОЕ: флаг "Remember Me"
+
+        if not init_data or not email or not password:
+            raise HTTPException(status_code=400, detail="Missing required data.")
+
+        if not check_webapp_signature(init_data, BOT_TOKEN):
+            raise HTTPException(status_code=403, detail="Invalid Telegram initData signature.")
+
+        user_data_tg_str = dict(parse_qsl(init_data)).get('user')
+        if not user_data_tg_str:
+            raise HTTPException(status_code=400, detail="Telegram user data not found in initData")
+
+        user_info_tg = json.loads(user_data_tg_str)
+        telegram_id_from_tg = int(user_info_tg.get('id'))
+
+        user_query = await db.execute(queries.user_by_email(email))
+        user = user_query.scalar_one_or_none()
+
+        if not user or not verify_password(password, user.password_hash):
+            raise HTTPException(status_code=401, detail="Invalid username or password.")
+
+        # Проверяем, что Telegram ID из initData совпадает с ID пользователя в БД
+        if user.id != telegram_id_from_tg:
+            print(f"Предупреждение: Пользователь {email} (ID: {user.id}) пытается войти с другим Telegram ID ({telegram_id_from_tg}).")
+            # Можно запретить вход или отправить уведомление. Для простоты сейчас запретим.
+            raise HTTPException(status_code=403, detail="Telegram ID mismatch. Please login from the correct Telegram account.")
+
+        # Обновляем статус и дату последнего входа
+        user.last_login_date = datetime.now(timezone.utc)
+        user.status = UserAccountStatus.active
+        await db.commit()
+        await db.refresh(user)
+
+        # === ГЕНЕРАЦИЯ ОБОИХ ТОКЕНОВ ===
+        access_token = create_access_token(data={"sub": str(user.id)})
+        refresh_token = create_refresh_token(data={"sub": str(user.id)})
+
+        print(f"Пользователь {email} (ID: {user.id}) успешно вошел в систему. Выданы токены.")
+
+        return {
+            "ok": True,
+            "message": "Login successful!",
+            "isRegistered": True,
+            "access_token": access_token,
+            "refresh_token": refresh_token, # НОВОЕ: Отправляем Refresh Token
+            "token_type": "bearer",
+            "main_balance": float(user.main_balance),
+            "bonus_balance": float(user.bonus_balance),
+            "lucrum_balance": float(user.lucrum_balance),
+            "total_invested": float(user.total_invested),
+            "total_withdrawn": float(user.total_withdrawn),
+            "username": user.username,
+            "first_name": user.first_name,
+            "last_name": user.last_name,
+            "registration_date": user.registration_date.isoformat() if user.registration_date else None,
+            "status": user.status.value,
+            "role": user.role.value
+        }
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        print(f"Error during login: {e}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
+
+
+# ================================================
+
+# НОВЫЙ ЭНДПОИНТ: Обновление Access Token с использованием Refresh Token
+@router.post("/api/refresh-token") 
+async def refresh_access_token(
+    request: Request,
+    db: AsyncSession = Depends(get_async_session),
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """
+    Обновляет Access Token, используя Refresh Token.
+    """
+    print("Получен запрос на обновление токена.")
+    try:
+        refresh_token = credentials.credentials
+        user_id_from_refresh = verify_refresh_token(refresh_token)
+
+        user = await db.get(User, user_id_from_refresh)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found.")
+
+        if user.status == UserAccountStatus.banned:
+            raise HTTPException(status_code=403, detail="Account is banned. Access denied.")
+        if user.status == UserAccountStatus.logged_out:
+            raise HTTPException(status_code=401, detail="Account was logged out from another session. Please re-login.")
+
+        # Генерируем новый Access Token и получаем его время истечения
+        new_access_token, access_token_expire_time = create_access_token(data={"sub": str(user.id)})
+
+        # Генерируем новый Refresh Token.
+        # Если ты хочешь "вращающиеся" refresh токены (когда старый токен становится недействительным
+        # после использования, а выдается новый), то это то место.
+        # Если нет, можешь вернуть тот же самый refresh_token, который пришел, но это менее безопасно.
+        new_refresh_token = create_refresh_token(data={"sub": str(user.id)})
+
+
+        print(f"Access Token и Refresh Token обновлены для пользователя {user.username} (ID: {user.id}).")
+
+        return {
+            "ok": True,
+            "access_token": new_access_token,
+            "refresh_token": new_refresh_token, # <- Отправляем новый Refresh Token
+            "expires_at": access_token_expire_time.isoformat(), # <- Отправляем время истечения Access Token в ISO формате
+            "token_type": "bearer",
+            "message": "Tokens refreshed successfully."
+        }
+    except HTTPException as e:
+        print(f"Ошибка при обновлении токена: {e.detail}")
+        raise e
+    except Exception as e:
+        print(f"Неизвестная ошибка при обновлении токена: {e}")
+        raise HTTPException(status_code=500, detail=f"Internal server error during token refresh: {e}")
+
+
+# ================================================
+
+
+def check_session_status(user: User):
+    """Проверки статуса аккаунта для живой сессии (check-session, bootstrap)."""
+    if user.status == UserAccountStatus.banned:
+        raise HTTPException(status_code=403, detail="Account is banned. Access denied.")
+    if user.status == UserAccountStatus.logged_out:
+        # Если статус logged_out, даже если access token валиден, мы хотим принудительно разлогинить
+        raise HTTPException(status_code=401, detail="Account was logged out from another session. Please re-login.")
+    if user.status == UserAccountStatus.inactive:
+        raise HTTPException(status_code=401, detail="Account is inactive. Please re-login.")
+
+
+def session_payload(user: User) -> dict:
+    """Ответ check-session для подтвержденной сессии."""
+    return {
+        "ok": True,
+        "isLoggedIn": True,
+        "message": "Session is valid.",
+        "user_id": str(user.id),
+        "username": user.username,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "main_balance": float(user.main_balance),
+        "bonus_balance": float(user.bonus_balance),
+        "lucrum_balance": float(user.lucrum_balance),
+        "total_invested": float(user.total_invested),
+        "total_withdrawn": float(user.total_withdrawn),
+        "registration_date": user.registration_date.isoformat() if user.registration_date else None,
+        "status": user.status.value,
+        "role": user.role.value
+    }
+
+
+# Проверка сессии (используется при запуске Mini App)
+@router.post("/api/check-session")
+async def check_user_session(
+    request: Request,
+    db: AsyncSession = Depends(get_async_session),
+    credentials: HTTPAuthorizationCredentials = Depends(security) # Ожидаем Access Token
+):
+    """
+    Проверяет валидность Access Token сессии и возвращает данные пользователя, если сессия активна.
+    Также принимает initData для дополнительной верификации Telegram ID, связанного с токеном.
+    """
+    print("Получен запрос на проверку сессии.")
+    try:
+        body = await request.json()
+        init_data = body.get("initData")
+    except Exception:
+        raise HTTPException(status_code=400, detail="Bad Request: Invalid JSON")
+
+    if not init_data:
+        raise HTTPException(status_code=403, detail="Missing Telegram initData")
+
+    if not check_webapp_signature(init_data, BOT_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid Telegram initData signature.")
+
+    user_data_tg_str = dict(parse_qsl(init_data)).get('user')
+    if not user_data_tg_str:
+        raise HTTPException(status_code=400, detail="Telegram user data not found in initData")
+
+    try:
+        user_info_tg = json.loads(user_data_tg_str)
+        telegram_id_from_tg = int(user_info_tg.get('id'))
+    except (json.JSONDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid Telegram user data JSON or ID.")
+
+    try:
+        user_id_from_access = verify_access_token(credentials.credentials) # Верифицируем Access Token
+
+        if user_id_from_access != telegram_id_from_tg:
+            print(f"Предупреждение: ID из токена ({user_id_from_access}) не совпадает с ID из initData ({telegram_id_from_tg}).")
+            raise HTTPException(status_code=403, detail="Access Token does not match Telegram user ID.")
+
+        user = await db.get(User, user_id_from_access)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found.")
+
+        check_session_status(user)
+
+        print(f"Сессия для пользователя {user.username} (ID: {user.id}) подтверждена. Статус: {user.status.value}, Роль: {user.role.value}")
+        return session_payload(user)
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        print(f"Ошибка при проверке сессии: {e}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
+
+
+# ================================================
+
+
+# ОБНОВЛЕННЫЙ ЭНДПОИНТ: Выход из системы
+@router.post("/api/logout")
+async def api_logout(
+    db: AsyncSession = Depends(get_async_session),
+    credentials: HTTPAuthorizationCredentials = Depends(security) # Ожидаем Access Token
+):
+    """
+    Выходит из системы, помечая пользователя как 'logged_out' в БД.
+    Отозвать refresh token можно, если хранить их в БД и удалять при логауте.
+    Пока просто устанавливаем статус.
+    """
+    try:
+        user_id = verify_access_token(credentials.credentials) # Верифицируем Access Token
+        user = await db.get(User, user_id)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found.")
+
+        user.status = UserAccountStatus.logged_out # Устанавливаем статус "вышел"
+        await db.commit()
+        print(f"Пользователь {user.username} (ID: {user.id}) вышел из системы (статус в БД: logged_out).")
+        return {"ok": True, "message": "Successfully logged out."}
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        print(f"Ошибка при выходе из системы: {e}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
+
+
+# ================================================
+
+# Для верификации Telegram initData
+@router.post("/api/verify-telegram-init")
+async def verify_telegram_init(request: Request):
+    """
+    Верифицирует Telegram initData и возвращает данные пользователя Telegram.
+    НЕ делает запросов к вашей БД.
+    """
+    try:
+        data = await request.json()
+        init_data = data.get("initData")
+
+        if not init_data:
+            raise HTTPException(status_code=400, detail="Missing initData")
+
+        if not check_webapp_signature(init_data, BOT_TOKEN):
+            raise HTTPException(status_code=403, detail="Invalid Telegram initData signature.")
+
+        user_data_tg_str = dict(parse_qsl(init_data)).get('user')
+        if not user_data_tg_str:
+            raise HTTPException(status_code=400, detail="Telegram user data not found in initData")
+
+        user_info_tg = json.loads(user_data_tg_str)
+        # Возвращаем только публичные данные Telegram пользователя
+        return {
+            "ok": True,
+            "telegram_id": user_info_tg.get('id'),
+            "message": "Telegram initData verified."
+        }
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        print(f"Error verifying Telegram initData: {e}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
+
+
+# ================================================
+
+def registration_payload(user: User | None) -> dict:
+    """Ответ is-user-registered: найден ли пользователь, его статус и роль."""
+    if user is None:
+        return {
+            "ok": True,
+            "isRegistered": False,
+            "message": "User not registered in our system."
+        }
+    return {
+        "ok": True,
+        "isRegistered": True,
+        "username": user.username,
+        "status": user.status.value, # Возвращаем статус и роль
+        "role": user.role.value
+    }
+
+
+# НОВЫЙ ЭНДПОИНТ: Проверка зарегистрирован ли пользователь в нашей БД по Telegram ID
+@router.post("/api/is-user-registered")
+async def is_user_registered(request: Request, db: AsyncSession = Depends(get_read_session)):
+    """
+    Проверяет, зарегистрирован ли пользователь в нашей системе по Telegram ID.
+    Предполагает, что initData уже проверена.
+    """
+    try:
+        data = await request.json()
+        telegram_id = data.get("telegram_id") # Получаем ID, который уже был верифицирован
+
+        if not telegram_id:
+            raise HTTPException(status_code=400, detail="Missing Telegram ID.")
+
+        # Сразу после регистрации реплика может еще не знать пользователя
+        await read_your_writes(db, telegram_id)
+        user = await db.get(User, telegram_id)
+        if user:
+            print(f"Пользователь с ID {telegram_id} найден в БД. Статус: {user.status.value}, Роль: {user.role.value}")
+        return registration_payload(user)
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        print(f"Error checking user registration: {e}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
+
+
+
+
+
+# === Эндпоинт для повторной отправки письма (если нужно) ===
+@router.post("/api/resend_email")
+async def api_resend_email(request: Request):
+    try:
+        body = await request.json()
+    except Exception:
+        raise HTTPException(status_code=400, detail="Bad Request: Invalid JSON")
+
+    init_data = body.get("telegramInitData")
+    email = body.get("email")
+
+    # 1. Проверяем наличие init_data
+    if not init_data:
+        raise HTTPException(status_code=403, detail="Missing Telegram initData.")
+
+    # 2. Если init_data есть, проверяем её подпись
+    if not check_webapp_signature(init_data, BOT_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid Telegram initData signature.")
+
+    print(f"Запрос на повторную отправку письма на {email}")
+    if email:
+        return {"ok": True, "message": "Email has been sent."}
+    else:
+        raise HTTPException(status_code=400, detail="Email is required.")
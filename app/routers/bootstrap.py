@@ -0,0 +1,108 @@
+# app/routers/bootstrap.py
+"""
+POST /api/bootstrap — все, что Mini App запрашивает при открытии, одним запросом.
+
+Раньше первый экран ждал шесть запросов подряд: verify-telegram-init, is-user-registered,
+check-session, investment_packages, referral_data и статус daily_bonus. Каждый заново проверял
+initData и открывал свою сессию БД. Здесь initData проверяется один раз, а все разделы читаются
+в одной сессии (на реплике, если она доступна, с read-your-writes).
+
+Тело — {"initData": "..."}; если у клиента есть сохраненная сессия — заголовок Authorization: Bearer <access token>.
+Каждый раздел ответа — ответ соответствующего эндпоинта:
+    {
+      "ok": true,
+      "telegram": {...},               # verify-telegram-init
+      "registration": {...},           # is-user-registered
+      "session": {...},                # check-session, а если сессии нет или она недействительна —
+                                       # {"ok": false, "isLoggedIn": false, "status_code": 401, "detail": "..."}
+      "investment_packages": [...],    # investment_packages
+      "referral_data": {...} | null,   # referral_data — только для зарегистрированного пользователя
+      "daily_bonus": {...} | null      # daily_bonus без action=claim — тоже
+    }
+"""
+import json
+from datetime import datetime, timezone
+from typing import Optional
+from urllib.parse import parse_qsl
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import queries
+from app.config import get_settings
+from app.database import get_read_session, read_your_writes
+from app.models import User
+from app.referrals import build_referral_data
+from app.responses import fast_json
+from app.routers.auth import check_session_status, registration_payload, session_payload
+from app.routers.games import daily_bonus_status
+from app.routers.investments import list_active_packages
+from app.security import verify_access_token
+from app.utils import check_webapp_signature
+
+BOT_TOKEN = get_settings().bot_token
+
+router = APIRouter(tags=["bootstrap"])
+
+
+def _session_section(user: Optional[User], telegram_id: int, authorization: Optional[str]) -> dict:
+    """Раздел session: проверки check-session, но ошибка не прерывает bootstrap, а попадает в раздел."""
+    scheme, _, token = (authorization or "").partition(" ")
+    try:
+        if scheme.lower() != "bearer" or not token:
+            raise HTTPException(status_code=401, detail="Missing access token.")
+        if verify_access_token(token) != telegram_id:
+            raise HTTPException(status_code=403, detail="Access Token does not match Telegram user ID.")
+        if user is None:
+            raise HTTPException(status_code=404, detail="User not found.")
+        check_session_status(user)
+    except HTTPException as e:
+        return {"ok": False, "isLoggedIn": False, "status_code": e.status_code, "detail": e.detail}
+    return session_payload(user)
+
+
+@router.post("/api/bootstrap")
+async def bootstrap(
+    request: Request,
+    authorization: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_read_session),
+):
+    """Данные первого экрана Mini App одним ответом (см. описание модуля)."""
+    try:
+        body = await request.json()
+        init_data = body.get("initData")
+    except Exception:
+        raise HTTPException(status_code=400, detail="Bad Request: Invalid JSON")
+
+    if not init_data:
+        raise HTTPException(status_code=403, detail="Missing Telegram initData")
+
+    if not check_webapp_signature(init_data, BOT_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid Telegram initData signature.")
+
+    user_data_tg_str = dict(parse_qsl(init_data)).get('user')
+    if not user_data_tg_str:
+        raise HTTPException(status_code=400, detail="Telegram user data not found in initData")
+
+    try:
+        telegram_id = int(json.loads(user_data_tg_str).get('id'))
+    except (json.JSONDecodeError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid Telegram user data JSON or ID.")
+
+    # Сразу после регистрации или выхода реплика может еще не знать об изменениях
+    await read_your_writes(db, telegram_id)
+    user = (await db.execute(queries.user_by_id(telegram_id))).scalar_one_or_none()
+
+    payload = {
+        "ok": True,
+        "telegram": {"ok": True, "telegram_id": telegram_id, "message": "Telegram initData verified."},
+        "registration": registration_payload(user),
+        "session": _session_section(user, telegram_id, authorization),
+        "investment_packages": await list_active_packages(db),
+        "referral_data": None,
+        "daily_bonus": None,
+    }
+    if user is not None:
+        payload["referral_data"] = await build_referral_data(db, user)
+        payload["daily_bonus"] = daily_bonus_status(user, datetime.now(timezone.utc))
+    return fast_json(payload)
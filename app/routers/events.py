@@ -0,0 +1,134 @@
+# app/routers/events.py
+"""
+GET /api/events — поток Server-Sent Events для Mini App: новые балансы приходят сами, без опроса.
+
+    const events = new EventSource(`/api/events?initData=${encodeURIComponent(Telegram.WebApp.initData)}`);
+    events.addEventListener("balance", (e) => render(JSON.parse(e.data)));
+
+EventSource не умеет заголовки, поэтому initData передается в query; другие клиенты могут прислать
+Authorization: Bearer <access token>. Первым событием приходит текущий баланс, затем — каждое
+изменение (app/events.py). Раз в HEARTBEAT_SECONDS идет комментарий-пинг, чтобы прокси не закрывали
+простаивающее соединение; после обрыва EventSource переподключается сам через RETRY_MS.
+
+Соединение с БД занимается только на проверку пользователя, не на время потока. Поток — это одна
+подписка (последнее событие каждого типа) и ожидание future, без буферов и задач на каждое событие.
+"""
+import asyncio
+import json
+from typing import Optional
+from urllib.parse import parse_qsl
+
+from fastapi import APIRouter, Header, HTTPException, Query
+from starlette.responses import Response
+
+from app import events
+from app.config import get_settings
+from app.database import get_session_factory
+from app.metrics import sse_connections
+from app.models import User, UserAccountStatus
+from app.responses import dumps
+from app.security import verify_access_token
+from app.utils import check_webapp_signature
+
+# Пинг раз в столько секунд: меньше типичных таймаутов простоя прокси (60 с)
+HEARTBEAT_SECONDS = 25
+# Через сколько миллисекунд EventSource переподключается после обрыва
+RETRY_MS = 3000
+# Больше потоков на пользователя не открываем (вкладки, переподключения)
+MAX_STREAMS_PER_USER = 5
+
+_PING = b": ping\n\n"
+
+router = APIRouter(tags=["events"])
+
+
+def _format_event(event_type: str, data: dict) -> bytes:
+    return b"event: " + event_type.encode() + b"\ndata: " + dumps(data) + b"\n\n"
+
+
+async def _wait_disconnect(receive):
+    # У GET первым сообщением приходит пустое тело запроса, затем — http.disconnect при обрыве
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+class EventStreamResponse(Response):
+    """Поток событий одной подписки. Отписывается при обрыве соединения или ошибке отправки."""
+
+    media_type = "text/event-stream"
+
+    def __init__(self, subscription: events.Subscription, initial: bytes):
+        # Как у StreamingResponse: без body, чтобы не появился Content-Length
+        self.status_code = 200
+        self.background = None
+        self.init_headers({"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+        self.subscription = subscription
+        self.initial = initial
+
+    async def __call__(self, scope, receive, send):
+        subscription = self.subscription
+        disconnected = asyncio.ensure_future(_wait_disconnect(receive))
+        sse_connections.inc()
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            await send({"type": "http.response.body", "body": self.initial, "more_body": True})
+            self.initial = b""
+            while not disconnected.done():
+                waiter = subscription.wake_future()
+                await asyncio.wait((waiter, disconnected), timeout=HEARTBEAT_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+                if disconnected.done():
+                    break
+                if waiter.done():
+                    body = b"".join(_format_event(event_type, data) for event_type, data in subscription.drain().items())
+                else:
+                    body = _PING
+                await send({"type": "http.response.body", "body": body, "more_body": True})
+        finally:
+            sse_connections.dec()
+            events.get_event_bus().unsubscribe(subscription)
+            disconnected.cancel()
+
+
+def _user_id_from_request(init_data: Optional[str], authorization: Optional[str]) -> int:
+    if init_data:
+        if not check_webapp_signature(init_data, get_settings().bot_token):
+            raise HTTPException(status_code=403, detail="Invalid Telegram initData signature.")
+        user_data_str = dict(parse_qsl(init_data)).get("user")
+        if not user_data_str:
+            raise HTTPException(status_code=400, detail="Telegram user data not found in initData")
+        try:
+            return int(json.loads(user_data_str).get("id"))
+        except (json.JSONDecodeError, TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid user data JSON or Telegram ID in initData")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        return verify_access_token(token)
+    raise HTTPException(status_code=403, detail="Missing Telegram initData or access token.")
+
+
+@router.get("/api/events", include_in_schema=False)
+async def stream_events(
+    init_data: Optional[str] = Query(None, alias="initData"),
+    authorization: Optional[str] = Header(None),
+):
+    """Поток SSE: событие balance с текущим балансом, затем при каждом изменении."""
+    user_id = _user_id_from_request(init_data, authorization)
+    bus = events.get_event_bus()
+    if bus.hub.count(user_id) >= MAX_STREAMS_PER_USER:
+        raise HTTPException(status_code=429, detail="Too many event streams for this user.")
+
+    # Подписываемся до чтения баланса: изменение между чтением и подпиской не потеряется
+    subscription = bus.subscribe(user_id)
+    try:
+        async with get_session_factory()() as db:
+            user = await db.get(User, user_id)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found.")
+        if user.status == UserAccountStatus.banned:
+            raise HTTPException(status_code=403, detail="User is banned.")
+    except BaseException:
+        bus.unsubscribe(subscription)
+        raise
+
+    initial = f"retry: {RETRY_MS}\n".encode() + _format_event(events.BALANCE_EVENT, events.balance_snapshot(user))
+    return EventStreamResponse(subscription, initial)
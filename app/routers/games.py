@@ -8,13 +8,15 @@ import random
 from urllib.parse import parse_qsl
 from decimal import Decimal 
 
+from app.config import get_settings
 from app.database import get_async_session
 from app.models import User, Transaction # ***ВАЖНО: Добавляем импорт Transaction***
+from app.fraud import BONUS_SCOPE, GAMES_SCOPE, fraud_guard
+from app.ratelimit import rate_limit
 from app.utils import check_webapp_signature
-import os
 
-# Загружаем BOT_TOKEN из переменных окружения
-BOT_TOKEN = os.getenv("BOT_TOKEN")
+# Загружаем BOT_TOKEN из настроек
+BOT_TOKEN = get_settings().bot_token
 
 router = APIRouter(
     prefix="/api/games",
@@ -24,10 +26,14 @@ router = APIRouter(
 # --- Вспомогательная функция для получения пользователя по initData ---
 async def get_current_user_from_init_data(
     init_data: str,
-    db: AsyncSession = Depends(get_async_session)
+    db: AsyncSession = Depends(get_async_session),
+    for_update: bool = False
 ) -> User:
     """
     Проверяет initData и возвращает объект пользователя.
+    for_update=True блокирует строку до конца транзакции: эндпоинты, меняющие bonus_balance, пишут
+    его абсолютным значением, и без блокировки затерли бы параллельные SQL-начисления
+    (комиссии app/commissions.py, admin_bonus), чьи транзакции в журнале остались бы.
     """
     if not init_data:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Missing Telegram initData.")
@@ -45,29 +51,17 @@ async def get_current_user_from_init_data(
     except (json.JSONDecodeError, ValueError):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid user data JSON or Telegram ID in initData")
 
-    user = await db.get(User, telegram_id)
+    user = await db.get(User, telegram_id, with_for_update=for_update)
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found.")
     
     return user
 
-@router.post("/daily_bonus")
-async def get_daily_bonus(request: Request, db: AsyncSession = Depends(get_async_session)):
+def daily_bonus_status(user: User, now_utc: datetime) -> dict:
     """
-    Эндпоинт для получения ежедневного бонуса.
-    Обрабатывает как запрос статуса бонуса, так и его начисление.
+    Статус ежедневного бонуса (ответ daily_bonus без action=claim): ok — можно ли забрать сейчас,
+    remaining_seconds — сколько ждать до следующего.
     """
-    try:
-        body = await request.json()
-        init_data = body.get("initData")
-        action = body.get("action") 
-    except Exception:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Bad Request: Invalid JSON")
-
-    user = await get_current_user_from_init_data(init_data, db)
-
-    now_utc = datetime.now(timezone.utc)
-    
     can_claim_bonus = True
     remaining_seconds = 0
     message = "Ежедневный бонус доступен!"
@@ -83,12 +77,38 @@ async def get_daily_bonus(request: Request, db: AsyncSession = Depends(get_async
             hours, remainder = divmod(remaining_seconds, 3600)
             minutes, seconds = divmod(remainder, 60)
             message = f"Вы уже получили ежедневный бонус. Повторите попытку через {hours} ч. {minutes} мин. {seconds} сек."
-    
+
+    return {
+        "ok": can_claim_bonus, 
+        "message": message,
+        "bonus_balance": float(user.bonus_balance),
+        "last_daily_bonus_claim": user.last_daily_bonus_claim.isoformat() if user.last_daily_bonus_claim else None,
+        "remaining_seconds": remaining_seconds
+    }
+
+@router.post("/daily_bonus", dependencies=[Depends(rate_limit("games")), Depends(fraud_guard(BONUS_SCOPE))])
+async def get_daily_bonus(request: Request, db: AsyncSession = Depends(get_async_session)):
+    """
+    Эндпоинт для получения ежедневного бонуса.
+    Обрабатывает как запрос статуса бонуса, так и его начисление.
+    """
+    try:
+        body = await request.json()
+        init_data = body.get("initData")
+        action = body.get("action") 
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Bad Request: Invalid JSON")
+
+    user = await get_current_user_from_init_data(init_data, db, for_update=action == 'claim')
+
+    now_utc = datetime.now(timezone.utc)
+    bonus_status = daily_bonus_status(user, now_utc)
+
     if action == 'claim':
-        if not can_claim_bonus:
+        if not bonus_status["ok"]:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST, 
-                detail=message
+                detail=bonus_status["message"]
             )
         
         bonus_amount = Decimal(str(round(random.uniform(0.5, 5.0), 2)))
@@ -122,15 +142,9 @@ async def get_daily_bonus(request: Request, db: AsyncSession = Depends(get_async
             await db.rollback()
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Ошибка при начислении бонуса: {e}")
     
-    return {
-        "ok": can_claim_bonus, 
-        "message": message,
-        "bonus_balance": float(user.bonus_balance),
-        "last_daily_bonus_claim": user.last_daily_bonus_claim.isoformat() if user.last_daily_bonus_claim else None,
-        "remaining_seconds": remaining_seconds
-    }
+    return bonus_status
 
-@router.post("/play")
+@router.post("/play", dependencies=[Depends(rate_limit("games")), Depends(fraud_guard(GAMES_SCOPE))])
 async def play_game(request: Request, db: AsyncSession = Depends(get_async_session)):
     """
     Эндпоинт для начала игры.
@@ -142,7 +156,7 @@ async def play_game(request: Request, db: AsyncSession = Depends(get_async_sessi
     except Exception:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Bad Request: Invalid JSON")
 
-    user = await get_current_user_from_init_data(init_data, db)
+    user = await get_current_user_from_init_data(init_data, db, for_update=True)
 
     game_costs = {
         "wheel_of_fortune": Decimal("1.00"),
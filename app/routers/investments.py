@@ -6,29 +6,32 @@ import json
 from urllib.parse import parse_qsl
 from operator import itemgetter
 from datetime import datetime, timedelta, timezone # Добавляем timezone
-import httpx
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
 import datetime
 
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
 from pydantic import BaseModel
 from decimal import Decimal
 
-from app.database import get_async_session
+from app import queries
+from app.commissions import pay_commissions
+from app.config import get_settings
+from app.database import get_async_session, get_read_session
+from app.http_cache import CATALOG_CACHE_CONTROL, active_packages_catalog, etag_matches, not_modified
 from app.models import InvestmentPackage, User, Investment, Transaction # Исправлено: Investment вместо UserInvestment
+from app.metrics import span
+from app.ratelimit import rate_limit
 from app.utils import check_webapp_signature
 
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
-BOT_TOKEN = os.getenv("BOT_TOKEN")
+settings = get_settings()
+BOT_TOKEN = settings.bot_token
 
 # !!! ВАЖНО: Получаем SECRET_PAYMENT_TOKEN из переменных окружения
 # ЭТО ОЧЕНЬ ВАЖНО: ЭТО ДОЛЖЕН БЫТЬ ТВОЙ СЕКРЕТНЫЙ ПЛАТЕЖНЫЙ ТОКЕН, ПОЛУЧЕННЫЙ ИЗ BOTFATHER
 # В РЕЖИМЕ "TEST" (ТЕСТОВЫЙ ТОКЕН) ИЛИ "LIVE" (БОЕВОЙ ТОКЕН)
-TELEGRAM_PAYMENT_PROVIDER_TOKEN = os.getenv("TELEGRAM_PAYMENT_PROVIDER_TOKEN") 
+TELEGRAM_PAYMENT_PROVIDER_TOKEN = settings.telegram_payment_provider_token
+# Адрес Telegram Bot API. Переопределяется для локальной заглушки (бенчмарки, тесты)
+TELEGRAM_API_BASE = settings.telegram_api_base
 
 if not TELEGRAM_PAYMENT_PROVIDER_TOKEN:
     print("ВНИМАНИЕ: Переменная окружения TELEGRAM_PAYMENT_PROVIDER_TOKEN не установлена. Платежи Telegram Stars не будут работать.")
@@ -88,24 +91,32 @@ class CreateStarsInvoiceResponse(BaseModel):
     stars_amount: int
     message: str
 
+async def list_active_packages(db: AsyncSession) -> list[dict]:
+    """Активные инвестиционные пакеты (ответ /api/investment_packages), из каталога воркера."""
+    return (await active_packages_catalog(db)).rows
+
 # --- Эндпоинты API ---
 
 @router.get("/api/investment_packages", response_model=list[InvestmentPackageResponse])
-async def get_investment_packages(db: AsyncSession = Depends(get_async_session)):
+async def get_investment_packages(request: Request, db: AsyncSession = Depends(get_read_session)):
     """
     Возвращает список всех активных инвестиционных пакетов.
+    Ответ одинаков для всех: с ETag и публичным Cache-Control, чтобы его держали браузер и CDN.
     """
     try:
-        stmt = select(InvestmentPackage).where(InvestmentPackage.is_active == True).order_by(InvestmentPackage.min_amount)
-        result = await db.execute(stmt)
-        packages = result.scalars().all()
-        return packages
+        catalog = await active_packages_catalog(db)
+        headers = {"ETag": catalog.etag, "Cache-Control": CATALOG_CACHE_CONTROL}
+        if etag_matches(request.headers.get("if-none-match"), catalog.etag):
+            return not_modified(headers)
+        # Тело сериализовано один раз на версию каталога; колонки совпадают с InvestmentPackageResponse,
+        # поэтому валидировать ответ через response_model повторно не нужно.
+        return Response(catalog.body, media_type="application/json", headers=headers)
     except Exception as e:
         print(f"Ошибка при получении инвестиционных пакетов: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Произошла ошибка на сервере при получении пакетов.")
 
 # --- НОВЫЙ ЭНДПОИНТ: Создание инвойса для Telegram Stars ---
-@router.post("/api/create_stars_invoice", response_model=CreateStarsInvoiceResponse)
+@router.post("/api/create_stars_invoice", response_model=CreateStarsInvoiceResponse, dependencies=[Depends(rate_limit("invoice"))])
 async def create_stars_invoice_endpoint(
     request_body: CreateStarsInvoiceRequest, 
     db: AsyncSession = Depends(get_async_session)
@@ -154,7 +165,7 @@ async def create_stars_invoice_endpoint(
     if not payment_provider_token:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Telegram Payment Provider Token не настроен.")
 
-    telegram_api_url = f"https://api.telegram.org/bot{payment_provider_token}/createInvoiceLink"
+    telegram_api_url = f"{TELEGRAM_API_BASE}/bot{payment_provider_token}/createInvoiceLink"
     
     invoice_params = {
         "title": f"Покупка '{investment_package.name}'",
@@ -177,9 +188,12 @@ async def create_stars_invoice_endpoint(
         "is_flexible": False
     }
 
+    import httpx # Импортируем здесь: httpx нужен только этому эндпоинту, старт приложения без него быстрее
+
     async with httpx.AsyncClient() as client:
         try:
-            tg_response = await client.post(telegram_api_url, json=invoice_params)
+            with span("bot_api"):
+                tg_response = await client.post(telegram_api_url, json=invoice_params)
             tg_response.raise_for_status()
 
             tg_data = tg_response.json()
@@ -307,16 +321,14 @@ async def telegram_payment_webhook(request: Request, db: AsyncSession = Depends(
 
             # 2. Проверяем, не была ли транзакция уже обработана (идемпотентность)
             # Ищем существующую инвестицию с данным stars_payment_charge_id
-            existing_investment = await db.execute(
-                select(Investment).where(Investment.stars_payment_charge_id == telegram_payment_charge_id)
-            )
+            existing_investment = await db.execute(queries.investment_by_charge_id(telegram_payment_charge_id))
             if existing_investment.scalar_one_or_none():
                 print(f"Duplicate payment for charge ID: {telegram_payment_charge_id}. Skipping.")
                 return {"ok": True} # Уже обработано, просто отвечаем OK.
 
             try:
                 # 3. Создаем запись о новом инвестиционном плане пользователя
-                start_date = datetime.now(timezone.utc)
+                start_date = datetime.datetime.now(timezone.utc) # datetime здесь — модуль (import datetime выше)
                 end_date = start_date + timedelta(days=investment_package.duration_days)
 
                 new_user_investment = Investment( # Использование Investment, как в модели
@@ -325,9 +337,9 @@ async def telegram_payment_webhook(request: Request, db: AsyncSession = Depends(
                     amount_invested=investment_package.min_amount, # Сумма инвестиции в LCR
                     start_date=start_date,
                     end_date=end_date,
-                    daily_roi_percentage=investment_package.daily_roi_percentage, # Сохраняем ROI на момент покупки
+                    # Доходность берется из пакета при начислении (app/jobs.py) — отдельной колонки у инвестиции нет
                     stars_payment_charge_id=telegram_payment_charge_id, # Сохраняем ID платежа Telegram
-                    status='active'
+                    is_active=True
                 )
                 db.add(new_user_investment)
 
@@ -340,7 +352,7 @@ async def telegram_payment_webhook(request: Request, db: AsyncSession = Depends(
                     type='investment_purchase_stars', # Новый тип транзакции
                     amount=investment_package.min_amount, # Сумма в LCR для истории
                     currency='₤s', # Валюта LCR
-                    timestamp=now_utc, # Используем теперь now_utc из импортов
+                    timestamp=start_date,
                     status='completed',
                     description=f"Покупка инвестиционного пакета '{investment_package.name}' за {stars_amount_paid} ⭐. Stars Charge ID: {telegram_payment_charge_id}",
                     txid=telegram_payment_charge_id # Сохраняем ID платежа Stars как TXID
@@ -353,16 +365,25 @@ async def telegram_payment_webhook(request: Request, db: AsyncSession = Depends(
                 await db.refresh(purchase_transaction)
 
                 print(f"Investment package {investment_package.name} successfully purchased by user {user.id} for {stars_amount_paid} Stars. Investment ID: {new_user_investment.id}")
-                return {"ok": True} # Сообщаем Telegram, что платеж успешно обработан
-
             except Exception as e:
                 await db.rollback()
-                print(f"CRITICAL ERROR: Failed to process successful payment for user {user.id}, package {package_id} with charge ID {telegram_payment_charge_id}: {e}")
+                print(f"CRITICAL ERROR: Failed to process successful payment for user {user_id}, package {package_id} with charge ID {telegram_payment_charge_id}: {e}")
                 # Если произошла ошибка здесь, это серьезно: пользователь заплатил, а мы не обработали.
                 # Нужно уведомить администратора и предоставить средства для ручной компенсации.
                 # Возвращаем True, чтобы Telegram не пытался повторно, но логируем критическую ошибку.
                 return {"ok": True} 
 
+            # 6. Реферальные комиссии — отдельной транзакцией: покупка уже сохранена, а если выплата
+            # не удастся, ее сделает задача pay_referral_commissions
+            investment_id = new_user_investment.id
+            try:
+                commissions = await pay_commissions(db, [investment_id])
+                print(f"Реферальные комиссии по инвестиции {investment_id}: {commissions.payouts} выплат на {commissions.total} ₤s")
+            except Exception as e:
+                await db.rollback()
+                print(f"❌ Не удалось выплатить реферальные комиссии по инвестиции {investment_id} (выплатит задача pay_referral_commissions): {e}")
+            return {"ok": True} # Сообщаем Telegram, что платеж успешно обработан
+
         else:
             print(f"Unknown webhook update received: {json.dumps(update, indent=2)}")
             return {"ok": False} # Неизвестный тип обновления
@@ -0,0 +1,291 @@
+# app/scheduler.py
+"""
+Фоновый планировщик периодических задач (начисление ROI, неактивные пользователи, очистка).
+
+Планировщик запускается на каждой реплике (в главном воркере), но задачи выполняет только лидер —
+процесс, который держит pg_try_advisory_lock(SCHEDULER_LOCK_ID) на отдельном соединении с БД.
+Если лидер упал или потерял соединение, блокировку снимает сам Postgres, и ее подхватывает другая реплика.
+
+Расписание — cron-строка из 5 полей в UTC (минута час день месяц день_недели) или @hourly/@daily/@weekly/@monthly.
+К каждому запуску добавляется случайная задержка (jitter), чтобы тяжелые задачи не стартовали ровно
+в одну секунду; каждая задача ограничена таймаутом; каждый запуск пишется в job_runs.
+
+Ручной запуск: python -m app.scheduler list | run <job>
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy import select, func, update, text
+
+from app.config import get_settings
+from app.database import get_engine, get_session_factory
+from app.metrics import job_duration, job_lag, job_last_success, scheduler_leader
+from app.models import JobRun
+
+# Ключ pg_advisory_lock лидера планировщика
+SCHEDULER_LOCK_ID = 7_401_034
+# Как часто не-лидер пробует стать лидером
+LEADER_RETRY_SECONDS = 30
+# Как часто лидер проверяет, живо ли соединение, на котором держится блокировка
+LEADER_HEARTBEAT_SECONDS = 15
+
+_CRON_ALIASES = {
+    "@hourly": "0 * * * *",
+    "@daily": "0 0 * * *",
+    "@weekly": "0 0 * * 0",
+    "@monthly": "0 0 1 * *",
+}
+# (минимум, максимум) для полей: минута, час, день месяца, месяц, день недели (0 и 7 — воскресенье)
+_CRON_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+def _parse_cron_field(spec: str, low: int, high: int) -> frozenset:
+    values = set()
+    for part in spec.split(","):
+        step = 1
+        if "/" in part:
+            part, step_str = part.split("/", 1)
+            step = int(step_str)
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start, end = (int(x) for x in part.split("-", 1))
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if not (low <= start <= end <= high) or step < 1:
+            raise ValueError(f"Некорректное поле cron: {spec!r}")
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+class CronSchedule:
+    """Минимальный разбор cron-выражений (UTC, точность — минута)."""
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        fields = _CRON_ALIASES.get(expression.strip(), expression).split()
+        if len(fields) != 5:
+            raise ValueError(f"Ожидалось 5 полей cron: {expression!r}")
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            _parse_cron_field(spec, low, high) for spec, (low, high) in zip(fields, _CRON_FIELDS)
+        )
+        self.weekdays = frozenset(day % 7 for day in weekdays)
+        # Как в классическом cron: если ограничены и день месяца, и день недели — подходит любой из них
+        self._days_restricted = fields[2] != "*"
+        self._weekdays_restricted = fields[4] != "*"
+
+    def _day_matches(self, day: datetime) -> bool:
+        if day.month not in self.months:
+            return False
+        dom = day.day in self.days
+        dow = (day.weekday() + 1) % 7 in self.weekdays # В cron 0 — воскресенье
+        if self._days_restricted and self._weekdays_restricted:
+            return dom or dow
+        return dom and dow
+
+    def next_after(self, moment: datetime) -> datetime:
+        """Ближайшее время срабатывания строго после moment."""
+        candidate = moment.astimezone(timezone.utc).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        for _ in range(366 * 5):
+            if self._day_matches(candidate):
+                for hour in sorted(h for h in self.hours if h >= candidate.hour):
+                    first_minute = candidate.minute if hour == candidate.hour else 0
+                    minutes = [m for m in sorted(self.minutes) if m >= first_minute]
+                    if minutes:
+                        return candidate.replace(hour=hour, minute=minutes[0])
+            candidate = (candidate + timedelta(days=1)).replace(hour=0, minute=0)
+        raise ValueError(f"Расписание {self.expression!r} не срабатывает ближайшие 5 лет")
+
+
+@dataclass
+class Job:
+    name: str
+    schedule: str # cron-выражение в UTC
+    func: Callable[[], Awaitable[Optional[str]]] # Возвращает краткий итог для job_runs.result
+    timeout: float = 300.0
+    jitter: float = 0.0 # Максимальная случайная задержка запуска, секунд
+    cron: CronSchedule = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.cron = CronSchedule(self.schedule)
+
+
+def _worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+async def run_job(job: Job, scheduled_at: datetime, planned_at: Optional[datetime] = None) -> str:
+    """Выполняет задачу с таймаутом, пишет запуск в job_runs и метрики. Возвращает статус."""
+    session_factory = get_session_factory()
+    started_at = datetime.now(timezone.utc)
+    job_lag.observe(max(0.0, (started_at - (planned_at or scheduled_at)).total_seconds()), job.name)
+
+    async with session_factory() as db:
+        run = JobRun(job_name=job.name, scheduled_at=scheduled_at, started_at=started_at,
+                     status="running", worker=_worker_name())
+        db.add(run)
+        await db.commit()
+        run_id = run.id
+
+    print(f"⏱️ Задача {job.name} запущена (по расписанию {scheduled_at:%Y-%m-%d %H:%M} UTC).")
+    status, result, error = "failed", None, None
+    timer = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(job.func(), timeout=job.timeout)
+        status = "success"
+    except asyncio.TimeoutError:
+        status, error = "timeout", f"Превышен таймаут {job.timeout:.0f} с"
+    except asyncio.CancelledError:
+        status, error = "cancelled", "Процесс остановлен во время выполнения"
+        raise
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    finally:
+        elapsed = time.perf_counter() - timer
+        job_duration.observe(elapsed, job.name, status)
+        if status == "success":
+            job_last_success.set(time.time(), job.name)
+            print(f"✅ Задача {job.name} выполнена за {elapsed:.1f} с: {result or 'ok'}")
+        else:
+            print(f"❌ Задача {job.name} завершилась со статусом {status}: {error}")
+        async with session_factory() as db:
+            await db.execute(
+                update(JobRun).where(JobRun.id == run_id).values(
+                    finished_at=datetime.now(timezone.utc), status=status, result=result, error=error,
+                )
+            )
+            await db.commit()
+    return status
+
+
+class Scheduler:
+    def __init__(self, jobs: list[Job], lock_id: int = SCHEDULER_LOCK_ID):
+        self.jobs = jobs
+        self.lock_id = lock_id
+        self.is_leader = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="scheduler")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                async with get_engine().connect() as conn:
+                    # Сессионная блокировка живет, пока живо соединение: его и держим все время лидерства
+                    acquired = (await conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": self.lock_id})).scalar()
+                    await conn.commit()
+                    if acquired:
+                        self.is_leader = True
+                        scheduler_leader.set(1)
+                        print(f"👑 {_worker_name()} — лидер планировщика.")
+                        try:
+                            await self._lead(conn)
+                        finally:
+                            self.is_leader = False
+                            scheduler_leader.set(0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Ошибка планировщика: {e}")
+            await asyncio.sleep(LEADER_RETRY_SECONDS)
+
+    async def _next_runs(self) -> dict:
+        """Следующий запуск каждой задачи. Считаем от последнего запуска в job_runs, чтобы не терять
+        срабатывания, пропущенные во время деплоя или смены лидера (такая задача запустится сразу)."""
+        now = datetime.now(timezone.utc)
+        async with get_session_factory()() as db:
+            rows = await db.execute(
+                select(JobRun.job_name, func.max(JobRun.scheduled_at))
+                .where(JobRun.job_name.in_([job.name for job in self.jobs]))
+                .group_by(JobRun.job_name)
+            )
+            last_runs = dict(rows.all())
+        return {job.name: job.cron.next_after(last_runs.get(job.name) or now) for job in self.jobs}
+
+    async def _lead(self, conn):
+        next_runs = await self._next_runs()
+        planned = {job.name: next_runs[job.name] + timedelta(seconds=random.uniform(0, job.jitter)) for job in self.jobs}
+        while True:
+            job = min(self.jobs, key=lambda j: planned[j.name])
+            # Спим до запуска, периодически проверяя соединение: без него блокировка уже потеряна
+            while (delay := (planned[job.name] - datetime.now(timezone.utc)).total_seconds()) > 0:
+                await asyncio.sleep(min(delay, LEADER_HEARTBEAT_SECONDS))
+                await conn.execute(text("SELECT 1"))
+                await conn.commit()
+
+            await run_job(job, next_runs[job.name], planned[job.name])
+            next_runs[job.name] = job.cron.next_after(max(next_runs[job.name], datetime.now(timezone.utc)))
+            planned[job.name] = next_runs[job.name] + timedelta(seconds=random.uniform(0, job.jitter))
+
+
+_scheduler: Optional[Scheduler] = None
+
+
+def get_scheduler() -> Scheduler:
+    global _scheduler
+    if _scheduler is None:
+        from app.jobs import JOBS
+
+        _scheduler = Scheduler(JOBS)
+    return _scheduler
+
+
+def start_scheduler():
+    if not get_settings().scheduler_enabled:
+        print("Планировщик фоновых задач выключен (SCHEDULER_ENABLED=False).")
+        return
+    get_scheduler().start()
+
+
+async def stop_scheduler():
+    if _scheduler is not None:
+        await _scheduler.stop()
+
+
+async def _main(args) -> int:
+    from app.jobs import JOBS
+
+    jobs = {job.name: job for job in JOBS}
+    if args.command == "list":
+        now = datetime.now(timezone.utc)
+        for job in JOBS:
+            print(f"{job.name:<32} {job.schedule:<16} следующий запуск {job.cron.next_after(now):%Y-%m-%d %H:%M} UTC, "
+                  f"таймаут {job.timeout:.0f} с, jitter {job.jitter:.0f} с")
+        return 0
+    if args.job not in jobs:
+        print(f"Нет задачи {args.job!r}. Доступные: {', '.join(jobs)}")
+        return 2
+    try:
+        # Вручную — в обход лидерства: задачи идемпотентны, повторный запуск безопасен
+        status = await run_job(jobs[args.job], datetime.now(timezone.utc))
+    finally:
+        await get_engine().dispose()
+    return 0 if status == "success" else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Фоновые задачи")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="Список задач и ближайшие запуски")
+    run_parser = sub.add_parser("run", help="Выполнить задачу сейчас")
+    run_parser.add_argument("job")
+    raise SystemExit(asyncio.run(_main(parser.parse_args())))
@@ -0,0 +1,87 @@
+# app/security.py
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+
+from fastapi import HTTPException
+from fastapi.security import HTTPBearer
+
+from app.config import get_settings
+from app.metrics import span
+
+# python-jose и passlib/bcrypt импортируются внутри функций: они нужны только эндпоинтам
+# аутентификации, а их импорт заметно удлиняет холодный старт.
+
+ALGORITHM = "HS256"
+
+# === ВРЕМЯ ЖИЗНИ ТОКЕНОВ ===
+ACCESS_TOKEN_EXPIRE_MINUTES = 120 # Например, 30 минут
+REFRESH_TOKEN_EXPIRE_DAYS = 14   # Например, 7 дней для "Remember Me"
+
+# --- Зависимость для получения токена из заголовка Authorization ---
+security = HTTPBearer()
+
+
+@lru_cache(maxsize=1)
+def get_pwd_context():
+    """Контекст для хеширования паролей (создается при первом логине/регистрации)."""
+    from passlib.context import CryptContext
+
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def hash_password(password: str) -> str:
+    with span("bcrypt"):
+        return get_pwd_context().hash(password)
+
+
+def verify_password(password: str, password_hash: str) -> bool:
+    with span("bcrypt"):
+        return get_pwd_context().verify(password, password_hash)
+
+
+# === ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ДЛЯ JWT ===
+
+def create_access_token(data: dict):
+    from jose import jwt
+
+    to_encode = data.copy()
+    expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    to_encode.update({"exp": expire})
+    encoded_jwt = jwt.encode(to_encode, get_settings().jwt_secret_key, algorithm=ALGORITHM)
+    # ВОТ ИЗМЕНЕНИЕ: возвращаем токен И объект expire
+    return encoded_jwt, expire
+
+def create_refresh_token(data: dict):
+    from jose import jwt
+
+    to_encode = data.copy()
+    expire = datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    to_encode.update({"exp": expire})
+    encoded_jwt = jwt.encode(to_encode, get_settings().refresh_token_secret_key, algorithm=ALGORITHM)
+    return encoded_jwt
+
+def verify_access_token(token: str):
+    from jose import jwt, JWTError
+
+    try:
+        with span("auth_verify"):
+            payload = jwt.decode(token, get_settings().jwt_secret_key, algorithms=[ALGORITHM])
+        user_id: str = payload.get("sub")
+        if user_id is None:
+            raise HTTPException(status_code=401, detail="Invalid Access Token: User ID missing")
+        return int(user_id)
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Invalid Access Token: Signature or expiration invalid")
+
+def verify_refresh_token(token: str):
+    from jose import jwt, JWTError
+
+    try:
+        with span("auth_verify"):
+            payload = jwt.decode(token, get_settings().refresh_token_secret_key, algorithms=[ALGORITHM])
+        user_id: str = payload.get("sub")
+        if user_id is None:
+            raise HTTPException(status_code=401, detail="Invalid Refresh Token: User ID missing")
+        return int(user_id)
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Invalid Refresh Token: Signature or expiration invalid")
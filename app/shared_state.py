@@ -0,0 +1,150 @@
+# app/shared_state.py
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from app.config import get_settings
+
+# Общее состояние воркеров: кеши, счетчики, лимитеры.
+# Код приложения работает только через get_shared_state(), поэтому поведение не зависит от того,
+# сколько процессов обслуживают запросы:
+#   - InMemorySharedState — один процесс (uvicorn main:app, локальная разработка);
+#   - RedisSharedState    — несколько воркеров/инстансов (SHARED_STATE_URL=redis://...).
+# Значения — строки; сложные объекты вызывающий код сериализует сам (orjson/json).
+
+
+class InMemorySharedState:
+    """Хранилище в памяти процесса: OrderedDict с LRU-вытеснением и TTL на ключ."""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._data: "OrderedDict[str, tuple[object, Optional[float]]]" = OrderedDict() # key -> (value, expires_at)
+
+    def _get_entry(self, key: str):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return entry
+
+    def _put(self, key: str, value, ttl: Optional[float]):
+        self._data[key] = (value, time.monotonic() + ttl if ttl else None)
+        self._data.move_to_end(key)
+        if len(self._data) > self.max_keys:
+            self._data.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._get_entry(key)
+        return None if entry is None else entry[0]
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        self._put(key, value, ttl)
+
+    async def delete(self, key: str):
+        self._data.pop(key, None)
+
+    async def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """Атомарно увеличивает счетчик. TTL ставится только при создании ключа."""
+        entry = self._get_entry(key)
+        if entry is None:
+            value = amount
+            self._put(key, str(value), ttl)
+        else:
+            value = int(entry[0]) + amount
+            self._data[key] = (str(value), entry[1])
+        return value
+
+    async def take_token(self, key: str, rate: float, burst: int) -> float:
+        """Token bucket: забирает токен. Возвращает 0, если можно, иначе сколько секунд ждать."""
+        now = time.monotonic()
+        entry = self._get_entry(key)
+        if entry is None:
+            bucket = [float(burst), now]
+            self._put(key, bucket, burst / rate + 1)
+        else:
+            bucket = entry[0]
+            bucket[0] = min(float(burst), bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            self._data[key] = (bucket, now + burst / rate + 1)
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / rate
+
+
+# Тот же алгоритм, но атомарно на стороне Redis (время берем у Redis, чтобы не зависеть от часов воркеров)
+_TOKEN_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + (now - ts) * rate)
+local retry = 0
+if tokens >= 1 then tokens = tokens - 1 else retry = (1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(retry)
+"""
+
+# INCRBY + EXPIRE только для нового ключа — одной командой, без гонок между воркерами
+_INCR_LUA = """
+local value = redis.call('INCRBY', KEYS[1], ARGV[1])
+if value == tonumber(ARGV[1]) and tonumber(ARGV[2]) > 0 then redis.call('PEXPIRE', KEYS[1], ARGV[2]) end
+return value
+"""
+
+
+class RedisSharedState:
+    """
+    Общее хранилище для нескольких воркеров и инстансов. client — redis.asyncio.Redis
+    (или любой объект с тем же async API: get/set/delete/eval).
+    """
+
+    def __init__(self, client, prefix: str = "lucrora:"):
+        self.client = client
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[str]:
+        value = await self.client.get(self.prefix + key)
+        return value.decode() if isinstance(value, bytes) else value
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        await self.client.set(self.prefix + key, value, px=int(ttl * 1000) if ttl else None)
+
+    async def delete(self, key: str):
+        await self.client.delete(self.prefix + key)
+
+    async def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        return int(await self.client.eval(_INCR_LUA, 1, self.prefix + key, amount, int(ttl * 1000) if ttl else 0))
+
+    async def take_token(self, key: str, rate: float, burst: int) -> float:
+        return float(await self.client.eval(_TOKEN_BUCKET_LUA, 1, self.prefix + key, rate, burst))
+
+
+_state = None
+
+
+def get_shared_state():
+    """Общее состояние процесса. Бэкенд выбирается по SHARED_STATE_URL при первом обращении."""
+    global _state
+    if _state is None:
+        settings = get_settings()
+        if settings.shared_state_url:
+            import redis.asyncio as redis # Импортируем только если общий бэкенд действительно нужен
+            _state = RedisSharedState(redis.from_url(settings.shared_state_url))
+        else:
+            _state = InMemorySharedState(max_keys=settings.shared_state_max_keys)
+    return _state
+
+
+def set_shared_state(state):
+    """Подменяет бэкенд (тесты, локальная заглушка общего хранилища)."""
+    global _state
+    _state = state
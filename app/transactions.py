@@ -1,28 +1,69 @@
 # app/transactions.py (создайте этот новый файл или добавьте в существующий роутер)
 
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
 from typing import List, Optional
+from datetime import datetime
 import json
 
-from app.database import get_async_session
-from app.models import Transaction, User # Убедитесь, что импортировали User и Transaction
+from app import queries
+from app.database import get_read_session, read_your_writes
+from app.http_cache import PRIVATE_CACHE_CONTROL, etag_matches, ledger_etag, not_modified
+from app.responses import fast_json
 from app.utils import check_webapp_signature, parse_qsl # Повторно используйте ваши утилитарные функции
+from app.config import get_settings
 
-import os
-from dotenv import load_dotenv
-load_dotenv()
-BOT_TOKEN = os.getenv("BOT_TOKEN")
+BOT_TOKEN = get_settings().bot_token
 
 router = APIRouter(prefix="/api", tags=["transactions"])
 
+# --- Компактный формат истории (format=columns) ---
+# Каждое поле — массив по всем строкам, а не ключ в каждой строке. user_id не нужен — это сам пользователь.
+COLUMNS = ("id", "type", "amount", "currency", "timestamp", "status", "txid")
+# Описания повторяются с точностью до суммы ("Ставка в игре '...': -10.00 ₤s"), поэтому сумма в них
+# заменяется на метку, а одинаковые шаблоны уходят один раз. Клиент восстанавливает описание так:
+#     descriptions[i].replace("{amount}", amount.toFixed(2))
+AMOUNT_PLACEHOLDER = "{amount}"
+
+
+def description_template(description: str, amount) -> str:
+    """Описание с первой записью суммы (со знаком, два знака после точки), замененной на AMOUNT_PLACEHOLDER."""
+    return description.replace(f"{amount:.2f}", AMOUNT_PLACEHOLDER, 1)
+
+
+def columnar_history(rows) -> dict:
+    """
+    История в колоночном виде:
+        {"format": "columns", "count": N, "columns": {"id": [...], ..., "description": [индекс | null]},
+         "descriptions": [шаблон, ...]}
+    """
+    columns = {name: [] for name in COLUMNS}
+    description_ids = []
+    templates = {} # шаблон -> индекс в descriptions
+    for row in rows:
+        for name in COLUMNS:
+            columns[name].append(getattr(row, name))
+        if row.description is None:
+            description_ids.append(None)
+        else:
+            template = description_template(row.description, row.amount)
+            description_ids.append(templates.setdefault(template, len(templates)))
+    columns["description"] = description_ids
+    return {"format": "columns", "count": len(description_ids), "columns": columns, "descriptions": list(templates)}
+
+
 # --- Эндпоинт для получения транзакций пользователя ---
 @router.get("/transactions")
 async def get_transactions(
+    request: Request,
     telegram_init_data: str = Query(..., alias="initData"), # Ожидаем initData из параметра запроса
     type: Optional[str] = Query(None), # Необязательный фильтр для типа(ов) транзакций
-    db: AsyncSession = Depends(get_async_session)
+    # Необязательный период: transactions секционирована по месяцам, и с ним читаются только нужные секции
+    since: Optional[datetime] = Query(None),
+    until: Optional[datetime] = Query(None),
+    # rows — список объектов (по умолчанию), columns — компактный колоночный формат (см. columnar_history)
+    response_format: str = Query("rows", alias="format", pattern="^(rows|columns)$"),
+    db: AsyncSession = Depends(get_read_session) # Только чтение: реплика, если доступна
 ):
     if not telegram_init_data:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Отсутствует Telegram initData.")
@@ -42,37 +83,27 @@ async def get_transactions(
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Неверный JSON данных пользователя или Telegram ID в initData.")
 
     # 3. Построение запроса
-    query = select(Transaction).where(Transaction.user_id == user_id)
-
     # Применение фильтра по типу, если он предоставлен
+    transaction_types = None
     if type:
         # Если параметр type содержит запятую, разделите его на несколько типов
         # например, "game_win,game_loss" -> ['game_win', 'game_loss']
         transaction_types = [t.strip() for t in type.split(',')]
-        query = query.where(Transaction.type.in_(transaction_types))
-
-    # Сортировка по времени для хронологической истории
-    query = query.order_by(Transaction.timestamp.desc())
 
     # 4. Выполнение запроса
-    result = await db.execute(query)
-    transactions = result.scalars().all()
+    # Только что сыгранная игра или покупка должна быть в истории — сразу после записи читаем из основной БД
+    await read_your_writes(db, user_id)
+    # История меняется только вместе с журналом: если у клиента та же версия — 304 без чтения истории
+    etag = await ledger_etag(db, user_id, transaction_types, since, until, response_format)
+    headers = {"ETag": etag, "Cache-Control": PRIVATE_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(headers)
+    # Только нужные колонки (без сборки ORM-объектов и identity map), новые сверху
+    result = await db.execute(queries.transaction_history(user_id, transaction_types, since, until))
 
     # 5. Возврат транзакций
-    # Преобразование Numeric (Decimal) в float для JSON-сериализации
-    # Возможно, вы захотите использовать модель Pydantic для вывода для лучшего контроля
-    # Для простоты мы преобразуем на лету здесь.
-    return [
-        {
-            "id": tx.id,
-            "user_id": tx.user_id,
-            "type": tx.type,
-            "amount": float(tx.amount), # Преобразование в float
-            "currency": tx.currency,
-            "timestamp": tx.timestamp.isoformat(), # Преобразование datetime в ISO-строку
-            "status": tx.status,
-            "description": tx.description,
-            "txid": tx.txid,
-        }
-        for tx in transactions
-    ]
\ No newline at end of file
+    if response_format == "columns":
+        return fast_json(columnar_history(result), headers=headers)
+    # Decimal и datetime кодирует сам FastJSONResponse (orjson), поэтому float()/isoformat()
+    # на каждой строке не нужны, а FastAPI не гоняет список через jsonable_encoder повторно.
+    return fast_json([row._asdict() for row in result], headers=headers)
@@ -0,0 +1,171 @@
+# app/user_stats.py
+"""
+Агрегаты журнала транзакций по пользователю и типу (таблица user_stats).
+
+Каждая новая запись в transactions со статусом 'completed' увеличивает строку (user_id, type) в той же
+транзакции БД: для ORM это делает обработчик after_flush ниже, массовые SQL-записи (app/jobs.py,
+app/routers/admin.py) обновляют user_stats сами, тем же UPSERT-ом. Поэтому «всего выиграно»,
+«всего бонусов» и т.п. — чтение одной строки по первичному ключу.
+
+Журнал только дописывается; записи, созданные не в статусе 'completed', в агрегаты не попадают.
+
+Полный пересчет из transactions (после ручных правок, восстановления из бэкапа и т.п.):
+    python -m app.user_stats rebuild [--workers 4] [--chunk-size 5000]
+"""
+import argparse
+import asyncio
+import time
+from collections import defaultdict
+from decimal import Decimal
+from typing import Iterable, Optional
+
+from sqlalchemy import event, func, inspect, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.models import Transaction, UserStat
+
+# Сколько пользователей пересчитывает один чанк rebuild (одна транзакция)
+REBUILD_CHUNK_USERS = 5000
+REBUILD_WORKERS = 4
+
+# Пересчет диапазона пользователей [:first_id, :last_id].
+# Сначала FOR SHARE на строки users: ждем транзакции, которые сейчас меняют баланс этих пользователей
+# (а значит, пишут и в журнал), и не пускаем новые до конца чанка — иначе их приращение user_stats
+# можно потерять между DELETE и INSERT.
+_LOCK_USERS_SQL = text("SELECT id FROM users WHERE id BETWEEN :first_id AND :last_id FOR SHARE")
+_DELETE_CHUNK_SQL = text("DELETE FROM user_stats WHERE user_id BETWEEN :first_id AND :last_id")
+_REBUILD_CHUNK_SQL = text("""
+INSERT INTO user_stats (user_id, type, tx_count, amount_sum, last_activity_at, last_transaction_id)
+SELECT user_id, type, count(*), COALESCE(sum(amount), 0), max(timestamp), max(id)
+FROM transactions
+WHERE user_id BETWEEN :first_id AND :last_id
+  AND COALESCE(status, 'completed') = 'completed'
+GROUP BY user_id, type
+""")
+# Границы чанков: каждый chunk-ый id пользователя
+_CHUNK_BOUNDS_SQL = text("""
+SELECT id FROM (SELECT id, row_number() OVER (ORDER BY id) AS rn FROM users) AS numbered
+WHERE rn % :chunk_size = 1
+ORDER BY id
+""")
+
+
+def _delta_upsert(rows: list[dict]):
+    stmt = pg_insert(UserStat).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[UserStat.user_id, UserStat.type],
+        set_={
+            "tx_count": UserStat.tx_count + stmt.excluded.tx_count,
+            "amount_sum": UserStat.amount_sum + stmt.excluded.amount_sum,
+            # GREATEST в Postgres пропускает NULL
+            "last_activity_at": func.greatest(UserStat.last_activity_at, stmt.excluded.last_activity_at),
+            "last_transaction_id": func.greatest(UserStat.last_transaction_id, stmt.excluded.last_transaction_id),
+        },
+    )
+
+
+def collect_deltas(transactions: Iterable[Transaction]) -> list[dict]:
+    """Сворачивает новые транзакции в приращения по (user_id, type), отсортированные по ключу."""
+    deltas = {}
+    for tx in transactions:
+        # Читаем уже загруженные значения, не трогая атрибуты: ленивая загрузка в after_flush недоступна
+        values = inspect(tx).dict
+        if (values.get("status") or "completed") != "completed":
+            continue
+        key = (values["user_id"], values["type"])
+        delta = deltas.setdefault(key, {"tx_count": 0, "amount_sum": Decimal("0"), "timestamps": [], "ids": []})
+        delta["tx_count"] += 1
+        delta["amount_sum"] += Decimal(str(values["amount"]))
+        if values.get("timestamp") is not None:
+            delta["timestamps"].append(values["timestamp"])
+        if values.get("id") is not None:
+            delta["ids"].append(values["id"])
+
+    # Один порядок ключей во всех транзакциях — без взаимных блокировок при параллельных UPSERT
+    return [
+        {
+            "user_id": user_id,
+            "type": tx_type,
+            "tx_count": delta["tx_count"],
+            "amount_sum": delta["amount_sum"],
+            # Без явного времени timestamp берется из server_default now() — то же now() этой транзакции
+            "last_activity_at": max(delta["timestamps"]) if delta["timestamps"] else func.now(),
+            "last_transaction_id": max(delta["ids"]) if delta["ids"] else None,
+        }
+        for (user_id, tx_type), delta in sorted(deltas.items())
+    ]
+
+
+@event.listens_for(Session, "after_flush")
+def _update_stats_after_flush(session, flush_context):
+    rows = collect_deltas(obj for obj in session.new if isinstance(obj, Transaction))
+    if rows:
+        session.connection().execute(_delta_upsert(rows))
+
+
+async def get_user_stats(db: AsyncSession, user_id: int, types: Optional[Iterable[str]] = None) -> dict:
+    """Агрегаты пользователя: {type: UserStat}. Типы без записей в словарь не попадают."""
+    stmt = select(UserStat).where(UserStat.user_id == user_id)
+    if types is not None:
+        stmt = stmt.where(UserStat.type.in_(list(types)))
+    return {stat.type: stat for stat in (await db.execute(stmt)).scalars()}
+
+
+async def _rebuild_chunk(engine, first_id: int, last_id: int) -> int:
+    params = {"first_id": first_id, "last_id": last_id}
+    async with engine.begin() as conn:
+        await conn.execute(_LOCK_USERS_SQL, params)
+        await conn.execute(_DELETE_CHUNK_SQL, params)
+        result = await conn.execute(_REBUILD_CHUNK_SQL, params)
+    return result.rowcount
+
+
+async def rebuild(engine, workers: int = REBUILD_WORKERS, chunk_size: int = REBUILD_CHUNK_USERS) -> int:
+    """Пересчитывает user_stats из transactions чанками по chunk_size пользователей в workers соединений."""
+    async with engine.connect() as conn:
+        bounds = list((await conn.execute(_CHUNK_BOUNDS_SQL, {"chunk_size": chunk_size})).scalars())
+    if not bounds:
+        return 0
+    # Последний чанк — до конца диапазона id
+    ranges = [(first, nxt - 1) for first, nxt in zip(bounds, bounds[1:])] + [(bounds[-1], 2 ** 63 - 1)]
+
+    queue = asyncio.Queue()
+    for chunk in ranges:
+        queue.put_nowait(chunk)
+    totals = defaultdict(int)
+
+    async def worker():
+        while not queue.empty():
+            first_id, last_id = queue.get_nowait()
+            rows = await _rebuild_chunk(engine, first_id, last_id)
+            totals["rows"] += rows
+            totals["chunks"] += 1
+            if totals["chunks"] % 10 == 0 or totals["chunks"] == len(ranges):
+                print(f"Пересчитано чанков: {totals['chunks']}/{len(ranges)}")
+
+    await asyncio.gather(*(worker() for _ in range(max(1, min(workers, len(ranges))))))
+    return totals["rows"]
+
+
+async def _main(args) -> int:
+    from app.database import get_engine
+
+    engine = get_engine()
+    try:
+        started = time.perf_counter()
+        rows = await rebuild(engine, workers=args.workers, chunk_size=args.chunk_size)
+        print(f"✅ user_stats пересчитана: {rows} строк за {time.perf_counter() - started:.1f} с.")
+        return 0
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m app.user_stats", description="Агрегаты транзакций пользователей")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = sub.add_parser("rebuild", help="Пересчитать user_stats из transactions")
+    rebuild_parser.add_argument("--workers", type=int, default=REBUILD_WORKERS, help="параллельных соединений")
+    rebuild_parser.add_argument("--chunk-size", type=int, default=REBUILD_CHUNK_USERS, help="пользователей в чанке")
+    raise SystemExit(asyncio.run(_main(parser.parse_args())))
@@ -5,7 +5,13 @@ import json
 from urllib.parse import parse_qsl
 from operator import itemgetter
 
+from app.metrics import span
+
 def check_webapp_signature(init_data: str, token: str) -> bool:
+    with span("auth_verify"):
+        return _check_webapp_signature(init_data, token)
+
+def _check_webapp_signature(init_data: str, token: str) -> bool:
     try:
         parsed_data = dict(parse_qsl(init_data))
     except ValueError:
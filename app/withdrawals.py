@@ -0,0 +1,403 @@
+# app/withdrawals.py
+"""
+Заявки на вывод средств с основного баланса (main_balance) и их пакетная выплата.
+
+Заявка (POST /api/withdrawals) сразу удерживает сумму: одна транзакция БД блокирует строку
+пользователя, проверяет баланс и лимит открытых заявок, списывает main_balance и создает заявку
+(status = pending) с записью 'withdrawal' в журнале. Параллельные заявки одного пользователя ждут
+друг друга на блокировке строки, поэтому удержать больше, чем есть на балансе, нельзя.
+Повтор запроса с тем же request_key возвращает уже созданную заявку, второй раз сумма не удерживается.
+
+Обработчик (process_pending_withdrawals, задача process_withdrawals) забирает пачку pending-заявок
+(FOR UPDATE SKIP LOCKED, status = processing), отправляет ее провайдеру выплат (app/payouts.py)
+и одним SQL применяет результаты:
+    completed — users.total_withdrawn += сумма;
+    failed    — сумма возвращается на main_balance (запись 'withdrawal_refund');
+    retry     — заявка снова pending, следующая попытка через RETRY_DELAY * 2^(попытка-1);
+                после MAX_ATTEMPTS попыток — failed с возвратом.
+Заявка, зависшая в processing дольше STUCK_AFTER (обработчик упал после отправки), возвращается
+в очередь: провайдер получит ее повторно с тем же ключом идемпотентности и второй раз не заплатит.
+
+Ручной запуск: python -m app.withdrawals process [--batch-size 100]
+"""
+import argparse
+import asyncio
+import json
+from datetime import timedelta
+from decimal import Decimal
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from pydantic import BaseModel, Field
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import get_settings
+from app.database import get_async_session, get_read_session, get_session_factory, read_your_writes
+from app.events import balances_from_rows, publish_balances
+from app.payouts import COMPLETED, FAILED, RETRY, Payout, PayoutResult, get_payout_provider
+from app.ratelimit import rate_limit
+from app.responses import fast_json
+from app.utils import check_webapp_signature, parse_qsl
+
+BOT_TOKEN = get_settings().bot_token
+
+WITHDRAWAL_TX_TYPE = "withdrawal"
+WITHDRAWAL_REFUND_TX_TYPE = "withdrawal_refund"
+WITHDRAWAL_CURRENCY = "₤s"
+MIN_WITHDRAWAL = Decimal("10.00")
+# Открытых (pending/processing) заявок на пользователя одновременно
+MAX_OPEN_WITHDRAWALS = 3
+WITHDRAWALS_HISTORY_LIMIT = 50
+
+BATCH_SIZE = 100 # Заявок в одной отправке провайдеру
+MAX_ATTEMPTS = 5
+RETRY_DELAY = timedelta(minutes=5)
+STUCK_AFTER = timedelta(minutes=30)
+
+router = APIRouter(prefix="/api", tags=["withdrawals"])
+
+
+class WithdrawalRequest(BaseModel):
+    initData: str
+    amount: Decimal = Field(..., ge=MIN_WITHDRAWAL, max_digits=18, decimal_places=2)
+    destination: str = Field(..., min_length=1, max_length=255)
+    # Повторный запрос с тем же request_key вернет уже созданную заявку
+    request_key: Optional[str] = Field(None, max_length=64)
+
+
+# --- Создание заявки ---
+
+# Блокирует строку пользователя до конца транзакции: следующий запрос видит все, что закоммитили
+# параллельные заявки этого пользователя (баланс, открытые заявки, request_key)
+_LOCK_USER_SQL = text("""
+SELECT u.status, COALESCE(u.main_balance, 0) AS main_balance,
+       (SELECT count(*) FROM withdrawals w
+        WHERE w.user_id = u.id AND w.status IN ('pending', 'processing')) AS open_withdrawals,
+       (SELECT w.id FROM withdrawals w
+        WHERE w.user_id = u.id AND w.request_key = :request_key) AS existing_id
+FROM users u
+WHERE u.id = :user_id
+FOR UPDATE OF u
+""")
+
+# Удержание: баланс -> заявка -> журнал -> user_stats. Условие на баланс в UPDATE остается
+# последней защитой, даже если блокировку выше кто-то уберет.
+_HOLD_SQL = text("""
+WITH balances AS (
+    UPDATE users u
+    SET main_balance = u.main_balance - :amount
+    WHERE u.id = :user_id AND u.main_balance >= :amount
+    RETURNING u.id, u.main_balance, u.bonus_balance, u.lucrum_balance
+),
+created AS (
+    INSERT INTO withdrawals (user_id, amount, currency, destination, status, request_key, attempts)
+    SELECT id, :amount, :currency, :destination, 'pending', :request_key, 0
+    FROM balances
+    RETURNING id, user_id, amount, currency, destination, status, created_at
+),
+ledger AS (
+    INSERT INTO transactions (user_id, type, amount, currency, status, description, txid)
+    SELECT user_id, :tx_type, -amount, currency, 'completed',
+           'Вывод средств, заявка #' || id || ': -' || amount || ' ' || currency,
+           'withdrawal:' || id
+    FROM created
+    RETURNING id, user_id, amount, timestamp
+),
+stats AS (
+    INSERT INTO user_stats (user_id, type, tx_count, amount_sum, last_activity_at, last_transaction_id)
+    SELECT user_id, :tx_type, count(*), sum(amount), max(timestamp), max(id)
+    FROM ledger
+    GROUP BY user_id
+    ON CONFLICT (user_id, type) DO UPDATE
+    SET tx_count = user_stats.tx_count + EXCLUDED.tx_count,
+        amount_sum = user_stats.amount_sum + EXCLUDED.amount_sum,
+        last_activity_at = GREATEST(user_stats.last_activity_at, EXCLUDED.last_activity_at),
+        last_transaction_id = GREATEST(user_stats.last_transaction_id, EXCLUDED.last_transaction_id)
+)
+SELECT created.*, balances.main_balance AS balance_after,
+       (SELECT array_agg(ARRAY[id, main_balance, bonus_balance, lucrum_balance]) FROM balances) AS balances
+FROM created JOIN balances ON balances.id = created.user_id
+""")
+
+_WITHDRAWAL_COLUMNS = "id, amount, currency, destination, status, attempts, provider_ref, error, created_at, processed_at"
+_WITHDRAWAL_BY_ID_SQL = text(f"SELECT {_WITHDRAWAL_COLUMNS} FROM withdrawals WHERE id = :id")
+_USER_WITHDRAWALS_SQL = text(f"""
+SELECT {_WITHDRAWAL_COLUMNS} FROM withdrawals
+WHERE user_id = :user_id
+ORDER BY created_at DESC
+LIMIT :limit
+""")
+
+
+def _withdrawal_json(row) -> dict:
+    return {
+        "id": row.id,
+        "amount": float(row.amount),
+        "currency": row.currency,
+        "destination": row.destination,
+        "status": row.status,
+        "attempts": getattr(row, "attempts", 0),
+        "provider_ref": getattr(row, "provider_ref", None),
+        "error": getattr(row, "error", None),
+        "created_at": row.created_at.isoformat() if row.created_at else None,
+        "processed_at": row.processed_at.isoformat() if getattr(row, "processed_at", None) else None,
+    }
+
+
+def _user_id_from_init_data(init_data: str) -> int:
+    if not check_webapp_signature(init_data, BOT_TOKEN):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Неверная подпись Telegram initData.")
+    user_data_str = dict(parse_qsl(init_data)).get('user')
+    try:
+        return int(json.loads(user_data_str)["id"])
+    except (TypeError, ValueError, KeyError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Неверные данные пользователя в initData.")
+
+
+async def _existing_withdrawal(db: AsyncSession, withdrawal_id: int) -> dict:
+    row = (await db.execute(_WITHDRAWAL_BY_ID_SQL, {"id": withdrawal_id})).one()
+    return {"ok": True, "duplicate": True, "withdrawal": _withdrawal_json(row)}
+
+
+async def create_withdrawal(db: AsyncSession, user_id: int, amount: Decimal, destination: str,
+                            request_key: Optional[str] = None) -> dict:
+    """Создает заявку с удержанием суммы с main_balance и коммитит. Ошибки — HTTPException."""
+    lock = (await db.execute(_LOCK_USER_SQL, {"user_id": user_id, "request_key": request_key})).one_or_none()
+    if lock is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Пользователь не найден.")
+    if lock.existing_id is not None:
+        await db.rollback()
+        return await _existing_withdrawal(db, lock.existing_id)
+    if lock.status == "banned":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Аккаунт заблокирован.")
+    if lock.open_withdrawals >= MAX_OPEN_WITHDRAWALS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Не больше {MAX_OPEN_WITHDRAWALS} заявок на вывод одновременно. Дождитесь обработки текущих.",
+        )
+    if lock.main_balance < amount:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Недостаточно средств на основном балансе.")
+
+    params = {
+        "user_id": user_id, "amount": amount, "currency": WITHDRAWAL_CURRENCY, "destination": destination,
+        "request_key": request_key, "tx_type": WITHDRAWAL_TX_TYPE,
+    }
+    try:
+        row = (await db.execute(_HOLD_SQL, params)).one_or_none()
+        await db.commit()
+    except IntegrityError:
+        # Тот же request_key успели записать без блокировки строки пользователя (ручная вставка) — отдаем ту заявку
+        await db.rollback()
+        existing = (await db.execute(_LOCK_USER_SQL, {"user_id": user_id, "request_key": request_key})).one()
+        await db.rollback()
+        if existing.existing_id is None:
+            raise # Нарушено другое ограничение (например, уникальный txid) — это не повтор запроса
+        return await _existing_withdrawal(db, existing.existing_id)
+    if row is None:
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Недостаточно средств на основном балансе.")
+
+    # Запись сделана в обход ORM: чтения пользователя ближайшие секунды идут в основную БД
+    db.info.setdefault("written_user_ids", set()).add(user_id)
+    await publish_balances(balances_from_rows(row.balances))
+    print(f"✅ Заявка на вывод #{row.id}: пользователь {user_id}, {row.amount} {row.currency}")
+    return {"ok": True, "duplicate": False, "withdrawal": _withdrawal_json(row), "main_balance": float(row.balance_after)}
+
+
+@router.post("/withdrawals", dependencies=[Depends(rate_limit("withdrawals"))])
+async def request_withdrawal(body: WithdrawalRequest, db: AsyncSession = Depends(get_async_session)):
+    """Заявка на вывод: сумма сразу удерживается с main_balance и выплачивается обработчиком пачкой."""
+    user_id = _user_id_from_init_data(body.initData)
+    return fast_json(await create_withdrawal(db, user_id, body.amount, body.destination, body.request_key))
+
+
+@router.get("/withdrawals")
+async def list_withdrawals(
+    telegram_init_data: str = Query(..., alias="initData"),
+    db: AsyncSession = Depends(get_read_session),
+):
+    """Последние заявки пользователя, новые первыми."""
+    user_id = _user_id_from_init_data(telegram_init_data)
+    await read_your_writes(db, user_id)
+    rows = (await db.execute(_USER_WITHDRAWALS_SQL, {"user_id": user_id, "limit": WITHDRAWALS_HISTORY_LIMIT})).all()
+    return fast_json({"withdrawals": [_withdrawal_json(row) for row in rows]})
+
+
+# --- Обработчик ---
+
+# Заявки, которые обработчик взял и не завершил (упал после отправки), возвращаются в очередь
+_RELEASE_STUCK_SQL = text("""
+UPDATE withdrawals SET status = 'pending', next_attempt_at = NULL
+WHERE status = 'processing' AND processing_started_at < now() - CAST(:stuck_after AS INTERVAL)
+""")
+
+_CLAIM_SQL = text("""
+UPDATE withdrawals w
+SET status = 'processing', attempts = w.attempts + 1, processing_started_at = now(), provider = :provider
+FROM (
+    SELECT id FROM withdrawals
+    WHERE status = 'pending' AND (next_attempt_at IS NULL OR next_attempt_at <= now())
+    ORDER BY id
+    LIMIT :batch_size
+    FOR UPDATE SKIP LOCKED
+) AS batch
+WHERE w.id = batch.id
+RETURNING w.id, w.user_id, w.amount, w.currency, w.destination
+""")
+
+# Результаты пачки одним запросом: заявки -> пользователи (блокируются по возрастанию id) ->
+# total_withdrawn и возвраты на main_balance -> журнал 'withdrawal_refund' -> user_stats.
+# Заявку, которую за это время вернули в очередь и забрал другой обработчик, меняет только тот,
+# у кого она в processing: возврат не случится дважды.
+_FINISH_SQL = text("""
+WITH results AS (
+    SELECT * FROM unnest(CAST(:ids AS INTEGER[]), CAST(:outcomes AS TEXT[]),
+                         CAST(:provider_refs AS TEXT[]), CAST(:errors AS TEXT[]))
+        AS r(id, outcome, provider_ref, error)
+),
+finished AS (
+    UPDATE withdrawals w
+    SET status = CASE
+            WHEN r.outcome = 'completed' THEN 'completed'
+            WHEN r.outcome = 'failed' OR w.attempts >= :max_attempts THEN 'failed'
+            ELSE 'pending'
+        END,
+        provider_ref = COALESCE(r.provider_ref, w.provider_ref),
+        error = r.error,
+        next_attempt_at = CASE
+            WHEN r.outcome = 'retry' AND w.attempts < :max_attempts
+            THEN now() + CAST(:retry_delay AS INTERVAL) * power(2, w.attempts - 1)
+        END,
+        processed_at = CASE WHEN r.outcome = 'retry' AND w.attempts < :max_attempts THEN NULL ELSE now() END
+    FROM results r
+    WHERE w.id = r.id AND w.status = 'processing'
+    RETURNING w.id, w.user_id, w.amount, w.currency, w.status
+),
+per_user AS (
+    SELECT user_id,
+           COALESCE(sum(amount) FILTER (WHERE status = 'completed'), 0) AS withdrawn,
+           COALESCE(sum(amount) FILTER (WHERE status = 'failed'), 0) AS refunded
+    FROM finished
+    WHERE status IN ('completed', 'failed')
+    GROUP BY user_id
+),
+locked AS (
+    SELECT u.id FROM users u
+    WHERE u.id IN (SELECT user_id FROM per_user)
+    ORDER BY u.id
+    FOR UPDATE
+),
+balances AS (
+    UPDATE users u
+    SET total_withdrawn = COALESCE(u.total_withdrawn, 0) + per_user.withdrawn,
+        main_balance = COALESCE(u.main_balance, 0) + per_user.refunded
+    FROM per_user JOIN locked ON locked.id = per_user.user_id
+    WHERE u.id = per_user.user_id
+    RETURNING u.id, u.main_balance, u.bonus_balance, u.lucrum_balance, per_user.refunded
+),
+ledger AS (
+    INSERT INTO transactions (user_id, type, amount, currency, status, description, txid)
+    SELECT user_id, :refund_tx_type, amount, currency, 'completed',
+           'Возврат по заявке на вывод #' || id || ': +' || amount || ' ' || currency,
+           'withdrawal_refund:' || id
+    FROM finished
+    WHERE status = 'failed'
+    RETURNING id, user_id, amount, timestamp
+),
+stats AS (
+    INSERT INTO user_stats (user_id, type, tx_count, amount_sum, last_activity_at, last_transaction_id)
+    SELECT user_id, :refund_tx_type, count(*), sum(amount), max(timestamp), max(id)
+    FROM ledger
+    GROUP BY user_id
+    ORDER BY user_id
+    ON CONFLICT (user_id, type) DO UPDATE
+    SET tx_count = user_stats.tx_count + EXCLUDED.tx_count,
+        amount_sum = user_stats.amount_sum + EXCLUDED.amount_sum,
+        last_activity_at = GREATEST(user_stats.last_activity_at, EXCLUDED.last_activity_at),
+        last_transaction_id = GREATEST(user_stats.last_transaction_id, EXCLUDED.last_transaction_id)
+)
+SELECT (SELECT count(*) FILTER (WHERE status = 'completed') FROM finished) AS completed,
+       (SELECT count(*) FILTER (WHERE status = 'failed') FROM finished) AS failed,
+       (SELECT count(*) FILTER (WHERE status = 'pending') FROM finished) AS retried,
+       (SELECT COALESCE(sum(amount) FILTER (WHERE status = 'completed'), 0) FROM finished) AS total,
+       (SELECT array_agg(ARRAY[id, main_balance, bonus_balance, lucrum_balance]) FROM balances WHERE refunded > 0) AS balances
+""")
+
+
+async def _send(provider, payouts: list[Payout]) -> dict[int, PayoutResult]:
+    """Результаты провайдера по id заявки; исключение, пропущенная заявка или неизвестный результат — RETRY."""
+    try:
+        results = {result.withdrawal_id: result for result in await provider.send_batch(payouts)}
+    except Exception as e:
+        print(f"❌ Провайдер выплат {provider.name}: {e!r}; пачка из {len(payouts)} заявок будет повторена")
+        results = {}
+    checked = {}
+    for payout in payouts:
+        result = results.get(payout.withdrawal_id)
+        if result is None:
+            result = PayoutResult(payout.withdrawal_id, RETRY, error="Провайдер не вернул результат")
+        elif result.outcome not in (COMPLETED, FAILED, RETRY):
+            result = PayoutResult(payout.withdrawal_id, RETRY, error=f"Неизвестный результат провайдера: {result.outcome}")
+        checked[payout.withdrawal_id] = result
+    return checked
+
+
+async def process_pending_withdrawals(batch_size: int = BATCH_SIZE, provider=None) -> str:
+    """
+    Выплачивает pending-заявки пачками по batch_size: каждая пачка — захват (своя транзакция),
+    отправка провайдеру и применение результатов (своя транзакция).
+    """
+    provider = provider or get_payout_provider()
+    completed, failed, retried, total = 0, 0, 0, Decimal("0")
+    session_factory = get_session_factory()
+    async with session_factory() as db:
+        released = (await db.execute(_RELEASE_STUCK_SQL, {"stuck_after": STUCK_AFTER})).rowcount
+        await db.commit()
+    if released:
+        print(f"⏱️ Возвращено в очередь зависших заявок на вывод: {released}")
+    while True:
+        async with session_factory() as db:
+            claimed = (await db.execute(_CLAIM_SQL, {"batch_size": batch_size, "provider": provider.name})).all()
+            await db.commit()
+        if not claimed:
+            break
+        payouts = [Payout(row.id, row.user_id, row.amount, row.currency, row.destination) for row in claimed]
+        results = list((await _send(provider, payouts)).values())
+        params = {
+            "ids": [result.withdrawal_id for result in results],
+            "outcomes": [result.outcome for result in results],
+            "provider_refs": [result.provider_ref for result in results],
+            "errors": [result.error for result in results],
+            "max_attempts": MAX_ATTEMPTS, "retry_delay": RETRY_DELAY, "refund_tx_type": WITHDRAWAL_REFUND_TX_TYPE,
+        }
+        async with session_factory() as db:
+            row = (await db.execute(_FINISH_SQL, params)).one()
+            await db.commit()
+        await publish_balances(balances_from_rows(row.balances))
+        completed += row.completed
+        failed += row.failed
+        retried += row.retried
+        total += row.total
+        if len(claimed) < batch_size:
+            break
+    return f"выплачено: {completed} ({total} ₤s), отклонено: {failed}, отложено: {retried}"
+
+
+async def _main(args) -> int:
+    from app.database import dispose_engine
+
+    try:
+        print(f"✅ Заявки на вывод обработаны: {await process_pending_withdrawals(args.batch_size)}")
+        return 0
+    finally:
+        await dispose_engine()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m app.withdrawals", description="Заявки на вывод средств")
+    sub = parser.add_subparsers(dest="command", required=True)
+    process_parser = sub.add_parser("process", help="Выплатить pending-заявки через провайдера PAYOUT_PROVIDER")
+    process_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="заявок в одной отправке провайдеру")
+    raise SystemExit(asyncio.run(_main(parser.parse_args())))
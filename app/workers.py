@@ -0,0 +1,170 @@
+# app/workers.py
+import asyncio
+import hashlib
+import os
+import time
+
+from app.config import get_settings
+
+try:
+    import fcntl
+except ImportError: # Windows: нескольких воркеров там не запускаем, каждый процесс считает себя единственным
+    fcntl = None
+
+# Выбор главного воркера при нескольких процессах на одной машине (gunicorn, uvicorn --workers).
+# Только главный воркер выполняет одноразовые действия старта: проверку/миграцию схемы БД и SetWebhook.
+# Используются два lock-файла (flock снимается ядром автоматически, даже если процесс убит):
+#   *.primary — эксклюзивная блокировка главного воркера, держится до его остановки;
+#   *.alive   — разделяемая блокировка каждого живого воркера. DeleteWebhook выполняет тот,
+#               кто последним остановился (сумел взять эксклюзивную блокировку), а не главный:
+#               перезапуск одного воркера (max_requests) не должен снимать вебхук у остальных.
+# Первый воркер поколения (никого живых на момент старта) — единственный, кому разрешено
+# пересоздавать/мигрировать БД: главный воркер, перезапущенный посреди работы, этого делать не должен.
+
+
+# Сколько новый воркер ждет, пока последний воркер прошлого поколения закончит остановку
+ALIVE_LOCK_WAIT_SECONDS = 10
+# Сколько остальные воркеры ждут, пока главный закончит подготовку (схема БД) и начнет принимать запросы
+PRIMARY_READY_WAIT_SECONDS = 60
+
+
+class WorkerRole:
+    def __init__(self, lock_dir: str | None = None, name: str | None = None):
+        settings = get_settings()
+        if name is None:
+            # Имя зависит от токена бота: несколько приложений на одной машине не мешают друг другу
+            name = "lucrora-" + hashlib.sha1((settings.bot_token or "").encode()).hexdigest()[:12]
+        base = os.path.join(lock_dir or settings.worker_lock_dir, name)
+        self.primary_path = base + ".primary"
+        self.alive_path = base + ".alive"
+        self.is_primary = False
+        self.is_first = False # Первый живой воркер в поколении
+        self._primary_fd = None
+        self._alive_fd = None
+
+    def start(self) -> bool:
+        """Регистрирует воркер и пытается стать главным. Возвращает True для главного воркера."""
+        if fcntl is None:
+            self.is_primary = self.is_first = True
+            return True
+
+        self._alive_fd = os.open(self.alive_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(self._alive_fd, fcntl.LOCK_EX | fcntl.LOCK_NB) # Получится, только если живых воркеров нет
+            self.is_first = True
+        except OSError:
+            self.is_first = False
+        deadline = time.monotonic() + ALIVE_LOCK_WAIT_SECONDS
+        while True:
+            try:
+                fcntl.flock(self._alive_fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                break
+            except OSError:
+                # Прямо сейчас последний воркер прошлого поколения снимает вебхук — ждем его,
+                # но недолго: зависший процесс не должен блокировать старт
+                if time.monotonic() > deadline:
+                    print("ВНИМАНИЕ: не дождался остановки предыдущих воркеров, продолжаю запуск.")
+                    break
+                time.sleep(0.05)
+
+        self._primary_fd = os.open(self.primary_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(self._primary_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self._write_primary_state("starting")
+            self.is_primary = True
+        except OSError:
+            os.close(self._primary_fd)
+            self._primary_fd = None
+            self.is_primary = False
+        return self.is_primary
+
+    def _write_primary_state(self, state: str):
+        os.ftruncate(self._primary_fd, 0)
+        os.pwrite(self._primary_fd, f"{os.getpid()} {state}".encode(), 0)
+
+    def mark_ready(self):
+        """Главный воркер закончил подготовку — остальные могут начинать принимать запросы."""
+        if self._primary_fd is not None:
+            self._write_primary_state("ready")
+
+    async def wait_for_primary(self, timeout: float = PRIMARY_READY_WAIT_SECONDS) -> bool:
+        """Ждет, пока главный воркер отметит готовность. False — не дождались."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                with open(self.primary_path) as f:
+                    pid, state = f.read().split()
+                os.kill(int(pid), 0) # Отметка могла остаться от главного воркера прошлого поколения
+                if state == "ready":
+                    return True
+            except (OSError, ValueError):
+                pass
+            await asyncio.sleep(0.1)
+        return False
+
+    def stop(self) -> bool:
+        """Снимает блокировки. Возвращает True, если это последний живой воркер."""
+        if fcntl is None:
+            return True
+
+        if self._primary_fd is not None:
+            os.close(self._primary_fd) # Закрытие дескриптора снимает flock
+            self._primary_fd = None
+        self.is_primary = False
+
+        if self._alive_fd is None:
+            return True
+        try:
+            # Повышаем разделяемую блокировку до эксклюзивной: получится, только если других воркеров нет.
+            # Дескриптор остается открытым до выхода процесса (или до release()), чтобы второй «последний» не нашелся.
+            fcntl.flock(self._alive_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            self.release()
+            return False
+
+    def release(self):
+        """Закрывает оставшиеся дескрипторы (повторный старт в том же процессе, тесты)."""
+        for fd in (self._primary_fd, self._alive_fd):
+            if fd is not None:
+                os.close(fd)
+        self._primary_fd = self._alive_fd = None
+        self.is_primary = False
+
+
+_role: WorkerRole | None = None
+
+
+def start_worker() -> bool:
+    """Вызывается на старте приложения. True — этот воркер главный."""
+    global _role
+    if _role is not None:
+        _role.release()
+    _role = WorkerRole()
+    return _role.start()
+
+
+def stop_worker() -> bool:
+    """Вызывается при остановке приложения. True — это последний живой воркер."""
+    if _role is None:
+        return True
+    return _role.stop()
+
+
+def is_primary_worker() -> bool:
+    return _role is not None and _role.is_primary
+
+
+def is_first_worker() -> bool:
+    return _role is not None and _role.is_first
+
+
+def mark_primary_ready():
+    if _role is not None:
+        _role.mark_ready()
+
+
+async def wait_for_primary() -> bool:
+    if _role is None or fcntl is None:
+        return True
+    return await _role.wait_for_primary()
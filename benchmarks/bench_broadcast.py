@@ -0,0 +1,100 @@
+# benchmarks/bench_broadcast.py
+"""
+Рассылка (app/broadcasts.py) против локальной заглушки Bot API с имитацией ограничений Telegram.
+
+Создает рассылку всем пользователям базы, выполняет ее и сверяет с заглушкой:
+скорость, сколько ответов 429 получено, каждому ли получателю дошло ровно одно сообщение.
+С --interrupt-after рассылка прерывается через N секунд (как при рестарте) и продолжается
+с чекпоинта: повторно может уйти не больше одной страницы (PAGE_SIZE).
+
+Запуск (база со схемой и пользователями: benchmarks.seed_data --create-schema):
+  python -m benchmarks.bench_broadcast --database-url postgresql://... --rate 25 --stub-global-rate 30
+"""
+import argparse
+import asyncio
+import os
+import time
+
+
+async def run(args) -> int:
+    from sqlalchemy import func, select
+
+    from app import broadcasts
+    from app.bot import close_bot
+    from app.database import dispose_engine, get_session_factory
+    from app.models import Broadcast, User, UserAccountStatus
+    from benchmarks import stub_bot_api
+
+    stub_bot_api.limits.update(
+        global_rate=args.stub_global_rate, chat_rate=args.stub_chat_rate,
+        blocked_every=args.blocked_every, latency=args.latency,
+    )
+    server, server_task = await stub_bot_api.serve(port=args.stub_port)
+    try:
+        async with get_session_factory()() as db:
+            recipients = set((await db.execute(
+                select(User.id).where(User.status != UserAccountStatus.banned)
+            )).scalars())
+            broadcast = await broadcasts.create_broadcast(db, "📣 Бенчмарк рассылки")
+        print(f"Рассылка {broadcast.id}: {len(recipients)} получателей, скорость {args.rate}/с, "
+              f"заглушка: {args.stub_global_rate or '∞'}/с на бота, {args.stub_chat_rate or '∞'}/с на чат")
+
+        started = time.monotonic()
+        if args.interrupt_after:
+            task = asyncio.create_task(broadcasts.run_broadcast(broadcast.id, rate=args.rate))
+            await asyncio.sleep(args.interrupt_after)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            print(f"Прервано через {args.interrupt_after} с, продолжаю с чекпоинта...")
+        status = await broadcasts.run_broadcast(broadcast.id, rate=args.rate)
+        elapsed = time.monotonic() - started
+
+        async with get_session_factory()() as db:
+            stats = await db.get(Broadcast, broadcast.id)
+            await db.delete(stats)
+            await db.commit()
+        delivered = {chat: n for chat, n in stub_bot_api.delivered.items() if chat in recipients}
+        duplicates = sum(n - 1 for n in delivered.values())
+        blocked = {chat for chat in recipients if args.blocked_every and chat % args.blocked_every == 0}
+        missing = len(recipients - blocked - delivered.keys())
+
+        print(f"\nстатус {status}, {elapsed:.1f} с, {stats.sent / elapsed:.1f} сообщ/с")
+        print(f"broadcasts: отправлено {stats.sent}, заблокировали {stats.blocked}, ошибок {stats.failed}, повторов {stats.retries}")
+        print(f"заглушка: доставлено {sum(delivered.values())}, ответов 429: {stub_bot_api.flood_errors}, "
+              f"дублей {duplicates}, не доставлено {missing}")
+        ok = status == "completed" and missing == 0 and duplicates <= (broadcasts.PAGE_SIZE if args.interrupt_after else 0)
+        return 0 if ok else 1
+    finally:
+        server.should_exit = True
+        await server_task
+        await close_bot()
+        await dispose_engine()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL"))
+    parser.add_argument("--rate", type=float, default=25, help="BROADCAST_RATE")
+    parser.add_argument("--stub-port", type=int, default=8082)
+    parser.add_argument("--stub-global-rate", type=int, default=30)
+    parser.add_argument("--stub-chat-rate", type=float, default=1)
+    parser.add_argument("--blocked-every", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--interrupt-after", type=float, default=0)
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("укажите --database-url или BENCH_DATABASE_URL")
+
+    # Настройки читаются один раз — окружение готовим до первого импорта app.*
+    os.environ["DATABASE_URL"] = args.database_url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    os.environ["TELEGRAM_API_BASE"] = f"http://127.0.0.1:{args.stub_port}"
+    os.environ.setdefault("BOT_TOKEN", "123456:bench")
+    os.environ["SQL_ECHO"] = "False"
+    raise SystemExit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+# benchmarks/bench_events.py
+"""
+Память и доставка потоков GET /api/events (app/routers/events.py).
+
+Поднимает main:app через uvicorn в отдельном процессе против уже заполненной базы
+(benchmarks.seed_data), открывает --connections потоков разных пользователей с initData и печатает,
+сколько памяти (RSS воркера) занимает одно простаивающее подключение. Затем, если в базе есть
+активный admin, начисляет всем этим пользователям бонус через POST /api/admin/users/credit_bonus
+и замеряет, за сколько событие balance дошло до каждого потока.
+
+ВНИМАНИЕ: начисление меняет bonus_balance и пишет транзакции admin_bonus; --no-fanout отключает его.
+
+Пример (потоков больше ~1000 — поднимите ulimit -n):
+  python -m benchmarks.bench_events --database-url postgresql://... --connections 10000
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from urllib.parse import quote
+
+import httpx
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from benchmarks.initdata import make_init_data
+
+BENCH_BOT_TOKEN = "123456:BENCHMARK-TOKEN"
+BENCH_JWT_SECRET = "bench-access-secret"
+# Одновременных подключений при открытии потоков (каждое — проверка пользователя в БД)
+CONNECT_CONCURRENCY = 100
+
+
+def _rss_kib(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def _start_app(args) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": args.database_url,
+        "BOT_TOKEN": BENCH_BOT_TOKEN,
+        "WEBAPP_URL": "https://example.invalid/",
+        "JWT_SECRET_KEY": BENCH_JWT_SECRET,
+        "REFRESH_TOKEN_SECRET_KEY": "bench-refresh-secret",
+        "SCHEMA_MODE": "skip",
+        "RATE_LIMIT_ENABLED": "False",
+        "FRAUD_DETECTION_ENABLED": "False",
+        "SCHEDULER_ENABLED": "False",
+        "BROADCASTS_ENABLED": "False",
+        "SQL_ECHO": "False",
+    })
+    env.pop("BASE_WEBHOOK_URL", None)
+    cmd = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.port),
+           "--log-level", "warning", "--no-access-log"]
+    return subprocess.Popen(cmd, env=env)
+
+
+async def _wait_ready(client: httpx.AsyncClient, proc: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Приложение завершилось при старте (код {proc.returncode})")
+        try:
+            if (await client.get("/metrics")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("Приложение не поднялось вовремя")
+
+
+class EventStream:
+    """Поток на голом сокете: клиент httpx на десятки тысяч соединений сам съел бы больше сервера."""
+
+    def __init__(self, port: int, user_id: int):
+        self.port, self.user_id = port, user_id
+        self.reader = self.writer = None
+        self.events = 0
+        self.shed = 0 # Ответов 429 от сброса нагрузки при открытии
+
+    async def open(self):
+        init_data = quote(make_init_data(BENCH_BOT_TOKEN, self.user_id))
+        while True:
+            self.reader, self.writer = await asyncio.open_connection("127.0.0.1", self.port)
+            self.writer.write(f"GET /api/events?initData={init_data} HTTP/1.1\r\nHost: bench\r\n\r\n".encode())
+            head = await self.reader.readuntil(b"\r\n\r\n")
+            if head.startswith(b"HTTP/1.1 200"):
+                break
+            self.close()
+            if not head.startswith(b"HTTP/1.1 429"):
+                raise RuntimeError(f"Пользователь {self.user_id}: {head.splitlines()[0].decode()}")
+            # Сервер сбрасывает нагрузку — переподключаемся позже, как должен делать клиент
+            self.shed += 1
+            await asyncio.sleep(1)
+        await self.next_event()
+
+    async def next_event(self):
+        while b"event: balance" not in await self.reader.readuntil(b"\n\n"):
+            pass
+        self.events += 1
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+async def run(args) -> int:
+    engine = create_async_engine(args.database_url)
+    async with engine.connect() as conn:
+        user_ids = list((await conn.execute(text(
+            "SELECT id FROM users WHERE status = 'active' ORDER BY id LIMIT :n"
+        ), {"n": args.connections})).scalars())
+        admin_id = (await conn.execute(text(
+            "SELECT id FROM users WHERE status = 'active' AND role = 'admin' ORDER BY id LIMIT 1"
+        ))).scalar()
+    await engine.dispose()
+    if len(user_ids) < args.connections:
+        print(f"В базе только {len(user_ids)} активных пользователей")
+
+    proc = _start_app(args)
+    streams = [EventStream(args.port, user_id) for user_id in user_ids]
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=300) as client:
+            await _wait_ready(client, proc)
+            # Прогрев: первый поток подгружает модули и открывает пул БД — это не память подключений
+            warmup = EventStream(args.port, user_ids[0])
+            await warmup.open()
+            warmup.close()
+            await asyncio.sleep(0.5)
+            rss_before = _rss_kib(proc.pid)
+
+            sem = asyncio.Semaphore(CONNECT_CONCURRENCY)
+
+            async def open_stream(stream: EventStream):
+                async with sem:
+                    await stream.open()
+
+            started = time.monotonic()
+            await asyncio.gather(*(open_stream(stream) for stream in streams))
+            opened = time.monotonic() - started
+            await asyncio.sleep(1)
+            rss_after = _rss_kib(proc.pid)
+            per_connection = (rss_after - rss_before) / len(streams)
+            print(f"Открыто потоков: {len(streams)} за {opened:.1f} с ({len(streams) / opened:.0f}/с), "
+                  f"ответов 429 по пути: {sum(stream.shed for stream in streams)}")
+            print(f"RSS воркера: {rss_before / 1024:.1f} -> {rss_after / 1024:.1f} МиБ, "
+                  f"{per_connection:.1f} КиБ на подключение")
+
+            if args.no_fanout or admin_id is None:
+                if admin_id is None:
+                    print("Активного admin в базе нет — замер доставки пропущен")
+                return 0
+
+            from jose import jwt
+
+            token = jwt.encode({"sub": str(admin_id), "exp": int(time.time()) + 600}, BENCH_JWT_SECRET, algorithm="HS256")
+            waiting = [asyncio.ensure_future(stream.next_event()) for stream in streams]
+            started = time.monotonic()
+            response = await client.post(
+                "/api/admin/users/credit_bonus", headers={"Authorization": f"Bearer {token}"},
+                json={"user_ids": user_ids, "amount": "0.01", "description": "bench_events"},
+            )
+            committed = time.monotonic() - started
+            print(f"Начисление {len(user_ids)} пользователям: {committed:.2f} с, {response.text.splitlines()[-1]}")
+            await asyncio.gather(*waiting)
+            print(f"Событие balance дошло до всех {len(streams)} потоков за {time.monotonic() - started:.2f} с")
+            return 0
+    finally:
+        for stream in streams:
+            stream.close()
+        proc.terminate()
+        try:
+            proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL"))
+    parser.add_argument("--port", type=int, default=8767)
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--no-fanout", action="store_true", help="не начислять бонус, только замер памяти")
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("укажите --database-url или BENCH_DATABASE_URL")
+    args.database_url = args.database_url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
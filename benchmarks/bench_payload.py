@@ -0,0 +1,96 @@
+# benchmarks/bench_payload.py
+"""
+Размер ответа /api/transactions на проводе: обычный формат (rows) против колоночного (format=columns),
+без сжатия, gzip и brotli — с теми же уровнями, что у app.compression.
+
+Запуск: python -m benchmarks.bench_payload [--rows 50 500 2000]
+БД не нужна — история генерируется в памяти с описаниями, как их пишут игры, бонусы и начисление ROI.
+brotli замеряется, только если установлен пакет brotli.
+"""
+import argparse
+import gzip
+import random
+import timeit
+from collections import namedtuple
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+from app.compression import BROTLI_QUALITY, GZIP_LEVEL
+from app.responses import dumps
+from app.transactions import columnar_history
+
+Row = namedtuple("Row", "id user_id type amount currency timestamp status description txid")
+
+
+def _make_history(n: int) -> list[Row]:
+    rnd = random.Random(42)
+    now = datetime.now(timezone.utc)
+    rows = []
+    for i in range(n):
+        kind = rnd.random()
+        if kind < 0.4:
+            tx_type, amount = "game_bet", Decimal("-10.00")
+            description = f"Ставка в игре 'wheel of fortune': {amount} ₤s"
+        elif kind < 0.65:
+            tx_type, amount = "game_loss", Decimal("0.00")
+            description = "Проигрыш в игре 'wheel of fortune'."
+        elif kind < 0.8:
+            tx_type, amount = "game_win", Decimal(f"{rnd.uniform(15, 50):.2f}")
+            description = f"Выигрыш в игре 'wheel of fortune': +{amount} ₤s"
+        elif kind < 0.9:
+            tx_type, amount = "daily_bonus", Decimal(rnd.choice(("10.00", "25.00", "50.00")))
+            description = f"Ежедневный бонус: +{amount} ₤s"
+        else:
+            tx_type, amount = "roi_accrual", Decimal(f"{rnd.uniform(1, 30):.2f}")
+            day = date.today() - timedelta(days=i)
+            description = f"Начисление ROI по инвестиции #{rnd.randint(1, 99)} по {day:%d.%m.%Y}: +{amount} ₤s"
+        rows.append(Row(10_000_000 + n - i, 123456789, tx_type, amount, "₤s",
+                        now - timedelta(minutes=7 * i), "completed", description, None))
+    return rows
+
+
+def _restore(payload: dict) -> list:
+    """Описания так, как их восстановит клиент из колоночного ответа."""
+    columns = payload["columns"]
+    return [
+        None if index is None else payload["descriptions"][index].replace("{amount}", f"{amount:.2f}")
+        for index, amount in zip(columns["description"], columns["amount"])
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[50, 500, 2000], help="длины истории")
+    args = parser.parse_args()
+
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+        print("Пакет brotli не установлен — только gzip")
+
+    encoders = {"identity": lambda body: body, "gzip": lambda body: gzip.compress(body, GZIP_LEVEL)}
+    if brotli is not None:
+        encoders["br"] = lambda body: brotli.compress(body, quality=BROTLI_QUALITY)
+
+    print(f"{'rows':>6} {'format':<8}" + "".join(f"{name:>12}" for name in encoders) + f"{'serialize':>12}")
+    for n in args.rows:
+        history = _make_history(n)
+        bodies = {
+            "rows": lambda: dumps([row._asdict() for row in history]),
+            "columns": lambda: dumps(columnar_history(history)),
+        }
+        assert _restore(columnar_history(history)) == [row.description for row in history]
+        baseline = None
+        for fmt, build in bodies.items():
+            body = build()
+            seconds = min(timeit.repeat(build, number=20, repeat=3)) / 20
+            sizes = {name: len(encode(body)) for name, encode in encoders.items()}
+            baseline = baseline or sizes["identity"]
+            cells = "".join(f"{size / 1024:8.1f} KiB" for size in sizes.values())
+            print(f"{n:>6} {fmt:<8}{cells}{seconds * 1e3:9.2f} ms"
+                  f"   (x{baseline / min(sizes.values()):.1f} меньше rows без сжатия)")
+
+
+if __name__ == "__main__":
+    main()
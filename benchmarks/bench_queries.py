@@ -0,0 +1,146 @@
+# benchmarks/bench_queries.py
+"""
+Накладные расходы горячих запросов до и после app/queries.py.
+
+1. Python (без БД), мкс на запрос:
+   - select     — построение select(...) и ключа кеша компиляции, как при каждом запросе раньше;
+   - lambda     — то же для lambda_stmt из app/queries.py;
+   - compile    — полная компиляция в SQL: столько стоил бы каждый запрос без кеша компиляции SQLAlchemy.
+2. С БД (--database-url), мкс на запрос в отдельной сессии, как в роутере:
+   - nullpool   — прежний режим: новое соединение, подготовка (разбор + план) каждый раз;
+   - no-cache   — пул, но без кеша подготовленных операторов (DB_STATEMENT_CACHE_SIZE=0, старый PgBouncer);
+   - pooled     — пул + кеш операторов + lambda_stmt (по умолчанию).
+
+Запуск: python -m benchmarks.bench_queries [--repeat 2000] [--database-url postgresql://...] [--db-repeat 300]
+Для второй части нужна заполненная база (python -m benchmarks.seed_data).
+"""
+import argparse
+import asyncio
+import os
+import time
+import timeit
+from dataclasses import replace
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects import postgresql
+
+from app import queries
+from app.config import get_settings
+from app.models import InvestmentPackage, Referral, Transaction, User
+
+# Параметры запросов (для части с БД подменяются реальными id из базы)
+SAMPLE = {"user_id": 1_000_000_000, "referrer_id": 1_000_000_000, "email": "bench@example.com"}
+
+
+def _inline(p: dict) -> dict:
+    """Те же запросы, как они строились в роутерах до app/queries.py."""
+    return {
+        "register.conflicts": lambda: [
+            select(User).filter_by(id=p["user_id"]), select(User).filter_by(username="bench"),
+            select(User).filter_by(email=p["email"]), select(User).filter_by(phone_number="+0"),
+        ],
+        "login.user_by_email": lambda: [select(User).filter_by(email=p["email"])],
+        "referrals.user": lambda: [select(User).where(User.id == p["referrer_id"])],
+        "referrals.count": lambda: [select(func.count(Referral.id)).where(Referral.referrer_id == p["referrer_id"])],
+        "referrals.level1": lambda: [select(Referral, User).join(User, Referral.referred_id == User.id).where(
+            Referral.referrer_id == p["referrer_id"], Referral.referral_level == 1,
+        )],
+        "transactions.history": lambda: [select(Transaction).where(Transaction.user_id == p["user_id"])
+                                         .order_by(Transaction.timestamp.desc())
+                                         .with_only_columns(*queries.TRANSACTION_COLUMNS)],
+        "investments.packages": lambda: [select(
+            *queries.PACKAGE_COLUMNS
+        ).where(InvestmentPackage.is_active == True).order_by(InvestmentPackage.min_amount)],
+    }
+
+
+def _cached(p: dict) -> dict:
+    return {
+        "register.conflicts": lambda: [queries.registration_conflicts(p["user_id"], "bench", p["email"], "+0")],
+        "login.user_by_email": lambda: [queries.user_by_email(p["email"])],
+        "referrals.user": lambda: [queries.user_by_id(p["referrer_id"])],
+        "referrals.count": lambda: [queries.referrals_count(p["referrer_id"])],
+        "referrals.level1": lambda: [queries.direct_referrals([p["referrer_id"]])],
+        "transactions.history": lambda: [queries.transaction_history(p["user_id"])],
+        "investments.packages": lambda: [queries.active_packages()],
+    }
+
+
+def bench_python(repeat: int):
+    dialect = postgresql.dialect()
+    inline, cached = _inline(SAMPLE), _cached(SAMPLE)
+
+    def per_call(fn) -> float:
+        fn() # Прогрев: первый вызов lambda_stmt анализирует лямбду
+        return timeit.timeit(fn, number=repeat) / repeat * 1e6
+
+    print(f"{'query':<24}{'select, мкс':>14}{'lambda, мкс':>14}{'compile, мкс':>15}")
+    for name in inline:
+        # _generate_cache_key — то, что SQLAlchemy вычисляет на каждом execute, чтобы найти SQL в кеше
+        select_us = per_call(lambda: [stmt._generate_cache_key() for stmt in inline[name]()])
+        lambda_us = per_call(lambda: [stmt._generate_cache_key() for stmt in cached[name]()])
+        compile_us = per_call(lambda: [stmt.compile(dialect=dialect) for stmt in inline[name]()])
+        print(f"{name:<24}{select_us:>14.1f}{lambda_us:>14.1f}{compile_us:>15.1f}")
+
+
+async def bench_db(url: str, repeat: int):
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import AsyncSession
+    from sqlalchemy.orm import sessionmaker
+
+    from app.database import build_engine
+
+    settings = replace(get_settings(), sql_echo=False)
+    modes = {
+        "nullpool": (replace(settings, db_pool_size=0), _inline),
+        "no-cache": (replace(settings, db_pool_size=2, db_statement_cache_size=0), _inline),
+        "pooled": (replace(settings, db_pool_size=2), _cached),
+    }
+    engines = {mode: build_engine(mode_settings, url) for mode, (mode_settings, _) in modes.items()}
+    try:
+        async with engines["pooled"].connect() as conn:
+            params = dict(SAMPLE)
+            params["user_id"] = (await conn.execute(text(
+                "SELECT user_id FROM user_stats GROUP BY user_id ORDER BY sum(tx_count) LIMIT 1"
+            ))).scalar() or SAMPLE["user_id"] # Немного транзакций: меряем накладные расходы, а не выборку
+            params["referrer_id"] = (await conn.execute(text(
+                "SELECT referrer_id FROM referrals GROUP BY referrer_id HAVING count(*) BETWEEN 5 AND 20 LIMIT 1"
+            ))).scalar() or SAMPLE["referrer_id"]
+
+        results = {}
+        for mode, (_, build) in modes.items():
+            factory = sessionmaker(bind=engines[mode], class_=AsyncSession, expire_on_commit=False)
+            for name, make in build(params).items():
+                for _ in range(5): # Прогрев пула и кешей
+                    async with factory() as db:
+                        for stmt in make():
+                            (await db.execute(stmt)).all()
+                started = time.perf_counter()
+                for _ in range(repeat):
+                    async with factory() as db:
+                        for stmt in make():
+                            (await db.execute(stmt)).all()
+                results[(name, mode)] = (time.perf_counter() - started) / repeat * 1e6
+
+        print(f"\n{'query':<24}" + "".join(f"{mode + ', мкс':>16}" for mode in modes))
+        for name in _inline(SAMPLE):
+            print(f"{name:<24}" + "".join(f"{results[(name, mode)]:>16.0f}" for mode in modes))
+    finally:
+        for engine in engines.values():
+            await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL"))
+    parser.add_argument("--db-repeat", type=int, default=300)
+    args = parser.parse_args()
+    bench_python(args.repeat)
+    if args.database_url:
+        url = args.database_url.replace("postgresql://", "postgresql+asyncpg://", 1)
+        asyncio.run(bench_db(url, args.db_repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# benchmarks/bench_serialization.py
+"""
+Сравнение старого и нового пути сериализации ответов:
+- история транзакций (/api/transactions);
+- реферальные данные (/api/referral_data).
+
+Запуск: python -m benchmarks.bench_serialization [--rows 500] [--repeat 200]
+БД не нужна — строки генерируются в памяти.
+"""
+import argparse
+import random
+import timeit
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from app.referrals import ReferralDetails, ReferralLevelData, ReferralSystemResponse
+from app.responses import FastJSONResponse
+
+
+def _make_transaction_rows(n: int) -> list[dict]:
+    rnd = random.Random(42)
+    now = datetime.now(timezone.utc)
+    types = ["game_bet", "game_win", "game_loss", "daily_bonus"]
+    return [
+        {
+            "id": i,
+            "user_id": 123456789,
+            "type": rnd.choice(types),
+            "amount": Decimal(f"{rnd.uniform(-5, 5):.2f}"),
+            "currency": "₤s",
+            "timestamp": now - timedelta(minutes=i),
+            "status": "completed",
+            "description": "Ставка в игре 'wheel of fortune': -1.00 ₤s",
+            "txid": None,
+        }
+        for i in range(n)
+    ]
+
+
+def _legacy_transactions(rows: list[dict]) -> bytes:
+    # Так ответ собирался раньше: float()/isoformat() в обработчике,
+    # затем jsonable_encoder и stdlib json внутри JSONResponse
+    payload = [
+        {**row, "amount": float(row["amount"]), "timestamp": row["timestamp"].isoformat()}
+        for row in rows
+    ]
+    return JSONResponse(jsonable_encoder(payload)).body
+
+
+def _fast_transactions(rows: list[dict]) -> bytes:
+    return FastJSONResponse(rows).body
+
+
+def _make_referrals(n: int) -> list[tuple[str, Decimal]]:
+    rnd = random.Random(7)
+    return [(f"user_{i}", Decimal(f"{rnd.uniform(0, 50):.2f}")) for i in range(n)]
+
+
+def _legacy_referrals(refs: list[tuple[str, Decimal]]) -> bytes:
+    details = [ReferralDetails(username=u, bonus_earned=float(b)) for u, b in refs]
+    levels = [ReferralLevelData(level=1, referrals=details, earned_from_level=float(sum(b for _, b in refs)))]
+    response = ReferralSystemResponse(
+        referral_link="https://t.me/lucrora_bot?start=ref_1",
+        total_referral_earnings=float(sum(b for _, b in refs)),
+        active_referrals_count=len(refs),
+        referral_network_levels=levels,
+    )
+    return JSONResponse(jsonable_encoder(response)).body
+
+
+def _fast_referrals(refs: list[tuple[str, Decimal]]) -> bytes:
+    details = [{"username": u, "bonus_earned": b} for u, b in refs]
+    total = sum(b for _, b in refs)
+    return FastJSONResponse({
+        "ok": True,
+        "message": "Referral data fetched successfully",
+        "referral_link": "https://t.me/lucrora_bot?start=ref_1",
+        "total_referral_earnings": total,
+        "active_referrals_count": len(refs),
+        "referral_network_levels": [{"level": 1, "referrals": details, "earned_from_level": total}],
+    }).body
+
+
+def _report(name: str, legacy, fast, repeat: int):
+    legacy_t = min(timeit.repeat(legacy, number=repeat, repeat=3)) / repeat
+    fast_t = min(timeit.repeat(fast, number=repeat, repeat=3)) / repeat
+    print(f"{name:<14} legacy {legacy_t * 1e3:8.3f} ms   orjson {fast_t * 1e3:8.3f} ms   x{legacy_t / fast_t:5.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=500, help="строк в истории / рефералов на уровне")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    rows = _make_transaction_rows(args.rows)
+    refs = _make_referrals(args.rows)
+    _report("transactions", lambda: _legacy_transactions(rows), lambda: _fast_transactions(rows), args.repeat)
+    _report("referral_data", lambda: _legacy_referrals(refs), lambda: _fast_referrals(refs), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
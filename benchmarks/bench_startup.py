@@ -0,0 +1,88 @@
+# benchmarks/bench_startup.py
+"""
+Профиль холодного старта: время импорта `main` по данным `python -X importtime`.
+
+Каждый прогон — отдельный чистый процесс (кеш модулей пустой, .pyc уже скомпилированы).
+Выводит медиану общего времени импорта, самые тяжелые пакеты (сумма self-времени всех их модулей)
+и список тяжелых зависимостей, которые НЕ должны грузиться при старте.
+
+Запуск: python -m benchmarks.bench_startup [--target main] [--runs 5] [--top 15] [--json out.json]
+БД не нужна: импорт приложения к базе не подключается.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# Эти зависимости нужны только отдельным эндпоинтам и должны импортироваться лениво
+LAZY_MODULES = ("aiogram", "jose", "passlib", "bcrypt", "httpx", "asyncpg")
+
+
+_RESULT_MARKER = "__startup_profile__"
+
+
+def profile_import(target: str) -> dict:
+    """Один прогон: импортирует target в новом процессе, возвращает разбор importtime."""
+    code = (
+        "import json, sys, time; t = time.perf_counter(); "
+        f"import {target}; "
+        f"print({_RESULT_MARKER!r} + json.dumps([time.perf_counter() - t, sorted(sys.modules)]))"
+    )
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          capture_output=True, text=True, check=True)
+
+    # Строки stderr: "import time:       self |  cumulative | imported package".
+    # Суммируем собственное время (self) по корневому пакету: видно, сколько стоит каждая зависимость целиком.
+    by_package: dict[str, int] = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or line.endswith("imported package"):
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        package = name.strip().split(".")[0]
+        by_package[package] = by_package.get(package, 0) + int(self_us)
+
+    # print() приложения тоже попадает в stdout, поэтому ищем строку с маркером
+    payload = next(line for line in proc.stdout.splitlines() if line.startswith(_RESULT_MARKER))
+    wall, modules = json.loads(payload[len(_RESULT_MARKER):])
+    return {"wall": wall, "packages": by_package, "modules": set(modules)}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Профиль импорта приложения (-X importtime)")
+    parser.add_argument("--target", default="main", help="Модуль для импорта (по умолчанию main)")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--json", help="Сохранить результат в файл")
+    args = parser.parse_args()
+
+    profile_import(args.target) # Прогрев: компиляция .pyc, файловый кеш ОС
+    runs = [profile_import(args.target) for _ in range(args.runs)]
+
+    wall = statistics.median(run["wall"] for run in runs)
+    names = set().union(*(run["packages"] for run in runs))
+    top = sorted(
+        ((name, statistics.median(run["packages"].get(name, 0) for run in runs) / 1000) for name in names),
+        key=lambda item: item[1],
+        reverse=True,
+    )[: args.top]
+    loaded = sorted({name for name in LAZY_MODULES if any(name in run["modules"] for run in runs)})
+
+    print(f"import {args.target}: {wall * 1000:.0f} мс (медиана из {args.runs}), модулей: {len(runs[-1]['modules'])}")
+    print(f"{'пакет':<28}{'импорт, мс':>16}")
+    for name, ms in top:
+        print(f"{name:<28}{ms:>16.1f}")
+    if loaded:
+        print(f"⚠️  При старте загружены тяжелые зависимости: {', '.join(loaded)}")
+    else:
+        print("✅ Тяжелые зависимости при старте не загружаются.")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"target": args.target, "wall_ms": wall * 1000, "top": top, "eager_heavy_modules": loaded}, f,
+                      ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
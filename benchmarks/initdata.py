@@ -0,0 +1,28 @@
+# benchmarks/initdata.py
+"""Генерация валидно подписанного Telegram WebApp initData для синтетических пользователей."""
+import hashlib
+import hmac
+import json
+import time
+from urllib.parse import urlencode
+
+
+def make_init_data(bot_token: str, user_id: int, username: str | None = None,
+                   first_name: str = "Bench", last_name: str = "User", auth_date: int | None = None) -> str:
+    """
+    Подписывает initData тем же алгоритмом, что проверяет app.utils.check_webapp_signature:
+    secret = HMAC_SHA256("WebAppData", bot_token), hash = HMAC_SHA256(secret, data_check_string).
+    """
+    fields = {
+        "auth_date": str(auth_date or int(time.time())),
+        "query_id": f"bench{user_id}",
+        "user": json.dumps(
+            {"id": user_id, "first_name": first_name, "last_name": last_name, "username": username or f"bench_{user_id}"},
+            separators=(",", ":"),
+            ensure_ascii=False,
+        ),
+    }
+    data_check_string = "\n".join(f"{k}={v}" for k, v in sorted(fields.items()))
+    secret_key = hmac.new(key=b"WebAppData", msg=bot_token.encode(), digestmod=hashlib.sha256).digest()
+    fields["hash"] = hmac.new(key=secret_key, msg=data_check_string.encode(), digestmod=hashlib.sha256).hexdigest()
+    return urlencode(fields)
@@ -0,0 +1,133 @@
+# benchmarks/stub_bot_api.py
+"""
+Локальная заглушка Telegram Bot API. Отвечает на /bot<token>/<method> так же, как настоящий API,
+но без сети. Приложение направляется на нее переменной TELEGRAM_API_BASE.
+
+Запуск отдельно: python -m benchmarks.stub_bot_api --port 8081
+
+По желанию имитирует ограничения Telegram для sendMessage (по умолчанию выключены; см. limits):
+429 с retry_after при превышении общего лимита или лимита на чат и 403 для «заблокировавших бота».
+"""
+import argparse
+import asyncio
+import itertools
+import time
+from collections import deque
+from urllib.parse import parse_qsl
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+_message_ids = itertools.count(1)
+# Сколько раз вызывался каждый метод (удобно проверять в тестах и бенчмарках)
+calls: dict[str, int] = {}
+
+# Имитация ограничений Telegram для sendMessage; 0 — выключено
+limits = {
+    "global_rate": 0, # Сообщений в секунду на бота (скользящее окно в 1 с)
+    "chat_rate": 0.0, # Сообщений в секунду на чат
+    "blocked_every": 0, # Чаты с chat_id % blocked_every == 0 «заблокировали бота» (403)
+    "latency": 0.0, # Задержка ответа, с
+}
+# Сколько sendMessage доставлено в каждый чат и сколько ответов 429 выдано
+delivered: dict[int, int] = {}
+flood_errors = 0
+_sent_times: deque = deque()
+_chat_last_sent: dict[int, float] = {}
+
+
+def _error(code: int, description: str, retry_after: int | None = None) -> JSONResponse:
+    body = {"ok": False, "error_code": code, "description": description}
+    if retry_after is not None:
+        body["parameters"] = {"retry_after": retry_after}
+    return JSONResponse(body, status_code=code)
+
+
+def _check_limits(chat_id: int) -> JSONResponse | None:
+    """Ответ-ошибка, если sendMessage нарушает имитируемые ограничения, иначе None."""
+    global flood_errors
+    if limits["blocked_every"] and chat_id % limits["blocked_every"] == 0:
+        return _error(403, "Forbidden: bot was blocked by the user")
+    now = time.monotonic()
+    while _sent_times and _sent_times[0] <= now - 1:
+        _sent_times.popleft()
+    chat_flood = limits["chat_rate"] and now - _chat_last_sent.get(chat_id, float("-inf")) < 1 / limits["chat_rate"]
+    if (limits["global_rate"] and len(_sent_times) >= limits["global_rate"]) or chat_flood:
+        flood_errors += 1
+        return _error(429, "Too Many Requests: retry after 1", retry_after=1)
+    _sent_times.append(now)
+    _chat_last_sent[chat_id] = now
+    delivered[chat_id] = delivered.get(chat_id, 0) + 1
+    return None
+
+
+async def _read_params(request: Request) -> dict:
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("application/json"):
+        return await request.json()
+    if content_type.startswith("application/x-www-form-urlencoded"):
+        return dict(parse_qsl((await request.body()).decode()))
+    if content_type.startswith("multipart/form-data"):
+        return dict(await request.form()) # Нужен python-multipart; aiogram шлет multipart только с файлами
+    return dict(request.query_params)
+
+
+async def bot_method(request: Request):
+    method = request.path_params["method"]
+    calls[method] = calls.get(method, 0) + 1
+    params = await _read_params(request)
+    method_lower = method.lower()
+
+    if method_lower == "createinvoicelink":
+        return JSONResponse({"ok": True, "result": f"https://t.me/$stub_{params.get('payload', '')}"})
+    if method_lower in ("sendmessage", "copymessage", "forwardmessage"):
+        if limits["latency"]:
+            await asyncio.sleep(limits["latency"])
+        if method_lower == "sendmessage" and (error := _check_limits(int(params.get("chat_id", 0)))):
+            return error
+        return JSONResponse({
+            "ok": True,
+            "result": {
+                "message_id": next(_message_ids),
+                "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+                "text": params.get("text", ""),
+            },
+        })
+    if method_lower == "getme":
+        return JSONResponse({"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Stub", "username": "stub_bot"}})
+    # setWebhook, deleteWebhook, deleteMessage, answerPreCheckoutQuery и прочие — просто True
+    return JSONResponse({"ok": True, "result": True})
+
+
+app = Starlette(routes=[Route("/bot{token}/{method}", bot_method, methods=["GET", "POST"])])
+
+
+async def serve(host: str = "127.0.0.1", port: int = 8081):
+    """Запускает заглушку внутри текущего event loop (возвращает uvicorn.Server)."""
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning", lifespan="off"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result() # Пробрасываем ошибку запуска (например, порт занят)
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--global-rate", type=int, default=0, help="лимит sendMessage в секунду (0 — без лимита)")
+    parser.add_argument("--chat-rate", type=float, default=0, help="лимит sendMessage в секунду на чат")
+    parser.add_argument("--blocked-every", type=int, default=0, help="каждый N-й chat_id заблокировал бота")
+    parser.add_argument("--latency", type=float, default=0, help="задержка ответа sendMessage, с")
+    args = parser.parse_args()
+    limits.update(global_rate=args.global_rate, chat_rate=args.chat_rate, blocked_every=args.blocked_every, latency=args.latency)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning", workers=1) # WEB_CONCURRENCY не для заглушки
@@ -0,0 +1,41 @@
+# gunicorn.conf.py
+# Многопроцессный режим: gunicorn управляет воркерами, каждый воркер — uvicorn с event loop.
+# Запуск: gunicorn main:app (конфиг подхватывается автоматически из текущей директории).
+#
+# Одноразовые действия старта (схема БД, SetWebhook/DeleteWebhook) выполняет один воркер — см. app/workers.py.
+# Лимиты и кеши общие для всех воркеров, только если задан SHARED_STATE_URL (redis://...) — см. app/shared_state.py.
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+# Прокси, чьим X-Forwarded-For верим: тогда request.client.host — IP клиента, а не балансировщика
+# (например, FORWARDED_ALLOW_IPS=10.0.0.0/8 для внутренней сети платформы). На нем держатся правила
+# устройств детектора мошенничества (FRAUD_DEVICE_RULES) и лимиты по IP.
+forwarded_allow_ips = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
+
+# Без общего состояния у каждого воркера свои лимиты, кеши и ожидающие рефералы — тогда воркер один
+SHARED_STATE_URL = os.getenv("SHARED_STATE_URL") or os.getenv("RATE_LIMIT_REDIS_URL")
+
+# С SHARED_STATE_URL — по воркеру на ядро: воркеры асинхронные, а CPU в основном съедают bcrypt и сериализация
+workers = int(os.getenv("WEB_CONCURRENCY") or (multiprocessing.cpu_count() if SHARED_STATE_URL else 1))
+if workers > 1 and not SHARED_STATE_URL:
+    raise RuntimeError(
+        f"WEB_CONCURRENCY={workers}, но SHARED_STATE_URL не задан: лимиты, кеши и рефералы разъедутся по воркерам. "
+        "Задайте SHARED_STATE_URL=redis://... или WEB_CONCURRENCY=1."
+    )
+# Воркеры читают WEB_CONCURRENCY из окружения (предупреждение об общем состоянии)
+os.environ["WEB_CONCURRENCY"] = str(workers)
+# UvicornWorker, который не ждет бесконечных потоков /api/events дольше graceful_timeout (см. app/gunicorn_worker.py)
+worker_class = "app.gunicorn_worker.Worker"
+
+# Вебхуки Telegram и платежи не должны обрываться при перезапуске — даем запросам договорить
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+keepalive = 5
+
+# Периодический перезапуск воркеров против утечек памяти; jitter — чтобы не перезапускались все сразу
+max_requests = int(os.getenv("MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+
+accesslog = None # Латентность и коды ответов и так есть в /metrics
+errorlog = "-"
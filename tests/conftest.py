@@ -0,0 +1,129 @@
+# tests/conftest.py
+"""
+Общие настройки тестов.
+
+Настройки приложения читаются один раз при первом импорте app.*, поэтому окружение задается здесь,
+до импорта тестовых модулей. Тесты без БД запускаются всегда. Тесты с PostgreSQL (миграции, выводы,
+сверка журнала) запускаются, только если задан TEST_DATABASE_URL: на этом сервере создается временная
+база, а после тестов удаляется. Рабочую DATABASE_URL тесты не трогают.
+
+    python -m pytest -q
+    TEST_DATABASE_URL=postgresql+asyncpg://postgres@localhost/postgres python -m pytest -q
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+from urllib.parse import urlencode
+
+import pytest
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+TEST_BOT_TOKEN = "123456:TEST-TOKEN"
+
+
+def _database_url(base_url: str, name: str) -> str:
+    """URL той же БД-сервера, но другой базы: postgresql+asyncpg://u@host/<name>?..."""
+    head, _, tail = base_url.partition("://")
+    location, _, query = tail.partition("?")
+    server = location.rsplit("/", 1)[0]
+    return f"{head}://{server}/{name}" + (f"?{query}" if query else "")
+
+
+APP_DATABASE_NAME = f"lucrora_test_{os.getpid()}"
+APP_DATABASE_URL = _database_url(TEST_DATABASE_URL, APP_DATABASE_NAME) if TEST_DATABASE_URL else None
+
+os.environ.update({
+    "BOT_TOKEN": TEST_BOT_TOKEN,
+    "WEBAPP_URL": "https://example.invalid/",
+    "JWT_SECRET_KEY": "test-access-secret",
+    "REFRESH_TOKEN_SECRET_KEY": "test-refresh-secret",
+    # Без TEST_DATABASE_URL — заведомо недоступный адрес: случайный запрос к БД упадет, а не уйдет в рабочую базу
+    "DATABASE_URL": APP_DATABASE_URL or "postgresql+asyncpg://test@127.0.0.1:1/unavailable",
+    "DATABASE_REPLICA_URL": "",
+    "SHARED_STATE_URL": "",
+    "SQL_ECHO": "False",
+    "SCHEDULER_ENABLED": "False",
+    "FRAUD_DETECTION_ENABLED": "False",
+    "PAYOUT_PROVIDER": "stub",
+    "TRANSACTIONS_ARCHIVE_AFTER_MONTHS": "0",
+})
+
+
+def run(coro):
+    """Выполняет корутину в новом event loop и закрывает пул БД в нем же: пул привязан к своему loop."""
+    async def main():
+        from app.database import dispose_engine
+
+        try:
+            return await coro
+        finally:
+            await dispose_engine()
+
+    return asyncio.run(main())
+
+
+def signed_init_data(user_id: int, **fields) -> str:
+    """initData, подписанный как Mini App для BOT_TOKEN тестов (см. app.utils.check_webapp_signature)."""
+    fields = {"auth_date": str(int(time.time())), "user": json.dumps({"id": user_id, "first_name": "Test"}), **fields}
+    check_string = "\n".join(f"{key}={value}" for key, value in sorted(fields.items()))
+    secret = hmac.new(b"WebAppData", TEST_BOT_TOKEN.encode(), hashlib.sha256).digest()
+    fields["hash"] = hmac.new(secret, check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(fields)
+
+
+async def _admin_execute(*statements):
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    admin = create_async_engine(TEST_DATABASE_URL, isolation_level="AUTOCOMMIT")
+    try:
+        async with admin.connect() as conn:
+            for statement in statements:
+                await conn.execute(text(statement))
+    finally:
+        await admin.dispose()
+
+
+async def create_database(name: str) -> str:
+    """Создает пустую базу на сервере TEST_DATABASE_URL (старая с тем же именем удаляется). Возвращает ее URL."""
+    await _admin_execute(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)', f'CREATE DATABASE "{name}"')
+    return _database_url(TEST_DATABASE_URL, name)
+
+
+async def drop_database(name: str):
+    await _admin_execute(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+
+
+@asynccontextmanager
+async def temporary_database():
+    """Пустая база на время блока; отдает ее URL."""
+    name = f"lucrora_test_{uuid.uuid4().hex[:12]}"
+    url = await create_database(name)
+    try:
+        yield url
+    finally:
+        await drop_database(name)
+
+
+requires_database = pytest.mark.skipif(not TEST_DATABASE_URL, reason="нужен TEST_DATABASE_URL (PostgreSQL)")
+
+
+@pytest.fixture(scope="session")
+def app_database():
+    """База приложения (DATABASE_URL тестов) со всеми миграциями — одна на сессию pytest."""
+    if not TEST_DATABASE_URL:
+        pytest.skip("нужен TEST_DATABASE_URL (PostgreSQL)")
+    from app.database import get_engine
+    from app.migrations import upgrade
+
+    asyncio.run(create_database(APP_DATABASE_NAME))
+    try:
+        run(upgrade(get_engine()))
+        yield APP_DATABASE_URL
+    finally:
+        asyncio.run(drop_database(APP_DATABASE_NAME))
@@ -0,0 +1,147 @@
+# tests/test_broadcasts.py
+import pytest
+from aiogram.exceptions import TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+from sqlalchemy import text
+
+from conftest import run
+from app import broadcasts, shared_state
+from app.broadcasts import TelegramRateLimiter, deliver
+from app.database import get_session_factory
+from app.models import Broadcast
+from app.shared_state import InMemorySharedState
+
+METHOD = SendMessage(chat_id=1, text="hi")
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def state():
+    shared_state.set_shared_state(InMemorySharedState())
+    yield
+    shared_state.set_shared_state(None)
+
+
+@pytest.fixture
+def slept(monkeypatch, state):
+    """Подменяет время: asyncio.sleep в рассылках не ждет, а сдвигает часы token bucket'ов. Отдает список пауз."""
+    clock = FakeClock()
+    pauses = []
+
+    async def sleep(seconds):
+        pauses.append(seconds)
+        clock.now += seconds
+
+    monkeypatch.setattr(shared_state.time, "monotonic", clock)
+    monkeypatch.setattr(broadcasts.asyncio, "sleep", sleep)
+    return pauses
+
+
+class FakeBot:
+    """Бот, который по chat_id выбрасывает заданные исключения (по одному на попытку), иначе «отправляет»."""
+
+    def __init__(self, errors: dict = None):
+        self.errors = {chat_id: list(queue) for chat_id, queue in (errors or {}).items()}
+        self.sent = []
+
+    async def send_message(self, chat_id, message):
+        queue = self.errors.get(chat_id)
+        if queue:
+            raise queue.pop(0)
+        self.sent.append(chat_id)
+
+
+# --- Лимитер ---
+
+def test_limiter_spaces_messages_to_one_chat(slept):
+    limiter = TelegramRateLimiter(rate=100.0)
+
+    async def scenario():
+        for _ in range(3):
+            await limiter.acquire(1)
+
+    run(scenario())
+    assert sum(slept) == pytest.approx(2.0) # 1 сообщение в секунду на чат
+
+
+def test_limiter_holds_global_rate(slept):
+    limiter = TelegramRateLimiter(rate=10.0)
+
+    async def scenario():
+        for chat_id in range(5):
+            await limiter.acquire(chat_id)
+
+    run(scenario())
+    assert sum(slept) == pytest.approx(0.4) # 5 разных чатов при 10 сообщениях/сек, без запаса
+
+
+def test_limiter_waits_out_retry_after_pause(slept):
+    limiter = TelegramRateLimiter(rate=100.0)
+    run(limiter.acquire(1))
+    limiter.pause(3)
+    run(limiter.acquire(2))
+    assert sum(slept) == pytest.approx(3.0)
+
+
+# --- Отправка одного сообщения ---
+
+def test_deliver_retries_after_retry_after(slept):
+    bot = FakeBot({1: [TelegramRetryAfter(METHOD, "Too Many Requests", retry_after=5)]})
+    assert run(deliver(bot, TelegramRateLimiter(rate=100.0), 1, "hi")) == ("sent", 1)
+    assert bot.sent == [1]
+    assert sum(slept) >= 5
+
+
+def test_deliver_reports_blocked_bot(slept):
+    bot = FakeBot({1: [TelegramForbiddenError(METHOD, "Forbidden: bot was blocked by the user")]})
+    assert run(deliver(bot, TelegramRateLimiter(rate=100.0), 1, "hi")) == ("blocked", 0)
+
+
+def test_deliver_gives_up_after_max_attempts(slept):
+    bot = FakeBot({1: [TelegramNetworkError(METHOD, "timeout")] * broadcasts.MAX_ATTEMPTS})
+    assert run(deliver(bot, TelegramRateLimiter(rate=100.0), 1, "hi")) == ("failed", broadcasts.MAX_ATTEMPTS)
+    assert bot.sent == []
+
+
+def test_deliver_turns_unexpected_errors_into_failed(slept):
+    bot = FakeBot({1: [RuntimeError("boom")]})
+    assert run(deliver(bot, TelegramRateLimiter(rate=100.0), 1, "hi")) == ("failed", 0)
+
+
+# --- Рассылка целиком ---
+
+RECIPIENTS = [900_000_001, 900_000_002, 900_000_003]
+
+
+# Настоящее время: подмененные часы и sleep сломали бы таймауты asyncpg
+def test_broadcast_checkpoint_advances_past_failing_recipient(app_database, monkeypatch, state):
+    bot = FakeBot({RECIPIENTS[1]: [RuntimeError("unexpected")]})
+    monkeypatch.setattr("app.bot.get_bot", lambda: bot)
+
+    async def scenario():
+        async with get_session_factory()() as db:
+            for user_id in RECIPIENTS:
+                await db.execute(text(
+                    "INSERT INTO users (id, username, main_balance, bonus_balance, lucrum_balance, total_withdrawn, status, role) "
+                    "VALUES (:id, :username, 0, 0, 0, 0, 'active', 'user')"
+                ), {"id": user_id, "username": f"broadcast_{user_id}"})
+            await db.commit()
+            broadcast = await broadcasts.create_broadcast(db, "hi")
+        status = await broadcasts.run_broadcast(broadcast.id, rate=100.0)
+        async with get_session_factory()() as db:
+            return status, await db.get(Broadcast, broadcast.id)
+
+    status, broadcast = run(scenario())
+    assert status == "completed"
+    assert broadcast.cursor_user_id >= RECIPIENTS[-1]
+    assert {RECIPIENTS[0], RECIPIENTS[2]} <= set(bot.sent)
+    assert RECIPIENTS[1] not in bot.sent
+    assert broadcast.failed >= 1
+    assert broadcast.sent + broadcast.blocked + broadcast.failed == broadcast.total
@@ -0,0 +1,171 @@
+# tests/test_commissions.py
+import asyncio
+from decimal import Decimal
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from sqlalchemy import text
+
+from conftest import run, signed_init_data
+from app import shared_state
+from app.commissions import pay_commissions, pay_pending_commissions
+from app.database import get_session_factory
+from app.ledger import reconcile_balances
+from app.routers import games
+from app.shared_state import InMemorySharedState
+
+
+@pytest.fixture
+def state():
+    shared_state.set_shared_state(InMemorySharedState())
+    yield
+    shared_state.set_shared_state(None)
+
+
+async def _add_user(db, user_id: int, bonus: str = "0", status: str = "active"):
+    """Пользователь с bonus_balance, сходящимся с журналом (транзакция daily_bonus на ту же сумму)."""
+    await db.execute(text(
+        "INSERT INTO users (id, username, main_balance, bonus_balance, lucrum_balance, total_withdrawn, status, role) "
+        "VALUES (:id, :username, 0, :bonus, 0, 0, :status, 'user')"
+    ), {"id": user_id, "username": f"commission_{user_id}", "bonus": Decimal(bonus), "status": status})
+    if Decimal(bonus):
+        await db.execute(text(
+            "INSERT INTO transactions (user_id, type, amount, currency, status) "
+            "VALUES (:id, 'daily_bonus', :bonus, '₤s', 'completed')"
+        ), {"id": user_id, "bonus": Decimal(bonus)})
+
+
+async def _refer(db, referrer_id: int, referred_id: int):
+    await db.execute(text(
+        "INSERT INTO referrals (referrer_id, referred_id, referral_level, bonus_earned) VALUES (:referrer, :referred, 1, 0)"
+    ), {"referrer": referrer_id, "referred": referred_id})
+
+
+async def _buy(db, user_id: int, amount: str) -> int:
+    package_id = (await db.execute(text(
+        "INSERT INTO investment_packages (name, min_amount, daily_roi_percentage, duration_days) "
+        "VALUES ('commissions_' || :user_id, 1, 1, 30) "
+        "ON CONFLICT (name) DO UPDATE SET min_amount = EXCLUDED.min_amount RETURNING id"
+    ), {"user_id": str(user_id)})).scalar()
+    return (await db.execute(text(
+        "INSERT INTO investments (user_id, package_id, amount_invested) VALUES (:user_id, :package_id, :amount) RETURNING id"
+    ), {"user_id": user_id, "package_id": package_id, "amount": Decimal(amount)})).scalar()
+
+
+def test_spin_during_commission_payout_keeps_ledger_in_balance(app_database, state):
+    sponsor, buyer = 950_000_001, 950_000_002
+    app = FastAPI()
+    app.include_router(games.router)
+
+    async def spin():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post("/api/games/play", json={
+                "initData": signed_init_data(sponsor), "game_id": "wheel_of_fortune",
+            })
+            return response.status_code
+
+    async def scenario():
+        async with get_session_factory()() as db:
+            await _add_user(db, sponsor, bonus="10.00")
+            await _add_user(db, buyer)
+            await _refer(db, sponsor, buyer)
+            investment_id = await _buy(db, buyer, "1000.00")
+            await db.commit()
+
+        session_factory = get_session_factory()
+        async with session_factory() as blocker, session_factory() as payer:
+            # Строку спонсора держит «чужая» транзакция: выплата встает в очередь первой, ставка — за ней
+            await blocker.execute(text("SELECT 1 FROM users WHERE id = :id FOR UPDATE"), {"id": sponsor})
+            payout = asyncio.create_task(pay_commissions(payer, [investment_id]))
+            await asyncio.sleep(0.3)
+            play = asyncio.create_task(spin())
+            await asyncio.sleep(0.3)
+            await blocker.commit()
+            row, status_code = await asyncio.gather(payout, play)
+
+        _, mismatches = await reconcile_balances()
+        return row, status_code, {m.user_id for m in mismatches}
+
+    row, status_code, mismatched = run(scenario())
+    assert (row.payouts, row.total) == (1, Decimal("5.00"))
+    assert status_code == 200
+    assert sponsor not in mismatched # Комиссия не затерта записью баланса из игры
+
+
+async def _commission_state(db, user_ids: list[int]):
+    """{id: (bonus_balance, bonus_earned связи с его рефералом, user_stats count/sum)} и txid выплат."""
+    rows = (await db.execute(text(
+        "SELECT u.id, u.bonus_balance, COALESCE(sum(r.bonus_earned), 0) AS earned, s.tx_count, s.amount_sum "
+        "FROM users u "
+        "LEFT JOIN referrals r ON r.referrer_id = u.id "
+        "LEFT JOIN user_stats s ON s.user_id = u.id AND s.type = 'referral_commission' "
+        "WHERE u.id = ANY(:ids) GROUP BY u.id, s.tx_count, s.amount_sum"
+    ), {"ids": user_ids})).all()
+    txids = (await db.execute(text(
+        "SELECT user_id, txid FROM transactions WHERE type = 'referral_commission' AND user_id = ANY(:ids) ORDER BY txid"
+    ), {"ids": user_ids})).all()
+    return {row.id: (row.bonus_balance, row.earned, row.tx_count, row.amount_sum) for row in rows}, txids
+
+
+def test_commissions_go_five_levels_up_past_banned_ancestor_once(app_database, state):
+    # buyer <- a1 <- a2 <- a3 (banned) <- a4 <- a5 <- a6: шесть предков, платят только первым пяти уровням
+    buyer = 950_000_100
+    a1, a2, a3, a4, a5, a6 = ancestors = list(range(950_000_101, 950_000_107))
+
+    async def scenario():
+        async with get_session_factory()() as db:
+            await _add_user(db, buyer)
+            for ancestor in ancestors:
+                await _add_user(db, ancestor, status="banned" if ancestor == a3 else "active")
+            for referred, referrer in zip([buyer] + ancestors, ancestors):
+                await _refer(db, referrer, referred)
+            investment_id = await _buy(db, buyer, "1000.00")
+            await db.commit()
+
+        async with get_session_factory()() as db:
+            webhook = await pay_commissions(db, [investment_id])
+        await pay_pending_commissions()
+        async with get_session_factory()() as db:
+            repeat = await pay_commissions(db, [investment_id])
+            paid, txids = await _commission_state(db, ancestors)
+        _, mismatches = await reconcile_balances()
+        return investment_id, webhook, repeat, paid, txids, {m.user_id for m in mismatches}
+
+    investment_id, webhook, repeat, paid, txids, mismatched = run(scenario())
+    assert (webhook.investments, webhook.payouts, webhook.total) == (1, 4, Decimal("12.00"))
+    assert (repeat.investments, repeat.payouts) == (0, 0) # Покупка уже выплачена
+    expected = {a1: "5.00", a2: "4.00", a4: "2.00", a5: "1.00"} # a3 заблокирован, a6 — шестой уровень
+    for ancestor in ancestors:
+        amount = Decimal(expected.get(ancestor, "0"))
+        stats = (1, amount) if amount else (None, None)
+        assert paid[ancestor] == (amount, amount, *stats), ancestor
+    assert txids == [
+        (a1, f"commission:{investment_id}:1"), (a2, f"commission:{investment_id}:2"),
+        (a4, f"commission:{investment_id}:4"), (a5, f"commission:{investment_id}:5"),
+    ]
+    assert not mismatched & set(ancestors)
+
+
+def test_referral_cycle_pays_each_ancestor_once(app_database, state):
+    # buyer <- c1 <- c2 <- c1 ...: цикл в referrals
+    buyer, c1, c2 = 950_000_201, 950_000_202, 950_000_203
+
+    async def scenario():
+        async with get_session_factory()() as db:
+            for user_id in (buyer, c1, c2):
+                await _add_user(db, user_id)
+            await _refer(db, c1, buyer)
+            await _refer(db, c2, c1)
+            await _refer(db, c1, c2)
+            investment_id = await _buy(db, buyer, "1000.00")
+            await db.commit()
+
+        await pay_pending_commissions() # Выплата задачей, без вебхука
+        async with get_session_factory()() as db:
+            return investment_id, await _commission_state(db, [c1, c2])
+
+    investment_id, (paid, txids) = run(scenario())
+    assert paid[c1] == (Decimal("5.00"), Decimal("5.00"), 1, Decimal("5.00"))
+    assert paid[c2] == (Decimal("4.00"), Decimal("4.00"), 1, Decimal("4.00"))
+    assert txids == [(c1, f"commission:{investment_id}:1"), (c2, f"commission:{investment_id}:2")]
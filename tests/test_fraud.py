@@ -0,0 +1,125 @@
+# tests/test_fraud.py
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+from conftest import signed_init_data
+from app import fraud, shared_state
+from app.fraud import (
+    BONUS_SCOPE, DAILY_BONUS_TX_TYPE, DEVICE_WINDOW_SECONDS, GAME_BET_TX_TYPE, MAX_ACCOUNTS_PER_DEVICE,
+    MAX_ACCOUNTS_PER_IP, SPINS_PER_MINUTE_LIMIT, FraudDetector, fraud_guard,
+)
+from app.shared_state import InMemorySharedState
+
+IP = "203.0.113.7"
+PHONE = (IP, "Mozilla/5.0 (iPhone)")
+
+
+def _reasons(actions, action="flag") -> dict:
+    """{reason: {user_id, ...}} решений одного вида."""
+    found = {}
+    for a in actions:
+        if a.action == action:
+            found.setdefault(a.reason, set()).add(a.user_id)
+    return found
+
+
+def test_accounts_on_one_device_are_flagged_once_over_the_limit():
+    detector = FraudDetector()
+    users = list(range(1, MAX_ACCOUNTS_PER_DEVICE + 2))
+    actions = [detector.observe(user_id, DAILY_BONUS_TX_TYPE, 1.0, PHONE, now=0.0) for user_id in users]
+    assert actions[:-1] == [[]] * MAX_ACCOUNTS_PER_DEVICE
+    assert _reasons(actions[-1]) == {"multi_account": set(users)}
+    # Повторные события флаги не дублируют
+    assert detector.observe(users[0], DAILY_BONUS_TX_TYPE, 1.0, PHONE, now=1.0) == []
+
+
+def test_multi_account_only_flags_unless_blocking_is_enabled():
+    users = range(1, MAX_ACCOUNTS_PER_DEVICE + 2)
+
+    flag_only = FraudDetector()
+    actions = [a for user_id in users for a in flag_only.observe(user_id, DAILY_BONUS_TX_TYPE, 1.0, PHONE, now=0.0)]
+    assert _reasons(actions, "throttle") == {}
+
+    blocking = FraudDetector(block_shared_devices=True)
+    actions = [a for user_id in users for a in blocking.observe(user_id, DAILY_BONUS_TX_TYPE, 1.0, PHONE, now=0.0)]
+    throttles = [a for a in actions if a.action == "throttle"]
+    assert [(a.user_id, a.reason, a.scope) for a in throttles] == [(users[-1], "multi_account", BONUS_SCOPE)]
+
+
+def test_shared_ip_flags_many_devices_behind_one_address():
+    detector = FraudDetector()
+    actions = []
+    for user_id in range(1, MAX_ACCOUNTS_PER_IP + 2):
+        actions += detector.observe(user_id, GAME_BET_TX_TYPE, 1.0, (IP, f"device-{user_id}"), now=0.0)
+    assert _reasons(actions) == {"shared_ip": set(range(1, MAX_ACCOUNTS_PER_IP + 2))}
+
+
+def test_device_accounts_expire_after_the_window():
+    detector = FraudDetector()
+    for user_id in range(1, MAX_ACCOUNTS_PER_DEVICE + 1):
+        detector.observe(user_id, DAILY_BONUS_TX_TYPE, 1.0, PHONE, now=0.0)
+    assert detector.crowded_device(*PHONE, user_id=99, now=1.0)
+    assert not detector.crowded_device(*PHONE, user_id=1, now=1.0) # Свой аккаунт не в счет
+
+    later = DEVICE_WINDOW_SECONDS + 1
+    assert not detector.crowded_device(*PHONE, user_id=99, now=later)
+    assert detector.observe(99, DAILY_BONUS_TX_TYPE, 1.0, PHONE, now=later) == []
+
+
+def test_without_device_only_user_rules_apply():
+    detector = FraudDetector()
+    actions = []
+    for n in range(SPINS_PER_MINUTE_LIMIT + 1):
+        actions += detector.observe(1, GAME_BET_TX_TYPE, 1.0, now=n * 0.1)
+    assert _reasons(actions) == {"spin_rate": {1}}
+    assert _reasons(actions, "throttle") == {"spin_rate": {1}}
+    assert detector.devices == {}
+
+
+# --- Зависимость fraud_guard ---
+
+@pytest.fixture
+def guarded_client(monkeypatch):
+    """Клиент с fraud_guard("bonus"); configure(rules) включает детектор с FRAUD_DEVICE_RULES=rules."""
+    shared_state.set_shared_state(InMemorySharedState())
+    app = FastAPI()
+
+    @app.post("/bonus", dependencies=[Depends(fraud_guard(BONUS_SCOPE))])
+    async def bonus():
+        return {"ok": True}
+
+    def configure(rules: str) -> FraudDetector:
+        detector = FraudDetector(block_shared_devices=rules == "block")
+        monkeypatch.setattr(fraud, "FRAUD_DETECTION_ENABLED", True)
+        monkeypatch.setattr(fraud, "DEVICE_RULES_ENABLED", rules in ("flag", "block"))
+        monkeypatch.setattr(fraud, "_detector", detector)
+        # Все аккаунты «за одним прокси»: тот же адрес и User-Agent, что у тестового клиента
+        for user_id in range(1, MAX_ACCOUNTS_PER_DEVICE + 1):
+            detector.observe(user_id, DAILY_BONUS_TX_TYPE, 1.0, ("testclient", "testclient"))
+        return detector
+
+    yield configure, TestClient(app, headers={"User-Agent": "testclient"})
+    shared_state.set_shared_state(None)
+
+
+def _claim_bonus(client, user_id: int) -> int:
+    return client.post("/bonus", json={"initData": signed_init_data(user_id)}).status_code
+
+
+def test_guard_ignores_devices_by_default(guarded_client):
+    configure, client = guarded_client
+    configure("off")
+    assert _claim_bonus(client, 99) == 200
+
+
+def test_guard_flag_mode_does_not_refuse_bonus(guarded_client):
+    configure, client = guarded_client
+    configure("flag")
+    assert _claim_bonus(client, 99) == 200
+
+
+def test_guard_block_mode_refuses_bonus_on_crowded_device(guarded_client):
+    configure, client = guarded_client
+    configure("block")
+    assert _claim_bonus(client, 99) == 429
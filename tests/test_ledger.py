@@ -0,0 +1,63 @@
+# tests/test_ledger.py
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+from sqlalchemy import text
+
+from conftest import run
+from app.database import get_engine, get_session_factory
+from app.ledger import reconcile_balances
+from app.partitions import archive_partition, ensure_partitions
+
+ARCHIVED_MONTH = date(2020, 1, 1)
+# Баланс = 5 (архивный бонус) + 2 (свежий бонус); main = 10 (архивный ROI) - 4 (свежий вывод)
+BALANCED, BROKEN = 930_000_001, 930_000_002
+
+
+async def _add_user(db, user_id: int, main: str, bonus: str):
+    await db.execute(text(
+        "INSERT INTO users (id, username, main_balance, bonus_balance, lucrum_balance, total_withdrawn, status, role) "
+        "VALUES (:id, :username, :main, :bonus, 0, 0, 'active', 'user')"
+    ), {"id": user_id, "username": f"ledger_{user_id}", "main": Decimal(main), "bonus": Decimal(bonus)})
+
+
+async def _add_tx(db, user_id: int, tx_type: str, amount: str, timestamp=None, status="completed"):
+    await db.execute(text(
+        "INSERT INTO transactions (user_id, type, amount, currency, timestamp, status) "
+        "VALUES (:user_id, :type, :amount, '₤s', COALESCE(:timestamp, now()), :status)"
+    ), {"user_id": user_id, "type": tx_type, "amount": Decimal(amount), "timestamp": timestamp, "status": status})
+
+
+def _mismatched_ids(mismatches) -> set[int]:
+    return {m.user_id for m in mismatches} & {BALANCED, BROKEN}
+
+
+def test_reconciliation_counts_archived_partitions(app_database, tmp_path):
+    old = datetime(2020, 1, 15, tzinfo=timezone.utc)
+
+    async def scenario():
+        async with get_session_factory()() as db:
+            for user_id, bonus in ((BALANCED, "7.00"), (BROKEN, "8.00")):
+                await _add_user(db, user_id, "6.00", bonus)
+                await _add_tx(db, user_id, "roi_accrual", "10.00", old)
+                await _add_tx(db, user_id, "daily_bonus", "5.00", old)
+                await _add_tx(db, user_id, "game_bet", "-100.00", old, status="failed") # Незавершенные не в счет
+                await _add_tx(db, user_id, "withdrawal", "-4.00")
+                await _add_tx(db, user_id, "daily_bonus", "2.00")
+            await db.commit()
+
+        _, before = await reconcile_balances(chunk_size=2)
+        await ensure_partitions(get_engine(), since=ARCHIVED_MONTH)
+        await archive_partition(get_engine(), ARCHIVED_MONTH, str(tmp_path))
+        _, after = await reconcile_balances(chunk_size=2)
+        async with get_session_factory()() as db:
+            opening = (await db.execute(text(
+                "SELECT main_sum, bonus_sum, archived_through FROM ledger_opening_sums WHERE user_id = :id"
+            ), {"id": BALANCED})).one()
+        return before, after, opening
+
+    before, after, opening = run(scenario())
+    assert _mismatched_ids(before) == {BROKEN}
+    assert _mismatched_ids(after) == {BROKEN} # Архивная история не превращается в расхождение
+    assert tuple(opening) == (Decimal("10.00"), Decimal("5.00"), ARCHIVED_MONTH)
+    assert (tmp_path / "transactions_y2020m01.csv.gz").exists()
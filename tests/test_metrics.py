@@ -0,0 +1,40 @@
+# tests/test_metrics.py
+import dataclasses
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import factory, metrics
+from app.config import get_settings
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """Клиент приложения с METRICS_TOKEN=token (без него — None); startup не выполняется."""
+    def configure(token):
+        settings = dataclasses.replace(get_settings(), metrics_token=token)
+        monkeypatch.setattr(factory, "get_settings", lambda: settings)
+        return TestClient(factory.create_app())
+    return configure
+
+
+def test_metrics_are_open_without_token(client):
+    assert client(None).get("/metrics").status_code == 200
+
+
+def test_metrics_require_bearer_token(client):
+    app = client("scrape-secret")
+    assert app.get("/metrics").status_code == 401
+    assert app.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    response = app.get("/metrics", headers={"Authorization": "Bearer scrape-secret"})
+    assert response.status_code == 200
+    assert "http_requests_in_flight" in response.text
+
+
+def test_route_label_is_the_template_and_cached(client, monkeypatch):
+    monkeypatch.setattr(metrics, "_route_labels", {})
+    app = client(None).app
+    scope = {"type": "http", "method": "GET", "path": "/api/leaderboards/weekly", "root_path": ""}
+    assert metrics._route_label(app, scope) == "/api/leaderboards/{board}"
+    assert metrics._route_labels == {("GET", "/api/leaderboards/weekly"): "/api/leaderboards/{board}"}
+    assert metrics._route_label(app, {**scope, "path": "/nope"}) == "unmatched"
@@ -0,0 +1,58 @@
+# tests/test_migrations.py
+import inspect
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from conftest import requires_database, run, temporary_database
+from app import migrations
+from app.models import Base
+
+
+def test_versions_are_numbered_without_gaps():
+    versions = [version for version, _, _ in migrations.load_migrations()]
+    assert versions == list(range(1, len(versions) + 1))
+    assert migrations.latest_version() == versions[-1]
+
+
+def test_every_migration_has_async_upgrade():
+    for version, name, module in migrations.load_migrations():
+        assert inspect.iscoroutinefunction(getattr(module, "upgrade", None)), f"{version:04d}_{name}"
+
+
+async def _tables(engine) -> set[str]:
+    async with engine.connect() as conn:
+        rows = await conn.execute(text(
+            "SELECT relname FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p') AND NOT c.relispartition"
+        ))
+        return set(rows.scalars())
+
+
+@requires_database
+def test_upgrade_from_empty_database_builds_model_schema():
+    async def scenario():
+        async with temporary_database() as url:
+            engine = create_async_engine(url)
+            try:
+                with pytest.raises(migrations.SchemaVersionError):
+                    await migrations.check(engine)
+
+                latest = migrations.latest_version()
+                assert await migrations.upgrade(engine, target=2) == [1, 2]
+                with pytest.raises(migrations.SchemaVersionError):
+                    await migrations.check(engine) # Схема отстает от кода
+
+                assert await migrations.upgrade(engine) == list(range(3, latest + 1))
+                assert await migrations.upgrade(engine) == [] # Повторный запуск ничего не делает
+                assert await migrations.check(engine) == latest
+
+                assert set(Base.metadata.tables) <= await _tables(engine)
+                async with engine.connect() as conn:
+                    packages = (await conn.execute(text("SELECT count(*) FROM investment_packages"))).scalar()
+                assert packages > 0 # Пакеты заводит миграция 0002
+            finally:
+                await engine.dispose()
+
+    run(scenario())
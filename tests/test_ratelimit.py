@@ -0,0 +1,152 @@
+# tests/test_ratelimit.py
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+from conftest import run, signed_init_data
+from app import ratelimit, shared_state
+from app.loop_lag import loop_lag_monitor
+from app.ratelimit import LoadSheddingMiddleware, rate_limit
+from app.shared_state import InMemorySharedState
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(shared_state.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def state():
+    state = InMemorySharedState()
+    shared_state.set_shared_state(state)
+    yield state
+    shared_state.set_shared_state(None)
+
+
+# --- Token bucket ---
+
+def test_bucket_allows_burst_then_asks_to_wait(clock):
+    state = InMemorySharedState()
+    waits = [run(state.take_token("k", rate=2.0, burst=3)) for _ in range(4)]
+    assert waits[:3] == [0.0, 0.0, 0.0]
+    assert waits[3] == pytest.approx(0.5) # 1 токен при 2 токенах/сек
+
+
+def test_bucket_refills_at_rate_up_to_burst(clock):
+    state = InMemorySharedState()
+    for _ in range(3):
+        run(state.take_token("k", rate=2.0, burst=3))
+    clock.now += 0.5 # +1 токен
+    assert run(state.take_token("k", rate=2.0, burst=3)) == 0.0
+    assert run(state.take_token("k", rate=2.0, burst=3)) > 0
+
+    clock.now += 60 # Долгий простой не копит больше burst
+    waits = [run(state.take_token("k", rate=2.0, burst=3)) for _ in range(4)]
+    assert waits.count(0.0) == 3
+
+
+def test_buckets_are_independent_per_key(clock):
+    state = InMemorySharedState()
+    assert run(state.take_token("a", rate=1.0, burst=1)) == 0.0
+    assert run(state.take_token("a", rate=1.0, burst=1)) > 0
+    assert run(state.take_token("b", rate=1.0, burst=1)) == 0.0
+
+
+def test_in_memory_state_evicts_least_recently_used_keys():
+    state = InMemorySharedState(max_keys=2)
+    run(state.set("a", "1"))
+    run(state.set("b", "2"))
+    run(state.get("a")) # a — недавно использован, вытесняется b
+    run(state.set("c", "3"))
+    assert run(state.get("a")) == "1"
+    assert run(state.get("b")) is None
+
+
+# --- Зависимость rate_limit ---
+
+@pytest.fixture
+def limited_client(monkeypatch, state, clock):
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setitem(ratelimit.RATE_LIMITS, "test", (1.0, 2))
+    app = FastAPI()
+
+    @app.post("/limited", dependencies=[Depends(rate_limit("test"))])
+    async def limited():
+        return {"ok": True}
+
+    return TestClient(app)
+
+
+def test_rate_limit_returns_429_with_retry_after(limited_client):
+    init_data = signed_init_data(42)
+    codes = [limited_client.post("/limited", json={"initData": init_data}).status_code for _ in range(2)]
+    assert codes == [200, 200]
+    response = limited_client.post("/limited", json={"initData": init_data})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
+
+
+def test_rate_limit_is_keyed_by_verified_telegram_user(limited_client):
+    for _ in range(2):
+        limited_client.post("/limited", json={"initData": signed_init_data(1)})
+    assert limited_client.post("/limited", json={"initData": signed_init_data(1)}).status_code == 429
+    assert limited_client.post("/limited", json={"initData": signed_init_data(2)}).status_code == 200
+
+
+def test_rate_limit_falls_back_to_ip_for_unsigned_requests(limited_client):
+    forged = signed_init_data(7).replace("hash=", "hash=0")
+    codes = [limited_client.post("/limited", json={"initData": forged}).status_code for _ in range(3)]
+    assert codes == [200, 200, 429]
+    # Подделанная подпись не дает отдельного ведра: тот же IP уже исчерпал лимит
+    assert limited_client.post("/limited", json={}).status_code == 429
+
+
+def test_rate_limit_lets_requests_through_when_backend_fails(monkeypatch, limited_client):
+    class Broken(InMemorySharedState):
+        async def take_token(self, key, rate, burst):
+            raise ConnectionError("backend down")
+
+    shared_state.set_shared_state(Broken())
+    codes = [limited_client.post("/limited", json={}).status_code for _ in range(5)]
+    assert codes == [200] * 5
+
+
+# --- Сброс нагрузки ---
+
+@pytest.fixture
+def shedding_client(monkeypatch):
+    app = FastAPI()
+
+    @app.get("/api/ping")
+    async def ping():
+        return {"ok": True}
+
+    @app.get("/metrics")
+    async def metrics():
+        return {"ok": True}
+
+    monkeypatch.setattr(loop_lag_monitor, "lag", 0.0)
+    return TestClient(LoadSheddingMiddleware(app, max_lag=0.5))
+
+
+def test_load_shedding_rejects_while_loop_lags(monkeypatch, shedding_client):
+    assert shedding_client.get("/api/ping").status_code == 200
+    monkeypatch.setattr(loop_lag_monitor, "lag", 1.2)
+    response = shedding_client.get("/api/ping")
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
+
+
+def test_load_shedding_skips_exempt_paths(monkeypatch, shedding_client):
+    monkeypatch.setattr(loop_lag_monitor, "lag", 5.0)
+    assert shedding_client.get("/metrics").status_code == 200
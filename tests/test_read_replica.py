@@ -0,0 +1,122 @@
+# tests/test_read_replica.py
+import dataclasses
+
+import pytest
+from sqlalchemy import text
+
+from conftest import run
+from app import database, shared_state
+from app.config import get_settings
+from app.database import (
+    _replica_state, get_async_session, get_read_session, get_replica_engine, read_your_writes, replica_available,
+)
+from app.models import User
+from app.shared_state import InMemorySharedState
+
+UNAVAILABLE_URL = "postgresql+asyncpg://test@127.0.0.1:1/unavailable"
+
+
+@pytest.fixture
+def state():
+    shared_state.set_shared_state(InMemorySharedState())
+    yield
+    shared_state.set_shared_state(None)
+
+
+@pytest.fixture
+def replica_url(monkeypatch):
+    """Задает DATABASE_REPLICA_URL тестам: replica_url(url)."""
+    def configure(url):
+        settings = dataclasses.replace(get_settings(), database_replica_url=url)
+        monkeypatch.setattr(database, "get_settings", lambda: settings)
+    return configure
+
+
+async def _open(generator):
+    return await generator.__anext__()
+
+
+async def _close(generator):
+    # Досрочное aclose() не выполнило бы код после yield (remember_writes, метрики)
+    await anext(generator, None)
+
+
+def _reads_from_replica(session) -> bool:
+    return session.sync_session.get_bind() is get_replica_engine().sync_engine
+
+
+def test_reads_go_to_primary_without_replica(state):
+    async def scenario():
+        assert get_replica_engine() is None
+        assert not replica_available()
+        sessions = get_read_session()
+        session = await _open(sessions)
+        routed = "read_bind" in session.info
+        await _close(sessions)
+        return routed
+
+    assert run(scenario()) is False
+
+
+def test_unreachable_replica_keeps_reads_on_primary(app_database, replica_url, state):
+    replica_url(UNAVAILABLE_URL)
+
+    async def scenario():
+        assert not replica_available() # Проверка ушла в фон
+        await _replica_state["task"]
+        sessions = get_read_session()
+        session = await _open(sessions)
+        routed = "read_bind" in session.info
+        users = (await session.execute(text("SELECT count(*) FROM users"))).scalar()
+        await _close(sessions)
+        return replica_available(), routed, users
+
+    available, routed, users = run(scenario())
+    assert not available and not routed
+    assert users >= 0
+
+
+def test_read_session_uses_replica_until_user_writes(app_database, replica_url, state):
+    # Основная БД в роли реплики: на ней REPLICA_LAG_SQL дает 0
+    replica_url(app_database)
+    writer, reader = 910_000_001, 910_000_002
+
+    async def scenario():
+        sessions = get_async_session()
+        db = await _open(sessions)
+        for user_id in (writer, reader):
+            await db.execute(text(
+                "INSERT INTO users (id, username, main_balance, bonus_balance, lucrum_balance, total_withdrawn, status, role) "
+                "VALUES (:id, :username, 0, 0, 0, 0, 'active', 'user')"
+            ), {"id": user_id, "username": f"replica_{user_id}"})
+        await db.commit()
+        await _close(sessions)
+
+        replica_available()
+        await _replica_state["task"]
+        assert replica_available()
+
+        sessions = get_read_session()
+        session = await _open(sessions)
+        await read_your_writes(session, writer)
+        assert _reads_from_replica(session)
+        await _close(sessions)
+
+        # Запись через ORM: пользователь попадает в written_user_ids и «прилипает» к основной БД
+        sessions = get_async_session()
+        db = await _open(sessions)
+        user = await db.get(User, writer)
+        user.main_balance += 1
+        await db.commit()
+        await _close(sessions)
+
+        routes = {}
+        for user_id in (writer, reader):
+            sessions = get_read_session()
+            session = await _open(sessions)
+            await read_your_writes(session, user_id)
+            routes[user_id] = _reads_from_replica(session)
+            await _close(sessions)
+        return routes
+
+    assert run(scenario()) == {writer: False, reader: True}
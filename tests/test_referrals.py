@@ -0,0 +1,110 @@
+# tests/test_referrals.py
+import pytest
+from sqlalchemy import select, text
+
+from conftest import run
+from app import referrals, shared_state
+from app.database import get_session_factory
+from app.models import Referral
+from app.referrals import (
+    attach_referrer, expire_pending_referrals, forget_referral, parse_referral_code, remember_referral,
+)
+from app.shared_state import InMemorySharedState
+
+REFERRER, INVITED, LATE = 920_000_001, 920_000_002, 920_000_003
+
+
+@pytest.fixture
+def state():
+    shared_state.set_shared_state(InMemorySharedState())
+    yield
+    shared_state.set_shared_state(None)
+
+
+async def _add_user(db, user_id: int):
+    await db.execute(text(
+        "INSERT INTO users (id, username, main_balance, bonus_balance, lucrum_balance, total_withdrawn, status, role) "
+        "VALUES (:id, :username, 0, 0, 0, 0, 'active', 'user')"
+    ), {"id": user_id, "username": f"referral_{user_id}"})
+
+
+def test_parse_referral_code():
+    assert parse_referral_code("ref_42") == 42
+    assert parse_referral_code("ref_") is None
+    assert parse_referral_code("ref_4x") is None
+    assert parse_referral_code("ref_²") is None
+    assert parse_referral_code(f"ref_{2**63 - 1}") == 2**63 - 1
+    assert parse_referral_code(f"ref_{2**63}") is None # Больше BIGINT
+    assert parse_referral_code("promo") is None
+    assert parse_referral_code(None) is None
+
+
+def test_self_referral_is_not_remembered(state):
+    assert run(remember_referral(7, "ref_7")) is None
+
+
+# Без SHARED_STATE_URL реферер из /start хранится в БД: регистрацию может принять другой воркер
+def test_pending_referral_from_start_survives_until_registration(app_database, state):
+    async def scenario():
+        assert await remember_referral(INVITED, f"ref_{REFERRER}") == REFERRER
+        # Кеш процесса бота ни при чем: регистрацию обслуживает «другой воркер» со своим состоянием
+        shared_state.set_shared_state(InMemorySharedState())
+
+        async with get_session_factory()() as db:
+            await _add_user(db, REFERRER)
+            await _add_user(db, INVITED)
+            referrer_id = await attach_referrer(db, INVITED)
+            await db.commit()
+        await forget_referral(INVITED)
+
+        async with get_session_factory()() as db:
+            link = (await db.execute(select(Referral.referrer_id).where(Referral.referred_id == INVITED))).scalar()
+            left = (await db.execute(text("SELECT count(*) FROM pending_referrals WHERE user_id = :id"), {"id": INVITED})).scalar()
+        return referrer_id, link, left
+
+    assert run(scenario()) == (REFERRER, REFERRER, 0)
+
+
+def test_expired_pending_referral_is_ignored_and_purged(app_database, state):
+    async def scenario():
+        await remember_referral(LATE, f"ref_{REFERRER}")
+        async with get_session_factory()() as db:
+            await db.execute(text("UPDATE pending_referrals SET expires_at = now() - interval '1 second' WHERE user_id = :id"), {"id": LATE})
+            await db.commit()
+            referrer_id = await attach_referrer(db, LATE)
+            await db.rollback()
+        return referrer_id, await expire_pending_referrals()
+
+    referrer_id, purged = run(scenario())
+    assert referrer_id is None
+    assert purged >= 1
+
+
+def test_start_param_referrer_creating_a_cycle_is_rejected(app_database, state):
+    a, b = 920_000_011, 920_000_012
+
+    async def scenario():
+        async with get_session_factory()() as db:
+            await _add_user(db, a)
+            await _add_user(db, b)
+            db.add(Referral(referrer_id=a, referred_id=b, referral_level=1))
+            await db.commit()
+            # a пришел бы по ссылке b, но b уже приглашен a — цикл
+            return await attach_referrer(db, a, start_param=f"ref_{b}")
+
+    assert run(scenario()) is None
+
+
+def test_failed_referrer_check_does_not_break_registration(app_database, state, monkeypatch):
+    user_id = 920_000_021
+    monkeypatch.setattr(referrals, "_REFERRER_CHECK_SQL", text("SELECT CAST(:referrer_id AS BIGINT) / 0, :user_id"))
+
+    async def scenario():
+        async with get_session_factory()() as db:
+            await _add_user(db, user_id)
+            referrer_id = await attach_referrer(db, user_id, start_param=f"ref_{REFERRER}")
+            await db.commit() # Пользователь сохраняется и без реферера
+            created = (await db.execute(text("SELECT count(*) FROM users WHERE id = :id"), {"id": user_id})).scalar()
+        return referrer_id, created
+
+    assert run(scenario()) == (None, 1)
@@ -0,0 +1,157 @@
+# tests/test_withdrawals.py
+from datetime import timedelta
+from decimal import Decimal
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import text
+
+from conftest import run
+from app.database import get_session_factory
+from app.ledger import reconcile_balances
+from app.payouts import StubPayoutProvider
+from app.withdrawals import MAX_ATTEMPTS, RETRY_DELAY, create_withdrawal, process_pending_withdrawals
+
+USER = 940_000_001
+
+
+async def _user(db, user_id: int = USER):
+    return (await db.execute(text(
+        "SELECT main_balance, total_withdrawn FROM users WHERE id = :id"
+    ), {"id": user_id})).one()
+
+
+async def _withdrawal(db, withdrawal_id: int):
+    return (await db.execute(text(
+        "SELECT status, attempts, provider_ref, next_attempt_at - now() AS delay FROM withdrawals WHERE id = :id"
+    ), {"id": withdrawal_id})).one()
+
+
+async def _create(amount: str, destination: str, request_key: str = None) -> dict:
+    async with get_session_factory()() as db:
+        return await create_withdrawal(db, USER, Decimal(amount), destination, request_key)
+
+
+async def _process(provider) -> str:
+    # Повторы с отложенной попыткой — «наступает» следующая попытка
+    async with get_session_factory()() as db:
+        await db.execute(text("UPDATE withdrawals SET next_attempt_at = now() WHERE status = 'pending'"))
+        await db.commit()
+    return await process_pending_withdrawals(provider=provider)
+
+
+@pytest.fixture(scope="module")
+def user(app_database):
+    """Пользователь со 100.00 на main_balance, заработанными ROI (баланс сходится с журналом)."""
+    async def create():
+        async with get_session_factory()() as db:
+            await db.execute(text(
+                "INSERT INTO users (id, username, main_balance, bonus_balance, lucrum_balance, total_withdrawn, status, role) "
+                "VALUES (:id, 'withdrawals_user', 100, 0, 0, 0, 'active', 'user')"
+            ), {"id": USER})
+            await db.execute(text(
+                "INSERT INTO transactions (user_id, type, amount, currency, status) "
+                "VALUES (:id, 'roi_accrual', 100, '₤s', 'completed')"
+            ), {"id": USER})
+            await db.commit()
+
+    run(create())
+    return USER
+
+
+def test_request_holds_balance_once_per_request_key(user):
+    async def scenario():
+        first = await _create("10.00", "wallet-1", request_key="hold-1")
+        repeat = await _create("10.00", "wallet-1", request_key="hold-1")
+        async with get_session_factory()() as db:
+            return first, repeat, await _user(db)
+
+    first, repeat, balances = run(scenario())
+    assert not first["duplicate"] and repeat["duplicate"]
+    assert repeat["withdrawal"]["id"] == first["withdrawal"]["id"]
+    assert first["withdrawal"]["status"] == "pending"
+    assert balances.main_balance == Decimal("90.00")
+
+
+def test_request_over_balance_is_refused(user):
+    async def scenario():
+        with pytest.raises(HTTPException) as refused:
+            await _create("1000.00", "wallet")
+        return refused.value.status_code
+
+    assert run(scenario()) == 400
+
+
+def test_completed_payout_adds_to_total_withdrawn(user):
+    async def scenario():
+        created = await _create("15.00", "wallet-2")
+        provider = StubPayoutProvider()
+        async with get_session_factory()() as db:
+            before = await _user(db)
+        await _process(provider)
+        async with get_session_factory()() as db:
+            return created, provider, before, await _user(db), await _withdrawal(db, created["withdrawal"]["id"])
+
+    created, provider, before, after, withdrawal = run(scenario())
+    withdrawal_id = created["withdrawal"]["id"]
+    assert withdrawal.status == "completed"
+    assert withdrawal.provider_ref == f"stub-{withdrawal_id}"
+    assert f"withdrawal:{withdrawal_id}" in provider.sent
+    assert after.main_balance == before.main_balance # Сумма удержана еще при создании заявки
+    assert after.total_withdrawn - before.total_withdrawn >= Decimal("15.00")
+
+
+def test_rejected_payout_is_refunded(user):
+    async def scenario():
+        async with get_session_factory()() as db:
+            before = await _user(db)
+        created = await _create("20.00", "fail:wallet")
+        await _process(StubPayoutProvider())
+        async with get_session_factory()() as db:
+            refunds = (await db.execute(text(
+                "SELECT count(*), sum(amount) FROM transactions WHERE txid = :txid"
+            ), {"txid": f"withdrawal_refund:{created['withdrawal']['id']}"})).one()
+            return before, await _user(db), await _withdrawal(db, created["withdrawal"]["id"]), refunds
+
+    before, after, withdrawal, refunds = run(scenario())
+    assert withdrawal.status == "failed"
+    assert tuple(refunds) == (1, Decimal("20.00"))
+    assert after.main_balance == before.main_balance
+
+
+def test_retry_backs_off_then_fails_after_max_attempts(user):
+    async def scenario():
+        async with get_session_factory()() as db:
+            before = await _user(db)
+        created = await _create("12.00", "retry:wallet")
+        withdrawal_id = created["withdrawal"]["id"]
+
+        await process_pending_withdrawals(provider=StubPayoutProvider())
+        async with get_session_factory()() as db:
+            first = await _withdrawal(db, withdrawal_id)
+        # Пока срок следующей попытки не наступил, обработчик заявку не берет
+        await process_pending_withdrawals(provider=StubPayoutProvider())
+        async with get_session_factory()() as db:
+            waiting = await _withdrawal(db, withdrawal_id)
+
+        history = [first]
+        for _ in range(MAX_ATTEMPTS - 1):
+            await _process(StubPayoutProvider())
+            async with get_session_factory()() as db:
+                history.append(await _withdrawal(db, withdrawal_id))
+        async with get_session_factory()() as db:
+            return before, await _user(db), first, waiting, history
+
+    before, after, first, waiting, history = run(scenario())
+    assert (first.status, first.attempts) == ("pending", 1)
+    assert RETRY_DELAY - timedelta(seconds=30) < first.delay <= RETRY_DELAY
+    assert waiting.attempts == 1
+    assert 2 * RETRY_DELAY - timedelta(seconds=30) < history[1].delay <= 2 * RETRY_DELAY # Пауза удваивается
+    assert [w.status for w in history] == ["pending"] * (MAX_ATTEMPTS - 1) + ["failed"]
+    assert history[-1].attempts == MAX_ATTEMPTS
+    assert after.main_balance == before.main_balance # Возврат после последней попытки
+
+
+def test_withdrawal_flow_keeps_ledger_in_balance(user):
+    _, mismatches = run(reconcile_balances())
+    assert USER not in {m.user_id for m in mismatches}